@@ -0,0 +1,237 @@
+#!/usr/bin/env python
+from __future__ import division
+
+__author__ = "Jai Ram Rideout"
+__copyright__ = "Copyright 2013, The QIIME project"
+__credits__ = ["Jai Ram Rideout"]
+__license__ = "GPL"
+__version__ = "0.1.0-dev"
+__maintainer__ = "Jai Ram Rideout"
+__email__ = "jai.rideout@gmail.com"
+
+"""Module for computing study-level aggregates of per-sample data.
+
+Most of the personalized results compare an individual's samples to everyone
+else's samples in the study. An individual's "Other" group is the whole study
+minus the individual, so its sums, sums of squares, and counts can be found by
+subtracting the individual's totals from the study's totals. The study's
+totals only need to be computed once, and each individual's totals only depend
+on the individual's own samples.
+"""
+
+from numpy import asarray, isnan, maximum, nan, sqrt, zeros
+
+class GroupTotals(object):
+    """Per-group sums, sums of squares, and counts of per-sample vectors.
+
+    Each vector contains one value per ID (e.g. an OTU's abundance in a sample,
+    or an alpha diversity metric's value for a sample). Groups can be any
+    hashable object, but are usually tuples of mapping file category values
+    (e.g. (body site, week)).
+
+    A sample can be missing values for some IDs (NaN), e.g. an alpha
+    rarefaction depth that the sample didn't have enough sequences for.
+    Missing values aren't added to the sums, and the number of samples that
+    have a value for each ID is kept alongside the number of samples.
+    """
+
+    def __init__(self, ids):
+        self.ids = list(ids)
+        self._totals = {}
+
+    def add(self, group, values):
+        """Adds a single sample's vector of values to group."""
+        values = asarray(values, dtype=float)
+
+        if values.shape != (len(self.ids),):
+            raise ValueError("Expected %d values but got %d." %
+                             (len(self.ids), values.size))
+
+        if group not in self._totals:
+            self._totals[group] = [zeros(len(self.ids)),
+                                   zeros(len(self.ids)), 0,
+                                   zeros(len(self.ids), dtype=int)]
+
+        missing = isnan(values)
+        if missing.any():
+            values = values.copy()
+            values[missing] = 0
+
+        totals = self._totals[group]
+        totals[0] += values
+        totals[1] += values ** 2
+        totals[2] += 1
+        totals[3] += ~missing
+
+    def groups(self):
+        """Returns a sorted list of the groups that contain samples."""
+        return sorted(self._totals)
+
+    def get_sums(self, group):
+        """Returns the sum of each ID's values in group."""
+        return self._get_totals(group)[0]
+
+    def get_sums_of_squares(self, group):
+        """Returns the sum of each ID's squared values in group."""
+        return self._get_totals(group)[1]
+
+    def get_count(self, group):
+        """Returns the number of samples in group."""
+        return self._get_totals(group)[2]
+
+    def get_value_counts(self, group):
+        """Returns the number of samples in group that have a value for each
+        ID (i.e. aren't missing a value).
+        """
+        return self._get_totals(group)[3]
+
+    def get_means(self, group):
+        """Returns the mean of each ID's values in group.
+
+        Each mean is taken over the samples that have a value for the ID.
+        IDs without any values have a mean of NaN.
+        """
+        sums, sums_of_squares, count, value_counts = self._get_totals(group)
+        means = zeros(len(self.ids))
+        means.fill(nan)
+        has_values = value_counts > 0
+        means[has_values] = sums[has_values] / value_counts[has_values]
+        return means
+
+    def get_stds(self, group):
+        """Returns the (population) standard deviation of each ID's values in
+        group.
+
+        Like get_means, each standard deviation is taken over the samples
+        that have a value for the ID, and is NaN for IDs without any values.
+        """
+        sums, sums_of_squares, count, value_counts = self._get_totals(group)
+        means = self.get_means(group)
+        stds = zeros(len(self.ids))
+        stds.fill(nan)
+        has_values = value_counts > 0
+
+        # Rounding error can make the variance slightly negative.
+        stds[has_values] = sqrt(maximum(
+                sums_of_squares[has_values] / value_counts[has_values] -
+                means[has_values] ** 2, 0))
+        return stds
+
+    def subtract(self, other):
+        """Returns new GroupTotals with other's totals removed from these.
+
+        other must have been computed from a subset of the samples that these
+        totals were computed from (e.g. an individual's samples versus the
+        whole study's samples). Groups that don't have any samples left are
+        not included in the result.
+        """
+        if other.ids != self.ids:
+            raise ValueError("Cannot subtract totals that were computed over "
+                             "different IDs.")
+
+        result = GroupTotals(self.ids)
+        for group, (sums, sums_of_squares, count, value_counts) in \
+                self._totals.items():
+            other_sums, other_sums_of_squares, other_count, \
+                    other_value_counts = other._get_totals(group)
+
+            if other_count > count:
+                raise ValueError("Cannot subtract %d samples from group %r, "
+                                 "which only has %d samples." %
+                                 (other_count, group, count))
+            elif other_count < count:
+                result._totals[group] = [sums - other_sums,
+                        sums_of_squares - other_sums_of_squares,
+                        count - other_count,
+                        value_counts - other_value_counts]
+
+        return result
+
+    def _get_totals(self, group):
+        if group in self._totals:
+            return self._totals[group]
+        else:
+            return (zeros(len(self.ids)), zeros(len(self.ids)), 0,
+                    zeros(len(self.ids), dtype=int))
+
+
+def get_sample_groups(mapping_data, sample_id_index, category_indices):
+    """Returns a list of (sample ID, group) for each row in mapping_data.
+
+    Each group is a tuple of the row's values in the category_indices
+    columns.
+    """
+    return [(row[sample_id_index],
+             tuple([row[cat_idx] for cat_idx in category_indices]))
+            for row in mapping_data]
+
+def aggregate_otu_table(otu_table, sample_groups):
+    """Returns GroupTotals of OTU abundances for each group of samples.
+
+    Arguments:
+        otu_table - parsed biom Table
+        sample_groups - list of (sample ID, group) (e.g. from
+            get_sample_groups). Samples that aren't in otu_table are ignored.
+            Only these samples are looked at, so totals for a subset of the
+            samples in the table (e.g. an individual's samples) can be
+            computed without iterating over the whole table
+    """
+    totals = GroupTotals(otu_table.ObservationIds)
+    table_sample_ids = set(otu_table.SampleIds)
+
+    for sample_id, group in sample_groups:
+        if sample_id in table_sample_ids:
+            totals.add(group, otu_table.sampleData(sample_id))
+
+    return totals
+
+def aggregate_alpha_diversity(alpha_diversity, sample_groups):
+    """Returns GroupTotals of alpha diversity values for each group of samples.
+
+    Arguments:
+        alpha_diversity - dict mapping each alpha diversity metric to a dict
+            of sample ID -> alpha diversity value. Missing (or NaN) values
+            can't be aggregated, so a sample is only added if it has a value
+            for every metric
+        sample_groups - list of (sample ID, group) (e.g. from
+            get_sample_groups)
+    """
+    metrics = sorted(alpha_diversity)
+    totals = GroupTotals(metrics)
+
+    for sample_id, group in sample_groups:
+        values = []
+        for metric in metrics:
+            value = alpha_diversity[metric].get(sample_id)
+            if value is None or value != value:
+                break
+            values.append(value)
+        else:
+            totals.add(group, values)
+
+    return totals
+
+def aggregate_rarefaction(rarefaction_store, metric, sample_groups):
+    """Returns GroupTotals of per-sample rarefaction means for each group.
+
+    The totals are computed over the metric's rarefaction depths, so each
+    group's mean (and standard deviation) at each depth is the mean (and
+    standard deviation) of its samples' means at that depth. Samples without
+    a value at a depth aren't counted at that depth (see
+    GroupTotals.get_value_counts), and samples without a value at any depth
+    aren't added at all.
+
+    Arguments:
+        rarefaction_store - RarefactionStore containing the per-sample means
+        metric - the alpha diversity metric to aggregate
+        sample_groups - list of (sample ID, group) (e.g. from
+            get_sample_groups)
+    """
+    totals = GroupTotals(rarefaction_store.get_depths(metric))
+
+    for sample_id, group in sample_groups:
+        means = rarefaction_store.get_sample_means(metric, sample_id)
+        if means is not None and not isnan(means).all():
+            totals.add(group, means)
+
+    return totals
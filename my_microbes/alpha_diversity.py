@@ -0,0 +1,177 @@
+#!/usr/bin/env python
+from __future__ import division
+
+__author__ = "Jai Ram Rideout"
+__copyright__ = "Copyright 2013, The QIIME project"
+__credits__ = ["Jai Ram Rideout"]
+__license__ = "GPL"
+__version__ = "0.1.0-dev"
+__maintainer__ = "Jai Ram Rideout"
+__email__ = "jai.rideout@gmail.com"
+
+"""Module for loading collated alpha diversity results once per run."""
+
+from glob import glob
+from os.path import basename, join, splitext
+
+from numpy import array, empty, nan, unique
+
+from my_microbes.parse import (parse_collated_alpha_diversity,
+                               parse_collated_rarefaction)
+
+class AlphaDiversityStore(object):
+    """Alpha diversity values for every metric at a single rarefaction depth.
+
+    Each collated alpha diversity file (i.e. metric) in a directory is parsed
+    once. A metric's values are stored as a 2D array with a row for each
+    iteration at the rarefaction depth and a column for each sample, in the
+    order of sample_ids (the samples in any of the files). Missing values
+    (n/a, or a sample that isn't in a metric's file) are NaN.
+
+    Per-sample metadata can be pulled into arrays in the same order as the
+    columns, so that groups of samples (e.g. an individual's samples at a body
+    site) can be selected with boolean masks.
+    """
+
+    def __init__(self, collated_adiv_dir, rarefaction_depth):
+        self.rarefaction_depth = rarefaction_depth
+
+        parsed = []
+        for collated_adiv_fp in sorted(glob(join(collated_adiv_dir,
+                                                 '*.txt'))):
+            metric = splitext(basename(collated_adiv_fp))[0]
+            collated_adiv_f = open(collated_adiv_fp, 'U')
+            try:
+                sample_ids, values = parse_collated_alpha_diversity(
+                        collated_adiv_f, rarefaction_depth)
+            finally:
+                collated_adiv_f.close()
+            parsed.append((metric, sample_ids, values))
+
+        self.metrics = [metric for metric, sample_ids, values in parsed]
+        self.sample_ids, sample_indices = _merge_sample_ids(
+                [sample_ids for metric, sample_ids, values in parsed])
+
+        self._values = {}
+        for metric, sample_ids, values in parsed:
+            self._values[metric] = _expand_columns(values, sample_ids,
+                                                   sample_indices,
+                                                   len(self.sample_ids))
+
+    def get_values(self, metric):
+        """Returns a metric's 2D array of values (iterations x samples)."""
+        return self._values[metric]
+
+    def get_sample_metadata(self, mapping_data, sample_id_index,
+                            category_index):
+        """Returns an array of each sample's value in a mapping category.
+
+        The array is in the same order as sample_ids. Samples that aren't in
+        mapping_data have a value of None.
+        """
+        sample_values = dict([(row[sample_id_index], row[category_index])
+                              for row in mapping_data])
+        return array([sample_values.get(sample_id)
+                      for sample_id in self.sample_ids], dtype=object)
+
+
+class RarefactionStore(object):
+    """Per-sample alpha rarefaction averages for every metric.
+
+    Each collated alpha diversity file (i.e. metric) in a directory is parsed
+    once, and each sample's values at each rarefaction depth are averaged
+    over the depth's iterations. A metric's means and variances are stored as
+    2D arrays with a row for each of the metric's depths (in increasing
+    order) and a column for each sample, in the order of sample_ids (the
+    samples in any of the files). A sample that doesn't have a value at a
+    depth (e.g. because it didn't have enough sequences) has a mean and
+    variance of NaN.
+
+    These are the per-sample averages that make_rarefaction_plots.py computes
+    before grouping samples, so they only need to be computed once for every
+    individual's rarefaction plots.
+    """
+
+    def __init__(self, collated_adiv_dir):
+        parsed = []
+        for collated_adiv_fp in sorted(glob(join(collated_adiv_dir,
+                                                 '*.txt'))):
+            metric = splitext(basename(collated_adiv_fp))[0]
+            collated_adiv_f = open(collated_adiv_fp, 'U')
+            try:
+                sample_ids, depths, values = parse_collated_rarefaction(
+                        collated_adiv_f)
+            finally:
+                collated_adiv_f.close()
+            parsed.append((metric, sample_ids, depths, values))
+
+        self.metrics = [metric for metric, sample_ids, depths, values in
+                        parsed]
+        self.sample_ids, self._sample_indices = _merge_sample_ids(
+                [sample_ids for metric, sample_ids, depths, values in parsed])
+
+        self._depths = {}
+        self._means = {}
+        self._variances = {}
+        for metric, sample_ids, depths, values in parsed:
+            metric_depths = unique(depths)
+            means = empty((len(metric_depths), values.shape[1]))
+            variances = empty((len(metric_depths), values.shape[1]))
+            for i, depth in enumerate(metric_depths):
+                depth_values = values[depths == depth]
+                means[i] = depth_values.mean(axis=0)
+                variances[i] = depth_values.var(axis=0)
+
+            self._depths[metric] = metric_depths
+            self._means[metric] = _expand_columns(means, sample_ids,
+                    self._sample_indices, len(self.sample_ids))
+            self._variances[metric] = _expand_columns(variances, sample_ids,
+                    self._sample_indices, len(self.sample_ids))
+
+    def get_depths(self, metric):
+        """Returns an array of a metric's rarefaction depths."""
+        return self._depths[metric]
+
+    def get_means(self, metric):
+        """Returns a metric's 2D array of means (depths x samples)."""
+        return self._means[metric]
+
+    def get_variances(self, metric):
+        """Returns a metric's 2D array of variances (depths x samples)."""
+        return self._variances[metric]
+
+    def get_sample_means(self, metric, sample_id):
+        """Returns a sample's mean at each of a metric's depths.
+
+        Returns None if the sample isn't in any of the collated files.
+        """
+        if sample_id in self._sample_indices:
+            return self._means[metric][:, self._sample_indices[sample_id]]
+        else:
+            return None
+
+
+def _merge_sample_ids(per_metric_sample_ids):
+    """Returns the sample IDs in any metric, in order of first appearance.
+
+    Also returns a dict mapping each sample ID to its index in that list.
+    """
+    sample_ids = []
+    sample_indices = {}
+    for metric_sample_ids in per_metric_sample_ids:
+        for sample_id in metric_sample_ids:
+            if sample_id not in sample_indices:
+                sample_indices[sample_id] = len(sample_ids)
+                sample_ids.append(sample_id)
+    return sample_ids, sample_indices
+
+def _expand_columns(values, sample_ids, sample_indices, num_samples):
+    """Returns values with its columns moved to their samples' indices.
+
+    Columns of samples that aren't in sample_ids are NaN.
+    """
+    expanded = empty((values.shape[0], num_samples))
+    expanded.fill(nan)
+    expanded[:, [sample_indices[sample_id]
+                 for sample_id in sample_ids]] = values
+    return expanded
@@ -9,20 +9,25 @@ __version__ = "0.1.0-dev"
 __maintainer__ = "John Chase"
 __email__ = "jc33@nau.edu"
 
-from os.path import basename, exists, join, splitext
-
-from cogent.parse.fasta import MinimalFastaParser
+from collections import OrderedDict
+from json import dumps
+from os.path import basename, dirname, exists, join, splitext
+from re import sub
+from shutil import copyfile
 
+from my_microbes.htpasswd import dbm_types
 from my_microbes.parse import _can_ignore
 
 # The following formatting functions are not unit-tested.
 def create_index_html(personal_id, output_fp,
                       taxa_summary_plots_html='',
+                      beta_diversity_html='',
                       alpha_diversity_boxplots_html='',
                       otu_category_significance_html=''):
     output_f = open(output_fp,'w')
     output_f.write(index_text % (personal_id, personal_id,
                                  taxa_summary_plots_html,
+                                 beta_diversity_html,
                                  alpha_diversity_boxplots_html,
                                  otu_category_significance_html))
     output_f.close()
@@ -31,9 +36,38 @@ def create_taxa_summary_plots_html(out_dir, personal_id, body_sites):
     return taxa_summary_plots_text % _create_taxa_summary_plots_links(out_dir,
             personal_id, body_sites)
 
-def create_alpha_diversity_boxplots_html(plot_fps):
-    return alpha_diversity_boxplots_text % \
-            _create_alpha_diversity_boxplots_links(plot_fps)
+def create_beta_diversity_html(pcoa_viewer=False):
+    if pcoa_viewer:
+        return beta_diversity_viewer_text
+    else:
+        return beta_diversity_make_3d_plots_text
+
+def create_pcoa_viewer_html(personal_id, output_fp):
+    output_f = open(output_fp, 'w')
+    output_f.write(pcoa_viewer_text % personal_id)
+    output_f.close()
+
+def create_alpha_rarefaction_html(personal_id, metric_plots, output_fp):
+    plots_html = []
+    for metric, plot_fp, depths, groups in metric_plots:
+        plots_html.append(alpha_rarefaction_plot_text % (format_title(metric),
+                plot_fp, _format_rarefaction_averages_as_html(depths,
+                                                              groups)))
+
+    output_f = open(output_fp, 'w')
+    output_f.write(alpha_rarefaction_text % (personal_id,
+                                             ''.join(plots_html)))
+    output_f.close()
+
+def create_alpha_diversity_boxplots_html(plot_fps,
+                                         static_alpha_rarefaction=False):
+    if static_alpha_rarefaction:
+        alpha_rarefaction_html = alpha_rarefaction_static_text
+    else:
+        alpha_rarefaction_html = alpha_rarefaction_make_rarefaction_plots_text
+    return alpha_diversity_boxplots_text % (
+            _create_alpha_diversity_boxplots_links(plot_fps),
+            alpha_rarefaction_html)
 
 def create_comparative_taxa_plots_html(category, output_fp):
     output_f = open(output_fp,'w')
@@ -52,12 +86,10 @@ def get_personalized_notification_email_text(personal_id, password):
 
 # The remaining functions are unit-tested.
 def _create_taxa_summary_plots_links(out_dir, personal_id, body_sites):
-    links_text = '<table cellpadding="5px">\n'
+    links_html = ['<table cellpadding="5px">\n']
     plots_prefix = join(out_dir, personal_id)
 
     for body_site in body_sites:
-        row_text = '<tr>\n'
-        row_text += '<td><b>%s:</b></td>\n' % body_site.title()
 
         self_plots_fp = join('time_series',
                              'taxa_plots_Self_%s' % body_site,
@@ -74,168 +106,311 @@ def _create_taxa_summary_plots_links(out_dir, personal_id, body_sites):
 
         if exists(join(plots_prefix, self_plots_fp)) and \
            exists(join(plots_prefix, other_plots_fp)):
-            row_text += ('<td><a href="%s" target="_blank">Self</a></td>\n' %
-                        self_plots_fp)
-            row_text += ('<td><a href="%s" target="_blank">Other</a></td>\n' %
-                         other_plots_fp)
-            row_text += ('<td><a href="%s" target="_blank">Self versus Other'
-                         '</a></td>\n' % self_vs_other_fp)
-
-            links_text += row_text + '</tr>\n'
-
-    return links_text + '</table>\n'
+            links_html.append(
+                    '<tr>\n'
+                    '<td><b>%s:</b></td>\n'
+                    '<td><a href="%s" target="_blank">Self</a></td>\n'
+                    '<td><a href="%s" target="_blank">Other</a></td>\n'
+                    '<td><a href="%s" target="_blank">Self versus Other</a>'
+                    '</td>\n'
+                    '</tr>\n' % (body_site.title(), self_plots_fp,
+                                 other_plots_fp, self_vs_other_fp))
+
+    links_html.append('</table>\n')
+    return ''.join(links_html)
 
 def _create_alpha_diversity_boxplots_links(plot_fps):
-    plot_links_text = '<ul>\n'
+    plot_links_html = ['<ul>\n']
 
     for plot_fp in plot_fps:
         adiv_metric_title = format_title(splitext(basename(plot_fp))[0])
-        plot_links_text += '<li><a href="%s" target="_blank">%s</a></li>\n' % (
-                plot_fp, adiv_metric_title)
+        plot_links_html.append(
+                '<li><a href="%s" target="_blank">%s</a></li>\n' %
+                (plot_fp, adiv_metric_title))
 
-    return plot_links_text + '</ul>\n'
+    plot_links_html.append('</ul>\n')
+    return ''.join(plot_links_html)
 
 def _create_otu_category_significance_links(table_fps):
-    table_links_text = '<ul>\n'
+    table_links_html = ['<ul>\n']
 
     for table_fp in table_fps:
         body_site = splitext(basename(table_fp))[0].title()
-        table_links_text += ('<li><a href="%s" target="_blank">%s</a></li>\n' %
-            (table_fp, body_site))
+        table_links_html.append(
+                '<li><a href="%s" target="_blank">%s</a></li>\n' %
+                (table_fp, body_site))
 
-    return table_links_text + '</ul>\n'
+    table_links_html.append('</ul>\n')
+    return ''.join(table_links_html)
 
 def create_otu_category_significance_html_tables(table_fps, alpha, output_dir,
                                                  individual_titles,
-                                                 rep_set_fp=None):
-    per_body_site_tables = _format_otu_category_significance_tables_as_html(
-            table_fps, alpha, individual_titles, rep_set_fp)
+                                                 rep_set=None,
+                                                 otu_fragment_cache=None):
+    """Writes an HTML page for each OTU category significance table.
+
+    Each page is written to disk as its table is read, one row at a time.
+    Only the significant OTUs' rep seq dialogs (which are placed after the
+    table) are held until the table is finished, and those are shared with
+    otu_fragment_cache.
+    """
+    _validate_alpha(alpha)
+    if otu_fragment_cache is None:
+        otu_fragment_cache = OTUFragmentCache(rep_set)
 
     created_files = []
-    for body_site, (table_html, rep_seq_html) in per_body_site_tables.items():
+    for table_fp in table_fps:
+        body_site = _get_otu_category_significance_body_site(table_fp)
         out_html_fp = join(output_dir, '%s.html' % body_site)
-        out_html_f = open(out_html_fp, 'w')
 
-        out_html_f.write(otu_category_significance_table_text % (body_site,
-                individual_titles[0], individual_titles[1],
-                individual_titles[0], individual_titles[1], table_html,
-                rep_seq_html))
+        with open(table_fp, 'U') as table_f:
+            with open(out_html_fp, 'w') as out_html_f:
+                out_html_f.write(otu_category_significance_table_text %
+                                 (body_site, individual_titles[0],
+                                  individual_titles[1], individual_titles[0],
+                                  individual_titles[1]))
+
+                rep_seq_divs = []
+                out_html_f.writelines(
+                        _generate_otu_category_significance_table_html(
+                                table_f, alpha, individual_titles,
+                                otu_fragment_cache, rep_seq_divs))
+                out_html_f.write('\n    ')
+                out_html_f.writelines(rep_seq_divs)
+                out_html_f.write(otu_category_significance_table_end_text)
 
-        out_html_f.close()
         created_files.append(basename(out_html_fp))
 
     return sorted(created_files)
 
 def _format_otu_category_significance_tables_as_html(table_fps, alpha,
                                                      individual_titles,
-                                                     rep_set_fp=None):
-    if alpha < 0 or alpha > 1:
-        raise ValueError("Alpha must be between zero and one.")
-
-    otu_id_lookup = {}
-    if rep_set_fp is not None:
-        for seq_id, seq in MinimalFastaParser(open(rep_set_fp, 'U')):
-            seq_id = seq_id.strip().split()[0]
-            otu_id_lookup[seq_id] = seq
+                                                     rep_set=None,
+                                                     otu_fragment_cache=None):
+    """rep_set, if provided, is a RepSet (or dict) of OTU ID -> rep seq.
+
+    Each significant OTU's HTML is taken from otu_fragment_cache if it is
+    provided (in which case rep_set is ignored in favor of the cache's rep
+    set), so that OTUs that are significant for many individuals are only
+    rendered once.
+    """
+    _validate_alpha(alpha)
+    if otu_fragment_cache is None:
+        otu_fragment_cache = OTUFragmentCache(rep_set)
 
     per_body_site_tables = {}
     for table_fp in table_fps:
-        body_site = splitext(basename(table_fp))[0].split('otu_cat_sig_')[-1]
-        html_table_text = ('<table class="data-table">\n'
-                           '<tr>\n'
-                           '<th>OTU ID</th>\n'
-                           '<th>Taxonomy</th>\n'
-                           '</tr>\n')
-
-        rep_seq_html = ''
-        processed_header = False
+        body_site = _get_otu_category_significance_body_site(table_fp)
 
+        rep_seq_divs = []
         with open(table_fp, 'U') as table_f:
-            for line in table_f:
-                cells = map(lambda e: e.strip(), line.strip().split('\t'))
-
-                if not processed_header:
-                    otu_id_idx = cells.index('OTU')
-                    fdr_p_value_idx = cells.index('FDR_corrected')
-                    bon_p_value_idx = cells.index('Bonferroni_corrected')
-                    taxonomy_idx = cells.index('Consensus Lineage')
-                    individual_title0_idx = cells.index('%s_mean' %
-                                                        individual_titles[0])
-                    individual_title1_idx = cells.index('%s_mean' %
-                                                        individual_titles[1])
-                    processed_header = True
-                    continue
-
-                otu_id = cells[otu_id_idx]
-
-                # Sometimes the FDR-corrected p-value is 'NA', so in that
-                # case we'll use the Bonferroni-corrected p-value.
-                try:
-                    p_value = float(cells[fdr_p_value_idx])
-                except ValueError:
-                    p_value = float(cells[bon_p_value_idx])
-
-                taxonomy = cells[taxonomy_idx]
-                individual_title0_mean = float(cells[individual_title0_idx])
-                individual_title1_mean = float(cells[individual_title1_idx])
-
-                if p_value <= alpha:
-                    # Taken from qiime.plot_taxa_summary.
-                    taxa_links = []
-                    for tax_level in taxonomy.split(';'):
-                        # identify the taxa name (e.g., everything after the
-                        # first double underscore) - we only want to include
-                        # this in the google links for better search
-                        # sensitivity
-                        tax_name = tax_level.split('__',1)[1]
-                        if len(tax_name) == 0:
-                            # if there is no taxa name
-                            # (e.g., tax_level == "s__") don't print anything
-                            # for this level or any levels below it (which all
-                            # should have no name anyway)
-                            break
-                        else:
-                            taxa_links.append(
-                                    '<a href="javascript:gg(\'%s\');">%s</a>' %
-                                    (tax_name.replace(' ', '+'),
-                                     tax_level.replace(' ', '&nbsp;')))
-                    taxonomy = ';'.join(taxa_links).replace('"', '')
-                    if individual_title0_mean < individual_title1_mean:
-                        row_color = "#FF9900" # orange
-                    else:
-                        row_color = "#99CCFF" # blue
-
-                    # If we have a rep seq for the current OTU ID, create a
-                    # link. If not, simply display the OTU ID as text.
-                    otu_id_html = otu_id
-                    if otu_id in otu_id_lookup:
-                        rep_seq = otu_id_lookup[otu_id]
-
-                        # Splitting code taken from
-                        # http://code.activestate.com/recipes/496784-split-
-                        # string-into-n-size-pieces/
-                        rep_seq = '\n'.join([rep_seq[i:i+40]
-                            for i in range(0, len(rep_seq), 40)])
-
-                        rep_seq_div_id = '%s-rep-seq' % otu_id
-                        otu_id_html = ('<a href="#" id="%s" '
-                                       'onclick="openDialog(\'%s\', \'%s\'); '
-                                       'return false;">%s</a>' % (otu_id,
-                                       rep_seq_div_id, otu_id, otu_id))
-                        rep_seq_html += ('<div id="%s" class="rep-seq-dialog" '
-                                         'title="Representative Sequence for '
-                                         'OTU ID %s">\n<pre>&gt;%s\n%s</pre>\n'
-                                         '</div>\n' % (rep_seq_div_id, otu_id,
-                                                       otu_id, rep_seq))
-
-                    html_table_text += ('<tr>\n<td bgcolor=%s>%s</td>\n'
-                                        '<td>%s</td>\n</tr>\n' % (row_color,
-                                        otu_id_html, taxonomy))
-        html_table_text += '</table>\n'
-        per_body_site_tables[body_site] = (html_table_text, rep_seq_html)
+            html_table_text = ''.join(
+                    _generate_otu_category_significance_table_html(table_f,
+                            alpha, individual_titles, otu_fragment_cache,
+                            rep_seq_divs))
+        per_body_site_tables[body_site] = (html_table_text,
+                                           ''.join(rep_seq_divs))
 
     return per_body_site_tables
 
+def _validate_alpha(alpha):
+    if alpha < 0 or alpha > 1:
+        raise ValueError("Alpha must be between zero and one.")
+
+def _get_otu_category_significance_body_site(table_fp):
+    return splitext(basename(table_fp))[0].split('otu_cat_sig_')[-1]
+
+def _generate_otu_category_significance_table_html(table_f, alpha,
+                                                   individual_titles,
+                                                   otu_fragment_cache,
+                                                   rep_seq_divs):
+    """Yields an HTML table of the significant OTUs in table_f, in pieces.
+
+    The rep seq dialog of each significant OTU (if it has one) is appended to
+    rep_seq_divs, since the dialogs go after the table.
+    """
+    yield ('<table class="data-table">\n'
+           '<tr>\n'
+           '<th>OTU ID</th>\n'
+           '<th>Taxonomy</th>\n'
+           '</tr>\n')
+
+    processed_header = False
+    for line in table_f:
+        cells = map(lambda e: e.strip(), line.strip().split('\t'))
+
+        if not processed_header:
+            otu_id_idx = cells.index('OTU')
+            fdr_p_value_idx = cells.index('FDR_corrected')
+            bon_p_value_idx = cells.index('Bonferroni_corrected')
+            taxonomy_idx = cells.index('Consensus Lineage')
+            individual_title0_idx = cells.index('%s_mean' %
+                                                individual_titles[0])
+            individual_title1_idx = cells.index('%s_mean' %
+                                                individual_titles[1])
+            processed_header = True
+            continue
+
+        otu_id = cells[otu_id_idx]
+
+        # Sometimes the FDR-corrected p-value is 'NA', so in that case we'll
+        # use the Bonferroni-corrected p-value.
+        try:
+            p_value = float(cells[fdr_p_value_idx])
+        except ValueError:
+            p_value = float(cells[bon_p_value_idx])
+
+        taxonomy = cells[taxonomy_idx]
+        individual_title0_mean = float(cells[individual_title0_idx])
+        individual_title1_mean = float(cells[individual_title1_idx])
+
+        if p_value <= alpha:
+            otu_id_html, taxonomy_html, rep_seq_div_html = \
+                    otu_fragment_cache.get_fragments(otu_id, taxonomy)
+
+            if individual_title0_mean < individual_title1_mean:
+                row_color = "#FF9900" # orange
+            else:
+                row_color = "#99CCFF" # blue
+
+            if rep_seq_div_html:
+                rep_seq_divs.append(rep_seq_div_html)
+            yield ('<tr>\n<td bgcolor=%s>%s</td>\n<td>%s</td>\n</tr>\n' %
+                   (row_color, otu_id_html, taxonomy_html))
+
+    yield '</table>\n'
+
+class OTUFragmentCache(object):
+    """LRU cache of the HTML rendered for each significant OTU.
+
+    The same OTUs are significant for many individuals (and body sites), so
+    each OTU's ID link, taxonomy links, and rep seq dialog are rendered once
+    and reused. Fragments are keyed by OTU ID and taxonomy, and once the
+    cache holds max_size fragments, the least recently used fragment is
+    evicted. hits and misses count how many lookups were (and weren't)
+    served from the cache.
+    """
+
+    def __init__(self, rep_set=None, max_size=10000):
+        if max_size < 1:
+            raise ValueError("The maximum size of the cache must be at least "
+                             "one.")
+
+        self.rep_set = {} if rep_set is None else rep_set
+        self.max_size = max_size
+        self.hits = 0
+        self.misses = 0
+        self._fragments = OrderedDict()
+
+    def __len__(self):
+        return len(self._fragments)
+
+    def get_fragments(self, otu_id, taxonomy):
+        """Returns the (OTU ID, taxonomy, rep seq dialog) HTML for an OTU.
+
+        The OTU ID is a link that opens the rep seq dialog if the OTU has a
+        rep seq. Otherwise, the OTU ID is displayed as text and the rep seq
+        dialog is empty.
+        """
+        key = (otu_id, taxonomy)
+        fragments = self._fragments.pop(key, None)
+
+        if fragments is None:
+            self.misses += 1
+            fragments = (_format_otu_id_html(otu_id, self.rep_set),
+                         _format_taxonomy_html(taxonomy),
+                         _format_rep_seq_html(otu_id, self.rep_set))
+
+            if len(self._fragments) >= self.max_size:
+                self._fragments.popitem(last=False)
+        else:
+            self.hits += 1
+
+        self._fragments[key] = fragments
+        return fragments
+
+    def get_hit_rate(self):
+        """Returns the fraction of lookups that were served from the cache.
+
+        Returns zero if there haven't been any lookups.
+        """
+        lookups = self.hits + self.misses
+        return self.hits / lookups if lookups else 0.0
+
+def _format_taxonomy_html(taxonomy):
+    # Taken from qiime.plot_taxa_summary.
+    taxa_links = []
+    for tax_level in taxonomy.split(';'):
+        # identify the taxa name (e.g., everything after the first double
+        # underscore) - we only want to include this in the google links for
+        # better search sensitivity
+        tax_name = tax_level.split('__',1)[1]
+        if len(tax_name) == 0:
+            # if there is no taxa name (e.g., tax_level == "s__") don't print
+            # anything for this level or any levels below it (which all
+            # should have no name anyway)
+            break
+        else:
+            taxa_links.append('<a href="javascript:gg(\'%s\');">%s</a>' %
+                              (tax_name.replace(' ', '+'),
+                               tax_level.replace(' ', '&nbsp;')))
+    return ';'.join(taxa_links).replace('"', '')
+
+def _format_otu_id_html(otu_id, rep_set):
+    # If we have a rep seq for the OTU ID, create a link. If not, simply
+    # display the OTU ID as text.
+    if otu_id not in rep_set:
+        return otu_id
+
+    return ('<a href="#" id="%s" onclick="openDialog(\'%s-rep-seq\', '
+            '\'%s\'); return false;">%s</a>' % (otu_id, otu_id, otu_id,
+                                                 otu_id))
+
+def _format_rep_seq_html(otu_id, rep_set):
+    rep_seq = rep_set.get(otu_id)
+    if rep_seq is None:
+        return ''
+
+    # Splitting code taken from
+    # http://code.activestate.com/recipes/496784-split-string-into-n-size-
+    # pieces/
+    rep_seq = '\n'.join([rep_seq[i:i+40] for i in range(0, len(rep_seq), 40)])
+
+    return ('<div id="%s-rep-seq" class="rep-seq-dialog" '
+            'title="Representative Sequence for OTU ID %s">\n'
+            '<pre>&gt;%s\n%s</pre>\n</div>\n' % (otu_id, otu_id, otu_id,
+                                                rep_seq))
+
+def _format_rarefaction_averages_as_html(depths, groups):
+    """Formats groups' average alpha diversity at each depth as a table.
+
+    Returns an HTML table with a row for each depth and a column for each
+    group. Each cell contains the group's average and error (e.g. standard
+    deviation), or n/a if the group doesn't have an average at the depth.
+
+    Arguments:
+        depths - list of rarefaction depths
+        groups - list of (title, averages, errors) tuples, one per group,
+            where averages and errors have one value per depth
+    """
+    html = ['<table class="data-table">\n<tr>\n<th>Seqs/Sample</th>\n']
+    for title, averages, errors in groups:
+        html.append('<th>%s</th>\n' % title)
+    html.append('</tr>\n')
+
+    for i, depth in enumerate(depths):
+        html.append('<tr>\n<td>%s</td>\n' % depth)
+        for title, averages, errors in groups:
+            if averages[i] != averages[i]:
+                html.append('<td>n/a</td>\n')
+            else:
+                html.append('<td>%.3f &plusmn; %.3f</td>\n' %
+                            (averages[i], errors[i]))
+        html.append('</tr>\n')
+
+    html.append('</table>\n')
+    return ''.join(html)
+
 def format_title(input_str):
     """Return title-cased string, with underscores converted to spaces.
 
@@ -253,7 +428,8 @@ def format_participant_list(participants_f, url_prefix):
     """Formats an HTML list of personal IDs with links to personal results.
 
     Returns the HTML list as a string suitable for writing to a file. Personal
-    IDs will be sorted.
+    IDs will be sorted. Use write_participant_list to write a large list
+    directly to a file instead.
 
     Arguments:
         participants_f - file containing a single personal ID per line. If
@@ -263,7 +439,132 @@ def format_participant_list(participants_f, url_prefix):
         url_prefix - URL to prefix each personal ID with to provide links to
             personalized results (string)
     """
-    personal_ids = []
+    return ''.join(_generate_participant_list_html(participants_f,
+                                                   url_prefix))
+
+def write_participant_list(participants_f, url_prefix, output_f):
+    """Writes an HTML list of personal IDs with links to personal results.
+
+    The list is the same as format_participant_list's, but each item is
+    written to output_f as it is formatted, so only the personal IDs (which
+    need to be sorted) are held in memory.
+    """
+    output_f.writelines(_generate_participant_list_html(participants_f,
+                                                        url_prefix))
+
+def write_participant_pages(participants_f, url_prefix, output_fp,
+                            page_size=1000):
+    """Writes a paginated HTML list of personal IDs and a search index.
+
+    The sorted personal IDs are split into pages of page_size IDs. The first
+    page is written to output_fp and each subsequent page to
+    <output_fp base>_<page number><output_fp extension> (e.g.
+    participants_2.html), and each page links to every other page.
+
+    Each page also has a search box, which looks up personal IDs (or
+    prefixes of them) in a search index without loading any of the pages.
+    The index (<output_fp base>_search_index.json) contains the first
+    personal ID of each page and the name of the page's search shard
+    (<output_fp base>_search_<page number>.json), which contains the page's
+    personal IDs. participant_search.js, which performs the search, is
+    copied to the same directory as output_fp. The files must be kept
+    together.
+
+    Returns the number of pages that were written.
+
+    Arguments:
+        participants_f - file containing a single personal ID per line (see
+            format_participant_list)
+        url_prefix - URL to prefix each personal ID with to provide links to
+            personalized results (string)
+        output_fp - the path to write the first page to
+        page_size - the maximum number of personal IDs on each page
+    """
+    if page_size < 1:
+        raise ValueError("The page size must be at least 1.")
+
+    personal_ids = sorted(_parse_participant_ids(participants_f))
+    pages = [personal_ids[start:start + page_size]
+             for start in range(0, len(personal_ids), page_size)] or [[]]
+
+    output_dir = dirname(output_fp)
+    base, ext = splitext(basename(output_fp))
+    page_fns = [base + ext] + ['%s_%d%s' % (base, page_num, ext)
+                               for page_num in range(2, len(pages) + 1)]
+    shard_fns = ['%s_search_%d.json' % (base, page_num)
+                 for page_num in range(1, len(pages) + 1)]
+    index_fn = '%s_search_index.json' % base
+
+    for page_num, page_ids in enumerate(pages):
+        with open(join(output_dir, shard_fns[page_num]), 'w') as shard_f:
+            shard_f.write(_format_participant_search_shard(page_ids))
+
+        with open(join(output_dir, page_fns[page_num]), 'w') as page_f:
+            nav_html = _format_participant_page_nav(pages, page_fns, page_num)
+            page_f.write(participant_search_text % index_fn)
+            page_f.write(nav_html)
+            page_f.writelines(_generate_participant_list_items(page_ids,
+                                                               url_prefix))
+            page_f.write(nav_html)
+
+    url_prefix = url_prefix if url_prefix.endswith('/') else url_prefix + '/'
+    with open(join(output_dir, index_fn), 'w') as index_f:
+        index_f.write(dumps({
+            'url_prefix': url_prefix,
+            'first_ids': [page_ids[0] if page_ids else ''
+                          for page_ids in pages],
+            'shards': shard_fns,
+            'pages': page_fns
+        }, separators=(',', ':'), sort_keys=True))
+
+    copyfile(join(dirname(__file__), 'support_files', 'js',
+                  'participant_search.js'),
+             join(output_dir, 'participant_search.js'))
+
+    return len(pages)
+
+def _format_participant_page_nav(pages, page_fns, page_num):
+    """Returns links to every page, titled with the page's ID range."""
+    if len(pages) == 1:
+        return ''
+
+    links = []
+    for i, (page_ids, page_fn) in enumerate(zip(pages, page_fns)):
+        if i == page_num:
+            links.append('<b>%d</b>' % (i + 1))
+        else:
+            links.append('<a href="%s" title="%s - %s">%d</a>' % (
+                    page_fn, page_ids[0], page_ids[-1], i + 1))
+    return '<p class="participant-pages">Page %d of %d: %s</p>\n' % (
+            page_num + 1, len(pages), ' '.join(links))
+
+def _format_participant_search_shard(personal_ids):
+    """Returns a JSON list of the sorted personal IDs, front-coded.
+
+    Each ID is stored as [length of the prefix it shares with the previous
+    ID, the rest of the ID], which is much smaller than the IDs themselves
+    when they share a common prefix (e.g. NAU123, NAU124).
+    """
+    entries = []
+    previous_id = ''
+    for personal_id in personal_ids:
+        prefix_len = 0
+        max_prefix_len = min(len(previous_id), len(personal_id))
+        while prefix_len < max_prefix_len and \
+              previous_id[prefix_len] == personal_id[prefix_len]:
+            prefix_len += 1
+        entries.append([prefix_len, personal_id[prefix_len:]])
+        previous_id = personal_id
+    return dumps(entries, separators=(',', ':'))
+
+def _generate_participant_list_html(participants_f, url_prefix):
+    # Read and validate all of the personal IDs before yielding anything, so
+    # that nothing is written if the participants file is invalid.
+    return _generate_participant_list_items(
+            sorted(_parse_participant_ids(participants_f)), url_prefix)
+
+def _parse_participant_ids(participants_f):
+    personal_ids = set()
 
     for line in participants_f:
         if not _can_ignore(line):
@@ -274,32 +575,120 @@ def format_participant_list(participants_f, url_prefix):
                                  "encountered. Personal IDs must be unique." %
                                  personal_id)
 
-            personal_ids.append(personal_id)
+            personal_ids.add(personal_id)
 
-    personal_ids.sort()
+    return personal_ids
 
+def _generate_participant_list_items(personal_ids, url_prefix):
     url_prefix = url_prefix if url_prefix.endswith('/') else url_prefix + '/'
 
-    result = '<ul>\n'
+    yield '<ul>\n'
     for personal_id in personal_ids:
         url = url_prefix + personal_id + '/index.html'
-        result += '  <li><a href="%s" target="_blank">%s</a></li>\n' % (
+        yield '  <li><a href="%s" target="_blank">%s</a></li>\n' % (
                 url, personal_id)
-    result += '</ul>\n'
+    yield '</ul>\n'
 
-    return result
+def format_htaccess_file(password_dir, pid, dbm_type=None):
+    """Returns the .htaccess file that only allows pid to log in.
 
-def format_htaccess_file(password_dir, pid):
+    If dbm_type is provided (any of the keys in htpasswd.dbm_types), users
+    are authenticated against the DBM user database in password_dir instead
+    of the flat .htpasswd file.
+    """
     result = ''
 
-    result += 'AuthUserFile %s\n' % join(password_dir, '.htpasswd')
-    result += 'AuthGroupFile /dev/null\n'
+    if dbm_type is None:
+        result += 'AuthUserFile %s\n' % join(password_dir, '.htpasswd')
+        result += 'AuthGroupFile /dev/null\n'
+    else:
+        result += 'AuthBasicProvider dbm\n'
+        result += 'AuthDBMType %s\n' % dbm_types[dbm_type][1]
+        result += 'AuthDBMUserFile %s\n' % join(password_dir,
+                                                '.htpasswd.dbm')
     result += 'AuthName "Please log in to view your personalized results"\n'
     result += 'AuthType Basic\n\n'
     result += 'require user %s\n' % pid
 
     return result
 
+def format_taxa_summary(taxa, sample_ids, abundances, delimiter=';'):
+    """Formats a taxa summary in the same way as summarize_taxa.py.
+
+    Returns the summary as a string suitable for writing to a file (the
+    "classic" tab-separated format).
+
+    Arguments:
+        taxa - list of taxa, where each taxon is a tuple of taxonomic levels
+        sample_ids - list of sample IDs (columns in the summary). Non-word
+            characters are replaced with periods, as summarize_taxa.py does
+        abundances - 2D array with a row for each taxon and a column for each
+            sample ID
+        delimiter - string used to join each taxon's levels
+    """
+    sample_ids = [sub(r'\W', '.', sample_id) for sample_id in sample_ids]
+
+    lines = ['\t'.join(['Taxon'] + sample_ids)]
+    for taxon, taxon_abundances in zip(taxa, abundances):
+        lines.append('\t'.join([delimiter.join(taxon)] +
+                               map(str, taxon_abundances)))
+
+    return '\n'.join(lines) + '\n'
+
+def format_otu_category_significance(results, individual_titles):
+    """Formats OTU significance results like otu_category_significance.py.
+
+    Returns the results as a tab-separated table (as a string) with the
+    columns that _format_otu_category_significance_tables_as_html reads.
+
+    Arguments:
+        results - list of (OTU ID, p-value, Bonferroni-corrected p-value,
+            FDR-corrected p-value, self mean, other mean, taxonomy) tuples
+            (e.g. from compare_individuals_to_study)
+        individual_titles - titles of self and other, used in the mean
+            columns' headers
+    """
+    lines = ['\t'.join(['OTU', 'prob', 'Bonferroni_corrected',
+                        'FDR_corrected'] +
+                       ['%s_mean' % title for title in individual_titles] +
+                       ['Consensus Lineage'])]
+    for result in results:
+        lines.append('\t'.join([result[0]] + map(str, result[1:6]) +
+                               [result[6]]))
+
+    return '\n'.join(lines) + '\n'
+
+def format_rarefaction_averages(metric, category, depths, x_max, groups):
+    """Formats groups' average alpha diversity like make_rarefaction_plots.py.
+
+    Returns the averages as a string in the format of
+    make_rarefaction_plots.py's average tables (which can be read by QIIME's
+    parse_rarefaction_data). As in those tables, errors of zero are written
+    as nan.
+
+    Arguments:
+        metric - the alpha diversity metric
+        category - the mapping category that the groups are from
+        depths - list of rarefaction depths (the x-axis values)
+        x_max - the x-axis' upper limit
+        groups - list of (name, color, averages, errors) tuples, one per
+            group, where color is a hex string (e.g. '#0000ff') and averages
+            and errors have one value per depth
+    """
+    lines = ['# %s' % metric, '# %s' % category,
+             'xaxis: ' + ''.join(['%s\t' % float(depth) for depth in depths]),
+             'xmax: %s' % float(x_max)]
+    for name, color, averages, errors in groups:
+        lines.append('>> %s' % name)
+        lines.append('color %s' % color)
+        lines.append('series ' + ''.join(['%s\t' % average
+                                          for average in averages]))
+        lines.append('error ' + ''.join(['%s\t' % (error if error != 0
+                                                   else float('nan'))
+                                         for error in errors]))
+
+    return '\n'.join(lines) + '\n'
+
 # Text for various HTML pages.
 index_text = """
 <!DOCTYPE html PUBLIC "-//W3C//DTD XHTML 1.0 Transitional//EN" "http://www.w3.org/TR/xhtml1/DTD/xhtml1-transitional.dtd">
@@ -395,10 +784,7 @@ index_text = """
         While many of the results apparent in this <a href="#" id="ordination-ref-4" class="ordination">ordination</a> plot were already known, the unprecedented number of indivduals and timepoints in the Student Microbiome Project data set allows us to address more sophisticated questions. For example, we are using these results to determine whether microbial communities of males or females more variable through time, if there are geographical differences in community composition that are visible across the three universities, and the affects of antibiotic usage and other <i>disturbances</i> on the composition of microbial communities. These are just a few examples that illustrate the utility of <a href="#" id="bdiv-ref-7" class="bdiv">beta diversity</a> analyses and the uniqueness of our dataset.
         <br/><br/>
 
-        <span class="error"><b>Note:</b></span> To view your beta diversity PCoA plots, you will need to have <a href="http://www.java.com" target="_blank">Java</a> installed and updated to the latest version.  Some browsers, such as Chrome and certain versions of Safari, have trouble displaying these plots. We recommend that you use <a href="http://www.mozilla.org/en-US/firefox/new/" target="_blank">Firefox</a> to view these plots. Additionally, you may receive a security warning when clicking the links below that asks if you'd like to run the application. Please click <b>Run</b> to display the plots.
-
-        <h3>Click <a href="./beta_diversity/unweighted_unifrac_pc_3D_PCoA_plots.html" target="_blank">here</a> to see your beta diversity PCoA plots.</h3>
-        <h3>Click <a href="./beta_diversity_time_series/unweighted_unifrac_pc_3D_PCoA_plots.html" target="_blank">here</a> to see your beta diversity PCoA plots with an explicit time series axis.</h3>
+        %s
       </div>
 
       <h3 class="accordion-header"><a href="#alpha-diversity">How many types of microbes live on my body?</a></h3>
@@ -472,6 +858,17 @@ You should be able to answer several questions from these plots:
 %s
 """
 
+beta_diversity_make_3d_plots_text = """
+<span class="error"><b>Note:</b></span> To view your beta diversity PCoA plots, you will need to have <a href="http://www.java.com" target="_blank">Java</a> installed and updated to the latest version.  Some browsers, such as Chrome and certain versions of Safari, have trouble displaying these plots. We recommend that you use <a href="http://www.mozilla.org/en-US/firefox/new/" target="_blank">Firefox</a> to view these plots. Additionally, you may receive a security warning when clicking the links below that asks if you'd like to run the application. Please click <b>Run</b> to display the plots.
+
+<h3>Click <a href="./beta_diversity/unweighted_unifrac_pc_3D_PCoA_plots.html" target="_blank">here</a> to see your beta diversity PCoA plots.</h3>
+<h3>Click <a href="./beta_diversity_time_series/unweighted_unifrac_pc_3D_PCoA_plots.html" target="_blank">here</a> to see your beta diversity PCoA plots with an explicit time series axis.</h3>
+"""
+
+beta_diversity_viewer_text = """
+<h3>Click <a href="./beta_diversity/index.html" target="_blank">here</a> to see your beta diversity PCoA plots. You can switch between the PCoA plots and the PCoA plots with an explicit time series axis, and drag the plots to rotate them.</h3>
+"""
+
 alpha_diversity_boxplots_text = """
 Here we present plots showing the distributions of your <a href="#" id="adiv-ref-2" class="adiv">alpha diversity</a> (<i>Self</i>) versus all other individuals' <a href="#" id="adiv-ref-3" class="adiv">alpha diversity</a> (<i>Other</i>), for each body site. <a href="#" id="adiv-ref-4" class="adiv">Alpha diversity</a> refers to within-sample diversity, and can be a measure of the number of different types of organisms that are present in a sample (i.e., the richness of the sample), the shape of the distribution of counts of different organisms in a sample (i.e., the evenness of the sample), or some other property of a single sample.
 <br/><br/>
@@ -488,8 +885,15 @@ You should be able to answer several questions about your microbial communities
 <br/><br/>
 Alpha rarefaction plots show the <a href="#" id="adiv-ref-7" class="adiv">alpha diversity</a> at different depths of sampling (i.e., as if different numbers of sequences were collected). An alpha rarefaction plot presents the <a href="#" id="adiv-ref-8" class="adiv">alpha diversity</a> (y-axis) at different depths of sampling (or number of sequences collected; x-axis). From an alpha rarefaction plot, you should be able to answer the question: <i>If we were to collect more sequences per sample, do you expect that your answers to the above questions 1 through 3 would change?</i>
 <br/><br/>
+%s
+"""
+
+alpha_rarefaction_make_rarefaction_plots_text = """
 Click <a href="./alpha_rarefaction/rarefaction_plots.html" target="_blank">here</a> to see your alpha rarefaction plots. After clicking the link, select the <tt>observed_species</tt> alpha diversity metric (the only one we computed here) from the first drop-down menu, and then a category from the second menu.
+"""
 
+alpha_rarefaction_static_text = """
+Click <a href="./alpha_rarefaction/rarefaction_plots.html" target="_blank">here</a> to see your alpha rarefaction plots. After clicking the link, look for the <i>Observed Species</i> alpha diversity metric (the only one we computed here). Each of your body sites is drawn as a solid line, and all other individuals' samples from the same body site are drawn as a dashed line.
 """
 
 # This javascript synchronizes the scrolling of the two iframes. It has been
@@ -666,6 +1070,71 @@ comparative_taxa_plots_text = """
 </html>
 """
 
+pcoa_viewer_text = """
+<!DOCTYPE html PUBLIC "-//W3C//DTD XHTML 1.0 Transitional//EN" "http://www.w3.org/TR/xhtml1/DTD/xhtml1-transitional.dtd">
+<html xmlns="http://www.w3.org/1999/xhtml" xml:lang="en" lang="en">
+<head>
+  <link href="../../support_files/css/themes/start/jquery-ui.css" rel="stylesheet">
+  <link href="../../support_files/css/main.css" rel="stylesheet">
+
+  <script src="../../support_files/js/pcoa_viewer.js"></script>
+  <script src="../../pcoa_data.js"></script>
+  <script src="overlay.js"></script>
+
+  <script language="javascript" type="text/javascript">
+    window.onload = function() {
+      new PCoAViewer("pcoa-canvas", "pcoa-legend", pcoaStudyData,
+                     pcoaOverlay);
+    };
+  </script>
+
+  <title>My Microbes: %s beta diversity PCoA plots</title>
+</head>
+
+<body>
+  <div class="ui-tabs ui-widget ui-widget-content ui-corner-all text">
+    <h2>Beta diversity PCoA plots</h2>
+    <a href="#" class="pcoa-view" data-view="pcoa">PCoA plot</a> |
+    <a href="#" class="pcoa-view" data-view="time">PCoA plot with explicit time series axis</a>
+    <br/><br/>
+    <table>
+      <tr>
+        <td><canvas id="pcoa-canvas" width="800" height="600"></canvas></td>
+        <td valign="top" id="pcoa-legend"></td>
+      </tr>
+    </table>
+  </div>
+</body>
+</html>
+"""
+
+alpha_rarefaction_text = """
+<!DOCTYPE html PUBLIC "-//W3C//DTD XHTML 1.0 Transitional//EN" "http://www.w3.org/TR/xhtml1/DTD/xhtml1-transitional.dtd">
+<html xmlns="http://www.w3.org/1999/xhtml" xml:lang="en" lang="en">
+<head>
+  <link href="../../support_files/css/themes/start/jquery-ui.css" rel="stylesheet">
+  <link href="../../support_files/css/main.css" rel="stylesheet">
+
+  <title>My Microbes: %s alpha rarefaction plots</title>
+</head>
+
+<body>
+  <div class="ui-tabs ui-widget ui-widget-content ui-corner-all text">
+    <h2>Alpha rarefaction plots</h2>
+    Each line shows the average alpha diversity of a group of samples at each depth of sampling, and the error bars show the standard deviation of the samples in the group.
+%s
+  </div>
+</body>
+</html>
+"""
+
+alpha_rarefaction_plot_text = """
+    <h3>%s</h3>
+    <img src="%s"/>
+    <br/>
+%s
+"""
+
 otu_category_significance_text = """
 Here we present <a href="#" id="otu-ref-3" class="otus">Operational Taxonomic Units (OTUs)</a> that seemed to differ in their average relative abundance when comparing you to all other individuals in the study. An <a href="#" id="otu-ref-4" class="otus">OTU</a> is a functional definition of a taxonomic group, often based on percent identity of 16S rRNA sequences. In this study, we began with a reference collection of 16S rRNA sequences (derived from the <a href="http://greengenes.secondgenome.com" target="_blank">Greengenes database</a>), and each of those sequences was used to define an Opertational Taxonomic Unit. We then compared all of the sequence reads that we obtained in this study (from your microbial communities and everyone else's) to those reference <a href="#" id="otu-ref-5" class="otus">OTUs</a>, and if a sequence read matched one of those sequences at at least 97%% identity, the read was considered an observation of that reference <a href="#" id="otu-ref-6" class="otus">OTU</a>. This process is one strategy for <i>OTU picking</i>, or assigning sequence reads to <a href="#" id="otu-ref-7" class="otus">OTUs</a>.
 <br/><br/>
@@ -700,13 +1169,21 @@ otu_category_significance_table_text = """
   <div class="ui-tabs ui-widget ui-widget-content ui-corner-all text">
     <h2>Operational Taxonomic Units (OTUs) that differed in relative abundance in %s samples (comparing self versus other)</h2> Click on the taxonomy links for each <a href="#" id="otu-ref-1" class="otus">OTU</a> to do a Google search for that taxonomic group. OTU IDs with an orange background are found in lower abundance in <i>%s</i> than in <i>%s</i>, and OTU IDs with a blue background are found in higher abundance in <i>%s</i> than in <i>%s</i>.  Click on the OTU ID to view the representative sequence for that OTU (try <a href="http://blast.ncbi.nlm.nih.gov/Blast.cgi?PROGRAM=blastn&BLAST_PROGRAMS=megaBlast&PAGE_TYPE=BlastSearch&SHOW_DEFAULTS=on&LINK_LOC=blasthome" target="_blank">BLASTing</a> these!).
     <br/><br/>
-    %s
-    %s
+    """
+
+otu_category_significance_table_end_text = """
   </div>
 </body>
 </html>
 """
 
+participant_search_text = """<div class="participant-search" data-index="%s">
+  <label>Find your personal ID: <input type="text" size="20" /></label>
+  <div class="participant-search-results"></div>
+</div>
+<script type="text/javascript" src="participant_search.js"></script>
+"""
+
 notification_email_subject = "Your personal microbiome results are ready!"
 
 notification_email_text = """
@@ -0,0 +1,245 @@
+#!/usr/bin/env python
+from __future__ import division
+
+__author__ = "Jai Ram Rideout"
+__copyright__ = "Copyright 2013, The QIIME project"
+__credits__ = ["Jai Ram Rideout"]
+__license__ = "GPL"
+__version__ = "0.1.0-dev"
+__maintainer__ = "Jai Ram Rideout"
+__email__ = "jai.rideout@gmail.com"
+
+"""Module for hashing passwords for Apache's .htpasswd files.
+
+The hashes are computed in-process (instead of by running Apache's htpasswd
+command for each password) and are identical to the ones htpasswd creates
+for the same password and salt. The following schemes are supported:
+
+    apr1 - Apache's MD5-based algorithm (htpasswd -m, the default)
+    sha1 - unsalted SHA-1 (htpasswd -s)
+    sha256, sha512 - SHA-256/SHA-512 crypt (htpasswd -2/-5). Requires the
+        system's crypt(3) to support them (e.g. glibc)
+    bcrypt - bcrypt (htpasswd -B). Requires the bcrypt package, which is
+        optional
+
+Hashed passwords can also be stored in a DBM user database (for Apache's
+AuthDBMUserFile), which Apache looks users up in directly instead of
+scanning a flat .htpasswd file on every request. Each DBM type requires the
+corresponding Python module (e.g. gdbm), which is optional.
+"""
+
+from base64 import b64encode
+from hashlib import md5, sha1
+from importlib import import_module
+from multiprocessing import Pool
+from random import SystemRandom
+
+try:
+    from crypt import crypt
+except ImportError:
+    crypt = None
+
+try:
+    import bcrypt
+except ImportError:
+    bcrypt = None
+
+password_schemes = ['apr1', 'bcrypt', 'sha1', 'sha256', 'sha512']
+
+# Maps each supported DBM type to the Python module that reads and writes it
+# and the value of Apache's AuthDBMType directive for it.
+dbm_types = {
+    'db': ('dbhash', 'DB'),
+    'gdbm': ('gdbm', 'GDBM'),
+    'ndbm': ('dbm', 'NDBM')
+}
+
+# The characters used to encode crypt-style salts and hashes.
+_itoa64 = './0123456789ABCDEFGHIJKLMNOPQRSTUVWXYZabcdefghijklmnopqrstuvwxyz'
+
+# The number of passwords each worker process hashes at a time.
+_batch_size = 64
+
+# How long (in seconds) to wait for the worker processes to finish. This is
+# effectively forever, but waiting without a timeout can't be interrupted.
+_pool_timeout = 60 * 60 * 24 * 365
+
+_random = SystemRandom()
+
+def hash_password(password, scheme='apr1', salt=None):
+    """Returns password's hash, as it would appear in an .htpasswd file.
+
+    Arguments:
+        password - the password to hash
+        scheme - the hashing scheme to use (any of password_schemes)
+        salt - the salt to hash the password with. If None, a random salt is
+            generated. Ignored by the sha1 and bcrypt schemes
+    """
+    check_password_scheme(scheme)
+
+    if scheme == 'apr1':
+        if salt is None:
+            salt = _generate_salt(8)
+        return _md5_crypt(password, salt, '$apr1$')
+    elif scheme == 'sha1':
+        return '{SHA}' + b64encode(sha1(password).digest())
+    elif scheme == 'bcrypt':
+        # htpasswd uses the $2y$ prefix, which is the same algorithm as $2b$.
+        hashed_password = bcrypt.hashpw(password, bcrypt.gensalt(5))
+        return '$2y$' + hashed_password[4:]
+    else:
+        if salt is None:
+            salt = _generate_salt(16)
+        prefix = '$5$' if scheme == 'sha256' else '$6$'
+        hashed_password = crypt(password, prefix + salt)
+        if hashed_password is None or not hashed_password.startswith(prefix):
+            raise ValueError("The system's crypt function does not support "
+                             "the %s scheme." % scheme)
+        return hashed_password
+
+def hash_passwords(passwords, scheme='apr1', jobs=1):
+    """Returns a list of the passwords' hashes (in the same order).
+
+    Arguments:
+        passwords - the passwords to hash
+        scheme - the hashing scheme to use (any of password_schemes)
+        jobs - the number of processes to hash passwords in. Each process
+            hashes a batch of passwords at a time
+    """
+    check_password_scheme(scheme)
+    if jobs < 1:
+        raise ValueError("The number of jobs must be at least 1.")
+
+    args = [(password, scheme) for password in passwords]
+    if jobs == 1 or len(args) <= _batch_size:
+        return map(_hash_password, args)
+
+    pool = Pool(jobs)
+    try:
+        hashed_passwords = pool.map_async(_hash_password, args,
+                _batch_size).get(_pool_timeout)
+    except:
+        pool.terminate()
+        pool.join()
+        raise
+    pool.close()
+    pool.join()
+    return hashed_passwords
+
+def check_password_scheme(scheme):
+    """Raises a ValueError if scheme can't be used."""
+    if scheme not in password_schemes:
+        raise ValueError("Unrecognized password hashing scheme '%s'. Must be "
+                         "one of: %s." % (scheme, ', '.join(password_schemes)))
+    if scheme == 'bcrypt' and bcrypt is None:
+        raise ValueError("The bcrypt scheme requires the bcrypt package to "
+                         "be installed.")
+    if scheme in ('sha256', 'sha512') and crypt is None:
+        raise ValueError("The %s scheme requires the crypt module, which is "
+                         "not available on this platform." % scheme)
+
+def update_user_dbm(dbm_fp, users, dbm_type='gdbm'):
+    """Adds or updates users in a DBM user database.
+
+    The database is created if it doesn't exist. Only the specified users
+    are written, so users that are already in the database (and aren't
+    being updated) are left as they are.
+
+    Returns a tuple containing the number of users that were added and the
+    number that were updated.
+
+    Arguments:
+        dbm_fp - the path of the database
+        users - iterable of (username, hashed password)
+        dbm_type - the type of database (any of the keys in dbm_types)
+    """
+    check_dbm_type(dbm_type)
+    dbm_module = import_module(dbm_types[dbm_type][0])
+
+    num_added = 0
+    num_updated = 0
+    user_dbm = dbm_module.open(dbm_fp, 'c')
+    try:
+        for username, hashed_password in users:
+            if ':' in username:
+                raise ValueError("Usernames can't contain a colon: %s" %
+                                 username)
+            if username in user_dbm:
+                # Keep anything after the hash (e.g. the user's groups).
+                fields = user_dbm[username].split(':', 1)
+                fields[0] = hashed_password
+                user_dbm[username] = ':'.join(fields)
+                num_updated += 1
+            else:
+                user_dbm[username] = hashed_password
+                num_added += 1
+    finally:
+        user_dbm.close()
+
+    return num_added, num_updated
+
+def check_dbm_type(dbm_type):
+    """Raises a ValueError if dbm_type can't be used."""
+    if dbm_type not in dbm_types:
+        raise ValueError("Unrecognized DBM type '%s'. Must be one of: %s." %
+                         (dbm_type, ', '.join(sorted(dbm_types))))
+
+    module_name = dbm_types[dbm_type][0]
+    try:
+        import_module(module_name)
+    except ImportError:
+        raise ValueError("The %s DBM type requires the %s module, which is "
+                         "not available." % (dbm_type, module_name))
+
+def _hash_password(args):
+    return hash_password(*args)
+
+def _generate_salt(length):
+    return ''.join([_random.choice(_itoa64) for i in range(length)])
+
+def _md5_crypt(password, salt, magic):
+    """Returns password's MD5-crypt hash.
+
+    This is Poul-Henning Kamp's MD5-crypt algorithm, which Apache's APR1 is
+    identical to aside from the magic string ('$apr1$' instead of '$1$').
+    """
+    salt = salt.split('$', 1)[0][:8]
+
+    final = md5(password + salt + password).digest()
+    ctx = md5(password + magic + salt)
+    for length in range(len(password), 0, -16):
+        ctx.update(final[:min(length, 16)])
+
+    i = len(password)
+    while i:
+        ctx.update('\x00' if i & 1 else password[:1])
+        i >>= 1
+    final = ctx.digest()
+
+    # Slow down brute-force attacks.
+    for i in range(1000):
+        ctx = md5()
+        ctx.update(password if i & 1 else final)
+        if i % 3:
+            ctx.update(salt)
+        if i % 7:
+            ctx.update(password)
+        ctx.update(final if i & 1 else password)
+        final = ctx.digest()
+
+    final = map(ord, final)
+    encoded = []
+    for a, b, c in ((0, 6, 12), (1, 7, 13), (2, 8, 14), (3, 9, 15),
+                    (4, 10, 5)):
+        encoded.append(_to64((final[a] << 16) | (final[b] << 8) | final[c],
+                             4))
+    encoded.append(_to64(final[11], 2))
+
+    return magic + salt + '$' + ''.join(encoded)
+
+def _to64(value, length):
+    chars = []
+    for i in range(length):
+        chars.append(_itoa64[value & 0x3f])
+        value >>= 6
+    return ''.join(chars)
@@ -0,0 +1,477 @@
+#!/usr/bin/env python
+from __future__ import division
+
+__author__ = "Jai Ram Rideout"
+__copyright__ = "Copyright 2013, The QIIME project"
+__credits__ = ["Jai Ram Rideout"]
+__license__ = "GPL"
+__version__ = "0.1.0-dev"
+__maintainer__ = "Jai Ram Rideout"
+__email__ = "jai.rideout@gmail.com"
+
+"""Module for sending many emails over a few reused SMTP connections.
+
+Connecting to an SMTP server, starting TLS, and logging in takes several
+round trips, and mail servers throttle clients that do this for every
+message. A Mailer instead sends messages from a few worker threads, each of
+which keeps its own authenticated connection open and reuses it for every
+message it sends. Sending can be rate limited, transient failures (e.g.
+dropped connections and 4xx responses) are retried with exponential backoff,
+and each delivered message can be recorded in a DeliveryJournal so that an
+interrupted run can be resumed without sending duplicates.
+
+Alternatively, a MailSpool writes the messages as files into a maildir or an
+MTA's pickup directory, and leaves delivering them to the local MTA.
+"""
+
+from email.Encoders import encode_base64
+from email.Generator import Generator
+from email.MIMEBase import MIMEBase
+from email.MIMEMultipart import MIMEMultipart
+from email.mime.text import MIMEText
+from email.Utils import formatdate
+from itertools import count
+from multiprocessing.pool import ThreadPool
+from os import fsync, getpid, makedirs, remove, rename
+from os.path import exists, isdir, join
+from Queue import Empty, Queue
+from smtplib import (SMTP, SMTPConnectError, SMTPResponseException,
+                     SMTPServerDisconnected)
+from socket import error as socket_error, gethostname
+from StringIO import StringIO
+from threading import Lock, Thread
+from time import sleep, time
+
+# Errors that are likely to go away if the message is resent (over a new
+# connection).
+_transient_errors = (SMTPServerDisconnected, SMTPConnectError, socket_error)
+
+# How long (in seconds) to wait for the spool's threads to finish. This is
+# effectively forever, but waiting without a timeout can't be interrupted.
+_pool_timeout = 60 * 60 * 24 * 365
+
+def create_email_message(sender, recipients, subject, body, attachments=None):
+    """Returns a MIME message (optionally with attachments).
+
+    A message without attachments is a single text/plain part, which is much
+    cheaper to render than a multipart message (e.g. when thousands of
+    notifications are rendered at once).
+
+    See util.send_email for a description of the arguments.
+    """
+    if attachments is None:
+        msg = MIMEText(body, 'plain')
+    else:
+        msg = MIMEMultipart()
+        for attachment_name, attachment_f in attachments:
+            part = MIMEBase('application', 'octet-stream')
+            part.set_payload(attachment_f.read())
+            encode_base64(part)
+            part.add_header('Content-Disposition',
+                            'attachment; filename="%s"' % attachment_name)
+            msg.attach(part)
+        part = MIMEText('text', 'plain')
+        part.set_payload(body)
+        msg.attach(part)
+
+    msg['From'] = sender
+    msg['To'] = ', '.join(recipients)
+    msg['Subject'] = subject
+    msg['Date'] = formatdate(localtime=True)
+
+    return msg
+
+class DeliveryJournal(object):
+    """Records the keys (e.g. personal IDs) of delivered messages.
+
+    Each key is appended to the journal file (one per line) and flushed to
+    disk as soon as its message is delivered, so the journal is accurate
+    even if the process is killed. Keys that were recorded by earlier runs
+    are loaded when the journal is opened. The journal file isn't created
+    until the first key is recorded.
+    """
+
+    def __init__(self, journal_fp):
+        self.journal_fp = journal_fp
+        self._delivered = set()
+        self._journal_f = None
+        self._partial_line = False
+        self._lock = Lock()
+
+        if exists(journal_fp):
+            journal_f = open(journal_fp, 'U')
+            try:
+                for line in journal_f:
+                    # A key without a newline was only partially written.
+                    if line.endswith('\n'):
+                        if line.strip():
+                            self._delivered.add(line.strip())
+                    else:
+                        self._partial_line = True
+            finally:
+                journal_f.close()
+
+    def __contains__(self, key):
+        return key in self._delivered
+
+    def __len__(self):
+        return len(self._delivered)
+
+    def record(self, key):
+        """Records that key's message was delivered."""
+        with self._lock:
+            if key not in self._delivered:
+                if self._journal_f is None:
+                    self._journal_f = open(self.journal_fp, 'a')
+                    if self._partial_line:
+                        self._journal_f.write('\n')
+                self._journal_f.write('%s\n' % key)
+                self._journal_f.flush()
+                fsync(self._journal_f.fileno())
+                self._delivered.add(key)
+
+    def close(self):
+        if self._journal_f is not None:
+            self._journal_f.close()
+            self._journal_f = None
+
+class RateLimiter(object):
+    """Spaces out events so that at most max_rate happen per second.
+
+    Can be shared by multiple threads. If max_rate is None, events aren't
+    limited.
+    """
+
+    def __init__(self, max_rate=None):
+        if max_rate is not None and max_rate <= 0:
+            raise ValueError("The maximum rate must be greater than zero.")
+
+        self.max_rate = max_rate
+        self._next_time = 0
+        self._lock = Lock()
+
+    def wait(self):
+        """Blocks until the next event is allowed to happen."""
+        if self.max_rate is None:
+            return
+
+        with self._lock:
+            now = time()
+            event_time = max(now, self._next_time)
+            self._next_time = event_time + 1 / self.max_rate
+        if event_time > now:
+            sleep(event_time - now)
+
+class Mailer(object):
+    """Sends messages over a pool of reused, authenticated SMTP connections.
+
+    Each of the pool's connections is owned by a worker thread, which opens
+    it when it sends its first message and closes it once there are no more
+    messages to send (or reopens it if it was dropped).
+
+    Arguments:
+        host - the SMTP server to send the messages with
+        port - the port number of the SMTP server to connect to
+        sender - the sender email address, which is also the username used to
+            log into the SMTP server
+        password - the password to log into the SMTP server with. If None,
+            the connections aren't logged in
+        connections - the number of connections (and worker threads)
+        max_rate - the maximum number of messages to send per second, or None
+            for no limit
+        max_retries - the number of times to resend a message after a
+            transient failure
+        backoff - the number of seconds to wait before the first retry. The
+            wait is doubled for each subsequent retry
+        use_tls - if True, each connection is encrypted with STARTTLS before
+            logging in
+        timeout - the number of seconds to wait for the server to respond
+    """
+
+    def __init__(self, host, port, sender, password, connections=2,
+                 max_rate=None, max_retries=3, backoff=1.0, use_tls=True,
+                 timeout=60):
+        if connections < 1:
+            raise ValueError("The number of connections must be at least 1.")
+        if max_retries < 0:
+            raise ValueError("The maximum number of retries must be at least "
+                             "0.")
+
+        self.host = host
+        self.port = port
+        self.sender = sender
+        self.password = password
+        self.connections = connections
+        self.max_retries = max_retries
+        self.backoff = backoff
+        self.use_tls = use_tls
+        self.timeout = timeout
+        self._rate_limiter = RateLimiter(max_rate)
+
+    def send(self, messages, journal=None, callback=None):
+        """Sends messages, skipping those that were already delivered.
+
+        Returns a tuple containing the list of keys of the messages that were
+        delivered and a dict mapping the key of each message that couldn't be
+        delivered to the exception that was raised the last time it was
+        tried.
+
+        Arguments:
+            messages - iterable of (key, recipients, message), where key
+                identifies the message in the journal (e.g. a personal ID),
+                recipients is a list of email addresses, and message is a
+                MIME message, a string, or a function that returns either
+                (which is called from one of the worker threads, so that
+                messages can be rendered concurrently)
+            journal - a DeliveryJournal. If provided, messages whose keys are
+                in the journal aren't sent, and each message's key is
+                recorded in the journal once it is delivered
+            callback - if provided, called with (key, recipients, error)
+                after each message is sent (error is None) or has failed
+                (error is the exception). Can be called from any of the
+                worker threads, but never from more than one at a time
+        """
+        queue = Queue()
+        for key, recipients, message in messages:
+            if journal is None or key not in journal:
+                queue.put((key, recipients, message))
+
+        report, delivered, failed = _create_reporter(journal, callback)
+        workers = [Thread(target=self._send_from_queue, args=(queue, report))
+                   for i in range(min(self.connections, queue.qsize()))]
+        for worker in workers:
+            worker.daemon = True
+            worker.start()
+
+        # Wait with a timeout so that the wait can be interrupted (e.g. by
+        # SIGINT).
+        for worker in workers:
+            while worker.is_alive():
+                worker.join(1)
+
+        return delivered, failed
+
+    def _send_from_queue(self, queue, report):
+        connection = None
+        try:
+            while True:
+                try:
+                    key, recipients, message = queue.get_nowait()
+                except Empty:
+                    break
+
+                connection, error = self._send_message(connection,
+                                                       recipients, message)
+                report(key, recipients, error)
+        finally:
+            if connection is not None:
+                _close_connection(connection)
+
+    def _send_message(self, connection, recipients, message):
+        """Sends a message, retrying transient failures.
+
+        Returns a tuple containing the connection to use for the next message
+        (None if it needs to be reopened) and the exception that was raised
+        the last time the message was tried (None if it was delivered).
+        """
+        message = _render_message(message)
+
+        for attempt in range(self.max_retries + 1):
+            if attempt > 0:
+                sleep(self.backoff * 2 ** (attempt - 1))
+
+            try:
+                if connection is None:
+                    connection = self._connect()
+
+                self._rate_limiter.wait()
+                connection.sendmail(self.sender, recipients, message)
+                return connection, None
+            except Exception, error:
+                if isinstance(error, _transient_errors):
+                    if connection is not None:
+                        _close_connection(connection)
+                    connection = None
+                    continue
+
+                # The connection is still usable, but the failed transaction
+                # needs to be reset before it can be reused.
+                if connection is not None:
+                    try:
+                        connection.rset()
+                    except Exception:
+                        _close_connection(connection)
+                        connection = None
+
+                if not (isinstance(error, SMTPResponseException) and
+                        400 <= error.smtp_code < 500):
+                    break
+
+        return connection, error
+
+    def _connect(self):
+        connection = SMTP(self.host, self.port, timeout=self.timeout)
+        try:
+            connection.ehlo()
+            if self.use_tls:
+                connection.starttls()
+                connection.ehlo()
+            if self.password is not None:
+                connection.login(self.sender, self.password)
+        except:
+            _close_connection(connection)
+            raise
+        return connection
+
+class MailSpool(object):
+    """Writes messages as RFC 822 files into a local mail spool directory.
+
+    Writing a file per message is much faster than sending each message over
+    SMTP, and the local MTA can then deliver the messages at its own rate.
+    Messages are serialized and written from a pool of threads. Each file is
+    written under a temporary name and then renamed, so the MTA never picks
+    up a partially-written message.
+
+    Arguments:
+        spool_dir - the directory to write the messages to. It (and its
+            maildir subdirectories) are created if they don't exist
+        maildir - if True, spool_dir is a maildir: each message is written to
+            spool_dir/tmp and then moved to spool_dir/new. If False,
+            spool_dir is a pickup directory: each message is written
+            directly to spool_dir as a .eml file (with CRLF line endings)
+        threads - the number of threads to write messages from
+    """
+
+    def __init__(self, spool_dir, maildir=True, threads=4):
+        if threads < 1:
+            raise ValueError("The number of threads must be at least 1.")
+
+        self.spool_dir = spool_dir
+        self.maildir = maildir
+        self.threads = threads
+        # Maildir filenames can't contain '/' or ':'.
+        self._hostname = gethostname().replace('/', '\\057')
+        self._hostname = self._hostname.replace(':', '\\072')
+        self._counter = count()
+        self._lock = Lock()
+
+    def send(self, messages, journal=None, callback=None):
+        """Writes messages, skipping those that were already delivered.
+
+        Takes the same arguments and returns the same tuple as Mailer.send.
+        """
+        if self.maildir:
+            for subdir in ('tmp', 'new', 'cur'):
+                subdir_path = join(self.spool_dir, subdir)
+                if not isdir(subdir_path):
+                    makedirs(subdir_path)
+        elif not isdir(self.spool_dir):
+            makedirs(self.spool_dir)
+
+        pending = [(key, recipients, message)
+                   for key, recipients, message in messages
+                   if journal is None or key not in journal]
+
+        report, delivered, failed = _create_reporter(journal, callback)
+        if not pending:
+            return delivered, failed
+
+        # Each message is reported by the thread that wrote it, so that it is
+        # recorded in the journal as soon as it is in the spool.
+        pool = ThreadPool(min(self.threads, len(pending)))
+        try:
+            pool.map_async(lambda args: report(*self._spool_message(args)),
+                           pending).get(_pool_timeout)
+        except:
+            pool.terminate()
+            pool.join()
+            raise
+        pool.close()
+        pool.join()
+
+        return delivered, failed
+
+    def _spool_message(self, args):
+        key, recipients, message = args
+
+        now = time()
+        with self._lock:
+            delivery_num = self._counter.next()
+        unique_name = '%d.M%dP%dQ%d.%s' % (int(now), int(now * 1e6) % 1000000,
+                                            getpid(), delivery_num,
+                                            self._hostname)
+        if self.maildir:
+            tmp_fp = join(self.spool_dir, 'tmp', unique_name)
+            fp = join(self.spool_dir, 'new', unique_name)
+        else:
+            # Pickup directories are scanned for new files, so hide the
+            # message until it has been written.
+            tmp_fp = join(self.spool_dir, '.%s.tmp' % unique_name)
+            fp = join(self.spool_dir, '%s.eml' % unique_name)
+
+        try:
+            if callable(message):
+                message = message()
+            if not isinstance(message, basestring) and \
+               message['Message-ID'] is None:
+                message['Message-ID'] = '<%s@%s>' % (unique_name,
+                                                     self._hostname)
+            message = _render_message(message)
+            if self.maildir:
+                if not message.endswith('\n'):
+                    message += '\n'
+            else:
+                message = '\r\n'.join(message.splitlines()) + '\r\n'
+
+            try:
+                with open(tmp_fp, 'wb') as message_f:
+                    message_f.write(message)
+                rename(tmp_fp, fp)
+            except:
+                if exists(tmp_fp):
+                    remove(tmp_fp)
+                raise
+        except (IOError, OSError), error:
+            return key, recipients, error
+
+        return key, recipients, None
+
+def _create_reporter(journal, callback):
+    """Returns a thread-safe function for reporting each message's result,
+    and the list and dict that it fills in (see Mailer.send).
+    """
+    delivered = []
+    failed = {}
+    lock = Lock()
+
+    def report(key, recipients, error):
+        with lock:
+            if error is None:
+                if journal is not None:
+                    journal.record(key)
+                delivered.append(key)
+            else:
+                failed[key] = error
+
+            if callback is not None:
+                callback(key, recipients, error)
+
+    return report, delivered, failed
+
+def _render_message(message):
+    if callable(message):
+        message = message()
+    if not isinstance(message, basestring):
+        # Don't rewrap the headers (they are short enough already), which is
+        # most of the cost of rendering a message.
+        message_f = StringIO()
+        Generator(message_f, mangle_from_=False,
+                  maxheaderlen=0).flatten(message)
+        message = message_f.getvalue()
+    return message
+
+def _close_connection(connection):
+    try:
+        connection.quit()
+    except Exception:
+        connection.close()
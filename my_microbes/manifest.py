@@ -0,0 +1,178 @@
+#!/usr/bin/env python
+from __future__ import division
+
+__author__ = "Jai Ram Rideout"
+__copyright__ = "Copyright 2013, The QIIME project"
+__credits__ = ["Jai Ram Rideout"]
+__license__ = "GPL"
+__version__ = "0.1.0-dev"
+__maintainer__ = "Jai Ram Rideout"
+__email__ = "jai.rideout@gmail.com"
+
+"""Module for recording what was built so that results can be rebuilt
+incrementally.
+
+Each stage of an individual's results (e.g. beta diversity plots) is keyed by
+a hash of everything the stage depends on: the contents of its input files,
+the parameters that affect its output, and the source code of the modules
+that build it. A manifest records the hash that
+each stage was last built from, along with the stage's output paths and the
+HTML that links to them from the individual's index page. A stage only needs
+to be rebuilt if its hash has changed or any of its outputs are missing.
+
+Manifests are saved as soon as each stage is finished, and are replaced
+atomically, so they also serve as a checkpoint journal: if a run is
+interrupted, every stage that was recorded is complete and doesn't need to be
+rebuilt when the run is resumed.
+"""
+
+from hashlib import md5
+from importlib import import_module
+from inspect import getsourcefile
+from json import dump, load
+from os import fsync, rename, walk
+from os.path import exists, isdir, join, relpath
+
+# The size of the chunks that files are read in while hashing them.
+_hash_chunk_size = 1024 * 1024
+
+class BuildManifest(object):
+    """Records the input hash, outputs, and HTML of each stage that was built.
+
+    Output paths are stored relative to the output directory that they were
+    created in, so the output directory can be moved between runs.
+    """
+
+    def __init__(self, manifest_fp, output_dir):
+        self.manifest_fp = manifest_fp
+        self.output_dir = output_dir
+
+        if exists(manifest_fp):
+            manifest_f = open(manifest_fp, 'U')
+            try:
+                self._stages = load(manifest_f)['stages']
+            finally:
+                manifest_f.close()
+        else:
+            self._stages = {}
+
+    def is_current(self, stage, input_hash):
+        """Returns True if stage was built from input_hash and still exists.
+        """
+        if stage not in self._stages:
+            return False
+
+        record = self._stages[stage]
+        return record['input_hash'] == input_hash and \
+               all([exists(join(self.output_dir, output))
+                    for output in record['outputs']])
+
+    def get_outputs(self, stage):
+        """Returns the output paths that were created by stage.
+
+        Returns an empty list if stage hasn't been recorded.
+        """
+        if stage not in self._stages:
+            return []
+        return [join(self.output_dir, output)
+                for output in self._stages[stage]['outputs']]
+
+    def get_html(self, stage):
+        """Returns the HTML that links to stage's outputs.
+
+        Returns an empty string if stage hasn't been recorded.
+        """
+        if stage not in self._stages:
+            return ''
+        return self._stages[stage]['html']
+
+    def record(self, stage, input_hash, outputs, html):
+        """Records that stage was built from input_hash.
+
+        Arguments:
+            stage - name of the stage that was built
+            input_hash - hash of the stage's inputs (e.g. from hash_inputs)
+            outputs - list of paths that the stage created. Each path must be
+                in the output directory
+            html - HTML that links to the stage's outputs
+        """
+        self._stages[stage] = {
+            'input_hash': input_hash,
+            'outputs': [relpath(output, self.output_dir)
+                        for output in outputs],
+            'html': html
+        }
+
+    def save(self):
+        """Writes the manifest to its filepath.
+
+        The manifest is written to a temporary file that then replaces the
+        existing manifest, so the manifest is never left partially written
+        (e.g. if the process is killed while saving).
+        """
+        tmp_fp = self.manifest_fp + '.tmp'
+        manifest_f = open(tmp_fp, 'w')
+        try:
+            dump({'stages': self._stages}, manifest_f, indent=2,
+                 sort_keys=True)
+            manifest_f.flush()
+            fsync(manifest_f.fileno())
+        finally:
+            manifest_f.close()
+        rename(tmp_fp, self.manifest_fp)
+
+
+def hash_path(path):
+    """Returns a hex digest of the contents of a file or directory.
+
+    A directory's digest covers the relative path and contents of every file
+    beneath it, so renaming, adding, removing, or modifying any file changes
+    the digest. A path that doesn't exist (e.g. an optional input that wasn't
+    provided) has the digest of an empty string.
+    """
+    path_hash = md5()
+
+    if path is None or not exists(path):
+        pass
+    elif isdir(path):
+        for dir_path, dir_names, file_names in walk(path):
+            dir_names.sort()
+            for file_name in sorted(file_names):
+                fp = join(dir_path, file_name)
+                path_hash.update(relpath(fp, path))
+                path_hash.update('\0')
+                path_hash.update(hash_path(fp))
+    else:
+        f = open(path, 'rb')
+        try:
+            chunk = f.read(_hash_chunk_size)
+            while chunk:
+                path_hash.update(chunk)
+                chunk = f.read(_hash_chunk_size)
+        finally:
+            f.close()
+
+    return path_hash.hexdigest()
+
+def hash_inputs(*inputs):
+    """Returns a hex digest of a sequence of input values.
+
+    Inputs can be strings (e.g. digests from hash_path), numbers, None, or
+    (possibly nested) lists and tuples of these.
+    """
+    return md5(repr(inputs)).hexdigest()
+
+def hash_modules(module_names):
+    """Returns a hex digest of the source code of a list of modules.
+
+    Modules that haven't been imported yet are imported. The digest changes
+    whenever any of the modules' source files change, so outputs that were
+    built by an older version of the code can be rebuilt.
+    """
+    source_hashes = []
+    for module_name in module_names:
+        module = import_module(module_name)
+        source_hashes.append((module_name,
+                              hash_path(getsourcefile(module) or
+                                        module.__file__)))
+    return hash_inputs(*source_hashes)
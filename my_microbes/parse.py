@@ -11,6 +11,10 @@ __email__ = "jai.rideout@gmail.com"
 
 """Module to parse various supported file formats."""
 
+from numpy import array
+
+from qiime.parse import parse_rarefaction
+
 def parse_recipients(recipients_f):
     """Parses and validates a file containing recipients' email addresses.
 
@@ -83,6 +87,56 @@ def parse_email_settings(email_settings_f):
                 "more of the following required fields: %r" % required_fields)
     return settings
 
+def parse_collated_alpha_diversity(collated_adiv_f, rarefaction_depth):
+    """Parses a collated alpha diversity file at a single rarefaction depth.
+
+    Returns a tuple containing the list of sample IDs and a 2D array with a
+    row for each iteration at the rarefaction depth and a column for each
+    sample. Missing values (n/a) are NaN.
+
+    Arguments:
+        collated_adiv_f - the collated alpha diversity file (e.g. created by
+            collate_alpha.py) for a single metric
+        rarefaction_depth - the rarefaction depth to pull values for
+    """
+    sample_ids, depths, rarefaction_data = \
+            parse_collated_rarefaction(collated_adiv_f)
+    rarefaction_data = rarefaction_data[depths == rarefaction_depth]
+
+    if not len(rarefaction_data):
+        raise ValueError("Rarefaction depth of %d could not be found in "
+                         "collated alpha diversity file." % rarefaction_depth)
+
+    return sample_ids, rarefaction_data
+
+def parse_collated_rarefaction(collated_adiv_f):
+    """Parses every rarefaction depth of a collated alpha diversity file.
+
+    Returns a tuple containing the list of sample IDs, an array of each row's
+    rarefaction depth, and a 2D array with a row for each (depth, iteration)
+    in the file and a column for each sample. Missing values (n/a) are NaN.
+
+    Arguments:
+        collated_adiv_f - the collated alpha diversity file (e.g. created by
+            collate_alpha.py) for a single metric
+    """
+    rarefaction = parse_rarefaction(collated_adiv_f)
+
+    # First three vals are part of the header, so ignore them.
+    sample_ids = rarefaction[0][3:]
+
+    # First two vals are depth and iteration number.
+    depths = array([row[0] for row in rarefaction[3]], dtype=int)
+    rarefaction_data = [row[2:] for row in rarefaction[3]]
+    if any([len(row) != len(sample_ids) for row in rarefaction_data]):
+        raise ValueError("The number of alpha diversity values does not "
+                         "match the number of samples in the collated alpha "
+                         "diversity file.")
+
+    rarefaction_data = array(rarefaction_data, dtype=float).reshape(
+            len(rarefaction_data), len(sample_ids))
+    return sample_ids, depths, rarefaction_data
+
 def _can_ignore(line):
     """Returns True if the line can be ignored (comment or blank line).
     
@@ -0,0 +1,147 @@
+#!/usr/bin/env python
+from __future__ import division
+
+__author__ = "Jai Ram Rideout"
+__copyright__ = "Copyright 2013, The QIIME project"
+__credits__ = ["Jai Ram Rideout"]
+__license__ = "GPL"
+__version__ = "0.1.0-dev"
+__maintainer__ = "Jai Ram Rideout"
+__email__ = "jai.rideout@gmail.com"
+
+"""Module for creating the data displayed by the built-in PCoA viewer.
+
+Running make_3d_plots.py for each individual writes a copy of every sample's
+coordinates for every individual. Instead, the study's coordinates (along with
+each sample's body site and time point) are written once, and each individual
+only gets a small overlay that identifies their samples and the order to
+connect them in over time. The viewer (support_files/js/pcoa_viewer.js)
+combines the two in the browser.
+
+Both are written as javascript files that assign a global variable, so that
+they can be loaded with script tags when the results are opened locally
+(browsers won't load JSON files from the local filesystem).
+"""
+
+from base64 import b64encode
+from json import dumps
+
+from numpy import asarray, nan, zeros
+
+from qiime.parse import parse_coords
+from qiime.sort import natsort
+
+class PCoAViewerData(object):
+    """The study's PCoA coordinates, in the form used by the PCoA viewer.
+
+    Only samples that are in both the coordinates file and the sample index
+    are displayed. Each sample has its first three principal coordinates
+    (padded with zeros if there are fewer axes) and its time point, which is
+    used as the third axis of the time series view. Time points that aren't
+    numbers can't be plotted on the time axis and are NaN.
+    """
+
+    num_axes = 3
+
+    def __init__(self, coord_f, sample_index):
+        coord_sample_ids, coords, eigvals, pct_var = parse_coords(coord_f)
+        coords = asarray(coords, dtype=float)
+        num_axes = min(self.num_axes,
+                       coords.shape[1] if coords.ndim == 2 else 0)
+
+        self.sample_ids = [sample_id for sample_id in coord_sample_ids
+                           if sample_id in sample_index]
+        self.pct_var = [0.0] * self.num_axes
+        self.pct_var[:num_axes] = map(float, pct_var[:num_axes])
+
+        # One row per sample: the principal coordinates followed by the
+        # time point.
+        self._values = zeros((len(self.sample_ids), self.num_axes + 1))
+        row_indices = dict([(sample_id, i)
+                            for i, sample_id in enumerate(coord_sample_ids)])
+        self._sample_indices = {}
+        self._samples = []
+        for i, sample_id in enumerate(self.sample_ids):
+            self._sample_indices[sample_id] = i
+            personal_id, body_site, time_point, rarefied = \
+                    sample_index.get_sample(sample_id)
+            self._samples.append((personal_id, body_site, time_point))
+
+            self._values[i, :num_axes] = \
+                    coords[row_indices[sample_id], :num_axes]
+            try:
+                self._values[i, self.num_axes] = float(time_point)
+            except ValueError:
+                self._values[i, self.num_axes] = nan
+
+        self.body_sites = sorted(set([body_site for personal_id, body_site,
+                                      time_point in self._samples]))
+
+    def format_study_data(self, time_series_category):
+        """Returns the javascript that defines the study's data.
+
+        The coordinates and time points are stored as base64-encoded
+        little-endian float32s (one row of four values per sample), and each
+        sample's body site is stored as an index into the list of body
+        sites. Personal IDs aren't included, since this file is shared by
+        every individual.
+        """
+        body_site_indices = dict([(body_site, i) for i, body_site in
+                                  enumerate(self.body_sites)])
+
+        study_data = {
+            'sample_ids': self.sample_ids,
+            'body_sites': self.body_sites,
+            'sample_body_sites': [body_site_indices[body_site]
+                                  for personal_id, body_site, time_point in
+                                  self._samples],
+            'pct_var': self.pct_var,
+            'time_series_category': time_series_category,
+            'num_values': self.num_axes + 1,
+            'values': b64encode(self._values.astype('<f4').tostring())
+        }
+        return 'var pcoaStudyData = %s;\n' % dumps(study_data,
+                                                   sort_keys=True)
+
+    def format_overlay(self, personal_id, individual_titles):
+        """Returns the javascript that defines an individual's overlay.
+
+        The overlay lists the indices of the individual's samples, along with
+        a trajectory for each of their body sites that connects the body
+        site's samples in order of time point.
+
+        Arguments:
+            personal_id - the individual to create the overlay for
+            individual_titles - the titles of the individual's samples and
+                everyone else's samples (e.g. ['Self', 'Other'])
+        """
+        self_samples = [i for i, (pid, body_site, time_point) in
+                        enumerate(self._samples) if pid == personal_id]
+
+        body_site_samples = {}
+        for i in self_samples:
+            body_site_samples.setdefault(self._samples[i][1], []).append(i)
+
+        trajectories = []
+        for body_site in sorted(body_site_samples):
+            samples = body_site_samples[body_site]
+            time_points = natsort(set([self._samples[i][2]
+                                       for i in samples]))
+            time_point_ranks = dict([(time_point, rank) for rank, time_point
+                                     in enumerate(time_points)])
+            samples.sort(key=lambda i: (time_point_ranks[self._samples[i][2]],
+                                        self.sample_ids[i]))
+            trajectories.append({'body_site': body_site, 'samples': samples})
+
+        overlay = {
+            'personal_id': personal_id,
+            'self_title': individual_titles[0],
+            'other_title': individual_titles[1],
+            'self_samples': self_samples,
+            'trajectories': trajectories
+        }
+        return 'var pcoaOverlay = %s;\n' % dumps(overlay, sort_keys=True)
+
+    def get_sample_values(self, sample_id):
+        """Returns a sample's principal coordinates and time point."""
+        return self._values[self._sample_indices[sample_id]]
@@ -0,0 +1,244 @@
+#!/usr/bin/env python
+from __future__ import division
+
+__author__ = "Jai Ram Rideout"
+__copyright__ = "Copyright 2013, The QIIME project"
+__credits__ = ["Jai Ram Rideout"]
+__license__ = "GPL"
+__version__ = "0.1.0-dev"
+__maintainer__ = "Jai Ram Rideout"
+__email__ = "jai.rideout@gmail.com"
+
+"""Module for rendering plots, optionally in the background."""
+
+from Queue import Queue
+from sys import exc_info
+from threading import Condition, Lock, Thread
+from time import time
+
+from matplotlib.backends.backend_agg import FigureCanvasAgg
+from matplotlib.figure import Figure
+from numpy import asarray, isnan, nanmax, where
+
+# How often (in seconds) wait stops waiting so that signals (e.g. SIGINT) can
+# be handled.
+_wait_timeout = 0.5
+
+# matplotlib's Agg font cache is shared between figures and isn't safe to use
+# from multiple threads, so every plot in the process is drawn while holding
+# this lock.
+_agg_lock = Lock()
+
+class BoxplotRenderer(object):
+    """Renders boxplots to image files in a background thread.
+
+    Plots are submitted with submit, which returns immediately, and are
+    rendered in the order they were submitted. This lets the caller do other
+    work (e.g. run QIIME commands) while plots are being rendered. Call wait
+    to block until every submitted plot has been rendered.
+
+    A figure is created once for each distinct title and axis labels (e.g.
+    one per alpha diversity metric) and reused as a template: rendering a
+    plot only replaces the previous plot's boxes and x-axis tick labels. The
+    figures aren't registered with pyplot, so they aren't kept alive after
+    the renderer is done with them. Plots look the same as those created by
+    QIIME's generate_box_plots with its default options.
+
+    Plots are drawn one at a time (see _agg_lock), even by separate
+    renderers or while other plots are drawn in the calling thread. Use
+    separate processes (each with its own renderer) to render plots in
+    parallel.
+    """
+
+    def __init__(self):
+        self._jobs = Queue()
+        self._cond = Condition()
+        self._thread = None
+        self._num_pending = 0
+        self._timings = []
+        self._error = None
+        self._templates = {}
+        self._default_subplot_params = None
+
+    def submit(self, output_fp, distributions, x_tick_labels, title=None,
+               x_label=None, y_label=None):
+        """Queues a boxplot to be rendered to output_fp.
+
+        Arguments:
+            output_fp - filepath to write the image to. The format is
+                determined by the extension (e.g. .png)
+            distributions - list of lists containing each distribution
+            x_tick_labels - list of labels, one per distribution
+            title - title of the plot
+            x_label - x-axis label
+            y_label - y-axis label
+        """
+        self._cond.acquire()
+        try:
+            if self._thread is None:
+                self._thread = Thread(target=self._render_jobs)
+                self._thread.daemon = True
+                self._thread.start()
+            self._num_pending += 1
+        finally:
+            self._cond.release()
+
+        self._jobs.put((output_fp, distributions, x_tick_labels, title,
+                        x_label, y_label))
+
+    def wait(self):
+        """Blocks until every submitted plot has been rendered.
+
+        Returns a list of (output filepath, seconds taken to render) for each
+        plot rendered since the last call to wait, in the order they were
+        rendered. If any plot couldn't be rendered, the first error is raised
+        (once the remaining plots have been rendered).
+        """
+        self._cond.acquire()
+        try:
+            while self._num_pending > 0:
+                self._cond.wait(_wait_timeout)
+
+            timings, self._timings = self._timings, []
+            error, self._error = self._error, None
+        finally:
+            self._cond.release()
+
+        if error is not None:
+            raise error[0], error[1], error[2]
+        return timings
+
+    def _render_jobs(self):
+        while True:
+            job = self._jobs.get()
+
+            # Only the time spent drawing is recorded, not the time spent
+            # waiting for another plot to be drawn.
+            _agg_lock.acquire()
+            start_time = time()
+            try:
+                self._render(*job)
+            except:
+                error = exc_info()
+            else:
+                error = None
+            elapsed_time = time() - start_time
+            _agg_lock.release()
+
+            self._cond.acquire()
+            try:
+                if error is None:
+                    self._timings.append((job[0], elapsed_time))
+                elif self._error is None:
+                    self._error = error
+                self._num_pending -= 1
+                self._cond.notify_all()
+            finally:
+                self._cond.release()
+
+    def _render(self, output_fp, distributions, x_tick_labels, title, x_label,
+                y_label):
+        template_key = (title, x_label, y_label)
+
+        if template_key not in self._templates:
+            figure = Figure()
+            FigureCanvasAgg(figure)
+            axes = figure.add_subplot(111)
+            if title is not None:
+                axes.set_title(title)
+            if x_label is not None:
+                axes.set_xlabel(x_label)
+            if y_label is not None:
+                axes.set_ylabel(y_label)
+            self._templates[template_key] = [figure, axes, []]
+
+            if self._default_subplot_params is None:
+                self._default_subplot_params = dict(
+                        [(param, getattr(figure.subplotpars, param))
+                         for param in ('left', 'bottom', 'right', 'top',
+                                       'wspace', 'hspace')])
+
+        template = self._templates[template_key]
+        figure, axes, box_plot_artists = template
+
+        # Swap out the previous plot's boxes for the new ones.
+        for artist in box_plot_artists:
+            artist.remove()
+        box_plot = axes.boxplot(distributions, whis=1.5, widths=0.5)
+        template[2] = [artist for artists in box_plot.values()
+                       for artist in artists]
+
+        axes.set_xticklabels(x_tick_labels, rotation='vertical')
+        axes.relim()
+        axes.autoscale_view()
+
+        # Lay out the figure from its default subplot parameters (as a new
+        # figure would be), not from the previous plot's layout. The canvas's
+        # renderer is passed explicitly because tight_layout otherwise uses
+        # the renderer cached by the last savefig, which may have a
+        # different dpi.
+        figure.subplots_adjust(**self._default_subplot_params)
+        figure.tight_layout(renderer=figure.canvas.get_renderer())
+        figure.savefig(output_fp)
+
+def plot_rarefaction_averages(output_fp, depths, series, x_max, title=None,
+                              y_label=None):
+    """Plots groups' average alpha diversity at each rarefaction depth.
+
+    Each group is drawn as a line with error bars, in the same style as
+    make_rarefaction_plots.py's average plots (plus a legend). Depths where a
+    group doesn't have an average (NaN) are left out of its line.
+
+    The plot is rendered in the calling thread, and waits for any plot that
+    a BoxplotRenderer is drawing in the background to finish (see
+    _agg_lock).
+
+    Arguments:
+        output_fp - filepath to write the image to. The format is determined
+            by the extension (e.g. .png)
+        depths - list of rarefaction depths (the x-axis values)
+        series - list of (label, color, line style, averages, errors)
+            tuples, one per group, where averages and errors have one value
+            per depth
+        x_max - the x-axis' upper limit
+        title - title of the plot
+        y_label - y-axis label
+    """
+    _agg_lock.acquire()
+    try:
+        _plot_rarefaction_averages(output_fp, depths, series, x_max, title,
+                                   y_label)
+    finally:
+        _agg_lock.release()
+
+def _plot_rarefaction_averages(output_fp, depths, series, x_max, title,
+                               y_label):
+    figure = Figure()
+    FigureCanvasAgg(figure)
+    axes = figure.add_subplot(111)
+
+    y_max = 0
+    for label, color, line_style, averages, errors in series:
+        averages = asarray(averages, dtype=float)
+        errors = asarray(errors, dtype=float)
+        axes.errorbar(depths, averages, yerr=errors, label=label,
+                      color=color, linestyle=line_style, elinewidth=1, lw=2,
+                      capsize=4)
+
+        # Leave room for the error bars (as make_rarefaction_plots.py does).
+        tops = averages + where(isnan(errors), 0, errors)
+        if not isnan(tops).all():
+            y_max = max(y_max, nanmax(tops) * 1.15)
+
+    if title is not None:
+        axes.set_title(title)
+    axes.set_xlabel('Sequences Per Sample')
+    if y_label is not None:
+        axes.set_ylabel(y_label)
+    axes.set_xlim(0, x_max)
+    if y_max > 0:
+        axes.set_ylim(0, y_max)
+    if series:
+        axes.legend(loc='best', fontsize='small', numpoints=1)
+
+    figure.savefig(output_fp)
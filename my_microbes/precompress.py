@@ -0,0 +1,175 @@
+#!/usr/bin/env python
+from __future__ import division
+
+__author__ = "Jai Ram Rideout"
+__copyright__ = "Copyright 2013, The QIIME project"
+__credits__ = ["Jai Ram Rideout"]
+__license__ = "GPL"
+__version__ = "0.1.0-dev"
+__maintainer__ = "Jai Ram Rideout"
+__email__ = "jai.rideout@gmail.com"
+
+"""Module for precompressing the static files of the results site.
+
+Web servers can serve a precompressed sibling of a file (e.g. index.html.gz
+for index.html) instead of compressing the file on every request (e.g.
+nginx's gzip_static and brotli_static). Every compressible file in the
+results is compressed once, after it is created, and only recompressed if it
+has changed since.
+
+Brotli compression requires the brotli package, which is optional.
+"""
+
+from gzip import GzipFile
+from multiprocessing import Pool
+from os import remove, rename, walk
+from os.path import exists, getmtime, getsize, isfile, join, splitext
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+# The file extension of each supported encoding's compressed siblings.
+encoding_extensions = {'gzip': '.gz', 'br': '.br'}
+
+# Images (e.g. PNG and PDF plots) are already compressed.
+_compressible_extensions = set(['.css', '.htm', '.html', '.js', '.json',
+                                '.svg', '.xml'])
+
+# Files smaller than this (in bytes) fit in a single packet and aren't worth
+# compressing.
+_min_size = 256
+
+# How long (in seconds) to wait for the worker processes to finish. This is
+# effectively forever, but waiting without a timeout can't be interrupted.
+_pool_timeout = 60 * 60 * 24 * 365
+
+def precompress_files(paths, encodings=('gzip',), jobs=1):
+    """Writes compressed siblings of the compressible files under paths.
+
+    Each path can be a file or a directory (which is searched recursively).
+    Hidden files and directories are skipped. A file's siblings are only
+    (re)written if they are missing or older than the file.
+
+    Returns a tuple containing the number of files that were compressed, the
+    number of files that were skipped because their siblings were
+    up-to-date, and a dict mapping each encoding to (original bytes,
+    compressed bytes) for the files that were compressed.
+
+    Arguments:
+        paths - the files and directories to precompress
+        encodings - the encodings to compress the files with (any of the
+            keys in encoding_extensions)
+        jobs - the number of processes to compress files in
+    """
+    check_encodings(encodings)
+    if jobs < 1:
+        raise ValueError("The number of jobs must be at least 1.")
+
+    file_args = [(fp, tuple(encodings))
+                 for fp in _find_compressible_files(paths)]
+
+    if jobs == 1 or len(file_args) < 2:
+        file_results = map(_precompress_file, file_args)
+    else:
+        pool = Pool(jobs)
+        try:
+            file_results = pool.map_async(_precompress_file,
+                                          file_args).get(_pool_timeout)
+        except:
+            pool.terminate()
+            pool.join()
+            raise
+        pool.close()
+        pool.join()
+
+    num_compressed = 0
+    num_up_to_date = 0
+    sizes = dict([(encoding, [0, 0]) for encoding in encodings])
+    for file_sizes in file_results:
+        if file_sizes is None:
+            num_up_to_date += 1
+            continue
+
+        num_compressed += 1
+        for encoding, (original_size, compressed_size) in file_sizes.items():
+            sizes[encoding][0] += original_size
+            sizes[encoding][1] += compressed_size
+
+    return num_compressed, num_up_to_date, \
+           dict([(encoding, tuple(size)) for encoding, size in sizes.items()])
+
+def check_encodings(encodings):
+    """Raises a ValueError if any of the encodings can't be used."""
+    for encoding in encodings:
+        if encoding not in encoding_extensions:
+            raise ValueError("Unrecognized encoding '%s'. Must be one of: "
+                             "%s." % (encoding,
+                                      ', '.join(sorted(encoding_extensions))))
+        if encoding == 'br' and brotli is None:
+            raise ValueError("Brotli compression requires the brotli "
+                             "package to be installed.")
+
+def _find_compressible_files(paths):
+    for path in paths:
+        if isfile(path):
+            if _is_compressible(path):
+                yield path
+            continue
+
+        for dir_path, dir_names, file_names in walk(path):
+            dir_names[:] = sorted([dir_name for dir_name in dir_names
+                                   if not dir_name.startswith('.')])
+            for file_name in sorted(file_names):
+                fp = join(dir_path, file_name)
+                if not file_name.startswith('.') and _is_compressible(fp):
+                    yield fp
+
+def _is_compressible(fp):
+    return splitext(fp)[1].lower() in _compressible_extensions and \
+           getsize(fp) >= _min_size
+
+def _precompress_file(args):
+    """Writes a file's compressed siblings.
+
+    Returns a dict mapping each encoding to the file's (original size,
+    compressed size), or None if all of the file's siblings are up-to-date.
+    """
+    fp, encodings = args
+    mtime = getmtime(fp)
+    sibling_fps = [(encoding, fp + encoding_extensions[encoding])
+                   for encoding in encodings]
+    if all([exists(sibling_fp) and getmtime(sibling_fp) >= mtime
+            for encoding, sibling_fp in sibling_fps]):
+        return None
+
+    with open(fp, 'rb') as f:
+        data = f.read()
+
+    sizes = {}
+    for encoding, sibling_fp in sibling_fps:
+        # Write to a temporary file first so that a partially-written sibling
+        # is never served (or mistaken for an up-to-date one).
+        tmp_fp = sibling_fp + '.tmp'
+        try:
+            with open(tmp_fp, 'wb') as sibling_f:
+                if encoding == 'gzip':
+                    # Omit the filename and timestamp so that unchanged files
+                    # compress to the same bytes.
+                    gzip_f = GzipFile('', 'wb', 9, sibling_f, mtime=0)
+                    try:
+                        gzip_f.write(data)
+                    finally:
+                        gzip_f.close()
+                else:
+                    sibling_f.write(brotli.compress(data))
+            rename(tmp_fp, sibling_fp)
+        except:
+            if exists(tmp_fp):
+                remove(tmp_fp)
+            raise
+
+        sizes[encoding] = (len(data), getsize(sibling_fp))
+
+    return sizes
@@ -0,0 +1,184 @@
+#!/usr/bin/env python
+from __future__ import division
+
+__author__ = "Jai Ram Rideout"
+__copyright__ = "Copyright 2013, The QIIME project"
+__credits__ = ["Jai Ram Rideout"]
+__license__ = "GPL"
+__version__ = "0.1.0-dev"
+__maintainer__ = "Jai Ram Rideout"
+__email__ = "jai.rideout@gmail.com"
+
+"""Module for looking up representative sequences by OTU ID.
+
+Only the sequences of an individual's significant OTUs are displayed, which
+is a tiny fraction of the rep set. Instead of parsing the whole rep set into
+memory, the offset of each sequence is recorded in a faidx-style index that
+is kept next to the rep set (<rep_set_fp>.fai), and sequences are read on
+demand from a memory-mapped view of the rep set.
+"""
+
+from mmap import mmap, ACCESS_READ
+from os import rename
+from os.path import exists, getmtime
+
+class RepSet(object):
+    """Random access to the sequences in a FASTA-formatted rep set.
+
+    The index is built the first time a rep set is used, and rebuilt if the
+    rep set has been modified since. If the index can't be written next to
+    the rep set (e.g. the directory is read-only), it is built in memory
+    instead.
+
+    Each index line has the same five tab-separated fields as a samtools
+    faidx index: sequence ID, sequence length, byte offset of the sequence,
+    bases per line, and bytes per line. A record whose lines don't all have
+    the same length (aside from its last line) is indexed as if its sequence
+    were on a single line that spans all of the record's bytes.
+    """
+
+    def __init__(self, rep_set_fp):
+        self.rep_set_fp = rep_set_fp
+        self.index_fp = rep_set_fp + '.fai'
+        self._map = None
+
+        if exists(self.index_fp) and \
+           getmtime(self.index_fp) >= getmtime(rep_set_fp):
+            index_f = open(self.index_fp, 'U')
+            try:
+                self._index = _parse_fasta_index(index_f)
+            finally:
+                index_f.close()
+        else:
+            rep_set_f = open(rep_set_fp, 'rb')
+            try:
+                index_lines = list(_index_fasta(rep_set_f))
+            finally:
+                rep_set_f.close()
+
+            try:
+                _write_fasta_index(index_lines, self.index_fp)
+            except (IOError, OSError):
+                pass
+            self._index = _parse_fasta_index(index_lines)
+
+    def __contains__(self, seq_id):
+        return seq_id in self._index
+
+    def __len__(self):
+        return len(self._index)
+
+    def get(self, seq_id, default=None):
+        """Returns a sequence, or default if its ID isn't in the rep set."""
+        entry = self._index.get(seq_id)
+        if entry is None:
+            return default
+
+        length, offset, line_bases, line_width = entry
+        if length == 0:
+            return ''
+
+        num_bytes = ((length // line_bases) * line_width +
+                     length % line_bases)
+        record = self._get_map()[offset:offset + num_bytes]
+        return ''.join([line.strip() for line in record.splitlines()])
+
+    def close(self):
+        """Releases the memory-mapped view of the rep set (if any)."""
+        if self._map is not None:
+            self._map.close()
+            self._map = None
+
+    def _get_map(self):
+        # The rep set is only mapped once a sequence is looked up, so that
+        # each worker process maps it itself.
+        if self._map is None:
+            rep_set_f = open(self.rep_set_fp, 'rb')
+            try:
+                self._map = mmap(rep_set_f.fileno(), 0, access=ACCESS_READ)
+            finally:
+                rep_set_f.close()
+        return self._map
+
+def _index_fasta(fasta_f):
+    """Yields a faidx-style index line for each record in fasta_f.
+
+    fasta_f must be opened in binary mode so that the byte offsets are
+    exact. Like MinimalFastaParser, blank lines are ignored, and each
+    sequence ID is the first word of its label. Raises a ValueError if there
+    is a sequence before the first label, or a label without a sequence.
+    """
+    record = None
+    offset = 0
+    for line in fasta_f:
+        stripped_line = line.strip()
+
+        if stripped_line.startswith('>'):
+            if record is not None:
+                yield _format_fasta_index_line(record)
+
+            label = stripped_line[1:].split()
+            # [seq ID, length, offset, end offset, line lengths, blank line
+            # seen]
+            record = [label[0] if label else '', 0, offset + len(line),
+                      offset + len(line), [], False]
+        elif stripped_line:
+            if record is None:
+                raise ValueError("Found a sequence without a label in the "
+                                 "rep set: %s" % stripped_line)
+
+            record[1] += len(stripped_line)
+            record[3] = offset + len(line)
+            record[4].append((len(stripped_line), len(line)))
+            if record[5]:
+                # A blank line in the middle of the sequence.
+                record[4].append(None)
+        elif record is not None and record[4]:
+            record[5] = True
+
+        offset += len(line)
+
+    if record is not None:
+        yield _format_fasta_index_line(record)
+
+def _format_fasta_index_line(record):
+    seq_id, length, offset, end_offset, line_lengths = record[:5]
+    if not line_lengths:
+        raise ValueError("Found a label without a sequence in the rep set: "
+                         "%s" % seq_id)
+
+    line_bases, line_width = line_lengths[0]
+    uniform = None not in line_lengths and \
+              line_lengths[-1][0] <= line_bases and \
+              len(set(line_lengths[:-1])) <= 1
+    if not uniform:
+        line_bases, line_width = length, end_offset - offset
+
+    return '%s\t%d\t%d\t%d\t%d\n' % (seq_id, length, offset, line_bases,
+                                     line_width)
+
+def _write_fasta_index(index_lines, index_fp):
+    # Write to a temporary file first so that an interrupted write doesn't
+    # leave a truncated index that looks up-to-date.
+    tmp_index_fp = index_fp + '.tmp'
+    tmp_index_f = open(tmp_index_fp, 'w')
+    try:
+        tmp_index_f.writelines(index_lines)
+    finally:
+        tmp_index_f.close()
+    rename(tmp_index_fp, index_fp)
+
+def _parse_fasta_index(index_f):
+    """Returns a dict mapping sequence ID to (length, offset, line bases,
+    line width).
+
+    If a sequence ID is in the index more than once, the last one is used
+    (the same as building a dict from MinimalFastaParser's output).
+    """
+    index = {}
+    for line in index_f:
+        fields = line.rstrip('\n').split('\t')
+        if len(fields) != 5:
+            continue
+        index[fields[0]] = tuple(map(int, fields[1:]))
+    return index
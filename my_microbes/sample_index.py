@@ -0,0 +1,132 @@
+#!/usr/bin/env python
+from __future__ import division
+
+__author__ = "Jai Ram Rideout"
+__copyright__ = "Copyright 2013, The QIIME project"
+__credits__ = ["Jai Ram Rideout"]
+__license__ = "GPL"
+__version__ = "0.1.0-dev"
+__maintainer__ = "Jai Ram Rideout"
+__email__ = "jai.rideout@gmail.com"
+
+"""Module for looking up study-wide sample information.
+
+Deciding which of an individual's body sites can be compared to the rest of
+the study only depends on how many samples each individual has at each body
+site, and how many of those made it into the rarefied OTU table. These counts
+are kept up-to-date as samples are added and marked as rarefied, so checking
+a body site for any individual is a dictionary lookup.
+"""
+
+class SampleIndex(object):
+    """Maps each sample in the study to its individual, body site, and time.
+
+    Each sample also has a flag indicating whether it is in the rarefied OTU
+    table (samples with too few sequences are dropped by rarefaction). Samples
+    start out unflagged and are flagged by mark_rarefied.
+    """
+
+    def __init__(self, mapping_data, sample_id_index, personal_id_index,
+                 body_site_index, time_point_index):
+        self._samples = {}
+        self._counts = {}
+        self._body_site_counts = {}
+        self._body_sites = {}
+
+        for row in mapping_data:
+            sample_id = row[sample_id_index]
+            if sample_id in self._samples:
+                raise ValueError("The sample ID '%s' is in the mapping file "
+                                 "more than once." % sample_id)
+
+            personal_id = row[personal_id_index]
+            body_site = row[body_site_index]
+            self._samples[sample_id] = [personal_id, body_site,
+                                        row[time_point_index], False]
+            self._counts.setdefault((personal_id, body_site), [0, 0])[0] += 1
+            self._body_site_counts.setdefault(body_site, [0, 0])[0] += 1
+            self._body_sites.setdefault(personal_id, set()).add(body_site)
+
+    def __contains__(self, sample_id):
+        return sample_id in self._samples
+
+    def mark_rarefied(self, sample_ids, body_site=None):
+        """Flags samples as being in the rarefied OTU table.
+
+        Sample IDs that aren't in the study, or that have already been
+        flagged, are ignored.
+
+        Arguments:
+            sample_ids - IDs of the samples in the rarefied OTU table
+            body_site - if provided, the rarefied OTU table is only used for
+                this body site, so samples from other body sites are ignored
+        """
+        for sample_id in sample_ids:
+            sample = self._samples.get(sample_id)
+            if sample is None or sample[3]:
+                continue
+
+            personal_id, sample_body_site = sample[:2]
+            if body_site is not None and sample_body_site != body_site:
+                continue
+
+            sample[3] = True
+            self._counts[(personal_id, sample_body_site)][1] += 1
+            self._body_site_counts[sample_body_site][1] += 1
+
+    def get_sample(self, sample_id):
+        """Returns a sample's (personal ID, body site, time point, rarefied).
+
+        Raises a KeyError if the sample isn't in the study.
+        """
+        return tuple(self._samples[sample_id])
+
+    def get_body_sites(self, personal_id=None):
+        """Returns a sorted list of the body sites that were sampled.
+
+        If personal_id is provided, only the individual's body sites are
+        included.
+        """
+        if personal_id is None:
+            return sorted(self._body_site_counts)
+        return sorted(self._body_sites.get(personal_id, []))
+
+    def count_samples(self, personal_id, body_site=None, rarefied=False):
+        """Returns the number of samples that an individual has.
+
+        Arguments:
+            personal_id - the individual to count samples for
+            body_site - if provided, only samples from this body site are
+                counted
+            rarefied - if True, only samples in the rarefied OTU table are
+                counted
+        """
+        if body_site is None:
+            body_sites = self._body_sites.get(personal_id, [])
+        else:
+            body_sites = [body_site]
+
+        count_idx = 1 if rarefied else 0
+        return sum([self._counts.get((personal_id, site), [0, 0])[count_idx]
+                    for site in body_sites])
+
+    def is_comparable(self, personal_id, body_site):
+        """Returns True if an individual can be compared to the rest of the
+        study at a body site.
+
+        The individual and everyone else must each have at least one sample
+        at the body site in the rarefied OTU table, and there must be at
+        least three such samples in total (the same requirements as
+        significance.compare_individuals_to_study).
+        """
+        self_count = self.count_samples(personal_id, body_site, True)
+        total_count = self._body_site_counts.get(body_site, [0, 0])[1]
+        return self_count > 0 and total_count > self_count and \
+               total_count > 2
+
+    def get_comparable_body_sites(self, personal_id):
+        """Returns a sorted list of the body sites that an individual can be
+        compared to the rest of the study at (see is_comparable).
+        """
+        return [body_site for body_site in self.get_body_sites(personal_id)
+                if self.is_comparable(personal_id, body_site)]
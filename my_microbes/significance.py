@@ -0,0 +1,302 @@
+#!/usr/bin/env python
+from __future__ import division
+
+__author__ = "Jai Ram Rideout"
+__copyright__ = "Copyright 2013, The QIIME project"
+__credits__ = ["Jai Ram Rideout"]
+__license__ = "GPL"
+__version__ = "0.1.0-dev"
+__maintainer__ = "Jai Ram Rideout"
+__email__ = "jai.rideout@gmail.com"
+
+"""Module for testing whether OTU abundances differ between self and other.
+
+This replaces running otu_category_significance.py (one-way ANOVA) for each
+individual and body site. The sums and sums of squares that an ANOVA needs
+are computed once per body site, and each individual's "other" totals are
+the body site's totals minus their own. The test statistics for a chunk of
+individuals and every OTU that is tested at a body site are computed together
+with array operations. Only the tested OTUs' totals are kept for each
+individual, and only for one chunk of individuals at a time, so memory use
+doesn't grow with the number of individuals.
+"""
+
+from math import lgamma
+
+from numpy import (absolute, argsort, asarray, errstate, exp, flatnonzero,
+                   inf, isfinite, log, minimum, ones, where, zeros)
+
+def compare_individuals_to_study(otu_table, sample_groups, min_fraction=0.25,
+                                 md_identifier='taxonomy', chunk_size=500):
+    """Tests whether each individual's OTU abundances differ from the rest.
+
+    For each group of samples (e.g. body site), each individual's samples
+    ("self") are compared to every other individual's samples in the group
+    ("other") using a one-way ANOVA on each OTU's relative abundances. As
+    with otu_category_significance.py, OTUs that are in fewer than
+    min_fraction of a group's samples are not tested, and the p-values are
+    Bonferroni- and FDR-corrected for the number of OTUs tested for the
+    individual.
+
+    Returns a dict mapping each personal ID to a dict mapping each group to
+    a list of (OTU ID, p-value, Bonferroni-corrected p-value, FDR-corrected
+    p-value, self mean, other mean, taxonomy) tuples, sorted by p-value. An
+    individual/group is only included if there is at least one self and one
+    other sample and the group has at least three samples. OTUs that can't
+    be tested (e.g. every sample has the same abundance) are left out.
+
+    Arguments:
+        otu_table - parsed biom Table (usually rarefied)
+        sample_groups - list of (sample ID, (group, personal ID)) (e.g. from
+            get_sample_groups). Samples that aren't in otu_table are ignored
+        min_fraction - minimum fraction of a group's samples that an OTU
+            must be present in to be tested
+        md_identifier - observation metadata key holding each OTU's
+            taxonomy. If an OTU doesn't have this metadata, its taxonomy is
+            an empty string
+        chunk_size - the number of individuals in a group to compare to
+            everyone else at once
+    """
+    if chunk_size < 1:
+        raise ValueError("The chunk size must be at least 1.")
+
+    otu_table = otu_table.normObservationBySample()
+    taxonomy = _get_taxonomy(otu_table, md_identifier)
+
+    # Each group's samples, by individual.
+    group_samples = {}
+    table_sample_ids = set(otu_table.SampleIds)
+    for sample_id, (group, personal_id) in sample_groups:
+        if sample_id in table_sample_ids:
+            personal_samples = group_samples.setdefault(group, {})
+            personal_samples.setdefault(personal_id, []).append(sample_id)
+
+    results = {}
+    for group in sorted(group_samples):
+        personal_samples = group_samples[group]
+        group_results = _compare_group(otu_table, personal_samples,
+                                       min_fraction, taxonomy, chunk_size)
+
+        for personal_id, rows in group_results.items():
+            results.setdefault(personal_id, {})[group] = rows
+
+    return results
+
+def _compare_group(otu_table, personal_samples, min_fraction, taxonomy,
+                   chunk_size):
+    """Compares each individual to everyone else within a single group.
+
+    personal_samples maps each individual in the group to their sample IDs.
+    """
+    num_otus = len(otu_table.ObservationIds)
+    group_sums = zeros(num_otus)
+    group_sums_of_squares = zeros(num_otus)
+    presence = zeros(num_otus)
+    group_count = 0
+    for sample_ids in personal_samples.values():
+        for sample_id in sample_ids:
+            values = otu_table.sampleData(sample_id)
+            group_sums += values
+            group_sums_of_squares += values ** 2
+            presence += values > 0
+            group_count += 1
+
+    results = {}
+    if group_count <= 2:
+        return results
+
+    otus_to_test = flatnonzero(presence >= min_fraction * group_count)
+    group_sums = group_sums[otus_to_test]
+    group_sums_of_squares = group_sums_of_squares[otus_to_test]
+
+    personal_ids = sorted(personal_samples)
+    for chunk_start in range(0, len(personal_ids), chunk_size):
+        chunk_ids = personal_ids[chunk_start:chunk_start + chunk_size]
+
+        sums = zeros((len(chunk_ids), len(otus_to_test)))
+        sums_of_squares = zeros(sums.shape)
+        counts = zeros((len(chunk_ids), 1))
+        for i, personal_id in enumerate(chunk_ids):
+            for sample_id in personal_samples[personal_id]:
+                values = otu_table.sampleData(sample_id)[otus_to_test]
+                sums[i] += values
+                sums_of_squares[i] += values ** 2
+                counts[i] += 1
+
+        results.update(_compare_chunk(chunk_ids, sums, sums_of_squares,
+                counts, group_sums, group_sums_of_squares, group_count,
+                [otu_table.ObservationIds[j] for j in otus_to_test],
+                [taxonomy[j] for j in otus_to_test]))
+
+    return results
+
+def _compare_chunk(personal_ids, sums, sums_of_squares, counts, group_sums,
+                   group_sums_of_squares, group_count, otu_ids, taxonomy):
+    """Compares a chunk of individuals to everyone else in their group.
+
+    Each row of sums, sums_of_squares, and counts holds an individual's
+    totals for each OTU being tested (in the order of otu_ids and
+    taxonomy).
+    """
+    other_sums = group_sums - sums
+    other_sums_of_squares = group_sums_of_squares - sums_of_squares
+    other_counts = group_count - counts
+
+    results = {}
+    testable = (other_counts > 0).ravel()
+    if not testable.any():
+        return results
+
+    with errstate(divide='ignore', invalid='ignore'):
+        self_means = sums / counts
+        other_means = other_sums / other_counts
+        probs = _anova_two_groups(sums, sums_of_squares, counts, other_sums,
+                                  other_sums_of_squares, other_counts)
+    probs[~isfinite(probs)] = inf
+
+    bonferroni_probs, fdr_probs = _correct_probs(probs)
+
+    for i, personal_id in enumerate(personal_ids):
+        if not testable[i]:
+            continue
+
+        rows = []
+        for j in argsort(probs[i], kind='mergesort'):
+            if probs[i, j] == inf:
+                break
+            rows.append((otu_ids[j], probs[i, j], bonferroni_probs[i, j],
+                         fdr_probs[i, j], self_means[i, j],
+                         other_means[i, j], taxonomy[j]))
+        results[personal_id] = rows
+
+    return results
+
+def _anova_two_groups(sums1, sums_of_squares1, counts1, sums2,
+                      sums_of_squares2, counts2):
+    """Returns one-way ANOVA p-values comparing two groups.
+
+    Each argument is an array of per-group totals; the p-value of each
+    element is computed. p-values are NaN where the within-group variance
+    is zero or either group has fewer than two samples (the test is
+    undefined), as with QIIME's ANOVA.
+    """
+    means1 = sums1 / counts1
+    means2 = sums2 / counts2
+    total_counts = counts1 + counts2
+    grand_means = (sums1 + sums2) / total_counts
+
+    # Within-group sums of squares can be slightly negative due to rounding.
+    within = ((sums_of_squares1 - sums1 * means1) +
+              (sums_of_squares2 - sums2 * means2))
+    within = where(within > 0, within, 0.0)
+    between = (counts1 * (means1 - grand_means) ** 2 +
+               counts2 * (means2 - grand_means) ** 2)
+
+    dfd = total_counts - 2
+    f_stats = between / (within / dfd)
+    f_stats[within == 0] = float('nan')
+
+    # QIIME computes each group's variance with one delta degree of freedom,
+    # which is NaN for a group with a single sample.
+    f_stats = where((counts1 < 2) | (counts2 < 2), float('nan'), f_stats)
+
+    # With one numerator degree of freedom, the upper tail of the F
+    # distribution is I_x(dfd / 2, 1 / 2), where x = dfd / (dfd + F).
+    probs = zeros(f_stats.shape)
+    probs.fill(float('nan'))
+    for df in set(dfd.ravel()):
+        df_mask = (dfd == df) & isfinite(f_stats)
+        probs[df_mask] = _betai(df / 2, 0.5,
+                                df / (df + f_stats[df_mask]))
+    return probs
+
+def _correct_probs(probs):
+    """Returns Bonferroni- and FDR-corrected p-values for each row.
+
+    Infinite p-values mark OTUs that weren't tested; they aren't counted as
+    tests (and their corrected p-values are meaningless). The FDR correction
+    multiplies each p-value by the number of tests divided by its rank, as
+    otu_category_significance.py does. Corrected p-values are capped at 1.
+    """
+    num_tests = isfinite(probs).sum(axis=1)[:, None]
+    ranks = argsort(argsort(probs, axis=1, kind='mergesort'),
+                    axis=1, kind='mergesort') + 1
+
+    bonferroni_probs = minimum(probs * num_tests, 1.0)
+    fdr_probs = minimum(probs * num_tests / ranks, 1.0)
+    return bonferroni_probs, fdr_probs
+
+def _get_taxonomy(otu_table, md_identifier):
+    """Returns each OTU's taxonomy as a semicolon-separated string."""
+    taxonomy = []
+    for otu_md in otu_table.ObservationMetadata or \
+                  [None] * len(otu_table.ObservationIds):
+        if otu_md is None or md_identifier not in otu_md:
+            taxonomy.append('')
+        elif isinstance(otu_md[md_identifier], basestring):
+            taxonomy.append(otu_md[md_identifier])
+        else:
+            taxonomy.append(';'.join(otu_md[md_identifier]))
+    return taxonomy
+
+# Constants for the continued fraction in _betacf.
+_betacf_max_iterations = 1000
+_betacf_eps = 1e-15
+_betacf_fpmin = 1e-300
+
+def _betai(a, b, x):
+    """Returns the regularized incomplete beta function I_x(a, b).
+
+    a and b are scalars and x is an array of values in [0, 1]. Uses the
+    continued fraction in Numerical Recipes (section 6.4), evaluated for all
+    x at once.
+    """
+    x = asarray(x, dtype=float)
+    result = zeros(x.shape)
+    result[x >= 1] = 1.0
+
+    inside = (x > 0) & (x < 1)
+    xs = x[inside]
+    with errstate(divide='ignore'):
+        front = exp(lgamma(a + b) - lgamma(a) - lgamma(b) + a * log(xs) +
+                    b * log(1 - xs))
+
+    # The continued fraction converges quickly for x < (a + 1) / (a + b + 2).
+    # Otherwise, use the symmetry relation I_x(a, b) = 1 - I_(1-x)(b, a).
+    direct = xs < (a + 1) / (a + b + 2)
+    values = zeros(xs.shape)
+    values[direct] = front[direct] * _betacf(a, b, xs[direct]) / a
+    values[~direct] = 1 - front[~direct] * _betacf(b, a, 1 - xs[~direct]) / b
+
+    result[inside] = values
+    return result
+
+def _betacf(a, b, x):
+    """Evaluates the continued fraction for the incomplete beta function."""
+    def clamp(v):
+        return where(absolute(v) < _betacf_fpmin, _betacf_fpmin, v)
+
+    qab = a + b
+    qap = a + 1
+    qam = a - 1
+    c = ones(x.shape)
+    d = 1 / clamp(1 - qab * x / qap)
+    h = d
+
+    for m in range(1, _betacf_max_iterations + 1):
+        m2 = 2 * m
+        aa = m * (b - m) * x / ((qam + m2) * (a + m2))
+        d = 1 / clamp(1 + aa * d)
+        c = clamp(1 + aa / c)
+        h = h * d * c
+
+        aa = -(a + m) * (qab + m) * x / ((a + m2) * (qap + m2))
+        d = 1 / clamp(1 + aa * d)
+        c = clamp(1 + aa / c)
+        delta = d * c
+        h = h * delta
+
+        if (absolute(delta - 1) < _betacf_eps).all():
+            break
+
+    return h
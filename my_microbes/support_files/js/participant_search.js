@@ -0,0 +1,165 @@
+/*
+ * Client-side search of the paginated participant list.
+ *
+ * The search index (created by my_microbes/format.py's
+ * write_participant_pages) contains the first personal ID on each page and
+ * the name of each page's search shard. Personal IDs are looked up by binary
+ * searching the index for the shard that they would be in, and only that
+ * shard (and the next one, if the matches might continue into it) is
+ * downloaded. Each shard is a list of sorted personal IDs that are
+ * front-coded as [length of prefix shared with the previous ID, rest of ID].
+ *
+ * Author: Jai Ram Rideout
+ */
+
+// The maximum number of matching personal IDs to list.
+var participantSearchMaxResults = 10;
+
+function getJSON(url, callback) {
+  var request = new XMLHttpRequest();
+  request.onreadystatechange = function() {
+    if (request.readyState == 4 && request.status == 200) {
+      callback(JSON.parse(request.responseText));
+    }
+  };
+  request.open("GET", url, true);
+  request.send(null);
+}
+
+/*
+ * Returns the personal IDs in a front-coded search shard.
+ */
+function decodeSearchShard(entries) {
+  var personalIds = [];
+  var previousId = "";
+  for (var i = 0; i < entries.length; i++) {
+    previousId = previousId.substring(0, entries[i][0]) + entries[i][1];
+    personalIds.push(previousId);
+  }
+  return personalIds;
+}
+
+/*
+ * Returns the index of the last element of sortedValues that is less than or
+ * equal to value (or 0 if there isn't one).
+ */
+function findLastAtMost(sortedValues, value) {
+  var low = 0, high = sortedValues.length;
+  while (low < high) {
+    var mid = Math.floor((low + high) / 2);
+    if (sortedValues[mid] <= value) {
+      low = mid + 1;
+    }
+    else {
+      high = mid;
+    }
+  }
+  return Math.max(low - 1, 0);
+}
+
+/*
+ * Creates a search box in the element container, which has a data-index
+ * attribute containing the URL of the search index.
+ */
+function ParticipantSearch(container) {
+  this.input = container.getElementsByTagName("input")[0];
+  this.results = container.getElementsByClassName(
+      "participant-search-results")[0];
+  this.index = null;
+  this.shards = {};
+
+  var search = this;
+  getJSON(container.getAttribute("data-index"), function(index) {
+    search.index = index;
+    search.update();
+  });
+  this.input.onkeyup = function() {
+    search.update();
+  };
+}
+
+ParticipantSearch.prototype.update = function() {
+  var query = this.input.value.replace(/^\s+|\s+$/g, "");
+  if (this.index === null || query.length == 0) {
+    this.results.innerHTML = "";
+    return;
+  }
+
+  // Matches start in the shard that the query would be in, and can continue
+  // into the next shard if its first ID also starts with the query.
+  var firstIds = this.index.first_ids;
+  var shardIndices = [findLastAtMost(firstIds, query)];
+  var next = shardIndices[0] + 1;
+  if (next < firstIds.length && firstIds[next].indexOf(query) == 0) {
+    shardIndices.push(next);
+  }
+
+  var search = this;
+  this.loadShards(shardIndices, function(personalIds) {
+    // Ignore results for a query that has since been changed.
+    if (search.input.value.replace(/^\s+|\s+$/g, "") == query) {
+      search.showResults(query, personalIds);
+    }
+  });
+};
+
+/*
+ * Calls callback with the personal IDs in the shards, downloading any that
+ * haven't been downloaded yet.
+ */
+ParticipantSearch.prototype.loadShards = function(shardIndices, callback) {
+  var search = this;
+  var personalIds = [];
+  var loadShard = function(i) {
+    if (i == shardIndices.length) {
+      callback(personalIds);
+      return;
+    }
+
+    var shardIndex = shardIndices[i];
+    if (shardIndex in search.shards) {
+      personalIds = personalIds.concat(search.shards[shardIndex]);
+      loadShard(i + 1);
+    }
+    else {
+      getJSON(search.index.shards[shardIndex], function(entries) {
+        search.shards[shardIndex] = decodeSearchShard(entries);
+        loadShard(i);
+      });
+    }
+  };
+  loadShard(0);
+};
+
+ParticipantSearch.prototype.showResults = function(query, personalIds) {
+  var start = findLastAtMost(personalIds, query);
+  if (personalIds[start] < query) {
+    start++;
+  }
+
+  var html = "";
+  var numResults = 0;
+  for (var i = start; i < personalIds.length &&
+       numResults < participantSearchMaxResults; i++) {
+    if (personalIds[i].indexOf(query) != 0) {
+      break;
+    }
+    var url = this.index.url_prefix + personalIds[i] + "/index.html";
+    html += '<a href="' + url + '" target="_blank">' + personalIds[i] +
+            '</a><br/>';
+    numResults++;
+  }
+
+  if (numResults == 0) {
+    html = "No personal IDs start with " +
+           query.replace(/&/g, "&amp;").replace(/</g, "&lt;") + ".";
+  }
+  this.results.innerHTML = html;
+};
+
+(function() {
+  var containers = document.getElementsByClassName("participant-search");
+  for (var i = 0; i < containers.length; i++) {
+    new ParticipantSearch(containers[i]);
+  }
+})();
@@ -0,0 +1,277 @@
+/*
+ * Built-in viewer for beta diversity PCoA plots.
+ *
+ * The study's coordinates (pcoaStudyData) are shared by every individual and
+ * each individual's overlay (pcoaOverlay) only identifies their samples and
+ * the order to connect them in over time. Both are created by
+ * my_microbes/pcoa.py.
+ *
+ * The plot is drawn on a canvas with an orthographic projection and can be
+ * rotated by dragging it with the mouse. There are two views: the first three
+ * principal coordinates, and the first two principal coordinates with time
+ * as the third axis (with the individual's samples at each body site
+ * connected in order of time).
+ *
+ * Author: Jai Ram Rideout
+ */
+
+// Body site colors used by the Student Microbiome Project. Other body sites
+// are colored from the fallback palette.
+var pcoaBodySiteColors = {
+  "forehead": [230, 200, 0],
+  "palm": [240, 130, 0],
+  "gut": [30, 90, 220],
+  "tongue": [220, 30, 30]
+};
+var pcoaFallbackColors = [[40, 160, 40], [150, 60, 200], [0, 170, 170],
+                          [160, 100, 40], [200, 60, 140], [110, 110, 110]];
+
+/*
+ * Decodes a base64 string of little-endian float32s into an array of
+ * numbers.
+ */
+function decodeFloat32s(base64) {
+  var bytes = atob(base64);
+  var view = new DataView(new ArrayBuffer(bytes.length));
+  for (var i = 0; i < bytes.length; i++) {
+    view.setUint8(i, bytes.charCodeAt(i));
+  }
+
+  var values = [];
+  for (var i = 0; i + 4 <= bytes.length; i += 4) {
+    values.push(view.getFloat32(i, true));
+  }
+  return values;
+}
+
+/*
+ * Returns the [r, g, b] color of a body site. Self samples are drawn in a
+ * lighter shade of the body site's color.
+ */
+function getBodySiteColor(bodySites, bodySiteIndex, isSelf) {
+  var name = bodySites[bodySiteIndex].toLowerCase();
+  var color = pcoaBodySiteColors[name];
+  if (typeof(color) == "undefined") {
+    color = pcoaFallbackColors[bodySiteIndex % pcoaFallbackColors.length];
+  }
+
+  if (isSelf) {
+    color = [Math.round((color[0] + 255) / 2),
+             Math.round((color[1] + 255) / 2),
+             Math.round((color[2] + 255) / 2)];
+  }
+  return color;
+}
+
+function colorToCss(color) {
+  return "rgb(" + color[0] + "," + color[1] + "," + color[2] + ")";
+}
+
+/*
+ * Creates a viewer that draws studyData and overlay on the canvas with the
+ * given id. The legend is written into the element with id legendId, and
+ * each element with class "pcoa-view" and a data-view attribute of "pcoa" or
+ * "time" switches to that view when clicked.
+ */
+function PCoAViewer(canvasId, legendId, studyData, overlay) {
+  this.canvas = document.getElementById(canvasId);
+  this.context = this.canvas.getContext("2d");
+  this.studyData = studyData;
+  this.overlay = overlay;
+  this.view = "pcoa";
+  this.yaw = -0.6;
+  this.pitch = 0.4;
+
+  var values = decodeFloat32s(studyData.values);
+  var numValues = studyData.num_values;
+  this.samples = [];
+  for (var i = 0; i < studyData.sample_ids.length; i++) {
+    this.samples.push(values.slice(i * numValues, (i + 1) * numValues));
+  }
+
+  this.isSelf = {};
+  for (var i = 0; i < overlay.self_samples.length; i++) {
+    this.isSelf[overlay.self_samples[i]] = true;
+  }
+
+  // Scale each value (three coordinates and the time point) to [-1, 1].
+  this.ranges = [];
+  for (var j = 0; j < numValues; j++) {
+    var min = Infinity, max = -Infinity;
+    for (var i = 0; i < this.samples.length; i++) {
+      if (isFinite(this.samples[i][j])) {
+        min = Math.min(min, this.samples[i][j]);
+        max = Math.max(max, this.samples[i][j]);
+      }
+    }
+    this.ranges.push([min, max]);
+  }
+
+  this.writeLegend(document.getElementById(legendId));
+  this.bindEvents();
+  this.draw();
+}
+
+PCoAViewer.prototype.writeLegend = function(legend) {
+  var html = "";
+  var bodySites = this.studyData.body_sites;
+  for (var i = 0; i < bodySites.length; i++) {
+    var titles = [this.overlay.self_title, this.overlay.other_title];
+    for (var j = 0; j < titles.length; j++) {
+      html += '<span style="color: ' +
+              colorToCss(getBodySiteColor(bodySites, i, j == 0)) +
+              '">&#9679;</span> ' + bodySites[i] + ' (' + titles[j] +
+              ')<br/>';
+    }
+  }
+  legend.innerHTML = html;
+};
+
+PCoAViewer.prototype.bindEvents = function() {
+  var viewer = this;
+  var dragging = null;
+
+  this.canvas.onmousedown = function(event) {
+    dragging = [event.clientX, event.clientY];
+    return false;
+  };
+  document.onmouseup = function() {
+    dragging = null;
+  };
+  document.onmousemove = function(event) {
+    if (dragging !== null) {
+      viewer.yaw += (event.clientX - dragging[0]) * 0.01;
+      viewer.pitch += (event.clientY - dragging[1]) * 0.01;
+      viewer.pitch = Math.max(-Math.PI / 2, Math.min(Math.PI / 2,
+                                                     viewer.pitch));
+      dragging = [event.clientX, event.clientY];
+      viewer.draw();
+    }
+  };
+
+  var viewLinks = document.getElementsByClassName("pcoa-view");
+  for (var i = 0; i < viewLinks.length; i++) {
+    viewLinks[i].onclick = function() {
+      viewer.view = this.getAttribute("data-view");
+      viewer.draw();
+      return false;
+    };
+  }
+};
+
+/*
+ * Returns the [x, y, depth] canvas position of a sample in the current view,
+ * or null if the sample can't be plotted (e.g. it doesn't have a numeric
+ * time point in the time series view).
+ */
+PCoAViewer.prototype.project = function(sampleIndex) {
+  var axes = this.view == "time" ? [0, 1, this.studyData.num_values - 1] :
+                                   [0, 1, 2];
+  var point = [];
+  for (var i = 0; i < axes.length; i++) {
+    var value = this.samples[sampleIndex][axes[i]];
+    var range = this.ranges[axes[i]];
+    if (!isFinite(value)) {
+      return null;
+    }
+    point.push(range[1] > range[0] ?
+               2 * (value - range[0]) / (range[1] - range[0]) - 1 : 0);
+  }
+
+  return this.projectPoint(point);
+};
+
+PCoAViewer.prototype.draw = function() {
+  var context = this.context;
+  var bodySites = this.studyData.body_sites;
+  context.fillStyle = "black";
+  context.fillRect(0, 0, this.canvas.width, this.canvas.height);
+
+  // Draw the axes.
+  var pctVar = this.studyData.pct_var;
+  var axisLabels = ["PC1 (" + pctVar[0].toFixed(1) + "%)",
+                    "PC2 (" + pctVar[1].toFixed(1) + "%)",
+                    this.view == "time" ? this.studyData.time_series_category :
+                    "PC3 (" + pctVar[2].toFixed(1) + "%)"];
+  var origin = this.projectPoint([-1, -1, -1]);
+  context.strokeStyle = "gray";
+  context.fillStyle = "white";
+  context.font = "12px sans-serif";
+  for (var i = 0; i < 3; i++) {
+    var end = [-1, -1, -1];
+    end[i] = 1;
+    end = this.projectPoint(end);
+    context.beginPath();
+    context.moveTo(origin[0], origin[1]);
+    context.lineTo(end[0], end[1]);
+    context.stroke();
+    context.fillText(axisLabels[i], end[0] + 4, end[1]);
+  }
+
+  // Draw the samples furthest away first, and the individual's samples on
+  // top of everyone else's.
+  var points = [];
+  for (var i = 0; i < this.samples.length; i++) {
+    var position = this.project(i);
+    if (position !== null) {
+      points.push([this.isSelf[i] ? 1 : 0, position[2], i, position]);
+    }
+  }
+  points.sort(function(a, b) { return a[0] - b[0] || a[1] - b[1]; });
+
+  var sampleBodySites = this.studyData.sample_body_sites;
+  for (var i = 0; i < points.length; i++) {
+    var isSelf = points[i][0] == 1;
+    var position = points[i][3];
+    context.fillStyle = colorToCss(getBodySiteColor(bodySites,
+        sampleBodySites[points[i][2]], isSelf));
+    context.beginPath();
+    context.arc(position[0], position[1], isSelf ? 5 : 3, 0, 2 * Math.PI);
+    context.fill();
+  }
+
+  // Connect the individual's samples at each body site over time.
+  if (this.view == "time") {
+    var trajectories = this.overlay.trajectories;
+    context.lineWidth = 2;
+    for (var i = 0; i < trajectories.length; i++) {
+      var samples = trajectories[i].samples;
+      context.strokeStyle = colorToCss(getBodySiteColor(bodySites,
+          sampleBodySites[samples[0]], true));
+      context.beginPath();
+      var started = false;
+      for (var j = 0; j < samples.length; j++) {
+        var position = this.project(samples[j]);
+        if (position === null) {
+          continue;
+        }
+        if (started) {
+          context.lineTo(position[0], position[1]);
+        }
+        else {
+          context.moveTo(position[0], position[1]);
+          started = true;
+        }
+      }
+      context.stroke();
+    }
+    context.lineWidth = 1;
+  }
+};
+
+/*
+ * Returns the [x, y, depth] canvas position of a point that has already been
+ * scaled to [-1, 1] (e.g. a sample, or the end of an axis).
+ */
+PCoAViewer.prototype.projectPoint = function(point) {
+  var cosYaw = Math.cos(this.yaw), sinYaw = Math.sin(this.yaw);
+  var cosPitch = Math.cos(this.pitch), sinPitch = Math.sin(this.pitch);
+  var x = point[0] * cosYaw + point[2] * sinYaw;
+  var z = -point[0] * sinYaw + point[2] * cosYaw;
+  var y = point[1] * cosPitch - z * sinPitch;
+  var depth = point[1] * sinPitch + z * cosPitch;
+
+  var scale = Math.min(this.canvas.width, this.canvas.height) * 0.3;
+  return [this.canvas.width / 2 + x * scale,
+          this.canvas.height / 2 - y * scale, depth];
+};
@@ -0,0 +1,105 @@
+#!/usr/bin/env python
+from __future__ import division
+
+__author__ = "Jai Ram Rideout"
+__copyright__ = "Copyright 2013, The QIIME project"
+__credits__ = ["Jai Ram Rideout"]
+__license__ = "GPL"
+__version__ = "0.1.0-dev"
+__maintainer__ = "Jai Ram Rideout"
+__email__ = "jai.rideout@gmail.com"
+
+"""Module for summarizing OTU abundances by taxonomy in-process."""
+
+from numpy import add, array, asarray, zeros
+
+class TaxaSummarizer(object):
+    """Summarizes OTU abundances at several taxonomic levels.
+
+    The mapping of OTUs to taxa at each level is built once from an OTU
+    table's observation metadata. Each level's mapping is stored as an array
+    holding the row index of each OTU's taxon, which is a compact form of the
+    level's OTU to taxon indicator matrix. Any number of columns of OTU
+    abundances (e.g. weekly totals for self and other at each body site) can
+    then be summarized at every level at once.
+
+    Summaries are computed the same way as QIIME's summarize_taxa.py: an
+    OTU's taxon at a level is its taxonomy truncated to that level (or padded
+    with 'Other' if the taxonomy is too short), taxa are sorted, and the
+    summarized abundances are relative to each column's total.
+    """
+
+    def __init__(self, otu_table, levels, md_identifier='taxonomy',
+                 missing_name='Other'):
+        if otu_table.ObservationMetadata is None:
+            raise ValueError("The OTU table does not contain any observation "
+                             "metadata (e.g. taxonomy).")
+
+        self.levels = sorted(levels)
+        max_level = self.levels[-1]
+
+        consensuses = []
+        for otu_id, otu_md in zip(otu_table.ObservationIds,
+                                  otu_table.ObservationMetadata):
+            if otu_md is None or md_identifier not in otu_md:
+                raise KeyError("Metadata category '%s' is not in OTU %s." %
+                               (md_identifier, otu_id))
+
+            consensus = list(otu_md[md_identifier][:max_level])
+            consensus.extend([missing_name] * (max_level - len(consensus)))
+            consensuses.append(tuple(consensus))
+
+        self._taxa = {}
+        self._otu_taxon_index = {}
+        for level in self.levels:
+            level_consensuses = [consensus[:level]
+                                 for consensus in consensuses]
+            self._taxa[level] = sorted(set(level_consensuses))
+            self._otu_taxon_index[level] = _build_group_index(
+                    level_consensuses, self._taxa[level])
+
+    def get_taxa(self, level):
+        """Returns the sorted list of taxa (tuples) at level."""
+        return self._taxa[level]
+
+    def summarize(self, otu_abundances):
+        """Summarizes columns of OTU abundances at each level.
+
+        otu_abundances must be a 2D array with a row for each OTU (in the
+        same order as the OTU table that this summarizer was built from) and
+        a column for each sample or group of samples.
+
+        Returns a dict mapping each level to a 2D array of relative
+        abundances with a row for each of the level's taxa (in the order
+        returned by get_taxa) and a column for each input column.
+        """
+        # Convert to relative abundances before summing (rather than after)
+        # so that the floating point results are identical to
+        # summarize_taxa.py's.
+        otu_abundances = asarray(otu_abundances, dtype=float)
+        otu_abundances = otu_abundances / otu_abundances.sum(axis=0)
+
+        summaries = {}
+        for level in self.levels:
+            summaries[level] = _sum_rows_by_group(otu_abundances,
+                    self._otu_taxon_index[level])
+        return summaries
+
+
+def _build_group_index(items, sorted_unique_items):
+    """Returns an array of the position of each item in sorted_unique_items.
+    """
+    positions = dict([(item, i) for i, item in enumerate(sorted_unique_items)])
+    return array([positions[item] for item in items], dtype=int)
+
+def _sum_rows_by_group(matrix, group_index):
+    """Sums the rows of matrix that are in the same group.
+
+    Equivalent to multiplying the indicator matrix described by group_index
+    (the group of each row) by matrix. Returns a 2D array with a row for each
+    group. Rows are added one at a time in their original order, which is
+    the same order summarize_taxa.py adds them in.
+    """
+    sums = zeros((group_index.max() + 1, matrix.shape[1]))
+    add.at(sums, group_index, matrix)
+    return sums
@@ -0,0 +1,269 @@
+#!/usr/bin/env python
+from __future__ import division
+
+__author__ = "Jai Ram Rideout"
+__copyright__ = "Copyright 2013, The QIIME project"
+__credits__ = ["Jai Ram Rideout"]
+__license__ = "GPL"
+__version__ = "0.1.0-dev"
+__maintainer__ = "Jai Ram Rideout"
+__email__ = "jai.rideout@gmail.com"
+
+"""Module for timing the commands that a workflow runs.
+
+Each command is run in its own process and waited on with os.wait4, which
+reports the resources used by that process (and any processes it waited on)
+alone. Each command's wall time, CPU time, peak resident set size (RSS), and
+the sizes of its inputs and outputs are written as a JSON object on its own
+line (JSON lines) to a timings file, which can be appended to by several
+processes and threads at once.
+"""
+
+from json import dumps, loads
+from math import ceil
+from os import WEXITSTATUS, WIFSIGNALED, WTERMSIG, wait4, walk
+from os.path import basename, getsize, isdir, isfile, join
+from subprocess import Popen
+from sys import platform, stderr as sys_stderr
+from tempfile import TemporaryFile
+from time import time
+
+from qiime.workflow.util import WorkflowError
+
+# ru_maxrss is in kilobytes on Linux but in bytes on OS X.
+_max_rss_scale = 1 if platform == 'darwin' else 1024
+
+class CommandTimer(object):
+    """Runs workflow commands and records how long each one takes.
+
+    A CommandTimer can be used in place of QIIME's call_commands_serially (it
+    runs, logs, and reports errors for commands in the same way). Instances
+    only hold the timings filepath and the individual they time commands
+    for, so they can be passed to worker processes.
+    """
+
+    def __init__(self, timings_fp, person_id=None):
+        """Initializes a timer that appends its records to timings_fp.
+
+        Arguments:
+            timings_fp - the JSON lines file to append records to
+            person_id - the personal ID of the individual whose results the
+                commands create (None for study-wide commands)
+        """
+        self.timings_fp = timings_fp
+        self.person_id = person_id
+
+    def for_person(self, person_id):
+        """Returns a timer that records commands for an individual."""
+        return CommandTimer(self.timings_fp, person_id)
+
+    def __call__(self, commands, status_update_callback, logger,
+                 close_logger_on_success=True, stage=None, inputs=None,
+                 outputs=None):
+        """Runs a list of commands, one after another.
+
+        The first four arguments are the same as call_commands_serially's.
+
+        Arguments:
+            stage - the stage of the individual's results that the commands
+                create, if any
+            inputs - list of filepaths the commands read
+            outputs - list of filepaths the commands write
+        """
+        logger.write("Executing commands.\n\n")
+        for c in commands:
+            for title, cmd in c:
+                status_update_callback('%s\n%s' % (title, cmd))
+                logger.write('# %s command \n%s\n\n' % (title, cmd))
+
+                input_bytes = sum(map(get_path_size, inputs or []))
+                stdout, stderr, return_value, usage = run_command(cmd)
+                self.record(dict(person_id=self.person_id,
+                                 stage=stage,
+                                 title=title,
+                                 script=basename(cmd.split(None, 1)[0]),
+                                 start=usage['start'],
+                                 wall_time=usage['wall_time'],
+                                 cpu_time=usage['user_time'] +
+                                          usage['system_time'],
+                                 user_time=usage['user_time'],
+                                 system_time=usage['system_time'],
+                                 peak_rss=usage['peak_rss'],
+                                 input_bytes=input_bytes,
+                                 output_bytes=sum(map(get_path_size,
+                                                      outputs or [])),
+                                 exit_status=return_value))
+
+                if return_value != 0:
+                    msg = "\n\n*** ERROR RAISED DURING STEP: %s\n" % title +\
+                          "Command run was:\n %s\n" % cmd +\
+                          "Command returned exit status: %d\n" % \
+                          return_value +\
+                          "Stdout:\n%s\nStderr\n%s\n" % (stdout, stderr)
+                    logger.write(msg)
+                    logger.close()
+                    raise WorkflowError(msg)
+
+                logger.write("Stdout:\n%s\nStderr:\n%s\n" % (stdout, stderr))
+                if stdout:
+                    print stdout
+                if stderr:
+                    sys_stderr.write(stderr)
+
+        if close_logger_on_success:
+            logger.close()
+
+    def record(self, record):
+        """Appends a record (a dict) to the timings file.
+
+        The file is opened in append mode and each record is written in a
+        single write, so records written by different processes or threads
+        at the same time aren't interleaved.
+        """
+        timings_f = open(self.timings_fp, 'a')
+        try:
+            timings_f.write(dumps(record, sort_keys=True) + '\n')
+        finally:
+            timings_f.close()
+
+
+def run_command(cmd):
+    """Runs cmd in a shell and measures the resources it used.
+
+    Returns a tuple containing the command's stdout, stderr, return value
+    (negative if it was killed by a signal), and a dict containing its start
+    time (seconds since the epoch), wall time, user and system CPU time (in
+    seconds), and peak RSS (in bytes).
+    """
+    # The output is written to temporary files instead of pipes so that the
+    # process can be waited on directly (Popen.communicate would reap it and
+    # discard its resource usage) without it blocking on a full pipe.
+    stdout_f = TemporaryFile()
+    stderr_f = TemporaryFile()
+    try:
+        start = time()
+        proc = Popen(cmd, shell=True, stdout=stdout_f, stderr=stderr_f,
+                     close_fds=True)
+        pid, status, rusage = wait4(proc.pid, 0)
+        wall_time = time() - start
+
+        if WIFSIGNALED(status):
+            return_value = -WTERMSIG(status)
+        else:
+            return_value = WEXITSTATUS(status)
+        # Keep the Popen object from trying to reap the process again.
+        proc.returncode = return_value
+
+        stdout_f.seek(0)
+        stderr_f.seek(0)
+        stdout = stdout_f.read().replace('\r\n', '\n')
+        stderr = stderr_f.read().replace('\r\n', '\n')
+    finally:
+        stdout_f.close()
+        stderr_f.close()
+
+    return stdout, stderr, return_value, dict(start=start,
+            wall_time=wall_time, user_time=rusage.ru_utime,
+            system_time=rusage.ru_stime,
+            peak_rss=rusage.ru_maxrss * _max_rss_scale)
+
+def get_path_size(path):
+    """Returns the size of a file, or the total size of a directory's files.
+
+    Paths that don't exist have a size of zero.
+    """
+    if isfile(path):
+        return getsize(path)
+    elif isdir(path):
+        size = 0
+        for dir_path, dir_names, file_names in walk(path):
+            for file_name in file_names:
+                fp = join(dir_path, file_name)
+                if isfile(fp):
+                    size += getsize(fp)
+        return size
+    else:
+        return 0
+
+def parse_timings(timings_f):
+    """Returns a list of the records (dicts) in a JSON lines timings file.
+
+    Blank lines are skipped, as is a last line that was only partially
+    written (e.g. by an interrupted run).
+    """
+    records = []
+    lines = timings_f.readlines()
+    for line_num, line in enumerate(lines):
+        line = line.strip()
+        if not line:
+            continue
+
+        try:
+            records.append(loads(line))
+        except ValueError:
+            if line_num != len(lines) - 1:
+                raise ValueError("Invalid timing record on line %d: %s" %
+                                 (line_num + 1, line))
+    return records
+
+def summarize_timings(records, key='stage'):
+    """Summarizes the wall time, CPU time, and peak RSS of groups of records.
+
+    Returns a list of (group, number of commands, total wall time, 95th
+    percentile wall time, total CPU time, maximum peak RSS) tuples, sorted by
+    total wall time (longest first). Records are grouped by the value of
+    key. Study-wide records (which don't have a person ID) are included.
+
+    Arguments:
+        records - timing records (e.g. from parse_timings)
+        key - the record field to group by (e.g. 'stage' or 'script')
+    """
+    groups = {}
+    for record in records:
+        groups.setdefault(record.get(key), []).append(record)
+
+    summary = []
+    for group, group_records in groups.items():
+        wall_times = [record['wall_time'] for record in group_records]
+        summary.append((group, len(group_records), sum(wall_times),
+                        get_percentile(wall_times, 95),
+                        sum([record['cpu_time'] for record in group_records]),
+                        max([record['peak_rss'] for record in group_records])))
+    summary.sort(key=lambda group_summary: (-group_summary[2],
+                                            group_summary[0]))
+    return summary
+
+def get_percentile(values, percentile):
+    """Returns the nearest-rank percentile of a list of values."""
+    if not values:
+        raise ValueError("Can't compute the percentile of an empty list.")
+    if not 0 < percentile <= 100:
+        raise ValueError("The percentile must be greater than 0 and at most "
+                         "100.")
+
+    values = sorted(values)
+    return values[int(ceil(percentile / 100 * len(values))) - 1]
+
+def format_timings_summary(records, top=10):
+    """Returns a report of the stages and scripts that took the most time.
+
+    The report contains two tables (grouped by stage, then by script), each
+    listing up to top groups ordered by total wall time.
+    """
+    lines = ['Command timings (%d commands, %.2f seconds total):' %
+             (len(records), sum([record['wall_time'] for record in records]))]
+
+    for key, heading in (('stage', 'Stage'), ('script', 'Script')):
+        lines.append('')
+        lines.append('%-30s %8s %12s %12s %12s %14s' %
+                     (heading, 'Commands', 'Total (s)', 'p95 (s)',
+                      'CPU (s)', 'Peak RSS (MB)'))
+        for group, num_commands, total_time, p95_time, cpu_time, peak_rss in \
+                summarize_timings(records, key)[:top]:
+            if group is None:
+                group = '(none)'
+            lines.append('%-30s %8d %12.2f %12.2f %12.2f %14.1f' %
+                         (group, num_commands, total_time, p95_time,
+                          cpu_time, peak_rss / (1024 * 1024)))
+
+    return '\n'.join(lines) + '\n'
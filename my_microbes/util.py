@@ -11,46 +11,73 @@ __maintainer__ = "John Chase"
 __email__ = "jc33@nau.edu"
 
 from collections import defaultdict
-from email.Encoders import encode_base64
-from email.MIMEBase import MIMEBase
-from email.MIMEMultipart import MIMEMultipart
-from email.mime.text import MIMEText
-from email.Utils import formatdate
 from glob import glob
-from os import makedirs
-from os.path import (abspath, basename, dirname, exists, join, normpath,
-                     splitext)
+from functools import partial
+from multiprocessing import Pool
+from os import makedirs, rename
+from os.path import (abspath, basename, dirname, exists, getsize, isdir,
+                     join, normpath)
 from random import choice, randint
-from shutil import copytree, rmtree
+from shutil import copyfile, copytree, rmtree
+from signal import SIG_DFL, SIGTERM, signal
 from smtplib import SMTP
 from string import digits, letters
+from sys import exc_info
 
 from biom.parse import parse_biom_table
 
 from cogent.util.misc import remove_files
 
-from numpy import isnan
+from numpy import (argsort, array, bincount, column_stack, cumsum,
+                   flatnonzero, isnan, nan, split, tile)
 
+from qiime import __version__ as qiime_version
 from qiime.format import format_mapping_file
-from qiime.parse import parse_mapping_file, parse_rarefaction
-from qiime.pycogent_backports.distribution_plots import generate_box_plots
-from qiime.util import (add_filename_suffix, create_dir, MetadataMap,
-                        qiime_system_call)
+from qiime.parse import parse_mapping_file
+from qiime.sort import natsort
+from qiime.util import add_filename_suffix, create_dir
 from qiime.workflow.util import (call_commands_serially, generate_log_fp,
                             no_status_updates, print_commands, print_to_stdout,
                             WorkflowError, WorkflowLogger)
 
-from my_microbes.format import (create_index_html,
+from my_microbes.aggregate import (aggregate_otu_table,
+                                   aggregate_rarefaction, get_sample_groups)
+from my_microbes.alpha_diversity import AlphaDiversityStore, RarefactionStore
+from my_microbes.format import (OTUFragmentCache,
+        create_index_html,
         create_alpha_diversity_boxplots_html,
+        create_alpha_rarefaction_html,
+        create_beta_diversity_html,
         create_comparative_taxa_plots_html,
         create_otu_category_significance_html,
         create_otu_category_significance_html_tables,
+        create_pcoa_viewer_html,
         create_taxa_summary_plots_html,
         format_htaccess_file,
+        format_otu_category_significance,
+        format_rarefaction_averages,
+        format_taxa_summary,
         format_title,
         get_personalized_notification_email_text,
         notification_email_subject)
-from my_microbes.parse import parse_email_settings, parse_recipients
+from my_microbes.htpasswd import (check_dbm_type, hash_password,
+                                  hash_passwords, update_user_dbm)
+from my_microbes.mail import (create_email_message, DeliveryJournal,
+                               Mailer, MailSpool)
+from my_microbes.manifest import (BuildManifest, hash_inputs, hash_modules,
+                                  hash_path)
+from my_microbes.pcoa import PCoAViewerData
+from my_microbes.parse import (parse_collated_alpha_diversity,
+                               parse_email_settings, parse_recipients)
+from my_microbes.plot import BoxplotRenderer, plot_rarefaction_averages
+from my_microbes.precompress import check_encodings, precompress_files
+from my_microbes.rep_set import RepSet
+from my_microbes.sample_index import SampleIndex
+from my_microbes.significance import compare_individuals_to_study
+from my_microbes.taxa import TaxaSummarizer
+from my_microbes.timing import (CommandTimer, format_timings_summary,
+                                parse_timings)
+from my_microbes.workflow import CommandGraph
 
 def get_personal_ids(mapping_data, personal_id_index):
     """Returns a set of personal IDs from a mapping file."""
@@ -107,6 +134,13 @@ def create_personal_results(output_dir,
                             suppress_taxa_summary_plots=False,
                             suppress_alpha_diversity_boxplots=False,
                             suppress_otu_category_significance=False,
+                            pcoa_viewer=False,
+                            static_alpha_rarefaction=False,
+                            jobs=1,
+                            max_concurrent_commands=1,
+                            incremental=False,
+                            precompress_encodings=None,
+                            timings_fp=None,
                             command_handler=call_commands_serially,
                             status_update_callback=no_status_updates):
     # Create our output directory and copy over the resources the personalized
@@ -120,6 +154,13 @@ def create_personal_results(output_dir,
 
     logger = WorkflowLogger(generate_log_fp(output_dir))
 
+    # Time every command that is run (there's nothing to time in print-only
+    # mode). The timings file only contains the records of the latest run.
+    command_timer = None
+    if timings_fp is not None and command_handler is not print_commands:
+        open(timings_fp, 'w').close()
+        command_timer = CommandTimer(timings_fp)
+
     mapping_data, header, comments = parse_mapping_file(open(mapping_fp, 'U'))
     try:
         personal_id_index = header.index(personal_id_column)
@@ -154,263 +195,1036 @@ def create_personal_results(output_dir,
         raise ValueError("Time series field '%s' is not a mapping file column "
                          "header." % time_series_category)
 
-    otu_table_title = splitext(basename(otu_table_fp))
+    if jobs < 1:
+        raise ValueError("The number of jobs must be at least 1.")
+
+    # Use the same default as create_personal_mapping_file.
+    if individual_titles is None:
+        individual_titles = ['Self', 'Other']
+
+    if max_concurrent_commands < 1:
+        raise ValueError("The maximum number of concurrent commands must be "
+                         "at least 1.")
+
+    if precompress_encodings:
+        check_encodings(precompress_encodings)
+
+    if pcoa_viewer and not suppress_beta_diversity and isdir(coord_fp):
+        raise ValueError("The PCoA viewer requires a single principal "
+                         "coordinates file, not a directory.")
 
     output_directories = []
     raw_data_files = []
     raw_data_dirs = []
 
-    # Rarefy the OTU table and split by body site here (instead of on a
-    # per-individual basis) as we can use the same rarefied and split tables
-    # for each individual.
-    if not suppress_otu_category_significance:
+    sample_id_index = header.index('SampleID')
+    time_series_index = header.index(time_series_category)
+    personal_ids = list(personal_ids)
+
+    # Index every sample in the study once so that each individual's body
+    # sites and sample counts can be looked up instead of re-parsed.
+    sample_index = SampleIndex(mapping_data, sample_id_index,
+                               personal_id_index, bodysite_index,
+                               time_series_index)
+
+    # Hash the inputs of each individual's stages. In incremental mode, a
+    # stage is only rebuilt if its inputs have changed since it was last
+    # built (or its outputs are missing).
+    stage_input_hashes = _hash_stage_inputs(personal_ids, mapping_data,
+            header, comments, sample_index, sample_id_index,
+            personal_id_index, bodysite_index, time_series_index, coord_fp,
+            collated_dir, otu_table_fp, prefs_fp, personal_id_column,
+            individual_titles, category_to_split, time_series_category,
+            rarefaction_depth, alpha, rep_set_fp,
+            body_site_rarefied_otu_table_dir, retain_raw_data,
+            suppress_alpha_rarefaction, suppress_beta_diversity,
+            suppress_taxa_summary_plots, suppress_alpha_diversity_boxplots,
+            suppress_otu_category_significance, pcoa_viewer,
+            static_alpha_rarefaction)
+
+    stages_to_build = {}
+    for person_of_interest in personal_ids:
+        input_hashes = stage_input_hashes[person_of_interest]
+        stages_to_build[person_of_interest] = set(input_hashes)
+
+        if incremental:
+            manifest = BuildManifest(
+                    _get_manifest_fp(output_dir, person_of_interest),
+                    output_dir)
+            for stage, input_hash in input_hashes.items():
+                if manifest.is_current(stage, input_hash):
+                    stages_to_build[person_of_interest].remove(stage)
+
+    # Study-wide data only needs to be loaded for stages that at least one
+    # individual needs built.
+    stages_to_build_for_anyone = set()
+    for person_stages in stages_to_build.values():
+        stages_to_build_for_anyone.update(person_stages)
+
+    # Rarefy the OTU table here (instead of on a per-individual basis) and
+    # compare every individual's OTU abundances to everyone else's at each
+    # body site at once.
+    rarefied_otu_table_fp = None
+    otu_cat_sig_results = None
+    if _otu_category_significance_stage in stages_to_build_for_anyone:
         rarefied_otu_table_fp = join(output_dir,
                 add_filename_suffix(otu_table_fp,
                                     '_even%d' % rarefaction_depth))
 
         if body_site_rarefied_otu_table_dir is None:
-            commands = []
+            graph = CommandGraph()
             cmd_title = 'Rarefying OTU table'
             cmd = 'single_rarefaction.py -i %s -o %s -d %s' % (otu_table_fp,
                     rarefied_otu_table_fp, rarefaction_depth)
-            commands.append([(cmd_title, cmd)])
+            graph.add_command(cmd_title, cmd, inputs=[otu_table_fp],
+                              outputs=[rarefied_otu_table_fp],
+                              stage=_otu_category_significance_stage)
             raw_data_files.append(rarefied_otu_table_fp)
 
-            per_body_site_dir = join(output_dir, 'per_body_site_otu_tables')
-
-            cmd_title = 'Splitting rarefied OTU table by body site'
-            cmd = 'split_otu_table.py -i %s -m %s -f %s -o %s' % (
-                    rarefied_otu_table_fp, mapping_fp, category_to_split,
-                    per_body_site_dir)
-            commands.append([(cmd_title, cmd)])
-            raw_data_dirs.append(per_body_site_dir)
+            graph.run(command_handler, status_update_callback, logger,
+                      command_timer=command_timer)
+            rarefied_otu_table_fps = [(rarefied_otu_table_fp, None)]
+        else:
+            rarefied_otu_table_fps = [
+                    (_get_body_site_otu_table_fp(
+                            body_site_rarefied_otu_table_dir, otu_table_fp,
+                            rarefaction_depth, body_site), body_site)
+                    for body_site in sample_index.get_body_sites()]
+
+        # Hack to allow print-only mode (the rarefied OTU table won't exist).
+        otu_cat_sig_results = {}
+        if command_handler is not print_commands:
+            sample_groups = get_sample_groups(mapping_data, sample_id_index,
+                    [bodysite_index, personal_id_index])
+
+            # Each table is parsed once: its sample IDs flag the samples that
+            # survived rarefaction, and it's only compared if at least one
+            # individual can be compared to everyone else. A per-body-site
+            # table only flags samples from its body site, so whether it's
+            # compared doesn't depend on the other tables.
+            for rarefied_fp, body_site in rarefied_otu_table_fps:
+                if not exists(rarefied_fp):
+                    continue
+
+                with open(rarefied_fp, 'U') as rarefied_f:
+                    rarefied_otu_table = parse_biom_table(rarefied_f)
+                sample_index.mark_rarefied(rarefied_otu_table.SampleIds,
+                                           body_site)
+
+                if body_site is None:
+                    table_body_sites = sample_index.get_body_sites()
+                else:
+                    table_body_sites = [body_site]
+
+                if any([sample_index.is_comparable(personal_id, site)
+                        for personal_id in personal_ids
+                        for site in table_body_sites]):
+                    # A per-body-site table is only used for its body site.
+                    table_sample_groups = [(sample_id, group)
+                            for sample_id, group in sample_groups
+                            if body_site is None or group[0] == body_site]
+
+                    table_results = compare_individuals_to_study(
+                            rarefied_otu_table, table_sample_groups)
+                    for personal_id, body_site_results in \
+                            table_results.items():
+                        otu_cat_sig_results.setdefault(personal_id,
+                                {}).update(body_site_results)
+
+    # Index the rep set once (the index is reused by later runs) so that the
+    # sequences of each individual's significant OTUs can be read on demand
+    # instead of parsing the whole rep set for every individual.
+    rep_set = None
+    if rep_set_fp is not None and \
+       _otu_category_significance_stage in stages_to_build_for_anyone:
+        rep_set = RepSet(rep_set_fp)
+
+    # The same OTUs are significant for many individuals, so each OTU's
+    # taxonomy links and rep seq dialog are rendered once and shared by
+    # everyone's tables.
+    otu_fragment_cache = OTUFragmentCache(rep_set)
+
+    # Write the study's coordinates once for the PCoA viewer. Each individual
+    # only gets an overlay that refers to their samples in this file. The
+    # file is rewritten whenever anyone's beta diversity plots are rebuilt,
+    # since its contents depend on the same inputs.
+    pcoa_data = None
+    if pcoa_viewer and _beta_diversity_stage in stages_to_build_for_anyone:
+        coord_f = open(coord_fp, 'U')
+        try:
+            pcoa_data = PCoAViewerData(coord_f, sample_index)
+        finally:
+            coord_f.close()
+
+        if command_handler is not print_commands:
+            # Output directories created before the viewer existed (and
+            # updated in incremental mode) won't have it yet.
+            viewer_fp = join(support_files_dir, 'js', 'pcoa_viewer.js')
+            if not exists(viewer_fp):
+                copyfile(join(get_project_dir(), 'my_microbes',
+                              'support_files', 'js', 'pcoa_viewer.js'),
+                         viewer_fp)
+
+            pcoa_data_f = open(join(output_dir, 'pcoa_data.js'), 'w')
+            pcoa_data_f.write(pcoa_data.format_study_data(
+                    time_series_category))
+            pcoa_data_f.close()
+
+    # Load each alpha diversity metric once for all individuals' boxplots,
+    # along with each sample's body site and personal ID.
+    adiv_store = None
+    adiv_body_sites = None
+    adiv_personal_ids = None
+    if _alpha_diversity_boxplots_stage in stages_to_build_for_anyone:
+        adiv_store = AlphaDiversityStore(collated_dir, rarefaction_depth)
+        adiv_body_sites = _encode_category_values(
+                adiv_store.get_sample_metadata(mapping_data, sample_id_index,
+                                               bodysite_index))
+        adiv_personal_ids = adiv_store.get_sample_metadata(mapping_data,
+                sample_id_index, personal_id_index)
+
+    # Average each sample's alpha diversity over the iterations at each
+    # rarefaction depth once, and total the averages per body site. Each
+    # individual's rarefaction plots are derived from these totals instead of
+    # re-reading the collated alpha diversity files.
+    rarefaction_store = None
+    study_rarefaction_totals = None
+    if static_alpha_rarefaction and \
+       _alpha_rarefaction_stage in stages_to_build_for_anyone:
+        rarefaction_store = RarefactionStore(collated_dir)
+        body_site_sample_groups = get_sample_groups(mapping_data,
+                                                    sample_id_index,
+                                                    [bodysite_index])
+        study_rarefaction_totals = dict([(metric,
+                aggregate_rarefaction(rarefaction_store, metric,
+                                      body_site_sample_groups))
+                for metric in rarefaction_store.metrics])
+
+    # Parse the OTU table once and compute the study's OTU abundance totals
+    # per body site and week. Each individual's "Other" totals for their taxa
+    # summary plots are derived from these.
+    otu_table = None
+    study_otu_totals = None
+    taxa_summarizer = None
+    if _taxa_summary_plots_stage in stages_to_build_for_anyone:
+        otu_table_f = open(otu_table_fp, 'U')
+        otu_table = parse_biom_table(otu_table_f)
+        otu_table_f.close()
+
+        study_otu_totals = aggregate_otu_table(otu_table,
+                get_sample_groups(mapping_data, sample_id_index,
+                                  [bodysite_index, time_series_index]))
+
+        # Map OTUs to taxa once for all individuals' taxa summaries.
+        taxa_summarizer = TaxaSummarizer(otu_table, _taxa_summary_levels)
+
+    # Everything an individual's results depend on, aside from their personal
+    # ID and the logger to write to.
+    individual_kwargs = dict(output_dir=output_dir,
+            mapping_data=mapping_data,
+            header=header,
+            comments=comments,
+            sample_index=sample_index,
+            coord_fp=coord_fp,
+            collated_dir=collated_dir,
+            adiv_store=adiv_store,
+            adiv_body_sites=adiv_body_sites,
+            adiv_personal_ids=adiv_personal_ids,
+            rarefaction_store=rarefaction_store,
+            study_rarefaction_totals=study_rarefaction_totals,
+            otu_table_fp=otu_table_fp,
+            otu_table=otu_table,
+            study_otu_totals=study_otu_totals,
+            taxa_summarizer=taxa_summarizer,
+            prefs_fp=prefs_fp,
+            personal_id_column=personal_id_column,
+            personal_id_index=personal_id_index,
+            sample_id_index=sample_id_index,
+            bodysite_index=bodysite_index,
+            time_series_index=time_series_index,
+            column_title=column_title,
+            individual_titles=individual_titles,
+            category_to_split=category_to_split,
+            time_series_category=time_series_category,
+            site_id_category=site_id_category,
+            rarefaction_depth=rarefaction_depth,
+            alpha=alpha,
+            otu_fragment_cache=otu_fragment_cache,
+            otu_cat_sig_results=otu_cat_sig_results,
+            pcoa_data=pcoa_data,
+            static_alpha_rarefaction=static_alpha_rarefaction,
+            retain_raw_data=retain_raw_data,
+            stage_input_hashes=stage_input_hashes,
+            stages_to_build=stages_to_build,
+            max_concurrent_commands=max_concurrent_commands,
+            command_timer=command_timer,
+            command_handler=command_handler,
+            status_update_callback=status_update_callback)
 
-            command_handler(commands, status_update_callback, logger,
-                            close_logger_on_success=False)
+    try:
+        if jobs == 1:
+            for person_of_interest in personal_ids:
+                output_directories.extend(_create_individual_results(
+                        person_of_interest, logger, **individual_kwargs))
         else:
-            per_body_site_dir = body_site_rarefied_otu_table_dir
+            # Each individual is processed in its own worker process, which
+            # logs to a file in the individual's output directory. These logs
+            # are merged into the main log in the same order that a serial
+            # run would have written them.
+            pool = Pool(jobs, _init_worker, (individual_kwargs,))
+            try:
+                # Wait for the results with a timeout so that the wait can be
+                # interrupted (e.g. by SIGINT).
+                worker_results = pool.map_async(
+                        _create_individual_results_in_worker, personal_ids,
+                        1).get(_pool_timeout)
+            except:
+                error = exc_info()
+                pool.terminate()
+                pool.join()
+                raise error[0], error[1], error[2]
+            pool.close()
+            pool.join()
+    except KeyboardInterrupt:
+        # Every stage that was finished has been recorded in its
+        # individual's build manifest, so the run can be resumed later.
+        logger.write("\nInterrupted. Finished results were recorded and "
+                     "won't be recreated if this run is resumed in "
+                     "incremental mode.\n")
+        logger.close()
+        raise
+
+    if jobs > 1:
+        error = None
+        for log_fp, log_start, log_end, individual_output_dirs, \
+                individual_error in worker_results:
+            _merge_worker_log(logger, log_fp, log_start, log_end)
+            output_directories.extend(individual_output_dirs)
+
+            if error is None:
+                error = individual_error
+
+        if error is not None:
+            logger.close()
+            raise error
 
-    for person_of_interest in personal_ids:
-        # Files to clean up on a per-individual basis.
-        personal_raw_data_files = []
-        personal_raw_data_dirs = []
-
-        create_dir(join(output_dir, person_of_interest))
-
-        personal_mapping_file_fp = join(output_dir, person_of_interest,
-                                        'mapping_file.txt')
-        html_fp = join(output_dir, person_of_interest, 'index.html')
-
-        personal_mapping_data = create_personal_mapping_file(mapping_data,
-                person_of_interest, personal_id_index, bodysite_index,
-                individual_titles)
-
-        personal_mapping_f = open(personal_mapping_file_fp, 'w')
-        personal_mapping_f.write(
-                format_mapping_file(header, personal_mapping_data, comments))
-        personal_mapping_f.close()
-        personal_raw_data_files.append(personal_mapping_file_fp)
-
-        column_title_index = header.index(column_title)
-        column_title_values = set([e[column_title_index]
-                                   for e in personal_mapping_data])
-        cat_index = header.index(category_to_split)
-        cat_values = set([e[cat_index] for e in personal_mapping_data])
-
-        # Generate alpha diversity boxplots, split by body site, one per
-        # metric. We run this one first because it completes relatively
-        # quickly and it does not call any QIIME scripts.
-        alpha_diversity_boxplots_html = ''
-        if not suppress_alpha_diversity_boxplots:
-            adiv_boxplots_dir = join(output_dir, person_of_interest,
-                                     'adiv_boxplots')
-            create_dir(adiv_boxplots_dir)
-            output_directories.append(adiv_boxplots_dir)
+    # Clean up any remaining raw data files that weren't created on a
+    # per-individual basis.
+    if not retain_raw_data:
+        clean_up_raw_data_files(raw_data_files, raw_data_dirs)
 
-            logger.write("\nGenerating alpha diversity boxplots (%s)\n\n" %
-                         person_of_interest)
+    if rep_set is not None:
+        rep_set.close()
+
+    # Compress the results' static files once so that the web server doesn't
+    # have to compress them on every request. Files that haven't changed
+    # since they were last compressed (e.g. in incremental mode) are skipped.
+    if precompress_encodings and command_handler is not print_commands:
+        logger.write("\nPrecompressing static files (%s)\n" %
+                     ', '.join(precompress_encodings))
+        num_compressed, num_up_to_date, sizes = precompress_files(
+                [support_files_dir, join(output_dir, 'pcoa_data.js')] +
+                [join(output_dir, pid) for pid in personal_ids],
+                precompress_encodings, jobs)
+        logger.write("Compressed %d files (%d already up-to-date)\n" %
+                     (num_compressed, num_up_to_date))
+        for encoding in precompress_encodings:
+            original_size, compressed_size = sizes[encoding]
+            logger.write("  %s: %d bytes saved (%d -> %d bytes)\n" %
+                         (encoding, original_size - compressed_size,
+                          original_size, compressed_size))
+
+    if command_timer is not None:
+        timings_f = open(timings_fp, 'U')
+        try:
+            timing_records = parse_timings(timings_f)
+        finally:
+            timings_f.close()
+
+        if timing_records:
+            logger.write("\n" + format_timings_summary(timing_records))
 
-            plot_filenames = _generate_alpha_diversity_boxplots(
-                    collated_dir, personal_mapping_file_fp,
-                    category_to_split, column_title, rarefaction_depth,
-                    adiv_boxplots_dir)
+    logger.close()
 
-            # Create relative paths for use with the index page.
-            rel_boxplot_dir = basename(normpath(adiv_boxplots_dir))
-            plot_fps = [join(rel_boxplot_dir, plot_filename)
-                        for plot_filename in plot_filenames]
+    return output_directories
 
-            alpha_diversity_boxplots_html = \
-                    create_alpha_diversity_boxplots_html(plot_fps)
+def _create_individual_results(person_of_interest, logger, output_dir,
+                               mapping_data, header, comments, sample_index,
+                               coord_fp, collated_dir, adiv_store,
+                               adiv_body_sites,
+                               adiv_personal_ids,
+                               rarefaction_store, study_rarefaction_totals,
+                               otu_table_fp, otu_table,
+                               study_otu_totals, taxa_summarizer, prefs_fp,
+                               personal_id_column, personal_id_index,
+                               sample_id_index, bodysite_index,
+                               time_series_index, column_title,
+                               individual_titles,
+                               category_to_split, time_series_category,
+                               site_id_category, rarefaction_depth, alpha,
+                               otu_fragment_cache, otu_cat_sig_results,
+                               pcoa_data, static_alpha_rarefaction,
+                               retain_raw_data, stage_input_hashes,
+                               stages_to_build, max_concurrent_commands,
+                               command_timer, command_handler,
+                               status_update_callback):
+    """Creates the personalized results for a single individual.
+
+    Only the individual's stages in stages_to_build are built. The other
+    stages were already built from the same inputs, so their outputs and HTML
+    are taken from the individual's build manifest. Each stage is recorded in
+    the manifest as soon as it is finished, so if a later stage fails (or the
+    run is interrupted), the finished stages aren't rebuilt when the run is
+    resumed.
+
+    Returns a list of the output directories that were created for the
+    individual. All other arguments are as they were passed to (or derived by)
+    create_personal_results.
+    """
+    # Files to clean up on a per-individual basis once all stages are
+    # finished. Files that only a single stage uses are cleaned up as soon as
+    # the stage is finished.
+    personal_raw_data_files = []
+    personal_raw_data_dirs = []
+    stage_raw_data_files = defaultdict(list)
+    stage_raw_data_dirs = defaultdict(list)
+
+    create_dir(join(output_dir, person_of_interest))
+
+    input_hashes = stage_input_hashes[person_of_interest]
+    stages_to_build = stages_to_build[person_of_interest]
+    manifest = BuildManifest(_get_manifest_fp(output_dir, person_of_interest),
+                             output_dir)
+    print_only = command_handler is print_commands
+    if command_timer is not None:
+        command_timer = command_timer.for_person(person_of_interest)
+
+    # Each stage's output directories and the HTML that links to them from
+    # the individual's index page.
+    stage_outputs = defaultdict(list)
+    stage_html = defaultdict(str)
+    for stage in _stages:
+        if stage not in input_hashes:
+            continue
 
-        ## Alpha rarefaction steps
-        if not suppress_alpha_rarefaction:
-            rarefaction_dir = join(output_dir, person_of_interest,
-                                   'alpha_rarefaction')
-            output_directories.append(rarefaction_dir)
-
-            commands = []
-            cmd_title = 'Creating rarefaction plots (%s)' % person_of_interest
-            cmd = 'make_rarefaction_plots.py -i %s -m %s -p %s -o %s' % (
-                    collated_dir, personal_mapping_file_fp, prefs_fp,
-                    rarefaction_dir)
-            commands.append([(cmd_title, cmd)])
-
-            personal_raw_data_dirs.append(join(rarefaction_dir,
-                                               'average_plots'))
-            personal_raw_data_dirs.append(join(rarefaction_dir,
-                                               'average_tables'))
-
-            command_handler(commands, status_update_callback, logger,
-                            close_logger_on_success=False)
-
-        ## Beta diversity steps
-        if not suppress_beta_diversity:
-            pcoa_dir = join(output_dir, person_of_interest, 'beta_diversity')
-            pcoa_time_series_dir = join(output_dir, person_of_interest, 
-                                         'beta_diversity_time_series')
-            output_directories.append(pcoa_dir)
-            output_directories.append(pcoa_time_series_dir)
-
-            commands = []
-            cmd_title = 'Creating beta diversity time series plots (%s)' % \
-                        person_of_interest
-            cmd = 'make_3d_plots.py -m %s -p %s -i %s -o %s --custom_axes=' % (
-                personal_mapping_file_fp, prefs_fp, coord_fp, pcoa_time_series_dir) +\
-                '\'%s\' --add_vectors=\'%s,%s\'' % (time_series_category,
-                site_id_category, time_series_category)
-            commands.append([(cmd_title, cmd)])
-            
-            cmd_title = 'Creating beta diversity plots (%s)' % \
-                        person_of_interest
-            cmd = 'make_3d_plots.py  -m %s -p %s -i %s -o %s' % (personal_mapping_file_fp,
-                                                                 prefs_fp, coord_fp, 
-                                                                 pcoa_dir)
-            commands.append([(cmd_title, cmd)])
-
-            command_handler(commands, status_update_callback, logger,
-                            close_logger_on_success=False)
-
-        ## Time series taxa summary plots steps
-        taxa_summary_plots_html = ''
-        if not suppress_taxa_summary_plots:
-            area_plots_dir = join(output_dir, person_of_interest,
-                                  'time_series')
-            create_dir(area_plots_dir)
-            output_directories.append(area_plots_dir)
-
-            files_to_remove, dirs_to_remove = _generate_taxa_summary_plots(
-                    otu_table_fp, personal_mapping_file_fp, person_of_interest,
-                    column_title, column_title_values, category_to_split,
-                    cat_values, time_series_category, area_plots_dir,
-                    command_handler, status_update_callback, logger)
-
-            personal_raw_data_files.extend(files_to_remove)
-            personal_raw_data_dirs.extend(dirs_to_remove)
-
-            taxa_summary_plots_html = create_taxa_summary_plots_html(
-                    output_dir, person_of_interest, cat_values)
-
-        # Generate OTU category significance tables (per body site).
-        otu_cat_sig_output_fps = []
-        otu_category_significance_html = ''
-        if not suppress_otu_category_significance:
-            otu_cat_sig_dir = join(output_dir, person_of_interest,
-                                   'otu_category_significance')
-            create_dir(otu_cat_sig_dir)
-            output_directories.append(otu_cat_sig_dir)
-
-            # For each body-site rarefied OTU table, run
-            # otu_category_significance.py using self versus other category.
-            # Keep track of each output file that is created because we need to
-            # parse these later on.
-            commands = []
-            valid_body_sites = []
-            for cat_value in cat_values:
-                body_site_otu_table_fp = join(per_body_site_dir,
-                        add_filename_suffix(rarefied_otu_table_fp,
-                                            '_%s' % cat_value))
-
-                if exists(body_site_otu_table_fp):
-                    # Make sure we have at least one sample for Self, otherwise
-                    # otu_category_significance.py crashes with a division by
-                    # zero error.
-                    body_site_otu_table_f = open(body_site_otu_table_fp, 'U')
-                    personal_mapping_file_f = open(personal_mapping_file_fp,
-                                                   'U')
-                    personal_sample_count = _count_per_individual_samples(
-                            body_site_otu_table_f, personal_mapping_file_f,
-                            personal_id_column, person_of_interest)
-                    body_site_otu_table_f.close()
-                    personal_mapping_file_f.close()
-
-                    if personal_sample_count < 1:
-                        continue
-                    else:
-                        valid_body_sites.append(cat_value)
-
-                    otu_cat_output_fp = join(otu_cat_sig_dir,
-                                             'otu_cat_sig_%s.txt' % cat_value)
-
-                    cmd_title = ('Testing for significant differences in '
-                                 'OTU abundances in "%s" body site (%s)' % (
-                                 cat_value, person_of_interest))
-                    cmd = ('otu_category_significance.py -i %s -m %s -c %s '
-                           '-o %s' % (body_site_otu_table_fp,
-                                      personal_mapping_file_fp,
-                                      column_title,
-                                      otu_cat_output_fp))
-                    commands.append([(cmd_title, cmd)])
-
-                    personal_raw_data_files.append(otu_cat_output_fp)
-                    otu_cat_sig_output_fps.append(otu_cat_output_fp)
-
-            # Hack to allow print-only mode.
-            if command_handler is not print_commands and not valid_body_sites:
-                raise ValueError("None of the body sites for personal ID '%s' "
-                                 "could be processed because there were no "
-                                 "matching samples in the rarefied OTU table."
-                                 % person_of_interest)
-
-            command_handler(commands, status_update_callback, logger,
-                            close_logger_on_success=False)
-
-            # Reformat otu category significance tables.
-            otu_cat_sig_html_filenames = \
-                    create_otu_category_significance_html_tables(
-                            otu_cat_sig_output_fps, alpha, otu_cat_sig_dir, 
-                            individual_titles, rep_set_fp=rep_set_fp)
-
-            # Create relative paths for use with the index page.
-            rel_otu_cat_sig_dir = basename(normpath(otu_cat_sig_dir))
-            otu_cat_sig_html_fps = [join(rel_otu_cat_sig_dir, html_filename)
-                    for html_filename in otu_cat_sig_html_filenames]
-
-            otu_category_significance_html = \
-                    create_otu_category_significance_html(otu_cat_sig_html_fps)
-
-        # Create the index.html file for the current individual.
-        create_index_html(person_of_interest, html_fp,
-                taxa_summary_plots_html=taxa_summary_plots_html,
-                alpha_diversity_boxplots_html=alpha_diversity_boxplots_html,
-                otu_category_significance_html=otu_category_significance_html)
-
-        # Clean up the unnecessary raw data files and directories for the
-        # current individual. glob will only grab paths that exist.
-        if not retain_raw_data:
-            clean_up_raw_data_files(personal_raw_data_files,
-                                    personal_raw_data_dirs)
+        if stage in stages_to_build:
+            # Remove the outputs of the last build so that outputs that
+            # aren't recreated (e.g. for a body site that no longer has any
+            # samples) aren't left behind. This also removes outputs that
+            # were only partially written by an interrupted run.
+            if not print_only:
+                stale_outputs = manifest.get_outputs(stage) + \
+                        [join(output_dir, person_of_interest, output_dir_name)
+                         for output_dir_name in _stage_output_dirs[stage]]
+                for output in stale_outputs:
+                    if isdir(output):
+                        rmtree(output)
+        else:
+            logger.write("\nSkipping %s (%s): already up-to-date\n" %
+                         (stage.replace('_', ' '), person_of_interest))
+            stage_outputs[stage] = manifest.get_outputs(stage)
+            stage_html[stage] = manifest.get_html(stage)
 
+    def finish_stage(stage):
+        """Cleans up the stage's raw data and records it in the manifest."""
+        if not retain_raw_data:
+            clean_up_raw_data_files(stage_raw_data_files[stage],
+                                    stage_raw_data_dirs[stage])
+
+        if not print_only:
+            manifest.record(stage, input_hashes[stage], stage_outputs[stage],
+                            stage_html[stage])
+            manifest.save()
+
+    # Stages whose outputs are created entirely by commands in the command
+    # graph (below) are finished as soon as all of their commands have run.
+    command_stage_steps = defaultdict(set)
+
+    def step_finished(step_id):
+        for stage, step_ids in command_stage_steps.items():
+            if step_id in step_ids:
+                step_ids.remove(step_id)
+                if not step_ids:
+                    finish_stage(stage)
+
+    personal_mapping_file_fp = join(output_dir, person_of_interest,
+                                    'mapping_file.txt')
+    html_fp = join(output_dir, person_of_interest, 'index.html')
+
+    personal_mapping_data = create_personal_mapping_file(mapping_data,
+            person_of_interest, personal_id_index, bodysite_index,
+            individual_titles)
+
+    personal_mapping_f = open(personal_mapping_file_fp, 'w')
+    personal_mapping_f.write(
+            format_mapping_file(header, personal_mapping_data, comments))
+    personal_mapping_f.close()
+    personal_raw_data_files.append(personal_mapping_file_fp)
+
+    column_title_index = header.index(column_title)
+    column_title_values = set([e[column_title_index]
+                               for e in personal_mapping_data])
+    cat_values = sample_index.get_body_sites(person_of_interest)
+    self_title, other_title = individual_titles
+
+    # Generate static alpha rarefaction plots, with the individual's and
+    # everyone else's samples grouped by body site, one per metric. Otherwise,
+    # make_rarefaction_plots.py creates them (below).
+    if _alpha_rarefaction_stage in stages_to_build and \
+       static_alpha_rarefaction:
+        rarefaction_dir = join(output_dir, person_of_interest,
+                               'alpha_rarefaction')
+        create_dir(rarefaction_dir)
+        stage_outputs[_alpha_rarefaction_stage].append(rarefaction_dir)
+
+        logger.write("\nGenerating alpha rarefaction plots (%s)\n\n" %
+                     person_of_interest)
+
+        # Hack to allow print-only mode.
+        if not print_only:
+            average_tables_dir = join(rarefaction_dir, 'average_tables')
+            create_dir(average_tables_dir)
+            stage_raw_data_dirs[_alpha_rarefaction_stage].append(
+                    average_tables_dir)
+
+            # The individual's "Other" totals are the study's totals minus
+            # their own, so only the individual's samples need to be looked
+            # at.
+            personal_sample_groups = get_sample_groups(
+                    [row for row in mapping_data
+                     if row[personal_id_index] == person_of_interest],
+                    sample_id_index, [bodysite_index])
+            metric_plots = _generate_alpha_rarefaction_plots(
+                    rarefaction_store, study_rarefaction_totals,
+                    personal_sample_groups, individual_titles,
+                    '%s&&%s' % (column_title, category_to_split),
+                    rarefaction_dir, average_tables_dir)
+            create_alpha_rarefaction_html(person_of_interest, metric_plots,
+                    join(rarefaction_dir, 'rarefaction_plots.html'))
+
+        finish_stage(_alpha_rarefaction_stage)
+
+    # The remaining steps are added to a single command graph so that
+    # independent steps (e.g. alpha rarefaction, beta diversity, and taxa
+    # summary plots) can be run at the same time.
+    graph = CommandGraph()
+
+    ## Alpha rarefaction steps
+    if _alpha_rarefaction_stage in stages_to_build and \
+       not static_alpha_rarefaction:
+        rarefaction_dir = join(output_dir, person_of_interest,
+                               'alpha_rarefaction')
+        stage_outputs[_alpha_rarefaction_stage].append(rarefaction_dir)
+
+        cmd_title = 'Creating rarefaction plots (%s)' % person_of_interest
+        cmd = 'make_rarefaction_plots.py -i %s -m %s -p %s -o %s' % (
+                collated_dir, personal_mapping_file_fp, prefs_fp,
+                rarefaction_dir)
+        command_stage_steps[_alpha_rarefaction_stage].add(graph.add_command(
+                cmd_title, cmd,
+                inputs=[collated_dir, personal_mapping_file_fp, prefs_fp],
+                outputs=[rarefaction_dir], stage=_alpha_rarefaction_stage))
+
+        stage_raw_data_dirs[_alpha_rarefaction_stage].append(
+                join(rarefaction_dir, 'average_plots'))
+        stage_raw_data_dirs[_alpha_rarefaction_stage].append(
+                join(rarefaction_dir, 'average_tables'))
+
+    ## Beta diversity steps
+    if _beta_diversity_stage in stages_to_build and pcoa_data is not None:
+        # The viewer displays the study's coordinates (written once for
+        # everyone), so only the individual's overlay needs to be written.
+        pcoa_dir = join(output_dir, person_of_interest, 'beta_diversity')
+        create_dir(pcoa_dir)
+        stage_outputs[_beta_diversity_stage].append(pcoa_dir)
+
+        if not print_only:
+            overlay_f = open(join(pcoa_dir, 'overlay.js'), 'w')
+            overlay_f.write(pcoa_data.format_overlay(person_of_interest,
+                                                     individual_titles))
+            overlay_f.close()
+            create_pcoa_viewer_html(person_of_interest,
+                                    join(pcoa_dir, 'index.html'))
+
+        stage_html[_beta_diversity_stage] = create_beta_diversity_html(True)
+        finish_stage(_beta_diversity_stage)
+    elif _beta_diversity_stage in stages_to_build:
+        pcoa_dir = join(output_dir, person_of_interest, 'beta_diversity')
+        pcoa_time_series_dir = join(output_dir, person_of_interest, 
+                                     'beta_diversity_time_series')
+        stage_outputs[_beta_diversity_stage].extend([pcoa_dir,
+                                                     pcoa_time_series_dir])
+        stage_html[_beta_diversity_stage] = create_beta_diversity_html()
+
+        cmd_title = 'Creating beta diversity time series plots (%s)' % \
+                    person_of_interest
+        cmd = 'make_3d_plots.py -m %s -p %s -i %s -o %s --custom_axes=' % (
+            personal_mapping_file_fp, prefs_fp, coord_fp, pcoa_time_series_dir) +\
+            '\'%s\' --add_vectors=\'%s,%s\'' % (time_series_category,
+            site_id_category, time_series_category)
+        command_stage_steps[_beta_diversity_stage].add(graph.add_command(
+                cmd_title, cmd,
+                inputs=[personal_mapping_file_fp, prefs_fp, coord_fp],
+                outputs=[pcoa_time_series_dir],
+                stage=_beta_diversity_stage))
+        
+        cmd_title = 'Creating beta diversity plots (%s)' % \
+                    person_of_interest
+        cmd = 'make_3d_plots.py  -m %s -p %s -i %s -o %s' % (personal_mapping_file_fp,
+                                                             prefs_fp, coord_fp, 
+                                                             pcoa_dir)
+        command_stage_steps[_beta_diversity_stage].add(graph.add_command(
+                cmd_title, cmd,
+                inputs=[personal_mapping_file_fp, prefs_fp, coord_fp],
+                outputs=[pcoa_dir], stage=_beta_diversity_stage))
+
+    ## Time series taxa summary plots steps
+    if _taxa_summary_plots_stage in stages_to_build:
+        area_plots_dir = join(output_dir, person_of_interest,
+                              'time_series')
+        create_dir(area_plots_dir)
+        stage_outputs[_taxa_summary_plots_stage].append(area_plots_dir)
+
+        # The individual's "Other" totals are the study's totals minus their
+        # own, so only the individual's samples need to be looked at.
+        personal_sample_groups = get_sample_groups(
+                [row for row in mapping_data
+                 if row[personal_id_index] == person_of_interest],
+                sample_id_index, [bodysite_index, time_series_index])
+        self_otu_totals = aggregate_otu_table(otu_table,
+                                              personal_sample_groups)
+        other_otu_totals = study_otu_totals.subtract(self_otu_totals)
+
+        dirs_to_remove, taxa_plot_steps = _add_taxa_summary_plot_commands(
+                graph, taxa_summarizer, [(self_title, self_otu_totals),
+                                   (other_title, other_otu_totals)],
+                person_of_interest, cat_values, time_series_category,
+                area_plots_dir)
+
+        stage_raw_data_dirs[_taxa_summary_plots_stage].extend(dirs_to_remove)
+
+    # Generate OTU category significance tables (per body site).
+    otu_cat_sig_output_fps = []
+    if _otu_category_significance_stage in stages_to_build:
+        otu_cat_sig_dir = join(output_dir, person_of_interest,
+                               'otu_category_significance')
+        create_dir(otu_cat_sig_dir)
+        stage_outputs[_otu_category_significance_stage].append(
+                otu_cat_sig_dir)
+
+        # Write the individual's results for each body site that they (and
+        # everyone else) had samples in the rarefied OTU table for. Keep track
+        # of each output file that is created because we need to parse these
+        # later on.
+        personal_otu_cat_sig_results = otu_cat_sig_results.get(
+                person_of_interest, {})
+        valid_body_sites = sample_index.get_comparable_body_sites(
+                person_of_interest)
+        for cat_value in valid_body_sites:
+            otu_cat_output_fp = join(otu_cat_sig_dir,
+                                     'otu_cat_sig_%s.txt' % cat_value)
+            otu_cat_output_f = open(otu_cat_output_fp, 'w')
+            otu_cat_output_f.write(format_otu_category_significance(
+                    personal_otu_cat_sig_results[cat_value],
+                    individual_titles))
+            otu_cat_output_f.close()
+
+            stage_raw_data_files[_otu_category_significance_stage].append(
+                    otu_cat_output_fp)
+            otu_cat_sig_output_fps.append(otu_cat_output_fp)
+
+        # Hack to allow print-only mode.
+        if not print_only and not valid_body_sites:
+            raise ValueError("None of the body sites for personal ID '%s' "
+                             "could be processed because there were no "
+                             "matching samples in the rarefied OTU table."
+                             % person_of_interest)
+
+    # Generate alpha diversity boxplots, split by body site, one per
+    # metric. The plots are rendered in the background while the commands
+    # are running, and are waited on once the commands are done (or one of
+    # them fails).
+    boxplot_renderer = None
+    if _alpha_diversity_boxplots_stage in stages_to_build:
+        adiv_boxplots_dir = join(output_dir, person_of_interest,
+                                 'adiv_boxplots')
+        create_dir(adiv_boxplots_dir)
+        stage_outputs[_alpha_diversity_boxplots_stage].append(
+                adiv_boxplots_dir)
+
+        logger.write("\nGenerating alpha diversity boxplots (%s)\n\n" %
+                     person_of_interest)
+
+        # Every sample is either self (code 0) or other (code 1).
+        comparison_categories = (individual_titles,
+                (adiv_personal_ids != person_of_interest).astype(int))
+        boxplot_renderer = _get_boxplot_renderer()
+        plot_filenames = _generate_alpha_diversity_boxplots(adiv_store,
+                adiv_body_sites, comparison_categories, adiv_boxplots_dir,
+                boxplot_renderer)
+
+        # Create relative paths for use with the index page.
+        rel_boxplot_dir = basename(normpath(adiv_boxplots_dir))
+        plot_fps = [join(rel_boxplot_dir, plot_filename)
+                    for plot_filename in plot_filenames]
+
+        stage_html[_alpha_diversity_boxplots_stage] = \
+                create_alpha_diversity_boxplots_html(plot_fps,
+                                                     static_alpha_rarefaction)
 
-    # Clean up any remaining raw data files that weren't created on a
-    # per-individual basis.
+    try:
+        graph.run(command_handler, status_update_callback, logger,
+                  max_concurrent_commands, step_finished, command_timer)
+    except:
+        # Don't leave the renderer drawing the failed individual's boxplots
+        # (and reporting its errors with the next individual's). The
+        # command's error is raised instead of any rendering error.
+        error = exc_info()
+        if boxplot_renderer is not None:
+            try:
+                boxplot_renderer.wait()
+            except Exception:
+                pass
+        raise error[0], error[1], error[2]
+
+    if _alpha_diversity_boxplots_stage in stages_to_build:
+        _log_render_timings(logger, person_of_interest,
+                            boxplot_renderer.wait())
+        finish_stage(_alpha_diversity_boxplots_stage)
+
+    if _taxa_summary_plots_stage in stages_to_build:
+        # A body site can only be displayed if its plots were created for
+        # both self and other (i.e. there were enough weeks).
+        valid_body_sites = sorted(taxa_plot_steps)
+
+        # Hack to allow print-only mode.
+        if not print_only and not valid_body_sites:
+            raise ValueError("None of the body sites for personal ID '%s' "
+                             "could be processed because there were not "
+                             "enough weeks to create taxa summary plots." %
+                             person_of_interest)
+
+        for body_site in valid_body_sites:
+            create_comparative_taxa_plots_html(body_site,
+                    join(area_plots_dir, '%s_comparative.html' % body_site))
+
+        stage_html[_taxa_summary_plots_stage] = \
+                create_taxa_summary_plots_html(output_dir, person_of_interest,
+                                               cat_values)
+        finish_stage(_taxa_summary_plots_stage)
+
+    if _otu_category_significance_stage in stages_to_build:
+        # Reformat otu category significance tables.
+        cache_hits = otu_fragment_cache.hits
+        cache_misses = otu_fragment_cache.misses
+        otu_cat_sig_html_filenames = \
+                create_otu_category_significance_html_tables(
+                        otu_cat_sig_output_fps, alpha, otu_cat_sig_dir, 
+                        individual_titles,
+                        otu_fragment_cache=otu_fragment_cache)
+        logger.write("\nFormatted %d significant OTUs (%s): %d reused from "
+                     "the OTU HTML cache (%.1f%% hit rate so far)\n" %
+                     (otu_fragment_cache.hits - cache_hits +
+                      otu_fragment_cache.misses - cache_misses,
+                      person_of_interest, otu_fragment_cache.hits - cache_hits,
+                      otu_fragment_cache.get_hit_rate() * 100))
+
+        # Create relative paths for use with the index page.
+        rel_otu_cat_sig_dir = basename(normpath(otu_cat_sig_dir))
+        otu_cat_sig_html_fps = [join(rel_otu_cat_sig_dir, html_filename)
+                for html_filename in otu_cat_sig_html_filenames]
+
+        stage_html[_otu_category_significance_stage] = \
+                create_otu_category_significance_html(otu_cat_sig_html_fps)
+        finish_stage(_otu_category_significance_stage)
+
+    # Create the index.html file for the current individual.
+    create_index_html(person_of_interest, html_fp,
+            taxa_summary_plots_html=stage_html[_taxa_summary_plots_stage],
+            beta_diversity_html=stage_html[_beta_diversity_stage],
+            alpha_diversity_boxplots_html=\
+                    stage_html[_alpha_diversity_boxplots_stage],
+            otu_category_significance_html=\
+                    stage_html[_otu_category_significance_stage])
+
+    # Clean up the unnecessary raw data files and directories for the
+    # current individual. glob will only grab paths that exist.
     if not retain_raw_data:
-        clean_up_raw_data_files(raw_data_files, raw_data_dirs)
-
-    logger.close()
+        clean_up_raw_data_files(personal_raw_data_files,
+                                personal_raw_data_dirs)
 
+    output_directories = []
+    for stage in _stages:
+        output_directories.extend(stage_outputs[stage])
     return output_directories
 
+# Keyword arguments for _create_individual_results that are shared by every
+# individual in a run. Set once in each worker process by _init_worker so that
+# the (potentially large) mapping data isn't pickled for every individual.
+_worker_kwargs = None
+
+# How long (in seconds) to wait for the worker processes to finish. This is
+# effectively forever, but waiting without a timeout can't be interrupted.
+_pool_timeout = 60 * 60 * 24 * 365
+
+def _init_worker(individual_kwargs):
+    """Initializes a worker process in create_personal_results' pool."""
+    global _worker_kwargs, _boxplot_renderer
+    _worker_kwargs = individual_kwargs
+
+    # A renderer inherited from the parent (e.g. after a serial run in the
+    # same process) doesn't have its rendering thread in this process, so
+    # waiting on it would block forever.
+    _boxplot_renderer = None
+
+    # Workers are stopped with SIGTERM when the run is interrupted, so they
+    # shouldn't inherit a handler that the parent process installed for it.
+    signal(SIGTERM, SIG_DFL)
+
+def _create_individual_results_in_worker(person_of_interest):
+    """Creates an individual's results in a worker process.
+
+    The worker logs to its own file in the individual's output directory.
+    Returns a tuple containing the worker's log filepath, the byte offsets
+    where the logged output starts and ends (i.e. excluding the logger's
+    start/stop messages), the individual's output directories, and the
+    exception that was raised (or None if the individual was processed
+    successfully). Exceptions are returned instead of raised so that the
+    parent process can merge the logs of all individuals before raising.
+
+    The logger is always closed, even if the individual fails.
+    """
+    personal_dir = join(_worker_kwargs['output_dir'], person_of_interest)
+    create_dir(personal_dir)
+
+    log_fp = join(personal_dir, 'log.txt')
+    logger = WorkflowLogger(log_fp)
+    log_start = getsize(log_fp)
+
+    try:
+        try:
+            output_directories = _create_individual_results(
+                    person_of_interest, logger, **_worker_kwargs)
+        except Exception as e:
+            output_directories = []
+            error = e
+        else:
+            error = None
+        log_end = getsize(log_fp)
+    finally:
+        _close_logger(logger)
+
+    return log_fp, log_start, log_end, output_directories, error
+
+def _close_logger(logger):
+    """Closes a WorkflowLogger unless it was already closed.
+
+    QIIME's command handlers close the logger when a command fails, and
+    closing it again fails because it writes to the closed log file.
+    """
+    try:
+        logger.close()
+    except ValueError:
+        pass
+
+def _merge_worker_log(logger, log_fp, log_start, log_end):
+    """Appends part of a worker's log to logger and removes the worker log."""
+    log_f = open(log_fp, 'U')
+    log_f.seek(log_start)
+    logger.write(log_f.read(log_end - log_start))
+    log_f.close()
+    remove_files([log_fp])
+
+# The stages of an individual's results, in the order that their outputs are
+# listed in.
+_alpha_diversity_boxplots_stage = 'alpha_diversity_boxplots'
+_alpha_rarefaction_stage = 'alpha_rarefaction'
+_beta_diversity_stage = 'beta_diversity'
+_taxa_summary_plots_stage = 'taxa_summary_plots'
+_otu_category_significance_stage = 'otu_category_significance'
+_stages = (_alpha_diversity_boxplots_stage, _alpha_rarefaction_stage,
+           _beta_diversity_stage, _taxa_summary_plots_stage,
+           _otu_category_significance_stage)
+
+# The directories (in an individual's output directory) that each stage
+# creates. These are removed before a stage is built in case they were left
+# partially written by an interrupted run.
+_stage_output_dirs = {
+    _alpha_diversity_boxplots_stage: ['adiv_boxplots'],
+    _alpha_rarefaction_stage: ['alpha_rarefaction'],
+    _beta_diversity_stage: ['beta_diversity', 'beta_diversity_time_series'],
+    _taxa_summary_plots_stage: ['time_series'],
+    _otu_category_significance_stage: ['otu_category_significance']
+}
+
+# The modules (aside from this one) whose code builds each stage's outputs.
+# A stage is rebuilt when any of these modules change, or when a different
+# version of QIIME is installed.
+_stage_modules = {
+    _alpha_diversity_boxplots_stage: ['my_microbes.alpha_diversity',
+                                      'my_microbes.format',
+                                      'my_microbes.parse',
+                                      'my_microbes.plot'],
+    _alpha_rarefaction_stage: ['my_microbes.aggregate',
+                               'my_microbes.alpha_diversity',
+                               'my_microbes.format', 'my_microbes.parse',
+                               'my_microbes.plot'],
+    _beta_diversity_stage: ['my_microbes.format', 'my_microbes.pcoa',
+                            'my_microbes.sample_index'],
+    _taxa_summary_plots_stage: ['my_microbes.aggregate', 'my_microbes.format',
+                                'my_microbes.taxa', 'my_microbes.workflow'],
+    _otu_category_significance_stage: ['my_microbes.format',
+                                       'my_microbes.rep_set',
+                                       'my_microbes.sample_index',
+                                       'my_microbes.significance']
+}
+
+def _get_manifest_fp(output_dir, person_of_interest):
+    """Returns the filepath of an individual's build manifest."""
+    return join(output_dir, person_of_interest, '.build_manifest.json')
+
+def _get_body_site_otu_table_fp(body_site_rarefied_otu_table_dir,
+                                otu_table_fp, rarefaction_depth, body_site):
+    """Returns the filepath of a body site's rarefied OTU table."""
+    return join(body_site_rarefied_otu_table_dir,
+                add_filename_suffix(add_filename_suffix(otu_table_fp,
+                        '_even%d' % rarefaction_depth), '_%s' % body_site))
+
+def _hash_stage_inputs(personal_ids, mapping_data, header, comments,
+                       sample_index, sample_id_index, personal_id_index,
+                       bodysite_index, time_series_index, coord_fp,
+                       collated_dir, otu_table_fp, prefs_fp,
+                       personal_id_column, individual_titles,
+                       category_to_split, time_series_category,
+                       rarefaction_depth, alpha, rep_set_fp,
+                       body_site_rarefied_otu_table_dir, retain_raw_data,
+                       suppress_alpha_rarefaction, suppress_beta_diversity,
+                       suppress_taxa_summary_plots,
+                       suppress_alpha_diversity_boxplots,
+                       suppress_otu_category_significance, pcoa_viewer,
+                       static_alpha_rarefaction):
+    """Returns the hash of each individual's (unsuppressed) stages' inputs.
+
+    Returns a dict mapping each personal ID to a dict of stage -> hash. Each
+    stage's hash covers the individual's own mapping file rows, the parts of
+    everyone else's rows that the stage compares them to, the contents of
+    the input files and the parameters that the stage uses, and the code
+    that builds the stage. For example, an individual's taxa summary plots
+    only compare them to everyone else at their own body sites, so they
+    aren't rebuilt when another body site's samples change. Each input file
+    is only hashed once, and only if a stage that uses it isn't suppressed.
+    """
+    path_hashes = {}
+    def get_path_hash(path):
+        if path not in path_hashes:
+            path_hashes[path] = hash_path(path)
+        return path_hashes[path]
+
+    code_hashes = {}
+    def get_code_hash(stage):
+        if stage not in code_hashes:
+            code_hashes[stage] = hash_inputs(qiime_version, hash_modules(
+                    ['my_microbes.util'] + _stage_modules[stage]))
+        return code_hashes[stage]
+
+    # Each individual's rows, and the samples at each body site with and
+    # without their time points. An individual's own rows determine which of
+    # a body site's samples are theirs and which are everyone else's.
+    personal_rows = defaultdict(list)
+    site_samples = defaultdict(list)
+    site_time_points = defaultdict(list)
+    for row in mapping_data:
+        personal_rows[row[personal_id_index]].append(row)
+        body_site = row[bodysite_index]
+        site_samples[body_site].append(row[sample_id_index])
+        site_time_points[body_site].append((row[sample_id_index],
+                                            row[time_series_index]))
+    site_samples_hashes = dict([(body_site, hash_inputs(sorted(samples)))
+                                for body_site, samples in
+                                site_samples.items()])
+    site_time_points_hashes = dict([(body_site,
+                                     hash_inputs(sorted(time_points)))
+                                    for body_site, time_points in
+                                    site_time_points.items()])
+
+    # The boxplots and static rarefaction plots have everyone else's samples
+    # at every body site. The PCoA viewer's study data has every sample's
+    # body site and time point. make_rarefaction_plots.py and
+    # make_3d_plots.py read the whole personal mapping file.
+    study_samples_hash = hash_inputs(sorted(site_samples_hashes.items()))
+    study_time_points_hash = hash_inputs(
+            sorted(site_time_points_hashes.items()))
+    mapping_hash = hash_inputs(header, mapping_data, comments)
+
+    stage_input_hashes = {}
+    for person_of_interest in personal_ids:
+        body_sites = sample_index.get_body_sites(person_of_interest)
+
+        # Everything that every stage depends on.
+        common_inputs = (personal_rows[person_of_interest],
+                         person_of_interest, personal_id_column,
+                         individual_titles, category_to_split,
+                         retain_raw_data)
+
+        # The boxplots' HTML also describes how to read the alpha rarefaction
+        # plots, which depends on how they're created.
+        input_hashes = {}
+        if not suppress_alpha_diversity_boxplots:
+            input_hashes[_alpha_diversity_boxplots_stage] = hash_inputs(
+                    _alpha_diversity_boxplots_stage,
+                    get_code_hash(_alpha_diversity_boxplots_stage),
+                    common_inputs, study_samples_hash,
+                    get_path_hash(collated_dir), rarefaction_depth,
+                    static_alpha_rarefaction)
+        if not suppress_alpha_rarefaction:
+            if static_alpha_rarefaction:
+                rarefaction_inputs = (study_samples_hash,)
+            else:
+                rarefaction_inputs = (mapping_hash, get_path_hash(prefs_fp))
+            input_hashes[_alpha_rarefaction_stage] = hash_inputs(
+                    _alpha_rarefaction_stage,
+                    get_code_hash(_alpha_rarefaction_stage), common_inputs,
+                    rarefaction_inputs, get_path_hash(collated_dir),
+                    static_alpha_rarefaction)
+        if not suppress_beta_diversity:
+            if pcoa_viewer:
+                study_mapping_hash = study_time_points_hash
+            else:
+                study_mapping_hash = mapping_hash
+            input_hashes[_beta_diversity_stage] = hash_inputs(
+                    _beta_diversity_stage,
+                    get_code_hash(_beta_diversity_stage), common_inputs,
+                    study_mapping_hash, get_path_hash(coord_fp),
+                    get_path_hash(prefs_fp), time_series_category,
+                    pcoa_viewer)
+        if not suppress_taxa_summary_plots:
+            input_hashes[_taxa_summary_plots_stage] = hash_inputs(
+                    _taxa_summary_plots_stage,
+                    get_code_hash(_taxa_summary_plots_stage), common_inputs,
+                    [site_time_points_hashes[body_site]
+                     for body_site in body_sites],
+                    get_path_hash(otu_table_fp), time_series_category)
+        if not suppress_otu_category_significance:
+            if body_site_rarefied_otu_table_dir is None:
+                otu_tables_hash = get_path_hash(otu_table_fp)
+            else:
+                otu_tables_hash = [get_path_hash(_get_body_site_otu_table_fp(
+                        body_site_rarefied_otu_table_dir, otu_table_fp,
+                        rarefaction_depth, body_site))
+                        for body_site in body_sites]
+            input_hashes[_otu_category_significance_stage] = hash_inputs(
+                    _otu_category_significance_stage,
+                    get_code_hash(_otu_category_significance_stage),
+                    common_inputs,
+                    [site_samples_hashes[body_site]
+                     for body_site in body_sites],
+                    otu_tables_hash, rarefaction_depth, alpha,
+                    get_path_hash(rep_set_fp))
+
+        stage_input_hashes[person_of_interest] = input_hashes
+
+    return stage_input_hashes
+
 def get_project_dir():
     """Returns the top-level personal microbiome delivery system directory.
 
@@ -432,86 +1246,248 @@ def clean_up_raw_data_files(raw_data_files, raw_data_dirs):
         for dir_to_remove in glob(raw_data_dir_glob):
             rmtree(dir_to_remove)
 
-def _generate_alpha_diversity_boxplots(collated_adiv_dir, map_fp,
-                                       split_category, comparison_category,
-                                       rarefaction_depth, output_dir):
+# Each process renders its boxplots with its own renderer (created on first
+# use), so the figure templates are reused for every individual the process
+# creates results for.
+_boxplot_renderer = None
+
+def _get_boxplot_renderer():
+    """Returns the current process's BoxplotRenderer."""
+    global _boxplot_renderer
+    if _boxplot_renderer is None:
+        _boxplot_renderer = BoxplotRenderer()
+    return _boxplot_renderer
+
+def _log_render_timings(logger, person_of_interest, timings):
+    """Writes the time taken to render each plot and the overall throughput.
+    """
+    total_time = sum([elapsed_time for plot_fp, elapsed_time in timings])
+    logger.write("\nRendered %d alpha diversity boxplots (%s) in %.2f "
+                 "seconds" % (len(timings), person_of_interest, total_time))
+    if total_time > 0:
+        logger.write(" (%.2f plots/second)" % (len(timings) / total_time))
+    logger.write("\n")
+
+    for plot_fp, elapsed_time in timings:
+        logger.write("  %s: %.3f seconds\n" % (plot_fp, elapsed_time))
+    logger.write("\n")
+
+def _generate_alpha_diversity_boxplots(adiv_store, split_categories,
+                                       comparison_categories, output_dir,
+                                       renderer):
     """Generates per-body-site self vs. other alpha diversity boxplots.
 
-    Creates a plot for each input collated alpha diversity file (i.e. metric)
-    in collated_adiv_dir. Returns a list of plot filenames that were created in
-    output_dir.
+    Submits a plot for each metric in adiv_store to renderer. Returns a list
+    of plot filenames that will be created in output_dir; the plots have
+    been written once renderer.wait() returns.
 
     Arguments:
-        collated_adiv_dir - path to directory containing one or more collated
-            alpha diversity files
-        map_fp - filepath to metadata mapping file
-        split_category - category to split on, e.g. body site. A boxplot will
-            be created for each category value (e.g. tongue, palm, etc.)
-        comparison_category - category to split on within each of the split
-            categories (e.g. self, other)
-        rarefaction_depth - rarefaction depth to use when pulling data from
-            rarefaction files
+        adiv_store - AlphaDiversityStore containing the alpha diversity values
+            to plot
+        split_categories - (category values, codes) for the category to
+            split on (e.g. body site), as returned by _encode_category_values
+            for each sample in adiv_store. A box will be created for each
+            category value (e.g. tongue, palm, etc.)
+        comparison_categories - (category values, codes) for the category to
+            split on within each of the split categories (e.g. self, other)
         output_dir - directory to write output plot images to
+        renderer - BoxplotRenderer to render the plots with
     """
-    metadata_map = MetadataMap.parseMetadataMap(open(map_fp, 'U'))
-    collated_adiv_fps = glob(join(collated_adiv_dir, '*.txt'))
-    plot_title = 'Alpha diversity (%d seqs/sample)' % rarefaction_depth
+    plot_title = 'Alpha diversity (%d seqs/sample)' % \
+                 adiv_store.rarefaction_depth
 
-    # Generate a plot for each collated alpha diversity metric file.
+    # Generate a plot for each alpha diversity metric.
     created_files = []
-    for collated_adiv_fp in collated_adiv_fps:
-        adiv_metric = splitext(basename(collated_adiv_fp))[0]
-
-        x_tick_labels, dists = _collect_alpha_diversity_boxplot_data(
-                open(collated_adiv_fp, 'U'), metadata_map, rarefaction_depth,
-                split_category, comparison_category)
-
-        plot_figure = generate_box_plots(dists,
-                                         x_tick_labels=x_tick_labels,
-                                         title=plot_title,
-                                         x_label='Grouping',
-                                         y_label=format_title(adiv_metric))
+    for adiv_metric in adiv_store.metrics:
+        x_tick_labels, dists = _group_alpha_diversity(
+                adiv_store.get_values(adiv_metric), split_categories,
+                comparison_categories)
+
         plot_fp = join(output_dir, '%s.png' % adiv_metric)
-        plot_figure.savefig(plot_fp)
+        renderer.submit(plot_fp, dists, x_tick_labels, title=plot_title,
+                        x_label='Grouping', y_label=format_title(adiv_metric))
         created_files.append(basename(plot_fp))
 
     return created_files
 
+# Colors of each body site's lines in the alpha rarefaction plots, in order of
+# body site. The individual's lines are solid and everyone else's are dashed.
+_rarefaction_plot_colors = ('#1e5adc', '#dc1e1e', '#f08200', '#e6c800',
+                            '#28a028', '#963cc8', '#00aaaa', '#a06428')
+
+def _generate_alpha_rarefaction_plots(rarefaction_store,
+                                      study_rarefaction_totals,
+                                      personal_sample_groups,
+                                      individual_titles, category,
+                                      plots_dir, tables_dir):
+    """Generates per-body-site self vs. other alpha rarefaction plots.
+
+    Creates a plot and an average table (in the format written by
+    make_rarefaction_plots.py) for each metric in rarefaction_store. As in
+    make_rarefaction_plots.py, a group's average at a depth is the mean of
+    its samples' per-sample means, its error is their standard deviation,
+    and it only has an average at depths where all of its samples have a
+    value. Returns a list of (metric, plot filename, depths, groups) for each
+    metric, where groups is a list of (title, averages, errors) for each
+    group in the plot (see create_alpha_rarefaction_html).
+
+    Arguments:
+        rarefaction_store - RarefactionStore containing the per-sample means
+        study_rarefaction_totals - dict mapping each metric to the study's
+            GroupTotals of per-sample means, grouped by (body site,)
+        personal_sample_groups - list of (sample ID, (body site,)) for each
+            of the individual's samples. The individual's "Other" totals are
+            the study's totals minus the totals of these samples
+        individual_titles - the titles of the individual's samples and
+            everyone else's samples (e.g. ['Self', 'Other'])
+        category - the name of the category that the groups are from, used
+            in the average tables' names (e.g. 'Self&&BodySite'). Groups are
+            named by their title followed by their body site (e.g. 'Selfgut')
+        plots_dir - directory to write the plot images to
+        tables_dir - directory to write the average tables to
+    """
+    self_title, other_title = individual_titles
+
+    metric_plots = []
+    for metric in rarefaction_store.metrics:
+        depths = rarefaction_store.get_depths(metric)
+        if not len(depths):
+            continue
+
+        if len(depths) > 1:
+            x_max = depths[-1] + (depths[-1] - depths[-2])
+        else:
+            x_max = 2 * depths[-1]
+
+        study_totals = study_rarefaction_totals[metric]
+        self_totals = aggregate_rarefaction(rarefaction_store, metric,
+                                            personal_sample_groups)
+        other_totals = study_totals.subtract(self_totals)
+
+        groups = []
+        for group_idx, group in enumerate(study_totals.groups()):
+            body_site = group[0]
+            color = _rarefaction_plot_colors[group_idx %
+                                             len(_rarefaction_plot_colors)]
+
+            for title, totals, line_style in ((self_title, self_totals, '-'),
+                                              (other_title, other_totals,
+                                               '--')):
+                if totals.get_count(group) == 0:
+                    continue
+
+                averages = totals.get_means(group)
+                errors = totals.get_stds(group)
+                incomplete = totals.get_value_counts(group) < \
+                             totals.get_count(group)
+                averages[incomplete] = nan
+                errors[incomplete] = nan
+
+                groups.append((title + body_site,
+                               '%s (%s)' % (body_site, title), color,
+                               line_style, averages, errors))
+
+        table_f = open(join(tables_dir, '%s%s.txt' % (metric, category)),
+                       'w')
+        table_f.write(format_rarefaction_averages(metric, category, depths,
+                x_max, [(name, color, averages, errors)
+                        for name, label, color, line_style, averages, errors
+                        in groups]))
+        table_f.close()
+
+        plot_filename = '%s.png' % metric
+        plot_rarefaction_averages(join(plots_dir, plot_filename), depths,
+                [(label, color, line_style, averages, errors)
+                 for name, label, color, line_style, averages, errors
+                 in groups],
+                x_max, title='Alpha rarefaction',
+                y_label=format_title(metric))
+
+        metric_plots.append((metric, plot_filename, depths,
+                [(label, averages, errors)
+                 for name, label, color, line_style, averages, errors
+                 in groups]))
+
+    return metric_plots
+
 def _collect_alpha_diversity_boxplot_data(rarefaction_f, metadata_map,
                                           rarefaction_depth, split_category,
                                           comparison_category):
     """Pulls data from rarefaction file based on supplied categories."""
-    # Pull out rarefaction data for the specified depth.
-    rarefaction = parse_rarefaction(rarefaction_f)
-
-    # First three vals are part of the header, so ignore them.
-    sample_ids = rarefaction[0][3:]
-
-    # First two vals are depth and iteration number, so ignore them.
-    rarefaction_data = [row[2:] for row in rarefaction[3]
-                        if row[0] == rarefaction_depth]
-
-    if not rarefaction_data:
-        raise ValueError("Rarefaction depth of %d could not be found in "
-                         "collated alpha diversity file." % rarefaction_depth)
-
-    # Build up dict mapping (body site, [self|other]) -> distribution.
-    plot_data = defaultdict(list)
-    for row in rarefaction_data:
-        assert len(sample_ids) == len(row)
-        for sample_id, adiv_val in zip(sample_ids, row):
-            if not isnan(adiv_val):
-                split_cat_val = metadata_map.getCategoryValue(sample_id,
-                                                              split_category)
-                comp_cat_val = metadata_map.getCategoryValue(sample_id,
-                        comparison_category)
-
-                plot_data[split_cat_val, comp_cat_val].append(adiv_val)
-
-    # Format tick labels as '<body site> (self|other)' and sort alphabetically.
-    plot_data = sorted(map(lambda e: ('%s (%s)' %
-                                      (e[0][0], e[0][1]), e[1]),
-                           plot_data.items()))
+    sample_ids, rarefaction_data = parse_collated_alpha_diversity(
+            rarefaction_f, rarefaction_depth)
+
+    mapped_sample_ids = set(metadata_map.SampleIds)
+    split_categories, comparison_categories = [
+            _encode_category_values(
+                    [metadata_map.getCategoryValue(sample_id, category)
+                     if sample_id in mapped_sample_ids else None
+                     for sample_id in sample_ids])
+            for category in split_category, comparison_category]
+
+    return _group_alpha_diversity(rarefaction_data, split_categories,
+                                  comparison_categories)
+
+def _encode_category_values(values):
+    """Encodes each sample's category value as an integer code.
+
+    Returns a tuple containing the sorted list of distinct category values
+    and an array with each sample's index into that list. Samples without a
+    value (None) have a code of -1.
+    """
+    category_values = sorted(set(values) - set([None]))
+    codes_lookup = dict([(value, code)
+                         for code, value in enumerate(category_values)])
+    codes = array([codes_lookup.get(value, -1) for value in values],
+                  dtype=int)
+    return category_values, codes
+
+def _group_alpha_diversity(rarefaction_data, split_categories,
+                           comparison_categories):
+    """Groups alpha diversity values by (split value, comparison value).
+
+    Returns a tuple containing the tick labels ('<body site> (self|other)')
+    and a list of distributions, sorted by label. Each distribution's values
+    are ordered by iteration and then by sample. NaN values and samples
+    without a split or comparison value are ignored.
+
+    Arguments:
+        rarefaction_data - 2D array of alpha diversity values (iterations x
+            samples)
+        split_categories - (category values, codes) for each sample's split
+            category value, as returned by _encode_category_values
+        comparison_categories - (category values, codes) for each sample's
+            comparison category value
+    """
+    split_values, split_codes = split_categories
+    comparison_values, comparison_codes = comparison_categories
+
+    # Combine the two codes into a single group code per sample, and repeat
+    # the sample's group code for each iteration (row-major, like ravel).
+    num_groups = len(split_values) * len(comparison_values)
+    group_codes = split_codes * len(comparison_values) + comparison_codes
+    group_codes[(split_codes < 0) | (comparison_codes < 0)] = -1
+    group_codes = tile(group_codes, rarefaction_data.shape[0])
+
+    adiv_vals = rarefaction_data.ravel()
+    valid = (group_codes >= 0) & ~isnan(adiv_vals)
+    adiv_vals = adiv_vals[valid]
+    group_codes = group_codes[valid]
+
+    # A stable sort keeps each group's values in their original order.
+    order = argsort(group_codes, kind='mergesort')
+    group_sizes = bincount(group_codes, minlength=num_groups)
+    dists = split(adiv_vals[order], cumsum(group_sizes)[:-1])
+
+    plot_data = []
+    for group_code in flatnonzero(group_sizes):
+        split_cat_val = split_values[group_code // len(comparison_values)]
+        comp_cat_val = comparison_values[group_code % len(comparison_values)]
+        plot_data.append(('%s (%s)' % (split_cat_val, comp_cat_val),
+                          dists[group_code].tolist()))
+
+    # Sort alphabetically by tick label.
+    plot_data.sort()
     x_tick_labels = []
     dists = []
     for label, dist in plot_data:
@@ -520,171 +1496,122 @@ def _collect_alpha_diversity_boxplot_data(rarefaction_f, metadata_map,
 
     return x_tick_labels, dists
 
-def _generate_taxa_summary_plots(otu_table_fp, personal_map_fp, personal_id,
-        personal_cat, personal_cat_values, body_site_cat, body_site_cat_values,
-        time_series_cat, output_dir, command_handler, status_update_callback,
-        logger):
-    files_to_remove = []
-    dirs_to_remove = []
+# Taxonomic levels that summarize_taxa.py creates summaries for by default.
+_taxa_summary_levels = (2, 3, 4, 5, 6)
 
-    ## Split OTU table into self/other per-body-site tables
-    commands = []
-    cmd_title = 'Splitting OTU table into self/other (%s)' % personal_id
-    cmd = 'split_otu_table.py -i %s -m %s -f %s -o %s' % (otu_table_fp,
-            personal_map_fp, personal_cat, output_dir)
-    commands.append([(cmd_title, cmd)])
+def _add_taxa_summary_plot_commands(graph, taxa_summarizer,
+        personal_otu_totals, personal_id, body_site_cat_values,
+        time_series_cat, output_dir):
+    """Adds the commands that create time series taxa summary plots to graph.
 
-    command_handler(commands, status_update_callback, logger,
-                    close_logger_on_success=False)
+    The per-week taxa summaries for self and other (one set per body site)
+    are created in-process before any commands are added. These replace
+    running summarize_otu_by_cat.py, sort_otu_table.py, and summarize_taxa.py
+    for each body site.
+
+    Arguments:
+        graph - CommandGraph to add commands to
+        taxa_summarizer - TaxaSummarizer built from the OTU table that the
+            totals were computed from
+        personal_otu_totals - list of two (self/other value, GroupTotals)
+            pairs (self first), where each GroupTotals contains the OTU
+            abundance totals grouped by (body site, week)
+        personal_id - the individual's personal ID
+        body_site_cat_values - the body sites to create plots for
+        time_series_cat - the mapping file category containing the weeks
+        output_dir - directory to create the plots in
+
+    Returns a tuple containing the directories to remove once the plots have
+    been created, and a dict mapping each body site to the IDs of the graph
+    steps that plot it. A body site's plots will only be created if there are
+    2+ weeks for both self and other, otherwise plot_taxa_summary.py would
+    fail.
+    """
+    dirs_to_remove = []
 
     # Prefix to be used for taxa summary dirs. Will be
     # <taxa_summary_dir_prefix>_<self|other>_<body site>/.
     ts_dir_prefix = 'taxa_summaries'
 
-    # Create taxa summaries for self and other, per body site.
-    for personal_cat_value in personal_cat_values:
-        personal_cat_biom_fp = join(output_dir,
-                add_filename_suffix(otu_table_fp, '_%s' % personal_cat_value))
-        personal_cat_map_fp = join(output_dir,
-                                   'mapping_%s.txt' % personal_cat_value)
-        files_to_remove.append(personal_cat_biom_fp)
-        files_to_remove.append(personal_cat_map_fp)
-
-        body_site_dir = join(output_dir, personal_cat_value)
-
-        commands = []
-        cmd_title = 'Splitting "%s" OTU table by body site (%s)' % (
-                personal_cat_value, personal_id)
-        cmd = 'split_otu_table.py -i %s -m %s -f %s -o %s' % (
-                personal_cat_biom_fp, personal_map_fp, body_site_cat,
-                body_site_dir)
-        commands.append([(cmd_title, cmd)])
-        dirs_to_remove.append(body_site_dir)
-
-        command_handler(commands, status_update_callback, logger,
-                        close_logger_on_success=False)
-
-        commands = []
-        for body_site_cat_value in body_site_cat_values:
-            body_site_otu_table_fp = join(body_site_dir,
-                    add_filename_suffix(personal_cat_biom_fp,
-                                        '_%s' % body_site_cat_value))
-
-            # We won't always get an OTU table if the mapping file
-            # category contains samples that aren't in the OTU table
-            # (e.g. the 'na' state for body site).
-            if exists(body_site_otu_table_fp):
-                ts_dir = join(output_dir, '%s_%s_%s' % (ts_dir_prefix,
-                    personal_cat_value, body_site_cat_value))
-                create_dir(ts_dir)
-                dirs_to_remove.append(ts_dir)
-
-                # Summarize.
-                summarized_otu_table_fp = join(ts_dir,
-                        '%s_otu_table.biom' % time_series_cat)
-
-                cmd_title = ('Summarizing OTU table by category (%s)' %
-                             personal_id)
-                cmd = ('summarize_otu_by_cat.py -i %s -c %s -o %s '
-                       '-m %s ' % (personal_map_fp, body_site_otu_table_fp,
-                        summarized_otu_table_fp, time_series_cat))
-                commands.append([(cmd_title, cmd)])
-
-                # Sort.
-                sorted_otu_table_fp = join(ts_dir,
-                        '%s_otu_table_sorted.biom' % time_series_cat)
-
-                cmd_title = 'Sorting OTU table (%s)' % personal_id
-                cmd = ('sort_otu_table.py -i %s -o %s' % (
-                       summarized_otu_table_fp, sorted_otu_table_fp))
-                commands.append([(cmd_title, cmd)])
-
-                # Summarize taxa.
-                cmd_title = 'Summarizing taxa (%s)' % personal_id
-                cmd = ('summarize_taxa.py -i %s -o %s' % (
-                    sorted_otu_table_fp, ts_dir))
-                commands.append([(cmd_title, cmd)])
-
-                create_comparative_taxa_plots_html(body_site_cat_value,
-                        join(output_dir,
-                             '%s_comparative.html' % body_site_cat_value))
-
-        command_handler(commands, status_update_callback, logger,
-                        close_logger_on_success=False)
-
-    # Make each corresponding taxa summary compatible so that coloring matches
-    # between them. We want to be able to compare self versus other at each
-    # body site.
-    commands = []
+    # Check that we have 2+ weeks for self and other.
     valid_body_sites = []
+    weeks = {}
     for body_site_cat_value in body_site_cat_values:
-        personal_cat_vals = list(personal_cat_values)
-
-        ts_dir = join(output_dir, '%s_%s_%s' % (
-                ts_dir_prefix, personal_cat_vals[0], body_site_cat_value))
-
-        if not exists(ts_dir):
-            continue
-
-        # Check that we have 2+ weeks (samples were previously collapsed into
-        # weeks for self and other). If we don't have 2+ weeks,
-        # plot_taxa_summary.py will fail, so we'll skip this body site.
-        weeks_otu_table_fp = join(ts_dir,
-                                  '%s_otu_table_sorted.biom' % time_series_cat)
-        with open(weeks_otu_table_fp, 'U') as weeks_otu_table_f:
-            if _count_num_samples(weeks_otu_table_f) < 2:
-                continue
-
-        ts_fps1 = sorted(glob(join(ts_dir,
-                '%s_otu_table_sorted_L*.txt' % time_series_cat)))
-
-        ts_dir = join(output_dir, '%s_%s_%s' % (
-                ts_dir_prefix, personal_cat_vals[1], body_site_cat_value))
-
-        if not exists(ts_dir):
-            continue
-
-        weeks_otu_table_fp = join(ts_dir,
-                                  '%s_otu_table_sorted.biom' % time_series_cat)
-
-        with open(weeks_otu_table_fp, 'U') as weeks_otu_table_f:
-            if _count_num_samples(weeks_otu_table_f) < 2:
-                continue
-
-        ts_fps2 = sorted(glob(join(ts_dir,
-                '%s_otu_table_sorted_L*.txt' % time_series_cat)))
-
-        if len(ts_fps1) != len(ts_fps2):
-            raise ValueError("There are not an equal number of taxa summaries "
-                             "to compare between self and other.")
-
+        site_weeks = [_get_weeks(totals, body_site_cat_value)
+                      for personal_cat_value, totals in personal_otu_totals]
+
+        if min(map(len, site_weeks)) >= 2:
+            valid_body_sites.append(body_site_cat_value)
+            weeks[body_site_cat_value] = site_weeks
+
+    if not valid_body_sites:
+        return dirs_to_remove, {}
+
+    # Summarize each week (for self and other, at every valid body site) at
+    # every level at once.
+    otu_abundances = []
+    for body_site_cat_value in valid_body_sites:
+        for (personal_cat_value, totals), cat_weeks in zip(
+                personal_otu_totals, weeks[body_site_cat_value]):
+            for week in cat_weeks:
+                otu_abundances.append(
+                        totals.get_sums((body_site_cat_value, week)))
+    summaries = taxa_summarizer.summarize(column_stack(otu_abundances))
+
+    personal_cat_vals = [personal_cat_value for personal_cat_value, totals in
+                         personal_otu_totals]
+    plot_steps = {}
+    start_col = 0
+    for body_site_cat_value in valid_body_sites:
+        # Write the taxa summaries for self and other.
+        ts_fps = []
+        for personal_cat_value, cat_weeks in zip(personal_cat_vals,
+                                                 weeks[body_site_cat_value]):
+            ts_dir = join(output_dir, '%s_%s_%s' % (ts_dir_prefix,
+                personal_cat_value, body_site_cat_value))
+            create_dir(ts_dir)
+            dirs_to_remove.append(ts_dir)
+
+            end_col = start_col + len(cat_weeks)
+            cat_ts_fps = _get_taxa_summary_fps(ts_dir, time_series_cat)
+            for level, ts_fp in zip(_taxa_summary_levels, cat_ts_fps):
+                ts_f = open(ts_fp, 'w')
+                ts_f.write(format_taxa_summary(
+                        taxa_summarizer.get_taxa(level), cat_weeks,
+                        summaries[level][:, start_col:end_col]))
+                ts_f.close()
+            ts_fps.append(cat_ts_fps)
+            start_col = end_col
+
+        # Make each corresponding taxa summary compatible so that coloring
+        # matches between them. We want to be able to compare self versus
+        # other at each body site.
         compatible_ts_dir = join(output_dir,
                                  'compatible_ts_%s' % body_site_cat_value)
         dirs_to_remove.append(compatible_ts_dir)
 
         compatible_ts_fps = defaultdict(list)
-        for ts_fp1, ts_fp2 in zip(ts_fps1, ts_fps2):
-            if basename(ts_fp1) != basename(ts_fp2):
-                raise ValueError("Could not find matching taxa summaries "
-                                 "between self and other to compare.")
+        for ts_fp1, ts_fp2 in zip(*ts_fps):
+            compatible_ts_fp1 = join(compatible_ts_dir,
+                    add_filename_suffix(ts_fp1, '_sorted_and_filled_0'))
+            compatible_ts_fp2 = join(compatible_ts_dir,
+                    add_filename_suffix(ts_fp2, '_sorted_and_filled_1'))
 
-            # Make taxa summaries compatible.
             cmd_title = 'Making compatible taxa summaries (%s)' % personal_id
             cmd = ('compare_taxa_summaries.py -i %s,%s -o %s -m paired -n 0' %
                    (ts_fp1, ts_fp2, compatible_ts_dir))
-            commands.append([(cmd_title, cmd)])
-
-            compatible_ts_fps[personal_cat_vals[0]].append(
-                    join(compatible_ts_dir, add_filename_suffix(ts_fp1,
-                        '_sorted_and_filled_0')))
+            graph.add_command(cmd_title, cmd, inputs=[ts_fp1, ts_fp2],
+                              outputs=[compatible_ts_fp1, compatible_ts_fp2],
+                              stage=_taxa_summary_plots_stage)
 
-            compatible_ts_fps[personal_cat_vals[1]].append(
-                    join(compatible_ts_dir, add_filename_suffix(ts_fp2,
-                         '_sorted_and_filled_1')))
+            compatible_ts_fps[personal_cat_vals[0]].append(compatible_ts_fp1)
+            compatible_ts_fps[personal_cat_vals[1]].append(compatible_ts_fp2)
 
-        for personal_cat_value in personal_cat_values:
+        plot_steps[body_site_cat_value] = []
+        for personal_cat_value in personal_cat_vals:
             # Plot taxa summaries.
-            ts_fps = ','.join(sorted(compatible_ts_fps[personal_cat_value]))
+            cat_compatible_ts_fps = sorted(
+                    compatible_ts_fps[personal_cat_value])
 
             ts_plots_dir = join(output_dir, 'taxa_plots_%s_%s' % (
                     personal_cat_value, body_site_cat_value),
@@ -692,44 +1619,40 @@ def _generate_taxa_summary_plots(otu_table_fp, personal_map_fp, personal_id,
 
             cmd_title = 'Plot taxa summaries (%s)' % personal_id
             cmd = ('plot_taxa_summary.py -i %s -o %s -a numeric' %
-                   (ts_fps, ts_plots_dir))
-            commands.append([(cmd_title, cmd)])
-
-        # If we've gotten this far, we'll be able to process this body site
-        # (i.e. there are enough weeks).
-        valid_body_sites.append(body_site_cat_value)
-
-    # Hack to allow print-only mode.
-    if command_handler is not print_commands and not valid_body_sites:
-        raise ValueError("None of the body sites for personal ID '%s' could "
-                         "be processed because there were not enough weeks "
-                         "to create taxa summary plots." % personal_id)
+                   (','.join(cat_compatible_ts_fps), ts_plots_dir))
+            plot_steps[body_site_cat_value].append(graph.add_command(
+                    cmd_title, cmd, inputs=cat_compatible_ts_fps,
+                    outputs=[ts_plots_dir], stage=_taxa_summary_plots_stage))
 
-    command_handler(commands, status_update_callback, logger,
-                    close_logger_on_success=False)
+    return dirs_to_remove, plot_steps
 
-    return files_to_remove, dirs_to_remove
+def _get_weeks(otu_totals, body_site):
+    """Returns the naturally-sorted weeks that have samples at a body site.
 
-def _count_num_samples(otu_table_f):
-    """Returns the number of samples in the OTU table."""
-    return len(parse_biom_table(otu_table_f).SampleIds)
-
-def _count_per_individual_samples(otu_table_f, map_f, pid_col, pid):
-    """Returns the number of samples in the OTU table for the individual."""
-    otu_table = parse_biom_table(otu_table_f)
-    mapping_data, header, comments = parse_mapping_file(map_f)
-    sid_idx = header.index('SampleID')
-    pid_idx = header.index(pid_col)
-
-    sids = []
-    for row in mapping_data:
-        if row[pid_idx] == pid:
-            sids.append(row[sid_idx])
+    otu_totals must be grouped by (body site, week).
+    """
+    return natsort([week for site, week in otu_totals.groups()
+                    if site == body_site])
+
+def _get_taxa_summary_fps(ts_dir, time_series_cat):
+    """Returns the filepaths of the taxa summaries created in ts_dir."""
+    return [join(ts_dir, '%s_otu_table_sorted_L%d.txt' % (time_series_cat,
+                                                         level))
+            for level in _taxa_summary_levels]
+
+def notify_participants(recipients_f, email_settings_f, dry_run=True,
+                        journal_fp=None, connections=2, max_rate=None,
+                        max_retries=3, use_tls=True, spool_dir=None,
+                        spool_maildir=True, spool_threads=4):
+    """Sends an email to each participant in the study.
 
-    return len(set(sids) & set(otu_table.SampleIds))
+    The emails are sent over a small pool of reused SMTP connections (see
+    mail.Mailer). A line is printed to stdout for each participant that is
+    emailed (or couldn't be emailed).
 
-def notify_participants(recipients_f, email_settings_f, dry_run=True):
-    """Sends an email to each participant in the study.
+    Alternatively, if spool_dir is provided, the emails are written to a
+    local mail spool for the local MTA to deliver (see mail.MailSpool), and
+    a summary is printed to stdout once they have all been written.
 
     Arguments:
         recipients_f - file containing email recipients (see
@@ -737,8 +1660,24 @@ def notify_participants(recipients_f, email_settings_f, dry_run=True):
         email_settings_f - file containing settings for sending emails (see
             parse.parse_email_settings for more details)
         dry_run - if True, no emails are sent and information of what would
-            have been done is printed to stdout. If False, no output is printed
-            and emails are sent
+            have been done is printed to stdout. If False, emails are sent
+        journal_fp - if provided, the personal ID of each participant who is
+            emailed is recorded in this file, and participants who are
+            already in it aren't emailed again (e.g. when rerunning after an
+            interruption)
+        connections - the number of SMTP connections to send emails over
+        max_rate - the maximum number of emails to send per second (None for
+            no limit)
+        max_retries - the number of times to resend an email after a
+            transient failure (e.g. a dropped connection)
+        use_tls - if True, the SMTP connections are encrypted with STARTTLS
+        spool_dir - if provided, the emails are written to this directory
+            instead of being sent over SMTP (connections, max_rate,
+            max_retries, and use_tls are ignored)
+        spool_maildir - if True, spool_dir is a maildir. If False, it is an
+            MTA pickup directory
+        spool_threads - the number of threads to write emails to spool_dir
+            from
     """
     recipients = parse_recipients(recipients_f)
     email_settings = parse_email_settings(email_settings_f)
@@ -748,46 +1687,109 @@ def notify_participants(recipients_f, email_settings_f, dry_run=True):
     server = email_settings['smtp_server']
     port = email_settings['smtp_port']
 
-    if dry_run:
-        num_recipients = len(recipients)
-
-        print("Running script in dry-run mode. No emails will be sent. Here's "
-              "what I would have done:\n")
-        print("Sender information:\n\nFrom address: %s\nPassword: %s\nSMTP "
-              "server: %s\nPort: %s\n" % (sender, email_password, server,
-                                          port))
-        print "Sending emails to %d recipient(s)." % num_recipients
-
-        if num_recipients > 0:
-            # Sort so that we will grab the same recipient each time this is
-            # run over the same input files.
-            sample_recipient = sorted(recipients.items())[0]
-            personal_id = sample_recipient[0]
-            password, addresses = sample_recipient[1]
-
-            print "\nSample email:\n"
-            print "To: %s" % ', '.join(addresses)
-            print "From: %s" % sender
-            print "Subject: %s" % notification_email_subject
-            print "Body:\n%s\n" % get_personalized_notification_email_text(
-                    personal_id, password)
-    else:
-        for personal_id, (password, addresses) in recipients.items():
-            personalized_text = \
-                    get_personalized_notification_email_text(personal_id,
-                                                             password)
-            print "Sending email to %s (%s)... " % (personal_id,
-                                                    ', '.join(addresses)),
-            send_email(server, port, sender, email_password, addresses,
-                       notification_email_subject, personalized_text)
-            print "success!"
+    journal = None
+    if journal_fp is not None:
+        journal = DeliveryJournal(journal_fp)
+
+    try:
+        if dry_run:
+            remaining_recipients = recipients
+            print("Running script in dry-run mode. No emails will be sent. "
+                  "Here's what I would have done:\n")
+            print("Sender information:\n\nFrom address: %s\nPassword: %s\n"
+                  "SMTP server: %s\nPort: %s\n" % (sender, email_password,
+                                                   server, port))
+            if spool_dir is not None:
+                print("Emails will be written to the %s %s instead of being "
+                      "sent over SMTP.\n" % ('maildir' if spool_maildir else
+                                             'pickup directory', spool_dir))
+
+            if journal is not None:
+                remaining_recipients = dict(
+                        [(personal_id, recipient)
+                         for personal_id, recipient in recipients.items()
+                         if personal_id not in journal])
+                num_delivered = len(recipients) - len(remaining_recipients)
+                if num_delivered > 0:
+                    print("Skipping %d recipient(s) who have already been "
+                          "emailed (recorded in %s)." % (num_delivered,
+                                                         journal_fp))
+
+            print("Sending emails to %d recipient(s)." %
+                  len(remaining_recipients))
+
+            if remaining_recipients:
+                # Sort so that we will grab the same recipient each time this
+                # is run over the same input files.
+                sample_recipient = sorted(remaining_recipients.items())[0]
+                personal_id = sample_recipient[0]
+                password, addresses = sample_recipient[1]
+
+                print "\nSample email:\n"
+                print "To: %s" % ', '.join(addresses)
+                print "From: %s" % sender
+                print "Subject: %s" % notification_email_subject
+                print "Body:\n%s\n" % \
+                        get_personalized_notification_email_text(personal_id,
+                                                                 password)
+        else:
+            messages = []
+            for personal_id, (password, addresses) in \
+                    sorted(recipients.items()):
+                personalized_text = \
+                        get_personalized_notification_email_text(personal_id,
+                                                                 password)
+                # Rendered by the mailer's worker threads.
+                messages.append((personal_id, addresses,
+                                 partial(create_email_message, sender,
+                                         addresses, notification_email_subject,
+                                         personalized_text)))
+
+            def print_status(personal_id, addresses, error):
+                if error is None:
+                    # Spooled emails are summarized at the end instead.
+                    if spool_dir is None:
+                        print "Sending email to %s (%s)... success!" % (
+                                personal_id, ', '.join(addresses))
+                else:
+                    print "Sending email to %s (%s)... failed: %s" % (
+                            personal_id, ', '.join(addresses), error)
+
+            if spool_dir is None:
+                mailer = Mailer(server, int(port), sender, email_password,
+                                connections=connections, max_rate=max_rate,
+                                max_retries=max_retries, use_tls=use_tls)
+            else:
+                mailer = MailSpool(spool_dir, maildir=spool_maildir,
+                                   threads=spool_threads)
+            delivered, failed = mailer.send(messages, journal, print_status)
+
+            if spool_dir is not None:
+                print("Wrote %d email(s) to the %s %s (%d skipped because "
+                      "they were already emailed, %d failed)." %
+                      (len(delivered), 'maildir' if spool_maildir else
+                       'pickup directory', spool_dir,
+                       len(messages) - len(delivered) - len(failed),
+                       len(failed)))
+
+            if failed:
+                raise ValueError("Could not email %d recipient(s): %s. Rerun "
+                                 "to try emailing them again%s." %
+                                 (len(failed), ', '.join(sorted(failed)),
+                                  '' if journal is None else
+                                  ' (recipients who were emailed will be '
+                                  'skipped)'))
+    finally:
+        if journal is not None:
+            journal.close()
 
 def send_email(host, port, sender, password, recipients, subject, body,
                attachments=None):
     """Sends an email (optionally with attachments).
 
     This function does not return anything. It is not unit tested because it
-    sends an actual email, and thus is difficult to test.
+    sends an actual email, and thus is difficult to test. Use mail.Mailer to
+    send more than one email.
 
     This code is largely based on the code found here:
     http://www.blog.pythonlibrary.org/2010/05/14/how-to-send-email-with-python/
@@ -809,24 +1811,8 @@ def send_email(host, port, sender, password, recipients, subject, body,
             recipient will see it), and the second element is the file to be
             attached
     """
-    msg = MIMEMultipart()
-    msg['From'] = sender
-    msg['To'] = ', '.join(recipients)
-    msg['Subject'] = subject
-    msg['Date'] = formatdate(localtime=True)
- 
-    if attachments is not None:
-        for attachment_name, attachment_f in attachments:
-            part = MIMEBase('application', 'octet-stream')
-            part.set_payload(attachment_f.read())
-            encode_base64(part)
-            part.add_header('Content-Disposition',
-                            'attachment; filename="%s"' % attachment_name)
-            msg.attach(part)
-    part = MIMEText('text', 'plain')
-    part.set_payload(body)
-    msg.attach(part)
- 
+    msg = create_email_message(sender, recipients, subject, body, attachments)
+
     server = SMTP(host, port)
     server.ehlo()
     server.starttls()
@@ -835,11 +1821,31 @@ def send_email(host, port, sender, password, recipients, subject, body,
     server.sendmail(sender, recipients, msg.as_string())
     server.quit()
 
-def generate_passwords(pids_f, results_dir, password_dir, out_dir):
-    """Creates PID -> password mapping, .htaccess files, and .htpasswd file."""
-    htpasswd_f = open(join(out_dir, '.htpasswd'), 'w')
-    pid_passwd_f = open(join(out_dir, 'personal_ids_with_passwords.txt'), 'w')
+def generate_passwords(pids_f, results_dir, password_dir, out_dir,
+                       scheme='apr1', jobs=1, dbm_type=None):
+    """Creates PID -> password mapping, .htaccess files, and .htpasswd file.
 
+    The passwords are hashed with the specified scheme (see
+    htpasswd.password_schemes) in jobs worker processes.
+
+    The users are added to (or updated in) out_dir/.htpasswd and
+    out_dir/personal_ids_with_passwords.txt. Users that are already in these
+    files and aren't in pids_f are kept, so users can be added (or their
+    passwords reset) a few at a time.
+
+    If dbm_type is provided (any of the keys in htpasswd.dbm_types), the
+    users are also added to (or updated in) the DBM user database
+    out_dir/.htpasswd.dbm in the same way, and the .htaccess files
+    authenticate against it instead of the .htpasswd file.
+
+    Returns the number of users that were added to and updated in the DBM
+    user database (both are zero if dbm_type is None).
+    """
+    if dbm_type is not None:
+        check_dbm_type(dbm_type)
+
+    pids = []
+    passwords = []
     for line in pids_f:
         pid = line.strip()
         pid_dir = join(results_dir, pid)
@@ -850,39 +1856,79 @@ def generate_passwords(pids_f, results_dir, password_dir, out_dir):
                              "results." % pid_dir)
 
         htaccess_f = open(join(pid_dir, '.htaccess'), 'w')
-        htaccess_f.write(format_htaccess_file(password_dir, pid))
+        htaccess_f.write(format_htaccess_file(password_dir, pid, dbm_type))
         htaccess_f.close()
 
-        password, encrypted_password = generate_random_password()
-        htpasswd_f.write('%s:%s\n' % (pid, encrypted_password))
-        pid_passwd_f.write('%s\t%s\n' % (pid, password))
+        pids.append(pid)
+        passwords.append(_generate_unencrypted_password())
+
+    encrypted_passwords = hash_passwords(passwords, scheme, jobs)
+
+    _update_user_file(join(out_dir, '.htpasswd'),
+                      zip(pids, encrypted_passwords), ':')
+    _update_user_file(join(out_dir, 'personal_ids_with_passwords.txt'),
+                      zip(pids, passwords), '\t')
+
+    if dbm_type is None:
+        return 0, 0
+    return update_user_dbm(join(out_dir, '.htpasswd.dbm'),
+                           zip(pids, encrypted_passwords), dbm_type)
 
-    htpasswd_f.close()
-    pid_passwd_f.close()
+def _update_user_file(fp, users, delimiter):
+    """Adds or updates users in a file of delimited (username, value) lines.
 
-def generate_random_password(min_len=8, max_len=12):
+    Existing users keep their place in the file and new users are appended,
+    in the order they are listed. Users that aren't listed are kept as they
+    are. The file is created if it doesn't exist, and is replaced in one step
+    so that it is never left partially written.
+    """
+    users = list(users)
+    values = dict(users)
+
+    lines = []
+    if exists(fp):
+        user_f = open(fp, 'U')
+        for line in user_f:
+            line = line.rstrip('\n')
+            if not line:
+                continue
+
+            username = line.split(delimiter, 1)[0]
+            if username in values:
+                line = '%s%s%s' % (username, delimiter,
+                                   values.pop(username))
+            lines.append(line)
+        user_f.close()
+
+    for username, value in users:
+        if username in values:
+            lines.append('%s%s%s' % (username, delimiter,
+                                     values.pop(username)))
+
+    tmp_fp = fp + '.tmp'
+    user_f = open(tmp_fp, 'w')
+    for line in lines:
+        user_f.write(line + '\n')
+    user_f.close()
+    rename(tmp_fp, fp)
+
+def generate_random_password(min_len=8, max_len=12, scheme='apr1'):
     """Returns a random alphanumeric password of random length.
 
     Returns both unencrypted and encrypted password. Encryption is performed
-    via Apache's htpasswd command, using their custom MD5 algorithm.
+    in-process using the specified scheme (see htpasswd.password_schemes),
+    which defaults to Apache's custom MD5 algorithm (the same as htpasswd
+    -m).
 
     Length will be randomly chosen from within the specified bounds
     (inclusive).
     """
+    password = _generate_unencrypted_password(min_len, max_len)
+    return password, hash_password(password, scheme)
+
+def _generate_unencrypted_password(min_len=8, max_len=12):
     # Modified from
     # http://code.activestate.com/recipes/59873-random-password-generation
     chars = letters + digits
     length = randint(min_len, max_len)
-    password = ''.join([choice(chars) for i in range(length)])
-
-    # This is hackish but should work for now...
-    stdout, stderr, ret_val = qiime_system_call('htpasswd -nbm foobarbaz %s' %
-                                                password)
-    if ret_val != 0:
-        raise ValueError("Error executing htpasswd command. Do you have this "
-                         "command on your machine?")
-
-    # Will be in the form foobarbaz:<encrypted password>
-    encrypted_password = stdout.strip().split('foobarbaz:', 1)[1]
-
-    return password, encrypted_password
+    return ''.join([choice(chars) for i in range(length)])
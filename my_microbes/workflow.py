@@ -0,0 +1,294 @@
+#!/usr/bin/env python
+from __future__ import division
+
+__author__ = "Jai Ram Rideout"
+__copyright__ = "Copyright 2013, The QIIME project"
+__credits__ = ["Jai Ram Rideout"]
+__license__ = "GPL"
+__version__ = "0.1.0-dev"
+__maintainer__ = "Jai Ram Rideout"
+__email__ = "jai.rideout@gmail.com"
+
+"""Module for scheduling workflow commands based on their inputs/outputs."""
+
+from os.path import abspath, normpath, sep
+from sys import exc_info
+from threading import Condition, Thread
+
+from my_microbes.timing import CommandTimer
+
+# How often (in seconds) to stop waiting for running commands to finish so
+# that signals (e.g. SIGINT) can be handled. Python 2 can't handle signals
+# while a thread is blocked waiting on a lock without a timeout.
+_wait_timeout = 0.5
+
+class CommandGraph(object):
+    """A set of workflow commands that are run in dependency order.
+
+    Each command declares the filepaths that it reads (inputs) and writes
+    (outputs). A command depends on another command if one of its inputs is
+    one of the other command's outputs, or if one path lies within the other
+    (e.g. an input file is inside another command's output directory). Inputs
+    that aren't the output of any command in the graph are assumed to already
+    exist.
+
+    Commands that don't depend on each other may be run at the same time.
+    """
+
+    def __init__(self):
+        self._steps = []
+
+    def add_command(self, title, cmd, inputs=None, outputs=None,
+                    stage=None):
+        """Adds a command to the graph and returns its step ID.
+
+        Arguments:
+            title - the title of the command (as used by QIIME's command
+                handlers)
+            cmd - the command to run
+            inputs - list of filepaths the command reads
+            outputs - list of filepaths the command writes
+            stage - the stage of the results that the command creates. Only
+                used when the command is timed (see run)
+        """
+        step_id = len(self._steps)
+        self._steps.append(_Step(title, cmd, inputs, outputs, stage))
+        return step_id
+
+    def run(self, command_handler, status_update_callback, logger,
+            max_concurrent_commands=1, step_finished_callback=None,
+            command_timer=None):
+        """Runs the commands in the graph in dependency order.
+
+        Each command is passed to command_handler (e.g.
+        call_commands_serially or print_commands) on its own. The logger is
+        not closed on success.
+
+        If step_finished_callback is provided, it is called with the step ID
+        of each command as soon as the command has been run successfully, so
+        that the caller can act on completed work (e.g. record it) even if a
+        later command fails. It is always called from the calling thread.
+
+        If command_timer is provided, it runs each command instead of
+        command_handler, and records the command's stage and how much time
+        and memory it used along with the sizes of its inputs and outputs.
+
+        Returns a list of the IDs of the steps, in the order that they
+        finished.
+
+        Arguments:
+            command_handler - QIIME command handler used to run each command
+            status_update_callback - callback passed to command_handler
+            logger - WorkflowLogger passed to command_handler
+            max_concurrent_commands - maximum number of commands to run at
+                the same time. If greater than one, each command's log output
+                is buffered and written to logger once the command finishes so
+                that the output of concurrent commands isn't interleaved
+            step_finished_callback - function taking a step ID that is
+                called after each command that is run successfully
+            command_timer - CommandTimer used to run and time each command
+        """
+        if max_concurrent_commands < 1:
+            raise ValueError("The maximum number of concurrent commands must "
+                             "be at least 1.")
+
+        dependencies, dependents = self._get_dependencies()
+
+        if step_finished_callback is None:
+            step_finished_callback = lambda step_id: None
+
+        if command_timer is not None:
+            command_handler = command_timer
+
+        if max_concurrent_commands == 1:
+            return self._run_serially(dependencies, command_handler,
+                                      status_update_callback, logger,
+                                      step_finished_callback)
+        else:
+            return self._run_concurrently(dependencies, dependents,
+                                          command_handler,
+                                          status_update_callback, logger,
+                                          max_concurrent_commands,
+                                          step_finished_callback)
+
+    def _get_dependencies(self):
+        """Returns each step's dependencies and dependents (lists of sets)."""
+        num_steps = len(self._steps)
+        dependencies = [set() for i in range(num_steps)]
+        dependents = [set() for i in range(num_steps)]
+
+        for i, step in enumerate(self._steps):
+            for j, other_step in enumerate(self._steps):
+                if i != j and _paths_overlap(step.inputs, other_step.outputs):
+                    dependencies[i].add(j)
+                    dependents[j].add(i)
+
+        # Make sure the graph doesn't contain any cycles by performing a
+        # topological sort.
+        num_deps = [len(deps) for deps in dependencies]
+        ready = [i for i in range(num_steps) if num_deps[i] == 0]
+        num_sorted = 0
+        while ready:
+            step_id = ready.pop()
+            num_sorted += 1
+            for dependent in dependents[step_id]:
+                num_deps[dependent] -= 1
+                if num_deps[dependent] == 0:
+                    ready.append(dependent)
+
+        if num_sorted != num_steps:
+            raise ValueError("The commands' inputs and outputs form a cycle, "
+                             "so there is no valid order to run them in.")
+
+        return dependencies, dependents
+
+    def _run_serially(self, dependencies, command_handler,
+                      status_update_callback, logger, step_finished_callback):
+        """Runs one command at a time, preferring the order they were added."""
+        finished = set()
+        run_steps = []
+        while len(finished) < len(self._steps):
+            step_id = min([i for i in range(len(self._steps))
+                           if i not in finished and
+                           dependencies[i].issubset(finished)])
+
+            self._steps[step_id].run(command_handler, status_update_callback,
+                                     logger)
+            run_steps.append(step_id)
+            step_finished_callback(step_id)
+            finished.add(step_id)
+
+        return run_steps
+
+    def _run_concurrently(self, dependencies, dependents, command_handler,
+                          status_update_callback, logger,
+                          max_concurrent_commands, step_finished_callback):
+        """Runs up to max_concurrent_commands commands at a time."""
+        finished_cond = Condition()
+        num_deps = [len(deps) for deps in dependencies]
+        ready = [i for i in range(len(self._steps)) if num_deps[i] == 0]
+        running = set()
+        newly_finished = []
+        run_steps = []
+        error = None
+
+        def run_step(step_id):
+            step_logger = _BufferedLogger()
+            step_error = None
+            try:
+                self._steps[step_id].run(command_handler,
+                                         status_update_callback, step_logger)
+            except:
+                step_error = exc_info()
+
+            finished_cond.acquire()
+            try:
+                logger.write(step_logger.getvalue())
+                newly_finished.append((step_id, step_error,
+                                       step_logger.closed))
+                finished_cond.notify()
+            finally:
+                finished_cond.release()
+
+        finished_cond.acquire()
+        try:
+            while ready or running:
+                # Start as many ready commands as we're allowed to.
+                ready.sort(reverse=True)
+                while ready and error is None and \
+                      len(running) < max_concurrent_commands:
+                    step_id = ready.pop()
+                    running.add(step_id)
+                    thread = Thread(target=run_step, args=(step_id,))
+                    thread.daemon = True
+                    thread.start()
+
+                if error is not None:
+                    ready = []
+
+                while not newly_finished and running:
+                    finished_cond.wait(_wait_timeout)
+
+                while newly_finished:
+                    step_id, step_error, closed_logger = \
+                            newly_finished.pop(0)
+                    running.discard(step_id)
+
+                    if step_error is not None:
+                        if error is None:
+                            error = step_error, closed_logger
+                        continue
+
+                    run_steps.append(step_id)
+                    step_finished_callback(step_id)
+
+                    for dependent in dependents[step_id]:
+                        num_deps[dependent] -= 1
+                        if num_deps[dependent] == 0:
+                            ready.append(dependent)
+        finally:
+            finished_cond.release()
+
+        if error is not None:
+            (error_type, error_value, error_tb), closed_logger = error
+
+            # Mirror the command handler's behavior of closing the logger when
+            # a command fails.
+            if closed_logger:
+                logger.close()
+            raise error_type, error_value, error_tb
+
+        return run_steps
+
+
+class _Step(object):
+    """A single command in a CommandGraph."""
+
+    def __init__(self, title, cmd, inputs, outputs, stage):
+        self.title = title
+        self.cmd = cmd
+        self.inputs = [_normalize_path(fp) for fp in inputs or []]
+        self.outputs = [_normalize_path(fp) for fp in outputs or []]
+        self.stage = stage
+
+    def run(self, command_handler, status_update_callback, logger):
+        """Runs the command with command_handler."""
+        commands = [[(self.title, self.cmd)]]
+        if isinstance(command_handler, CommandTimer):
+            command_handler(commands, status_update_callback, logger,
+                            close_logger_on_success=False, stage=self.stage,
+                            inputs=self.inputs, outputs=self.outputs)
+        else:
+            command_handler(commands, status_update_callback, logger,
+                            close_logger_on_success=False)
+
+
+class _BufferedLogger(object):
+    """Stands in for a WorkflowLogger, keeping everything written in memory."""
+
+    def __init__(self):
+        self._buffer = []
+        self.closed = False
+
+    def write(self, s):
+        self._buffer.append(s)
+
+    def close(self):
+        self.closed = True
+
+    def getvalue(self):
+        return ''.join(self._buffer)
+
+
+def _normalize_path(fp):
+    return normpath(abspath(fp))
+
+def _paths_overlap(fps1, fps2):
+    """Returns True if a path in fps1 is equal to, inside of, or contains a
+    path in fps2."""
+    for fp1 in fps1:
+        for fp2 in fps2:
+            if fp1 == fp2 or fp1.startswith(fp2 + sep) or \
+               fp2.startswith(fp1 + sep):
+                return True
+    return False
@@ -11,7 +11,8 @@ __email__ = "jai.rideout@gmail.com"
 
 from qiime.util import (parse_command_line_parameters, get_options_lookup,
                         make_option)
-from my_microbes.format import format_participant_list
+from my_microbes.format import (write_participant_list,
+                                write_participant_pages)
 
 options_lookup = get_options_lookup()
 
@@ -28,6 +29,12 @@ This script is kept separate from the personal_results.py script because that
 script may be run many times (in parallel) over different subsets of personal
 IDs. This script can then be used once a final comprehensive list of
 participants has been prepared.
+
+For studies with many participants, --page_size splits the list into pages
+and adds a search box to each page. Participants can look up their personal
+ID without loading the whole list. The search box uses a compact search index
+(written as JSON files next to the pages) and only downloads the part of the
+index that could contain the personal ID being searched for.
 """
 
 script_info['script_usage'] = []
@@ -39,9 +46,21 @@ script_info['script_usage'].append((
 "prefix is 'http://my-microbes.qiime.org/NAU123/index.html'.",
 "%prog -p participants.txt -u http://my-microbes.qiime.org -o "
 "participants.html"))
+script_info['script_usage'].append((
+"Generate paginated HTML list of participants",
+"The following command generates an HTML list of all participants in "
+"participants.txt with 1000 participants per page, and a search index. The "
+"first page is written to participants.html, the second to "
+"participants_2.html, and so on.",
+"%prog -p participants.txt -u http://my-microbes.qiime.org -o "
+"participants.html --page_size 1000"))
 
 script_info['output_description'] = """
-The script produces an output HTML file containing the list.
+The script produces an output HTML file containing the list. If --page_size is
+provided, the script produces an HTML file for each page, a search index
+(<output base>_search_index.json and a <output base>_search_<page>.json shard
+for each page), and participant_search.js, all in the same directory as the
+output HTML file. These files must be kept together.
 """
 
 script_info['required_options'] = [
@@ -58,18 +77,29 @@ script_info['required_options'] = [
         'results links)')
 ]
 
-script_info['optional_options'] = []
+script_info['optional_options'] = [
+    make_option('--page_size', type='int',
+        help='if provided, the list is split into pages of this many '
+        'participants each, and a search index is created [default: write '
+        'a single list]', default=None)
+]
 
 script_info['version'] = __version__
 
 def main():
     option_parser, opts, args = parse_command_line_parameters(**script_info)
 
-    participant_list = format_participant_list(open(opts.participants, 'U'),
-                                               opts.url_prefix)
+    if opts.page_size is not None and opts.page_size < 1:
+        option_parser.error("The page size must be at least 1.")
 
-    with open(opts.output_fp, 'w') as output_f:
-        output_f.write(participant_list)
+    with open(opts.participants, 'U') as participants_f:
+        if opts.page_size is None:
+            with open(opts.output_fp, 'w') as output_f:
+                write_participant_list(participants_f, opts.url_prefix,
+                                       output_f)
+        else:
+            write_participant_pages(participants_f, opts.url_prefix,
+                                    opts.output_fp, opts.page_size)
 
 
 if __name__ == "__main__":
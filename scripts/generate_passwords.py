@@ -12,6 +12,8 @@ __email__ = "jai.rideout@gmail.com"
 from qiime.util import (create_dir, get_options_lookup, make_option,
                         parse_command_line_parameters)
 
+from my_microbes.htpasswd import (check_dbm_type, check_password_scheme,
+                                  dbm_types, password_schemes)
 from my_microbes.util import generate_passwords
 
 options_lookup = get_options_lookup()
@@ -25,14 +27,47 @@ the username) and the encrypted password. A .htaccess file is created in the
 root of each personalized results subdirectory to allow only the participant to
 see his/her personalized results.
 
+The passwords are hashed in-process (Apache's htpasswd command isn't needed),
+and the hashes are the same as htpasswd would create. With --jobs, the
+passwords are hashed in batches across multiple processes.
+
+With --dbm_type, the users are also written to a DBM user database
+(.htpasswd.dbm), and each .htaccess file authenticates against it
+(AuthDBMUserFile) instead of the .htpasswd file. Apache looks users up in a
+DBM database directly instead of reading through the whole .htpasswd file on
+every request.
+
+If the output files already exist, only the users in -i/--personal_ids_fp are
+added or updated (e.g. to add new participants or reset a participant's
+password), and every other user is left as is. This applies to the .htpasswd
+file, the personal ID -> password mapping file, and the DBM user database.
+
 WARNING: be very careful with the output file that maps personal IDs (i.e.
 usernames) to unencrypted passwords. If someone gains access to this file, they
 will be able to view everyone's personalized results!
 """
 
 script_info['script_usage'] = []
-
-script_info['output_description'] = ""
+script_info['script_usage'].append((
+"Generate passwords",
+"Generate passwords for the individuals in personal_ids.txt, whose "
+"results are in personal_results/. The .htpasswd file will be stored in "
+"/var/www/passwords on the web server.",
+"%prog -i personal_ids.txt -r personal_results -p /var/www/passwords "
+"-o passwords"))
+script_info['script_usage'].append((
+"Add or update users in a DBM user database",
+"Add the individuals in new_personal_ids.txt to the GDBM user database in "
+"passwords/ (or reset their passwords if they are already in it).",
+"%prog -i new_personal_ids.txt -r personal_results -p /var/www/passwords "
+"-o passwords --dbm_type gdbm"))
+
+script_info['output_description'] = """
+The output directory will contain the .htpasswd file, the .htpasswd.dbm user
+database (if --dbm_type is provided), and a personal ID -> unencrypted
+password mapping file (personal_ids_with_passwords.txt). A .htaccess file is
+written to each individual's results directory.
+"""
 
 script_info['required_options'] = [
     make_option('-i', '--personal_ids_fp', type='existing_filepath',
@@ -51,17 +86,51 @@ script_info['required_options'] = [
     options_lookup['output_dir']
 ]
 
-script_info['optional_options'] = []
+script_info['optional_options'] = [
+    make_option('--hash_scheme', type='choice', choices=password_schemes,
+        help='the scheme to hash the passwords in the .htpasswd file with. '
+        'Valid choices are: ' + ', '.join(password_schemes) + '. "apr1" is '
+        'Apache\'s MD5-based algorithm (htpasswd -m), "sha1" is unsalted '
+        'SHA-1 (htpasswd -s), "sha256" and "sha512" are SHA-256/SHA-512 '
+        'crypt (htpasswd -2/-5), and "bcrypt" is bcrypt (htpasswd -B, '
+        'requires the bcrypt package) [default: %default]', default='apr1'),
+    make_option('--jobs', default=1, type='int',
+        help='the number of processes to hash passwords in '
+        '[default: %default]'),
+    make_option('--dbm_type', type='choice', choices=sorted(dbm_types),
+        help='if provided, users are also written to a DBM user database of '
+        'this type, which the .htaccess files will authenticate against. '
+        'Valid choices are: ' + ', '.join(sorted(dbm_types)) + ', which '
+        'require the dbhash, gdbm, and dbm Python modules, respectively. Use '
+        'a type that Apache\'s mod_authn_dbm supports on the web server '
+        '[default: no DBM user database]', default=None)
+]
 
 script_info['version'] = __version__
 
 def main():
     option_parser, opts, args = parse_command_line_parameters(**script_info)
 
+    if opts.jobs < 1:
+        option_parser.error("The number of jobs must be at least 1.")
+
+    try:
+        check_password_scheme(opts.hash_scheme)
+        if opts.dbm_type is not None:
+            check_dbm_type(opts.dbm_type)
+    except ValueError, e:
+        option_parser.error(e)
+
     create_dir(opts.output_dir)
 
-    generate_passwords(open(opts.personal_ids_fp, 'U'), opts.results_dir,
-                       opts.password_dir, opts.output_dir)
+    num_added, num_updated = generate_passwords(
+            open(opts.personal_ids_fp, 'U'), opts.results_dir,
+            opts.password_dir, opts.output_dir, scheme=opts.hash_scheme,
+            jobs=opts.jobs, dbm_type=opts.dbm_type)
+
+    if opts.dbm_type is not None:
+        print("Added %d user(s) to and updated %d user(s) in the DBM user "
+              "database." % (num_added, num_updated))
 
 
 if __name__ == "__main__":
@@ -34,9 +34,17 @@ When executed with --really, a line will be printed to stdout for each
 participant that is successfully emailed. The line will say something like:
     Sending email to <personal ID> (<email addresses>)... success!
 
-If there is a problem during the email sending process, you will be able to see
-which recipients (if any) were emailed successfully, so that you'll know not to
-email them again when you rerun the script.
+Emails are sent over a few SMTP connections that are reused for every email
+(see --connections), and emails that fail because of temporary problems (e.g.
+a dropped connection) are retried. The personal ID of each participant that is
+successfully emailed is recorded in a journal file (see --journal_fp). If the
+script is interrupted or some emails can't be sent, rerunning it with the same
+journal file will only email the participants who haven't been emailed yet.
+
+Alternatively, with --spool_dir, the emails are written as files into a local
+maildir (or an MTA's pickup directory, see --spool_format) in one pass instead
+of being sent over SMTP, and the local MTA delivers them at its own rate. A
+summary of the emails that were written is printed at the end.
 """
 
 script_info['script_usage'] = []
@@ -47,11 +55,20 @@ script_info['script_usage'].append((
 "specified in email_settings.txt. No emails are actually sent, and helpful "
 "information is printed to stdout, to (hopefully) avoid potential mistakes.",
 "%prog -r recipients.txt -s email_settings.txt"))
+script_info['script_usage'].append((
+"Write notification emails to a local maildir",
+"The following command writes an email for each participant in "
+"recipients.txt to the maildir /var/spool/my_microbes for the local MTA to "
+"deliver.",
+"%prog -r recipients.txt -s email_settings.txt --really "
+"--spool_dir /var/spool/my_microbes"))
 
 script_info['output_description'] = """
-The script does not produce any output files. It will print useful information
-to stdout by default unless --really is used, in which case the script will
-print a line for each recipient that is successfully emailed.
+The script does not produce any output files (aside from the journal, and the
+emails written to --spool_dir). It will print useful information to stdout by
+default unless --really is used, in which case the script will print a line
+for each recipient that is successfully emailed (or a summary of the emails
+written to --spool_dir).
 """
 
 script_info['required_options'] = [
@@ -73,7 +90,34 @@ script_info['optional_options'] = [
         'recommended to run the script without this option first to see what '
         'will be done, and to double-check everything. There is no going back '
         'after executing the script with this option enabled '
-        '[default: %default]', default=False)
+        '[default: %default]', default=False),
+    make_option('--journal_fp', type='string',
+        help='the file to record the personal IDs of participants who have '
+        'been emailed in. Participants who are already in this file won\'t be '
+        'emailed again [default: the recipients filepath with .sent '
+        'appended]', default=None),
+    make_option('--connections', type='int',
+        help='the number of SMTP connections to send emails over '
+        '[default: %default]', default=2),
+    make_option('--max_rate', type='float',
+        help='the maximum number of emails to send per second [default: no '
+        'limit]', default=None),
+    make_option('--max_retries', type='int',
+        help='the number of times to retry an email that fails because of a '
+        'temporary problem [default: %default]', default=3),
+    make_option('--spool_dir', type='string',
+        help='if provided, emails are written to this local mail spool '
+        'directory instead of being sent over SMTP. It will be created if it '
+        'doesn\'t exist [default: send emails over SMTP]', default=None),
+    make_option('--spool_format', type='choice',
+        choices=['maildir', 'pickup'],
+        help='the format of --spool_dir. "maildir" writes each email to '
+        'the maildir\'s new subdirectory. "pickup" writes each email '
+        'directly to --spool_dir as a .eml file (e.g. for an MTA\'s pickup '
+        'directory) [default: %default]', default='maildir'),
+    make_option('--spool_threads', type='int',
+        help='the number of threads to write emails to --spool_dir from '
+        '[default: %default]', default=4)
 ]
 
 script_info['version'] = __version__
@@ -81,9 +125,30 @@ script_info['version'] = __version__
 def main():
     option_parser, opts, args = parse_command_line_parameters(**script_info)
 
+    if opts.connections < 1:
+        option_parser.error("The number of connections must be at least 1.")
+    if opts.max_rate is not None and opts.max_rate <= 0:
+        option_parser.error("The maximum rate must be greater than zero.")
+    if opts.max_retries < 0:
+        option_parser.error("The maximum number of retries must be at least "
+                            "0.")
+    if opts.spool_threads < 1:
+        option_parser.error("The number of spool threads must be at least 1.")
+
+    journal_fp = opts.journal_fp
+    if journal_fp is None:
+        journal_fp = opts.recipients + '.sent'
+
     notify_participants(open(opts.recipients, 'U'),
                         open(opts.email_settings, 'U'),
-                        dry_run=not opts.really)
+                        dry_run=not opts.really,
+                        journal_fp=journal_fp,
+                        connections=opts.connections,
+                        max_rate=opts.max_rate,
+                        max_retries=opts.max_retries,
+                        spool_dir=opts.spool_dir,
+                        spool_maildir=opts.spool_format == 'maildir',
+                        spool_threads=opts.spool_threads)
 
 
 if __name__ == "__main__":
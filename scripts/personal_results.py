@@ -11,10 +11,13 @@ __email__ = "jc33@nau.edu"
  
 from os import makedirs 
 from os.path import exists, join
+from signal import SIGTERM, signal
+from sys import exit
 
 from qiime.util import parse_command_line_parameters, make_option
 from qiime.workflow.util import (call_commands_serially, no_status_updates,
                                  print_commands, print_to_stdout)
+from my_microbes.precompress import check_encodings
 from my_microbes.util import create_personal_results
 
 script_info = {}
@@ -43,6 +46,15 @@ script_info['script_usage'] = [("Basic usage",
 "%prog -m map.txt -i unweighted_unifrac_pc.txt -c alpha_div_collated/ -a "
 "otu_table.biom -p prefs.txt -o limited_output -l CUB027,NAU113"),
 
+("Update existing output",
+"If output was already created (e.g. for CUB027 and NAU113 above), "
+"additional individuals can be added to it without recreating the results "
+"that haven't changed. The following command creates output for NAU123 and "
+"skips CUB027 and NAU113 because their results are up-to-date.",
+"%prog -m map.txt -i unweighted_unifrac_pc.txt -c alpha_div_collated/ -a "
+"otu_table.biom -p prefs.txt -o limited_output -l CUB027,NAU113,NAU123 "
+"--incremental"),
+
 ("Change default ID column title",
 "If the column indicating the individual is named something other than "
 "'PersonalID' the user can indicate the name of that column. This will, "
@@ -60,7 +72,29 @@ script_info['script_usage'] = [("Basic usage",
 "the prefs file as well.",
 "%prog -m map.txt -i unweighted_unifrac_pc.txt -c alpha_div_collated/ -a "
 "otu_table.biom -p prefs.txt -o custom_column_output -l CUB027,NAU113 -t "
-"individual -r yes,no""")]
+"individual -r yes,no"),
+
+("Process individuals in parallel",
+"Each individual's results are independent of all other individuals' "
+"results, so they can be created in parallel. The following command "
+"processes up to eight individuals at a time.",
+"%prog -m map.txt -i unweighted_unifrac_pc.txt -c alpha_div_collated/ -a "
+"otu_table.biom -p prefs.txt -o parallel_output --jobs 8"),
+
+("Built-in PCoA viewer",
+"Beta diversity plots can be displayed with a built-in viewer instead of "
+"make_3d_plots.py. The study's coordinates are only written once, so the "
+"output is much smaller and faster to create for large studies.",
+"%prog -m map.txt -i unweighted_unifrac_pc.txt -c alpha_div_collated/ -a "
+"otu_table.biom -p prefs.txt -o viewer_output --pcoa_viewer"),
+
+("Static alpha rarefaction plots",
+"Alpha rarefaction plots can be created as static images and tables instead "
+"of with make_rarefaction_plots.py. The collated alpha diversity files are "
+"only read once for every individual, which is much faster for large "
+"studies.",
+"%prog -m map.txt -i unweighted_unifrac_pc.txt -c alpha_div_collated/ -a "
+"otu_table.biom -p prefs.txt -o static_output --static_alpha_rarefaction")]
 
 script_info['output_description'] = """
 The output directory will contain sets of HTML pages for each individual in the
@@ -142,12 +176,12 @@ script_info['optional_options'] = [
     make_option('--body_site_rarefied_otu_table_dir',
         help='path to directory containing per-body-site OTU tables that were '
         'split from a rarefied OTU table. If provided, the '
-        'single_rarefaction.py and split_otu_table.py steps are skipped when '
+        'single_rarefaction.py step is skipped when '
         'generating the OTU category significance tables (the tables in this '
         'directory are used instead). This option only applies if OTU '
         'category significance tables are not suppressed. This option is '
         'useful if you are running this script many times on subsets of '
-        'individuals, so that rarefaction/splitting doesn\'t occur each time '
+        'individuals, so that rarefaction doesn\'t occur each time '
         'the script is run. The tables\' filenames must be in the format '
         '\'<otu table name>_even<rarefaction depth>_<body site>.<extension>\' '
         '[default: %default]', type='existing_dirpath', default=None),
@@ -176,6 +210,66 @@ script_info['optional_options'] = [
          default=False,action='store_true',
          help=('Suppress generation of otu category significance tables '
                '[default: %default]')),
+    make_option('--pcoa_viewer', default=False, action='store_true',
+        help='create beta diversity plots with the built-in PCoA viewer '
+        'instead of running make_3d_plots.py twice for each individual. The '
+        'study\'s coordinates are written once to pcoa_data.js in the output '
+        'directory, and each individual only gets a small overlay that '
+        'highlights their samples and connects them over time. The viewer '
+        'doesn\'t require Java. -i must be a single principal coordinates '
+        'file [default: %default]'),
+    make_option('--static_alpha_rarefaction', default=False,
+        action='store_true',
+        help='create a static page of alpha rarefaction plots and average '
+        'tables for each individual instead of running '
+        'make_rarefaction_plots.py. The collated alpha diversity files are '
+        'read once for everyone, and each individual\'s samples are compared '
+        'to everyone else\'s at each body site. The prefs file isn\'t used '
+        'and per-sample plots aren\'t created [default: %default]'),
+    make_option('--jobs', default=1, type='int',
+        help='the number of individuals to process in parallel. Each '
+        'individual is processed in its own worker process, so this should '
+        'not exceed the number of available cores. The rarefaction and '
+        'splitting of the OTU table that is shared by all individuals is '
+        'still only performed once [default: %default]'),
+    make_option('--max_concurrent_commands', default=1, type='int',
+        help='the maximum number of commands to run at the same time for '
+        'each individual. Commands that do not depend on each other\'s '
+        'output (e.g. alpha rarefaction, beta diversity, and taxa summary '
+        'plots) will be run concurrently, up to this limit. This is in '
+        'addition to --jobs, so up to jobs * max_concurrent_commands '
+        'commands may be running at once [default: %default]'),
+    make_option('--incremental', '--resume', action='store_true',
+        default=False,
+        help='update the results in an existing output directory instead of '
+        'creating them from scratch. The inputs of each part of each '
+        'individual\'s results (e.g. beta diversity plots) are hashed and '
+        'recorded as soon as it is created, and only the parts whose inputs '
+        'have changed (or that are missing or were only partially created) '
+        'are recreated. Use this to resume a run that failed or was '
+        'interrupted (e.g. with SIGTERM or Ctrl-C). Each part only depends '
+        'on the individual\'s mapping file rows and the rows of the samples '
+        'it compares them to (e.g. the taxa summary plots only compare the '
+        'individual to everyone else at their own body sites). Every '
+        'individual is compared to the rest of the study, so changes to the '
+        'input files (e.g. adding individuals to the OTU table) will cause '
+        'most results to be recreated. Results are also recreated when the '
+        'code that creates them (or the installed version of QIIME) changes '
+        '[default: %default]'),
+    make_option('--precompress', type='string', default=None,
+        help='comma-separated list of encodings to precompress the results\' '
+        'static files (e.g. HTML, javascript, and CSS) with once they are '
+        'created, so that the web server can serve the compressed files '
+        'instead of compressing them on every request. Valid encodings are '
+        'gzip (writes .gz files) and br (writes .br files, requires the '
+        'brotli package). Files that haven\'t changed since they were last '
+        'compressed are skipped [default: don\'t precompress]'),
+    make_option('--timings_fp', type='string', default=None,
+        help='file to record how long each command took in (one JSON object '
+        'per line, with the command\'s wall time, CPU time, peak memory '
+        'usage, input and output sizes, personal ID, and stage). A summary of '
+        'the stages and scripts that took the most time is written to the '
+        'log file [default: don\'t record timings]'),
     make_option('-w', '--print_only', action='store_true',
         help='Print the commands but don\'t call them -- useful for debugging '
         '[default: %default]', default=False),      
@@ -186,12 +280,13 @@ script_info['version'] = __version__
 def main():
     option_parser, opts, args = parse_command_line_parameters(**script_info)
 
-    if exists(opts.output_dir):
+    if exists(opts.output_dir) and not opts.incremental:
         # don't overwrite existing output directory - make the user provide a
         # different name or move/delete the existing directory since it may
         # have taken a while to create.
         option_parser.error("Output directory (%s) already exists. "
-                            "Won't overwrite." % opts.output_dir)
+                            "Won't overwrite (use --incremental to update "
+                            "its results)." % opts.output_dir)
 
     personal_ids = opts.personal_ids
     if personal_ids is not None:
@@ -199,6 +294,21 @@ def main():
 
     individual_titles = opts.individual_titles.split(',')
 
+    if opts.jobs < 1:
+        option_parser.error("The number of jobs must be at least 1.")
+
+    if opts.max_concurrent_commands < 1:
+        option_parser.error("The maximum number of concurrent commands must "
+                            "be at least 1.")
+
+    precompress_encodings = None
+    if opts.precompress is not None:
+        precompress_encodings = opts.precompress.split(',')
+        try:
+            check_encodings(precompress_encodings)
+        except ValueError, e:
+            option_parser.error(str(e))
+
     if opts.print_only:
         command_handler = print_commands
     else:
@@ -209,30 +319,49 @@ def main():
     else:
         status_update_callback = no_status_updates
 
-    create_personal_results(opts.output_dir,
-                            opts.mapping_fp,
-                            opts.coord_fname,
-                            opts.collated_dir,
-                            opts.otu_table_fp,
-                            opts.prefs_fp,
-                            opts.personal_id_column,
-                            personal_ids,
-                            opts.column_title,
-                            individual_titles,
-                            opts.category_to_split,
-                            opts.time_series_category,
-                            rarefaction_depth=opts.rarefaction_depth,
-                            alpha=opts.alpha,
-                            rep_set_fp=opts.rep_set_fp,
-                            body_site_rarefied_otu_table_dir=opts.body_site_rarefied_otu_table_dir,
-                            retain_raw_data=opts.retain_raw_data,
-                            suppress_alpha_rarefaction=opts.suppress_alpha_rarefaction,
-                            suppress_beta_diversity=opts.suppress_beta_diversity,
-                            suppress_taxa_summary_plots=opts.suppress_taxa_summary_plots,
-                            suppress_alpha_diversity_boxplots=opts.suppress_alpha_diversity_boxplots,
-                            suppress_otu_category_significance=opts.suppress_otu_category_significance,
-                            command_handler=command_handler,
-                            status_update_callback=status_update_callback)
+    # Stop cleanly when terminated (e.g. when a batch job is preempted), in
+    # the same way as when interrupted with Ctrl-C.
+    signal(SIGTERM, _raise_keyboard_interrupt)
+
+    try:
+        create_personal_results(opts.output_dir,
+                                opts.mapping_fp,
+                                opts.coord_fname,
+                                opts.collated_dir,
+                                opts.otu_table_fp,
+                                opts.prefs_fp,
+                                opts.personal_id_column,
+                                personal_ids,
+                                opts.column_title,
+                                individual_titles,
+                                opts.category_to_split,
+                                opts.time_series_category,
+                                rarefaction_depth=opts.rarefaction_depth,
+                                alpha=opts.alpha,
+                                rep_set_fp=opts.rep_set_fp,
+                                body_site_rarefied_otu_table_dir=opts.body_site_rarefied_otu_table_dir,
+                                retain_raw_data=opts.retain_raw_data,
+                                suppress_alpha_rarefaction=opts.suppress_alpha_rarefaction,
+                                suppress_beta_diversity=opts.suppress_beta_diversity,
+                                suppress_taxa_summary_plots=opts.suppress_taxa_summary_plots,
+                                suppress_alpha_diversity_boxplots=opts.suppress_alpha_diversity_boxplots,
+                                suppress_otu_category_significance=opts.suppress_otu_category_significance,
+                                pcoa_viewer=opts.pcoa_viewer,
+                                static_alpha_rarefaction=opts.static_alpha_rarefaction,
+                                jobs=opts.jobs,
+                                max_concurrent_commands=\
+                                        opts.max_concurrent_commands,
+                                incremental=opts.incremental,
+                                precompress_encodings=precompress_encodings,
+                                timings_fp=opts.timings_fp,
+                                command_handler=command_handler,
+                                status_update_callback=status_update_callback)
+    except KeyboardInterrupt:
+        exit("Interrupted. Rerun with --resume to continue where this run "
+             "stopped.")
+
+def _raise_keyboard_interrupt(signum, frame):
+    raise KeyboardInterrupt
 
 
 if __name__ == "__main__":
@@ -0,0 +1,201 @@
+#!/usr/bin/env python
+from __future__ import division
+
+__author__ = "Jai Ram Rideout"
+__copyright__ = "Copyright 2013, The QIIME Project"
+__credits__ = ["Jai Ram Rideout"]
+__license__ = "GPL"
+__version__ = "0.1.0-dev"
+__maintainer__ = "Jai Ram Rideout"
+__email__ = "jai.rideout@gmail.com"
+
+"""Test suite for the aggregate.py module."""
+
+from biom.parse import parse_biom_table
+from cogent.util.unit_test import TestCase, main
+from qiime.parse import parse_mapping_file
+from qiime.util import get_qiime_temp_dir
+
+from os.path import join
+from shutil import rmtree
+from tempfile import mkdtemp
+
+from numpy import isnan
+
+from my_microbes.aggregate import (aggregate_alpha_diversity,
+                                   aggregate_otu_table, aggregate_rarefaction,
+                                   get_sample_groups, GroupTotals)
+from my_microbes.alpha_diversity import RarefactionStore
+
+class AggregateTests(TestCase):
+    """Tests for the aggregate.py module."""
+
+    def setUp(self):
+        """Define some sample data that will be used by the tests."""
+        self.otu_table = parse_biom_table(otu_table_str.split('\n'))
+        self.mapping_data, self.header = parse_mapping_file(
+                mapping_str.split('\n'))[:2]
+        self.sample_groups = get_sample_groups(self.mapping_data, 0, [1, 3])
+
+        self.totals = GroupTotals(['a', 'b'])
+        self.totals.add('g1', [1, 2])
+        self.totals.add('g1', [3, 0])
+        self.totals.add('g2', [5, 5])
+
+    def test_group_totals(self):
+        """Test adding values to groups and retrieving their totals."""
+        self.assertEqual(self.totals.groups(), ['g1', 'g2'])
+        self.assertFloatEqual(self.totals.get_sums('g1'), [4, 2])
+        self.assertFloatEqual(self.totals.get_sums_of_squares('g1'), [10, 4])
+        self.assertEqual(self.totals.get_count('g1'), 2)
+        self.assertEqual(self.totals.get_count('g2'), 1)
+
+        # Groups without any samples have zero totals.
+        self.assertFloatEqual(self.totals.get_sums('foo'), [0, 0])
+        self.assertEqual(self.totals.get_count('foo'), 0)
+
+    def test_group_totals_means_and_stds(self):
+        """Test computing each ID's mean and standard deviation."""
+        self.assertFloatEqual(self.totals.get_means('g1'), [2, 1])
+        self.assertFloatEqual(self.totals.get_stds('g1'), [1, 1])
+        self.assertFloatEqual(self.totals.get_stds('g2'), [0, 0])
+        self.assertTrue(isnan(self.totals.get_means('foo')).all())
+        self.assertTrue(isnan(self.totals.get_stds('foo')).all())
+
+    def test_group_totals_missing_values(self):
+        """Test that missing values aren't added to the sums."""
+        self.totals.add('g2', [float('nan'), 1])
+        self.assertEqual(self.totals.get_count('g2'), 2)
+        self.assertEqual(self.totals.get_value_counts('g2').tolist(), [1, 2])
+        self.assertFloatEqual(self.totals.get_sums('g2'), [5, 6])
+        self.assertFloatEqual(self.totals.get_means('g2'), [5, 3])
+        self.assertFloatEqual(self.totals.get_stds('g2'), [0, 2])
+
+        subset = GroupTotals(['a', 'b'])
+        subset.add('g2', [5, 5])
+        obs = self.totals.subtract(subset)
+        self.assertEqual(obs.get_count('g2'), 1)
+        self.assertEqual(obs.get_value_counts('g2').tolist(), [0, 1])
+        self.assertTrue(isnan(obs.get_means('g2')[0]))
+        self.assertFloatEqual(obs.get_means('g2')[1], 1)
+
+    def test_group_totals_invalid_input(self):
+        """Test adding the wrong number of values."""
+        self.assertRaises(ValueError, self.totals.add, 'g1', [1, 2, 3])
+
+    def test_group_totals_subtract(self):
+        """Test subtracting a subset's totals."""
+        subset = GroupTotals(['a', 'b'])
+        subset.add('g1', [3, 0])
+        subset.add('g2', [5, 5])
+
+        obs = self.totals.subtract(subset)
+        self.assertEqual(obs.groups(), ['g1'])
+        self.assertFloatEqual(obs.get_sums('g1'), [1, 2])
+        self.assertFloatEqual(obs.get_sums_of_squares('g1'), [1, 4])
+        self.assertEqual(obs.get_count('g1'), 1)
+
+        # The original totals are unchanged.
+        self.assertFloatEqual(self.totals.get_sums('g1'), [4, 2])
+
+        # Mismatched IDs and too many samples.
+        self.assertRaises(ValueError, self.totals.subtract,
+                          GroupTotals(['a', 'c']))
+        subset.add('g2', [1, 1])
+        self.assertRaises(ValueError, self.totals.subtract, subset)
+
+    def test_get_sample_groups(self):
+        """Test grouping samples by multiple categories."""
+        self.assertEqual(self.sample_groups[:3],
+                         [('S1', ('Palm', '1')), ('S2', ('Tongue', '2')),
+                          ('S3', ('Palm', '1'))])
+
+    def test_aggregate_otu_table(self):
+        """Test computing OTU totals for the study and an individual."""
+        obs = aggregate_otu_table(self.otu_table, self.sample_groups)
+
+        # S9 isn't in the OTU table.
+        self.assertEqual(obs.ids, ['OTU0', 'OTU1'])
+        self.assertEqual(obs.groups(), [('Palm', '1'), ('Palm', '2'),
+                                        ('Tongue', '2')])
+        self.assertFloatEqual(obs.get_sums(('Palm', '1')), [4, 2])
+        self.assertFloatEqual(obs.get_sums_of_squares(('Palm', '1')),
+                              [10, 4])
+        self.assertEqual(obs.get_count(('Palm', '1')), 2)
+        self.assertEqual(obs.get_count(('Tongue', '2')), 2)
+
+        # "Other" totals for NAU123 via subtraction match computing them
+        # directly from the other individuals' samples.
+        personal_groups = get_sample_groups(
+                [row for row in self.mapping_data if row[2] == 'NAU123'], 0,
+                [1, 3])
+        other_groups = get_sample_groups(
+                [row for row in self.mapping_data if row[2] != 'NAU123'], 0,
+                [1, 3])
+        exp = aggregate_otu_table(self.otu_table, other_groups)
+        obs = obs.subtract(aggregate_otu_table(self.otu_table,
+                                               personal_groups))
+        self.assertEqual(obs.groups(), exp.groups())
+        for group in exp.groups():
+            self.assertFloatEqual(obs.get_sums(group), exp.get_sums(group))
+            self.assertFloatEqual(obs.get_sums_of_squares(group),
+                                  exp.get_sums_of_squares(group))
+            self.assertEqual(obs.get_count(group), exp.get_count(group))
+
+    def test_aggregate_alpha_diversity(self):
+        """Test computing alpha diversity totals, ignoring missing values."""
+        adiv = {'PD_whole_tree': {'S1': 1.0, 'S2': 2.0, 'S3': 3.0,
+                                  'S4': float('nan')},
+                'chao1': {'S1': 10.0, 'S2': 20.0, 'S3': 30.0, 'S4': 40.0}}
+
+        obs = aggregate_alpha_diversity(adiv, self.sample_groups)
+        self.assertEqual(obs.ids, ['PD_whole_tree', 'chao1'])
+        self.assertEqual(obs.groups(), [('Palm', '1'), ('Tongue', '2')])
+        self.assertFloatEqual(obs.get_sums(('Palm', '1')), [4, 40])
+        self.assertFloatEqual(obs.get_sums_of_squares(('Palm', '1')),
+                              [10, 1000])
+        self.assertEqual(obs.get_count(('Tongue', '2')), 1)
+
+    def test_aggregate_rarefaction(self):
+        """Test computing rarefaction totals from per-sample means."""
+        collated_dir = mkdtemp(dir=get_qiime_temp_dir(),
+                               prefix='my_microbes_tests_collated_')
+        try:
+            collated_f = open(join(collated_dir, 'chao1.txt'), 'w')
+            collated_f.write(collated_chao1_str)
+            collated_f.close()
+            store = RarefactionStore(collated_dir)
+        finally:
+            rmtree(collated_dir)
+
+        sample_groups = get_sample_groups(self.mapping_data, 0, [1])
+        obs = aggregate_rarefaction(store, 'chao1', sample_groups)
+        self.assertEqual(obs.ids, [10, 20])
+
+        # S3 doesn't have any values, and S9 isn't in the collated file.
+        self.assertEqual(obs.groups(), [('Palm',), ('Tongue',)])
+        self.assertEqual(obs.get_count(('Palm',)), 2)
+        self.assertEqual(obs.get_value_counts(('Palm',)).tolist(), [2, 1])
+        self.assertFloatEqual(obs.get_means(('Palm',)), [3, 6])
+        self.assertFloatEqual(obs.get_stds(('Palm',)), [1, 0])
+        self.assertFloatEqual(obs.get_means(('Tongue',)), [7, 10])
+
+
+mapping_str = """#SampleID\tBodySite\tPersonalID\tWeeksSinceStart\tDescription
+S1\tPalm\tNAU123\t1\tS1
+S2\tTongue\tNAU456\t2\tS2
+S3\tPalm\tNAU789\t1\tS3
+S4\tPalm\tNAU123\t2\tS4
+S5\tTongue\tNAU123\t2\tS5
+S9\tTongue\tNAU123\t2\tS9"""
+
+otu_table_str = """{"rows": [{"id": "OTU0", "metadata": null}, {"id": "OTU1", "metadata": null}], "format": "Biological Observation Matrix 0.9dev", "data": [[1, 2, 3, 4, 5], [2, 0, 0, 1, 1]], "columns": [{"id": "S1", "metadata": null}, {"id": "S2", "metadata": null}, {"id": "S3", "metadata": null}, {"id": "S4", "metadata": null}, {"id": "S5", "metadata": null}], "generated_by": "QIIME 1.4.0-dev, svn revision 2532", "matrix_type": "dense", "shape": [2, 5], "format_url": "http://biom-format.org", "date": "2011-12-21T00:49:15.978315", "type": "OTU table", "id": null, "matrix_element_type": "float"}"""
+
+collated_chao1_str = """\tsequences per sample\titeration\tS1\tS2\tS3\tS4\tS5
+alpha_rarefaction_10_0.biom\t10\t0\t1\t3\tn/a\t4\t9
+alpha_rarefaction_10_1.biom\t10\t1\t3\t5\tn/a\t4\t11
+alpha_rarefaction_20_0.biom\t20\t0\tn/a\t6\tn/a\t6\t14"""
+
+
+if __name__ == "__main__":
+    main()
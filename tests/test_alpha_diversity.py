@@ -0,0 +1,117 @@
+#!/usr/bin/env python
+from __future__ import division
+
+__author__ = "Jai Ram Rideout"
+__copyright__ = "Copyright 2013, The QIIME Project"
+__credits__ = ["Jai Ram Rideout"]
+__license__ = "GPL"
+__version__ = "0.1.0-dev"
+__maintainer__ = "Jai Ram Rideout"
+__email__ = "jai.rideout@gmail.com"
+
+"""Test suite for the alpha_diversity.py module."""
+
+from os.path import join
+from shutil import rmtree
+from tempfile import mkdtemp
+
+from cogent.util.unit_test import TestCase, main
+from numpy import isnan
+from qiime.util import get_qiime_temp_dir
+
+from my_microbes.alpha_diversity import (AlphaDiversityStore,
+                                         RarefactionStore)
+
+class AlphaDiversityTests(TestCase):
+    """Tests for the alpha_diversity.py module."""
+
+    def setUp(self):
+        """Define some sample data that will be used by the tests."""
+        self.collated_dir = mkdtemp(dir=get_qiime_temp_dir(),
+                                    prefix='my_microbes_tests_collated_')
+
+        for metric, collated_str in (('PD_whole_tree', pd_str),
+                                     ('chao1', chao1_str)):
+            collated_f = open(join(self.collated_dir, '%s.txt' % metric), 'w')
+            collated_f.write(collated_str)
+            collated_f.close()
+
+        self.mapping_data = [['S1', 'Palm', 'NAU123'],
+                             ['S2', 'Tongue', 'NAU456'],
+                             ['S3', 'Palm', 'NAU456']]
+
+    def tearDown(self):
+        """Remove temporary files/dirs created by tests."""
+        rmtree(self.collated_dir)
+
+    def test_alpha_diversity_store(self):
+        """Test loading every metric at a rarefaction depth."""
+        store = AlphaDiversityStore(self.collated_dir, 10)
+        self.assertEqual(store.rarefaction_depth, 10)
+        self.assertEqual(store.metrics, ['PD_whole_tree', 'chao1'])
+        self.assertEqual(store.sample_ids, ['S1', 'S2', 'S3', 'S4'])
+
+        self.assertFloatEqual(store.get_values('PD_whole_tree')[:, :3],
+                              [[1, 2, 3], [4, 5, 6]])
+        self.assertTrue(isnan(store.get_values('PD_whole_tree')[:, 3]).all())
+
+        # Missing samples and n/a values are NaN.
+        obs = store.get_values('chao1')
+        self.assertEqual(obs.shape, (1, 4))
+        self.assertTrue(isnan(obs[0, 0]))
+        self.assertTrue(isnan(obs[0, 2]))
+        self.assertFloatEqual(obs[0, [1, 3]], [20, 40])
+
+    def test_alpha_diversity_store_invalid_depth(self):
+        """Test loading a rarefaction depth that isn't in every metric."""
+        self.assertRaises(ValueError, AlphaDiversityStore, self.collated_dir,
+                          20)
+
+    def test_get_sample_metadata(self):
+        """Test pulling out each sample's value in a mapping category."""
+        store = AlphaDiversityStore(self.collated_dir, 10)
+        self.assertEqual(
+                store.get_sample_metadata(self.mapping_data, 0, 1).tolist(),
+                ['Palm', 'Tongue', 'Palm', None])
+        self.assertEqual(
+                store.get_sample_metadata(self.mapping_data, 0, 2).tolist(),
+                ['NAU123', 'NAU456', 'NAU456', None])
+
+    def test_rarefaction_store(self):
+        """Test averaging every metric's iterations at each depth."""
+        store = RarefactionStore(self.collated_dir)
+        self.assertEqual(store.metrics, ['PD_whole_tree', 'chao1'])
+        self.assertEqual(store.sample_ids, ['S1', 'S2', 'S3', 'S4'])
+        self.assertEqual(store.get_depths('PD_whole_tree').tolist(),
+                         [10, 20])
+        self.assertEqual(store.get_depths('chao1').tolist(), [10])
+
+        obs = store.get_means('PD_whole_tree')
+        self.assertFloatEqual(obs[:, :3], [[2.5, 3.5, 4.5], [7, 8, 9]])
+        self.assertTrue(isnan(obs[:, 3]).all())
+        obs = store.get_variances('PD_whole_tree')
+        self.assertFloatEqual(obs[:, :3], [[2.25, 2.25, 2.25], [0, 0, 0]])
+
+        # Missing samples and n/a values are NaN.
+        obs = store.get_means('chao1')
+        self.assertEqual(obs.shape, (1, 4))
+        self.assertTrue(isnan(obs[0, [0, 2]]).all())
+        self.assertFloatEqual(obs[0, [1, 3]], [20, 40])
+
+        self.assertFloatEqual(store.get_sample_means('PD_whole_tree', 'S2'),
+                              [3.5, 8])
+        self.assertEqual(store.get_sample_means('PD_whole_tree', 'S42'),
+                         None)
+
+
+pd_str = """\tsequences per sample\titeration\tS1\tS2\tS3
+alpha_rarefaction_10_0.biom\t10\t0\t1\t2\t3
+alpha_rarefaction_10_1.biom\t10\t1\t4\t5\t6
+alpha_rarefaction_20_0.biom\t20\t0\t7\t8\t9"""
+
+chao1_str = """\tsequences per sample\titeration\tS2\tS4\tS1
+alpha_rarefaction_10_0.biom\t10\t0\t20\t40\tn/a"""
+
+
+if __name__ == "__main__":
+    main()
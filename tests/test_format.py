@@ -14,21 +14,33 @@ __email__ = "jai.rideout@gmail.com"
 from unittest import main, TestCase
 from os import chdir, getcwd
 from qiime.util import create_dir, get_qiime_temp_dir
+from json import loads
 from os.path import exists, join
+from StringIO import StringIO
 from tempfile import mkdtemp
 from shutil import rmtree
 
 from cogent.util.misc import remove_files
 
 from my_microbes.format import (
+        create_alpha_diversity_boxplots_html,
         _create_alpha_diversity_boxplots_links,
         create_otu_category_significance_html_tables,
         _create_otu_category_significance_links,
         _create_taxa_summary_plots_links,
         format_htaccess_file,
         _format_otu_category_significance_tables_as_html,
+        format_otu_category_significance,
         format_participant_list,
-        format_title)
+        format_rarefaction_averages,
+        _format_rarefaction_averages_as_html,
+        format_taxa_summary,
+        format_title,
+        otu_category_significance_table_text,
+        OTUFragmentCache,
+        write_participant_list,
+        write_participant_pages)
+from my_microbes.rep_set import RepSet
 
 class FormatTests(TestCase):
     """Tests for the format.py module."""
@@ -139,18 +151,115 @@ class FormatTests(TestCase):
                           self.duplicate_participants,
                           'http://my-microbes.qiime.org')
 
+    def test_write_participant_list(self):
+        """Test writing an HTML list of study participants to a file."""
+        url_prefix = 'http://my-microbes.qiime.org'
+        output_f = StringIO()
+        write_participant_list(self.recipients, url_prefix, output_f)
+        self.assertEqual(output_f.getvalue(),
+                         format_participant_list(self.participants,
+                                                 url_prefix))
+
+        # Nothing is written if the participants file is invalid.
+        output_f = StringIO()
+        self.assertRaises(ValueError, write_participant_list,
+                          self.duplicate_participants, url_prefix, output_f)
+        self.assertEqual(output_f.getvalue(), '')
+
+    def test_write_participant_pages(self):
+        """Test writing a paginated list of participants and search index."""
+        participants = ['NAU%d' % i for i in (12, 10, 101, 2, 11)]
+        output_fp = join(self.output_dir, 'participants.html')
+        num_pages = write_participant_pages(participants,
+                                            'http://my-microbes.qiime.org',
+                                            output_fp, 2)
+        self.assertEqual(num_pages, 3)
+
+        index = loads(open(join(self.output_dir,
+                                'participants_search_index.json')).read())
+        self.assertEqual(index, {
+            'url_prefix': 'http://my-microbes.qiime.org/',
+            'first_ids': ['NAU10', 'NAU11', 'NAU2'],
+            'shards': ['participants_search_1.json',
+                       'participants_search_2.json',
+                       'participants_search_3.json'],
+            'pages': ['participants.html', 'participants_2.html',
+                      'participants_3.html']})
+
+        # The personal IDs are front-coded.
+        obs = [loads(open(join(self.output_dir, shard_fn)).read())
+               for shard_fn in index['shards']]
+        self.assertEqual(obs, [[[0, 'NAU10'], [5, '1']],
+                               [[0, 'NAU11'], [4, '2']],
+                               [[0, 'NAU2']]])
+
+        obs = open(join(self.output_dir, 'participants_2.html')).read()
+        self.assertTrue(obs.startswith('<div class="participant-search" '
+                                       'data-index="participants_search_'
+                                       'index.json">'))
+        self.assertTrue('<p class="participant-pages">Page 2 of 3: '
+                        '<a href="participants.html" title="NAU10 - NAU101">'
+                        '1</a> <b>2</b> <a href="participants_3.html" '
+                        'title="NAU2 - NAU2">3</a></p>\n' in obs)
+        self.assertTrue('<ul>\n'
+               '  <li><a href="http://my-microbes.qiime.org/'
+               'NAU11/index.html" target="_blank">NAU11</a></li>\n'
+               '  <li><a href="http://my-microbes.qiime.org/'
+               'NAU12/index.html" target="_blank">NAU12</a></li>\n'
+               '</ul>\n' in obs)
+        self.assertTrue(exists(join(self.output_dir,
+                                    'participant_search.js')))
+
+        # A single page doesn't link to other pages.
+        self.assertEqual(write_participant_pages(participants, 'foo/',
+                                                 output_fp), 1)
+        obs = open(output_fp).read()
+        self.assertFalse('participant-pages' in obs)
+        self.assertEqual(obs.count('<li>'), 5)
+
+        self.assertRaises(ValueError, write_participant_pages,
+                          self.duplicate_participants, 'foo/', output_fp)
+        self.assertRaises(ValueError, write_participant_pages, participants,
+                          'foo/', output_fp, 0)
+
     def test_create_taxa_summary_plots_links(self):
         """Test creating links to taxa summary plots."""
         obs = _create_taxa_summary_plots_links('/foobarbaz', 'foo123',
                                                ['tongue', 'forehead'])
         self.assertEqual(obs, '<table cellpadding="5px">\n</table>\n')
 
+        # Only body sites with both self and other plots are linked.
+        for title, body_site in ('Self', 'tongue'), ('Other', 'tongue'), \
+                                ('Self', 'forehead'):
+            plots_dir = join(self.output_dir, 'foo123', 'time_series',
+                             'taxa_plots_%s_%s' % (title, body_site),
+                             'taxa_summary_plots')
+            create_dir(plots_dir)
+            open(join(plots_dir, 'area_charts.html'), 'w').close()
+
+        obs = _create_taxa_summary_plots_links(self.output_dir, 'foo123',
+                                               ['tongue', 'forehead'])
+        self.assertEqual(obs, expected_taxa_summary_plots_links)
+
     def test_create_alpha_diversity_boxplots_links(self): 
         """Test creating links to alpha diversity boxplots."""
         filenames = ('pd.txt', 'chao.txt', 'observed_species.txt')
         self.assertEqual(_create_alpha_diversity_boxplots_links(filenames),
                          expected_alpha_diversity_boxplots_links)
 
+    def test_create_alpha_diversity_boxplots_html(self):
+        """Test describing the alpha rarefaction plots that were created."""
+        filenames = ('pd.txt', 'chao.txt', 'observed_species.txt')
+        obs = create_alpha_diversity_boxplots_html(filenames)
+        self.assertTrue(expected_alpha_diversity_boxplots_links in obs)
+        self.assertTrue('from the first drop-down menu' in obs)
+        self.assertFalse('solid line' in obs)
+
+        obs = create_alpha_diversity_boxplots_html(filenames, True)
+        self.assertTrue(expected_alpha_diversity_boxplots_links in obs)
+        self.assertTrue('drawn as a solid line' in obs)
+        self.assertFalse('drop-down menu' in obs)
+
     def test_create_otu_category_significance_links(self): 
         """Test creating links to OTU category significance tables."""
         filenames = ('gut.html', 'palm.html')
@@ -160,10 +269,21 @@ class FormatTests(TestCase):
     def test_create_otu_category_significance_html_tables(self):
         obs = create_otu_category_significance_html_tables(
                 [self.otu_cat_sig_gut_fp, self.otu_cat_sig_palm_fp], 0.05,
-                self.output_dir,['Self','Other'], rep_set_fp=self.rep_seqs_fp)
+                self.output_dir,['Self','Other'],
+                rep_set=RepSet(self.rep_seqs_fp))
 
         self.assertEqual(obs, ['gut.html', 'palm.html'])
 
+        with open(join(self.output_dir, 'gut.html'), 'U') as gut_f:
+            obs = gut_f.read()
+        self.assertTrue(obs.startswith(
+                otu_category_significance_table_text %
+                ('gut', 'Self', 'Other', 'Self', 'Other')))
+        self.assertTrue(obs.endswith('%s\n    %s\n  </div>\n</body>\n'
+                                     '</html>\n' %
+                                     (expected_otu_cat_sig_table_html,
+                                      expected_otu_cat_sig_rep_seq_html)))
+
     def test_format_otu_category_significance_tables_as_html(self): 
         """Test that an error is raised if alpha not between 0 and 1."""
         self.assertRaises(ValueError,
@@ -175,9 +295,54 @@ class FormatTests(TestCase):
                        expected_otu_cat_sig_rep_seq_html)}
         obs = _format_otu_category_significance_tables_as_html(
                 [self.otu_cat_sig_gut_fp], 0.05,
-                ['Self','Other'], rep_set_fp=self.rep_seqs_fp)
+                ['Self','Other'], rep_set=RepSet(self.rep_seqs_fp))
         self.assertEqual(obs, exp)
 
+        # The same OTUs in a second table are reused from the cache.
+        cache = OTUFragmentCache({'175844': 'TTGGACCGT'})
+        exp['palm'] = exp['gut']
+        obs = _format_otu_category_significance_tables_as_html(
+                [self.otu_cat_sig_gut_fp, self.otu_cat_sig_palm_fp], 0.05,
+                ['Self','Other'], otu_fragment_cache=cache)
+        self.assertEqual(obs, exp)
+        self.assertEqual((cache.hits, cache.misses), (2, 2))
+
+    def test_otu_fragment_cache(self):
+        """Test caching the HTML rendered for each OTU."""
+        self.assertRaises(ValueError, OTUFragmentCache, max_size=0)
+
+        cache = OTUFragmentCache({'OTU1': 'A' * 45}, max_size=2)
+        self.assertEqual(cache.get_hit_rate(), 0.0)
+
+        otu_id_html, taxonomy_html, rep_seq_html = cache.get_fragments(
+                'OTU1', 'k__Bacteria; p__')
+        self.assertEqual(otu_id_html, '<a href="#" id="OTU1" '
+                'onclick="openDialog(\'OTU1-rep-seq\', \'OTU1\'); '
+                'return false;">OTU1</a>')
+        self.assertEqual(taxonomy_html,
+                         "<a href=javascript:gg('Bacteria');>k__Bacteria</a>")
+        self.assertEqual(rep_seq_html, '<div id="OTU1-rep-seq" '
+                'class="rep-seq-dialog" title="Representative Sequence for '
+                'OTU ID OTU1">\n<pre>&gt;OTU1\n%s\n%s</pre>\n</div>\n' %
+                ('A' * 40, 'A' * 5))
+
+        # OTUs without a rep seq don't get a link or dialog.
+        self.assertEqual(cache.get_fragments('OTU2', 'k__foo')[0::2],
+                         ('OTU2', ''))
+
+        self.assertEqual(cache.get_fragments('OTU1', 'k__Bacteria; p__'),
+                         (otu_id_html, taxonomy_html, rep_seq_html))
+        self.assertEqual((cache.hits, cache.misses), (1, 2))
+        self.assertAlmostEqual(cache.get_hit_rate(), 1 / 3)
+
+        # The least recently used OTU (OTU2) is evicted, and a different
+        # taxonomy is a different fragment.
+        cache.get_fragments('OTU1', 'k__Archaea')
+        self.assertEqual(len(cache), 2)
+        cache.get_fragments('OTU1', 'k__Bacteria; p__')
+        cache.get_fragments('OTU2', 'k__foo')
+        self.assertEqual((cache.hits, cache.misses), (2, 4))
+
     def test_format_title(self):
         """Tests converting string to title."""
         self.assertEqual(format_title("observed_species"), "Observed Species")
@@ -188,6 +353,37 @@ class FormatTests(TestCase):
         self.assertEqual(format_title("PD_whole_tree"),
                          "Phylogenetic Diversity")
 
+    def test_format_rarefaction_averages(self):
+        """Tests formatting groups' averages as an average table."""
+        obs = format_rarefaction_averages('chao1', 'Self&&BodySite', [10, 20],
+                30, [('Selfgut', '#0000ff', [1.5, 2.0], [0.5, 0.0]),
+                     ('Othergut', '#ff0000', [1.0, float('nan')],
+                      [0.25, float('nan')])])
+        self.assertEqual(obs, expected_rarefaction_averages)
+
+    def test_format_rarefaction_averages_as_html(self):
+        """Tests formatting groups' averages as an HTML table."""
+        obs = _format_rarefaction_averages_as_html([10, 20],
+                [('gut (Self)', [1.5, 2.0], [0.5, 0.0]),
+                 ('gut (Other)', [1.0, float('nan')], [0.25, float('nan')])])
+        self.assertEqual(obs, expected_rarefaction_averages_html)
+
+    def test_format_otu_category_significance(self):
+        """Tests formatting OTU significance results."""
+        obs = format_otu_category_significance(
+                [('OTU0', 0.001, 0.002, 0.002, 0.55, 0.125,
+                  'k__Bacteria;p__Firmicutes'),
+                 ('OTU1', 0.5, 1.0, 0.5, 0.45, 0.85, '')], ['Self', 'Other'])
+        self.assertEqual(obs, expected_otu_category_significance)
+
+    def test_format_taxa_summary(self):
+        """Tests formatting a taxa summary like summarize_taxa.py."""
+        obs = format_taxa_summary(
+                [('k__Bacteria', 'p__Bacteroidetes'),
+                 ('k__Bacteria', 'p__Firmicutes')],
+                ['NAU123-1', '2'], [[0.25, 1.0], [0.75, 0.0]])
+        self.assertEqual(obs, expected_taxa_summary)
+
     def test_format_htaccess_file(self):
         """Tests correctly formatting a .htaccess file."""
         # With trailing slash.
@@ -198,6 +394,10 @@ class FormatTests(TestCase):
         obs = format_htaccess_file('/foo/bar/baz', 'NAU123')
         self.assertEqual(obs, expected_htaccess_file)
 
+        # DBM user database.
+        obs = format_htaccess_file('/foo/bar/baz', 'NAU123', 'gdbm')
+        self.assertEqual(obs, expected_dbm_htaccess_file)
+
 
 # Input test data.
 otu_cat_sig_gut_text = """OTU\tprob\tBonferroni_corrected\tFDR_corrected\tSelf_mean\tOther_mean\tConsensus Lineage
@@ -208,6 +408,16 @@ rep_seqs_text = """>175844 PC.635_779
 TTGGACCGT"""
 
 # Expected output.
+expected_taxa_summary_plots_links = """<table cellpadding="5px">
+<tr>
+<td><b>Tongue:</b></td>
+<td><a href="time_series/taxa_plots_Self_tongue/taxa_summary_plots/area_charts.html" target="_blank">Self</a></td>
+<td><a href="time_series/taxa_plots_Other_tongue/taxa_summary_plots/area_charts.html" target="_blank">Other</a></td>
+<td><a href="time_series/tongue_comparative.html" target="_blank">Self versus Other</a></td>
+</tr>
+</table>
+"""
+
 expected_alpha_diversity_boxplots_links = """<ul>
 <li><a href="pd.txt" target="_blank">Pd</a></li>
 <li><a href="chao.txt" target="_blank">Chao</a></li>
@@ -243,6 +453,49 @@ TTGGACCGT</pre>
 </div>
 """
 
+expected_otu_category_significance = """OTU\tprob\tBonferroni_corrected\tFDR_corrected\tSelf_mean\tOther_mean\tConsensus Lineage
+OTU0\t0.001\t0.002\t0.002\t0.55\t0.125\tk__Bacteria;p__Firmicutes
+OTU1\t0.5\t1.0\t0.5\t0.45\t0.85\t
+"""
+
+expected_rarefaction_averages = """# chao1
+# Self&&BodySite
+xaxis: 10.0\t20.0\t
+xmax: 30.0
+>> Selfgut
+color #0000ff
+series 1.5\t2.0\t
+error 0.5\tnan\t
+>> Othergut
+color #ff0000
+series 1.0\tnan\t
+error 0.25\tnan\t
+"""
+
+expected_rarefaction_averages_html = """<table class="data-table">
+<tr>
+<th>Seqs/Sample</th>
+<th>gut (Self)</th>
+<th>gut (Other)</th>
+</tr>
+<tr>
+<td>10</td>
+<td>1.500 &plusmn; 0.500</td>
+<td>1.000 &plusmn; 0.250</td>
+</tr>
+<tr>
+<td>20</td>
+<td>2.000 &plusmn; 0.000</td>
+<td>n/a</td>
+</tr>
+</table>
+"""
+
+expected_taxa_summary = """Taxon\tNAU123.1\t2
+k__Bacteria;p__Bacteroidetes\t0.25\t1.0
+k__Bacteria;p__Firmicutes\t0.75\t0.0
+"""
+
 expected_htaccess_file = """AuthUserFile /foo/bar/baz/.htpasswd
 AuthGroupFile /dev/null
 AuthName "Please log in to view your personalized results"
@@ -251,6 +504,15 @@ AuthType Basic
 require user NAU123
 """
 
+expected_dbm_htaccess_file = """AuthBasicProvider dbm
+AuthDBMType GDBM
+AuthDBMUserFile /foo/bar/baz/.htpasswd.dbm
+AuthName "Please log in to view your personalized results"
+AuthType Basic
+
+require user NAU123
+"""
+
 
 if __name__ == "__main__":
     main()
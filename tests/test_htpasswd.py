@@ -0,0 +1,136 @@
+#!/usr/bin/env python
+from __future__ import division
+
+__author__ = "Jai Ram Rideout"
+__copyright__ = "Copyright 2013, The QIIME Project"
+__credits__ = ["Jai Ram Rideout"]
+__license__ = "GPL"
+__version__ = "0.1.0-dev"
+__maintainer__ = "Jai Ram Rideout"
+__email__ = "jai.rideout@gmail.com"
+
+"""Test suite for the htpasswd.py module."""
+
+from os.path import join
+from shutil import rmtree
+from tempfile import mkdtemp
+from unittest import main, TestCase
+
+from my_microbes.htpasswd import (bcrypt, check_dbm_type,
+                                  check_password_scheme, crypt, dbm_types,
+                                  hash_password, hash_passwords,
+                                  update_user_dbm)
+
+class HtpasswdTests(TestCase):
+    """Tests for the htpasswd.py module."""
+
+    def test_hash_password_apr1(self):
+        """Test hashing passwords the same way as htpasswd -m."""
+        # Expected hashes were created with openssl passwd -apr1.
+        self.assertEqual(hash_password('myPassword', 'apr1', 'abcdefgh'),
+                         '$apr1$abcdefgh$EfExgQSMBXioDhIVk8IOb1')
+        self.assertEqual(hash_password('a', salt='r31.....'),
+                         '$apr1$r31.....$s7OSk4uJoyS8elmZY5Ru40')
+        self.assertEqual(hash_password('', salt='x'),
+                         '$apr1$x$tMwYqBfQwi3FYAr0aJc8M/')
+        self.assertEqual(hash_password('thisisaverylongpasswordthatexceeds'
+                                       'sixteenbytes', salt='abcdefgh'),
+                         '$apr1$abcdefgh$PdDwhr8c22nQTgOAUN6So1')
+
+        # Salts are random, and truncated to eight characters.
+        obs = hash_password('myPassword')
+        self.assertTrue(obs.startswith('$apr1$'))
+        self.assertEqual(len(obs), 37)
+        self.assertNotEqual(obs, hash_password('myPassword'))
+        self.assertEqual(hash_password('myPassword', salt=obs[6:14]), obs)
+        self.assertEqual(hash_password('myPassword', salt='abcdefghijk'),
+                         '$apr1$abcdefgh$EfExgQSMBXioDhIVk8IOb1')
+
+    def test_hash_password_sha1(self):
+        """Test hashing passwords the same way as htpasswd -s."""
+        self.assertEqual(hash_password('secret', 'sha1'),
+                         '{SHA}5en6G6MezRroT3XKqkdPOmY/BfQ=')
+
+    def test_hash_password_sha512(self):
+        """Test hashing passwords with SHA-512 crypt."""
+        if crypt is None:
+            return
+
+        try:
+            obs = hash_password('secret', 'sha512', 'saltsalt')
+        except ValueError:
+            # The system's crypt doesn't support SHA-512.
+            return
+        self.assertEqual(obs, crypt('secret', '$6$saltsalt'))
+        self.assertTrue(obs.startswith('$6$saltsalt$'))
+
+    def test_hash_password_bcrypt(self):
+        """Test hashing passwords the same way as htpasswd -B."""
+        if bcrypt is None:
+            self.assertRaises(ValueError, hash_password, 'secret', 'bcrypt')
+            return
+
+        obs = hash_password('secret', 'bcrypt')
+        self.assertTrue(obs.startswith('$2y$05$'))
+        self.assertEqual(bcrypt.hashpw('secret', '$2b$' + obs[4:]),
+                         '$2b$' + obs[4:])
+
+    def test_hash_passwords(self):
+        """Test hashing passwords in batches across processes."""
+        passwords = ['password%d' % i for i in range(150)]
+        exp = [hash_password(password, 'sha1') for password in passwords]
+        self.assertEqual(hash_passwords(passwords, 'sha1'), exp)
+        self.assertEqual(hash_passwords(passwords, 'sha1', jobs=2), exp)
+
+        obs = hash_passwords(passwords[:3], jobs=2)
+        self.assertEqual([hash_password(password, salt=hashed[6:14])
+                          for password, hashed in zip(passwords, obs)], obs)
+        self.assertEqual(hash_passwords([]), [])
+
+    def test_update_user_dbm(self):
+        """Test adding and updating users in a DBM user database."""
+        tmp_dir = mkdtemp(prefix='my_microbes_tests_')
+        try:
+            for dbm_type, (module_name, apache_type) in dbm_types.items():
+                try:
+                    check_dbm_type(dbm_type)
+                except ValueError:
+                    # The module for this DBM type isn't available.
+                    self.assertRaises(ValueError, update_user_dbm,
+                                      join(tmp_dir, dbm_type),
+                                      [('foo', 'bar')], dbm_type)
+                    continue
+
+                dbm_module = __import__(module_name)
+                dbm_fp = join(tmp_dir, dbm_type)
+                self.assertEqual(update_user_dbm(dbm_fp,
+                        [('P1', 'hash1'), ('P2', 'hash2')], dbm_type), (2, 0))
+
+                # Add groups to P2, which are kept when its hash is updated.
+                user_dbm = dbm_module.open(dbm_fp, 'w')
+                user_dbm['P2'] = 'hash2:group1,group2'
+                user_dbm.close()
+
+                self.assertEqual(update_user_dbm(dbm_fp,
+                        [('P2', 'newhash2'), ('P3', 'hash3')], dbm_type),
+                        (1, 1))
+
+                user_dbm = dbm_module.open(dbm_fp, 'r')
+                self.assertEqual(sorted(user_dbm.keys()), ['P1', 'P2', 'P3'])
+                self.assertEqual(user_dbm['P1'], 'hash1')
+                self.assertEqual(user_dbm['P2'], 'newhash2:group1,group2')
+                self.assertEqual(user_dbm['P3'], 'hash3')
+                user_dbm.close()
+        finally:
+            rmtree(tmp_dir)
+
+    def test_invalid_input(self):
+        """Test invalid schemes and numbers of jobs raise errors."""
+        self.assertRaises(ValueError, check_password_scheme, 'md4')
+        self.assertRaises(ValueError, hash_password, 'secret', 'md4')
+        self.assertRaises(ValueError, hash_passwords, ['secret'], jobs=0)
+        self.assertRaises(ValueError, check_dbm_type, 'sdbm')
+
+
+if __name__ == "__main__":
+    main()
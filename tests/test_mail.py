@@ -0,0 +1,314 @@
+#!/usr/bin/env python
+from __future__ import division
+
+__author__ = "Jai Ram Rideout"
+__copyright__ = "Copyright 2013, The QIIME Project"
+__credits__ = ["Jai Ram Rideout"]
+__license__ = "GPL"
+__version__ = "0.1.0-dev"
+__maintainer__ = "Jai Ram Rideout"
+__email__ = "jai.rideout@gmail.com"
+
+"""Test suite for the mail.py module."""
+
+from email import message_from_string
+from glob import glob
+from os import listdir
+from os.path import join
+from shutil import rmtree
+from StringIO import StringIO
+from SocketServer import StreamRequestHandler, ThreadingTCPServer
+from tempfile import mkdtemp
+from threading import Lock, Thread
+from time import time
+from unittest import main, TestCase
+
+from my_microbes.mail import (create_email_message, DeliveryJournal, Mailer,
+                              MailSpool, RateLimiter)
+
+class FakeSMTPHandler(StreamRequestHandler):
+    """Speaks just enough SMTP to accept messages from smtplib.SMTP."""
+
+    def handle(self):
+        server = self.server
+        with server.lock:
+            server.num_connections += 1
+        self.reply('220 localhost ESMTP')
+
+        while True:
+            line = self.rfile.readline()
+            if not line:
+                break
+            command = line.strip().split(' ', 1)[0].upper()
+
+            if command == 'EHLO':
+                self.reply('250-localhost\r\n250 AUTH PLAIN')
+            elif command == 'AUTH':
+                with server.lock:
+                    server.num_logins += 1
+                self.reply('235 Authentication successful')
+            elif command == 'MAIL':
+                with server.lock:
+                    drop = server.num_drops > 0
+                    server.num_drops -= 1
+                if drop:
+                    break
+                self.reply('250 OK')
+            elif command == 'RCPT':
+                address = line.split(':', 1)[1].strip().strip('<>')
+                if address in server.rejected_addresses:
+                    self.reply('550 No such user')
+                else:
+                    self.reply('250 OK')
+            elif command == 'DATA':
+                self.reply('354 End data with <CR><LF>.<CR><LF>')
+                data = []
+                for data_line in iter(self.rfile.readline, ''):
+                    if data_line == '.\r\n':
+                        break
+                    data.append(data_line)
+                with server.lock:
+                    server.messages.append(''.join(data))
+                self.reply('250 OK')
+            elif command in ('RSET', 'NOOP'):
+                self.reply('250 OK')
+            elif command == 'QUIT':
+                self.reply('221 Bye')
+                break
+            else:
+                self.reply('502 Command not implemented')
+
+    def reply(self, text):
+        self.wfile.write(text + '\r\n')
+        self.wfile.flush()
+
+
+class FakeSMTPServer(ThreadingTCPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self):
+        ThreadingTCPServer.__init__(self, ('127.0.0.1', 0), FakeSMTPHandler)
+        self.lock = Lock()
+        self.num_connections = 0
+        self.num_logins = 0
+        self.messages = []
+        # The number of connections to drop instead of accepting a message.
+        self.num_drops = 0
+        self.rejected_addresses = set()
+
+
+class MailTests(TestCase):
+    """Tests for the mail.py module."""
+
+    def setUp(self):
+        """Define some sample data that will be used by the tests."""
+        self.tmp_dir = mkdtemp(prefix='my_microbes_tests_')
+
+        self.server = FakeSMTPServer()
+        self.server_thread = Thread(target=self.server.serve_forever)
+        self.server_thread.daemon = True
+        self.server_thread.start()
+        self.port = self.server.server_address[1]
+
+        self.messages = []
+        for i in range(6):
+            personal_id = 'P%d' % i
+            address = '%s@example.com' % personal_id
+            self.messages.append((personal_id, [address],
+                    create_email_message('me@example.com', [address],
+                                         'Hello', 'Hi %s!' % personal_id)))
+
+    def tearDown(self):
+        """Remove temporary files and stop the fake SMTP server."""
+        self.server.shutdown()
+        self.server.server_close()
+        rmtree(self.tmp_dir)
+
+    def create_mailer(self, **kwargs):
+        return Mailer('127.0.0.1', self.port, 'me@example.com', 'secret',
+                      use_tls=False, backoff=0, timeout=10, **kwargs)
+
+    def test_create_email_message(self):
+        """Test creating a message with an attachment."""
+        msg = create_email_message('me@example.com',
+                                   ['a@example.com', 'b@example.com'],
+                                   'Hello', 'Hi there!',
+                                   [('foo.txt', StringIO('bar'))])
+        self.assertEqual(msg['From'], 'me@example.com')
+        self.assertEqual(msg['To'], 'a@example.com, b@example.com')
+        self.assertEqual(msg['Subject'], 'Hello')
+
+        parts = msg.get_payload()
+        self.assertEqual(len(parts), 2)
+        self.assertEqual(parts[0].get_filename(), 'foo.txt')
+        self.assertEqual(parts[1].get_payload(), 'Hi there!')
+
+        msg = create_email_message('me@example.com', ['a@example.com'],
+                                   'Hello', 'Hi there!')
+        self.assertEqual(msg.get_content_type(), 'text/plain')
+        self.assertEqual(msg['To'], 'a@example.com')
+        self.assertEqual(msg.get_payload(), 'Hi there!')
+
+    def test_send(self):
+        """Test sending messages over reused connections."""
+        sent = []
+        mailer = self.create_mailer(connections=2)
+        delivered, failed = mailer.send(self.messages,
+                callback=lambda key, recipients, error: sent.append(
+                        (key, recipients, error)))
+
+        self.assertEqual(sorted(delivered), ['P0', 'P1', 'P2', 'P3', 'P4',
+                                             'P5'])
+        self.assertEqual(failed, {})
+        self.assertEqual(len(self.server.messages), 6)
+        self.assertEqual(sorted(sent),
+                         [('P%d' % i, ['P%d@example.com' % i], None)
+                          for i in range(6)])
+
+        # Each connection is logged into once.
+        self.assertTrue(1 <= self.server.num_connections <= 2)
+        self.assertEqual(self.server.num_logins, self.server.num_connections)
+
+    def test_send_no_messages(self):
+        """Test sending nothing doesn't open any connections."""
+        self.assertEqual(self.create_mailer().send([]), ([], {}))
+        self.assertEqual(self.server.num_connections, 0)
+
+    def test_send_retry(self):
+        """Test resending messages over a new connection after a drop."""
+        self.server.num_drops = 2
+        mailer = self.create_mailer(connections=1, max_retries=2)
+        delivered, failed = mailer.send(self.messages[:3])
+
+        self.assertEqual(delivered, ['P0', 'P1', 'P2'])
+        self.assertEqual(failed, {})
+        self.assertEqual(len(self.server.messages), 3)
+        self.assertEqual(self.server.num_connections, 3)
+
+    def test_send_failures(self):
+        """Test messages that can't be delivered are reported."""
+        self.server.rejected_addresses.add('P1@example.com')
+        self.server.num_drops = 1
+        mailer = self.create_mailer(connections=1, max_retries=0)
+        delivered, failed = mailer.send(self.messages[:3])
+
+        # P0 is dropped (and not retried) and P1 is rejected. The connection
+        # is still used for P2 after P1 is rejected.
+        self.assertEqual(delivered, ['P2'])
+        self.assertEqual(sorted(failed), ['P0', 'P1'])
+        self.assertEqual(failed['P1'].recipients.keys(), ['P1@example.com'])
+        self.assertEqual(self.server.num_connections, 2)
+
+    def test_send_journal(self):
+        """Test resuming an interrupted run from the journal."""
+        journal_fp = join(self.tmp_dir, 'recipients.txt.sent')
+        with open(journal_fp, 'w') as journal_f:
+            # P5 was only partially written.
+            journal_f.write('P0\nP2\nP5')
+
+        journal = DeliveryJournal(journal_fp)
+        self.assertEqual(len(journal), 2)
+        self.assertTrue('P2' in journal)
+        self.assertFalse('P5' in journal)
+
+        delivered, failed = self.create_mailer().send(self.messages, journal)
+        journal.close()
+        self.assertEqual(sorted(delivered), ['P1', 'P3', 'P4', 'P5'])
+        self.assertEqual(len(self.server.messages), 4)
+
+        journal = DeliveryJournal(journal_fp)
+        self.assertEqual(len(journal), 6)
+        self.assertEqual(self.create_mailer().send(self.messages, journal),
+                         ([], {}))
+        journal.close()
+
+        with open(journal_fp, 'U') as journal_f:
+            self.assertEqual(journal_f.readlines()[:3],
+                             ['P0\n', 'P2\n', 'P5\n'])
+
+    def test_delivery_journal_not_created(self):
+        """Test the journal file isn't created until a key is recorded."""
+        journal_fp = join(self.tmp_dir, 'recipients.txt.sent')
+        journal = DeliveryJournal(journal_fp)
+        journal.close()
+        self.assertRaises(IOError, open, journal_fp)
+
+    def test_mail_spool_maildir(self):
+        """Test writing messages to a maildir."""
+        spool_dir = join(self.tmp_dir, 'Maildir')
+        journal = DeliveryJournal(join(self.tmp_dir, 'recipients.txt.sent'))
+        journal.record('P3')
+
+        sent = []
+        delivered, failed = MailSpool(spool_dir, threads=3).send(
+                self.messages, journal,
+                lambda key, recipients, error: sent.append(key))
+        journal.close()
+
+        self.assertEqual(sorted(delivered), ['P0', 'P1', 'P2', 'P4', 'P5'])
+        self.assertEqual(failed, {})
+        self.assertEqual(sorted(sent), sorted(delivered))
+        self.assertEqual(len(journal), 6)
+        self.assertEqual(listdir(join(spool_dir, 'tmp')), [])
+        self.assertEqual(listdir(join(spool_dir, 'cur')), [])
+
+        message_fps = glob(join(spool_dir, 'new', '*'))
+        self.assertEqual(len(message_fps), 5)
+        messages = [message_from_string(open(fp, 'rb').read())
+                    for fp in message_fps]
+        self.assertEqual(sorted([message['To'] for message in messages]),
+                         ['P%d@example.com' % i for i in (0, 1, 2, 4, 5)])
+        self.assertEqual(len(set([message['Message-ID']
+                                  for message in messages])), 5)
+        self.assertEqual(sorted([message.get_payload()
+                                 for message in messages]),
+                         ['Hi P%d!\n' % i for i in (0, 1, 2, 4, 5)])
+
+        # Nothing is written if everyone was already emailed.
+        self.assertEqual(MailSpool(spool_dir).send(self.messages, journal),
+                         ([], {}))
+        self.assertEqual(len(listdir(join(spool_dir, 'new'))), 5)
+
+    def test_mail_spool_pickup(self):
+        """Test writing messages to a pickup directory."""
+        spool_dir = join(self.tmp_dir, 'pickup')
+        delivered, failed = MailSpool(spool_dir, maildir=False).send(
+                self.messages[:2] + [('P9', ['P9@example.com'], 'Hi!\n')])
+
+        self.assertEqual(sorted(delivered), ['P0', 'P1', 'P9'])
+        self.assertEqual(failed, {})
+        message_fps = sorted(listdir(spool_dir))
+        self.assertEqual(len(message_fps), 3)
+        self.assertTrue(all([fp.endswith('.eml') for fp in message_fps]))
+
+        message_strs = [open(join(spool_dir, fp), 'rb').read()
+                        for fp in message_fps]
+        self.assertTrue('Hi!\r\n' in message_strs)
+        for message_str in message_strs:
+            self.assertFalse('\n' in message_str.replace('\r\n', ''))
+
+    def test_rate_limiter(self):
+        """Test events are spaced out by the rate limiter."""
+        rate_limiter = RateLimiter(20)
+        start = time()
+        for i in range(5):
+            rate_limiter.wait()
+        self.assertTrue(time() - start >= 0.19)
+
+        start = time()
+        rate_limiter = RateLimiter()
+        for i in range(100):
+            rate_limiter.wait()
+        self.assertTrue(time() - start < 0.1)
+
+    def test_invalid_input(self):
+        """Test invalid arguments raise errors."""
+        self.assertRaises(ValueError, RateLimiter, 0)
+        self.assertRaises(ValueError, self.create_mailer, connections=0)
+        self.assertRaises(ValueError, self.create_mailer, max_retries=-1)
+        self.assertRaises(ValueError, MailSpool, self.tmp_dir, threads=0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,140 @@
+#!/usr/bin/env python
+from __future__ import division
+
+__author__ = "Jai Ram Rideout"
+__copyright__ = "Copyright 2013, The QIIME Project"
+__credits__ = ["Jai Ram Rideout"]
+__license__ = "GPL"
+__version__ = "0.1.0-dev"
+__maintainer__ = "Jai Ram Rideout"
+__email__ = "jai.rideout@gmail.com"
+
+"""Test suite for the manifest.py module."""
+
+import sys
+from os import makedirs, rename
+from os.path import exists, join
+from shutil import rmtree
+from tempfile import mkdtemp
+from unittest import main, TestCase
+
+from my_microbes.manifest import (BuildManifest, hash_inputs, hash_modules,
+                                  hash_path)
+
+class ManifestTests(TestCase):
+    """Tests for the manifest.py module."""
+
+    def setUp(self):
+        """Define some sample data that will be used by the tests."""
+        self.output_dir = mkdtemp()
+        self.manifest_fp = join(self.output_dir, 'manifest.json')
+
+        self.stage_dir = join(self.output_dir, 'foo', 'beta_diversity')
+        makedirs(self.stage_dir)
+
+    def tearDown(self):
+        """Remove temporary files created by the tests."""
+        rmtree(self.output_dir)
+
+    def write_file(self, fp, s):
+        f = open(fp, 'w')
+        f.write(s)
+        f.close()
+
+    def test_build_manifest(self):
+        """Test recording stages and reading them back in."""
+        manifest = BuildManifest(self.manifest_fp, self.output_dir)
+        self.assertFalse(manifest.is_current('beta_diversity', 'abc'))
+        self.assertEqual(manifest.get_outputs('beta_diversity'), [])
+        self.assertEqual(manifest.get_html('beta_diversity'), '')
+
+        manifest.record('beta_diversity', 'abc', [self.stage_dir],
+                        '<p>foo</p>')
+        manifest.save()
+        self.assertFalse(exists(self.manifest_fp + '.tmp'))
+
+        manifest = BuildManifest(self.manifest_fp, self.output_dir)
+        self.assertTrue(manifest.is_current('beta_diversity', 'abc'))
+        self.assertFalse(manifest.is_current('beta_diversity', 'abd'))
+        self.assertFalse(manifest.is_current('taxa_summary_plots', 'abc'))
+        self.assertEqual(manifest.get_outputs('beta_diversity'),
+                         [self.stage_dir])
+        self.assertEqual(manifest.get_html('beta_diversity'), '<p>foo</p>')
+
+        # A stage isn't current if any of its outputs are missing.
+        rmtree(self.stage_dir)
+        self.assertFalse(manifest.is_current('beta_diversity', 'abc'))
+
+    def test_build_manifest_moved_output_dir(self):
+        """Test that outputs are relative to the output directory."""
+        manifest = BuildManifest(self.manifest_fp, self.output_dir)
+        manifest.record('beta_diversity', 'abc', [self.stage_dir], '')
+        manifest.save()
+
+        moved_dir = self.output_dir + '_moved'
+        rename(self.output_dir, moved_dir)
+        try:
+            manifest = BuildManifest(join(moved_dir, 'manifest.json'),
+                                     moved_dir)
+            self.assertTrue(manifest.is_current('beta_diversity', 'abc'))
+            self.assertEqual(manifest.get_outputs('beta_diversity'),
+                             [join(moved_dir, 'foo', 'beta_diversity')])
+        finally:
+            rename(moved_dir, self.output_dir)
+
+    def test_hash_path(self):
+        """Test hashing the contents of files and directories."""
+        fp = join(self.stage_dir, 'a.txt')
+        self.write_file(fp, 'foo\n')
+        self.assertEqual(hash_path(fp), 'd3b07384d113edec49eaa6238ad5ff00')
+
+        dir_hash = hash_path(self.stage_dir)
+        self.assertEqual(hash_path(self.stage_dir), dir_hash)
+
+        # Adding, modifying, and renaming files changes a directory's hash.
+        self.write_file(join(self.stage_dir, 'b.txt'), 'bar\n')
+        new_dir_hash = hash_path(self.stage_dir)
+        self.assertNotEqual(new_dir_hash, dir_hash)
+
+        self.write_file(fp, 'baz\n')
+        self.assertNotEqual(hash_path(self.stage_dir), new_dir_hash)
+        new_dir_hash = hash_path(self.stage_dir)
+
+        rename(fp, join(self.stage_dir, 'c.txt'))
+        self.assertNotEqual(hash_path(self.stage_dir), new_dir_hash)
+
+        # Missing paths hash the same as an empty file.
+        self.assertEqual(hash_path(None), 'd41d8cd98f00b204e9800998ecf8427e')
+        self.assertEqual(hash_path(join(self.output_dir, 'nonexistent')),
+                         'd41d8cd98f00b204e9800998ecf8427e')
+
+    def test_hash_inputs(self):
+        """Test hashing input values."""
+        exp = hash_inputs('foo', 42, ['a', 'b'], None)
+        self.assertEqual(hash_inputs('foo', 42, ['a', 'b'], None), exp)
+        self.assertNotEqual(hash_inputs('foo', 42, ['b', 'a'], None), exp)
+        self.assertNotEqual(hash_inputs('foo', 43, ['a', 'b'], None), exp)
+
+    def test_hash_modules(self):
+        """Test hashing the source code of modules."""
+        module_fp = join(self.output_dir, 'my_microbes_test_module.py')
+        self.write_file(module_fp, 'foo = 42\n')
+
+        sys.path.insert(0, self.output_dir)
+        try:
+            exp = hash_modules(['my_microbes_test_module'])
+            self.assertEqual(hash_modules(['my_microbes_test_module']), exp)
+            self.assertNotEqual(hash_modules(['my_microbes_test_module',
+                                              'my_microbes.manifest']), exp)
+
+            # The source file is hashed, not the module that was imported.
+            self.write_file(module_fp, 'foo = 43\n')
+            self.assertNotEqual(hash_modules(['my_microbes_test_module']),
+                                exp)
+        finally:
+            sys.path.remove(self.output_dir)
+            sys.modules.pop('my_microbes_test_module', None)
+
+
+if __name__ == "__main__":
+    main()
@@ -13,7 +13,11 @@ __email__ = "jai.rideout@gmail.com"
 
 from unittest import main, TestCase
 
-from my_microbes.parse import (parse_email_settings, parse_recipients,
+from numpy import isnan
+
+from my_microbes.parse import (parse_collated_alpha_diversity,
+                               parse_collated_rarefaction,
+                               parse_email_settings, parse_recipients,
                                _can_ignore)
 
 class ParseTests(TestCase):
@@ -75,6 +79,13 @@ class ParseTests(TestCase):
         self.email_settings5 = ["# A comment", "smtp_server\tfoo.bar.com",
                                 "smtp_port\t44"]
 
+        # Collated alpha diversity file with two depths and an n/a value.
+        self.collated_adiv1 = [
+                "\tsequences per sample\titeration\tS1\tS2\tS3",
+                "alpha_rarefaction_10_0.biom\t10\t0\t1\t2\t3",
+                "alpha_rarefaction_10_1.biom\t10\t1\tn/a\t5\t6",
+                "alpha_rarefaction_20_0.biom\t20\t0\t7\t8\t9"]
+
     def test_parse_recipients_standard(self):
         """Test parsing a standard recipients file."""
         exp = {'foo1': ('abcABC123', ['foo@bar.baz']),
@@ -122,6 +133,38 @@ class ParseTests(TestCase):
         self.assertRaises(ValueError,
                           parse_email_settings, self.email_settings5)
 
+    def test_parse_collated_alpha_diversity(self):
+        """Test parsing a collated alpha diversity file at a single depth."""
+        sample_ids, obs = parse_collated_alpha_diversity(
+                self.collated_adiv1, 10)
+        self.assertEqual(sample_ids, ['S1', 'S2', 'S3'])
+        self.assertEqual(obs.tolist()[0], [1.0, 2.0, 3.0])
+        self.assertEqual(obs[1, 1:].tolist(), [5.0, 6.0])
+        self.assertTrue(isnan(obs[1, 0]))
+
+        sample_ids, obs = parse_collated_alpha_diversity(
+                self.collated_adiv1, 20)
+        self.assertEqual(obs.tolist(), [[7.0, 8.0, 9.0]])
+
+    def test_parse_collated_alpha_diversity_invalid_depth(self):
+        """Test parsing a depth that isn't in the collated file."""
+        self.assertRaises(ValueError, parse_collated_alpha_diversity,
+                          self.collated_adiv1, 42)
+
+    def test_parse_collated_rarefaction(self):
+        """Test parsing every depth of a collated alpha diversity file."""
+        sample_ids, depths, obs = parse_collated_rarefaction(
+                self.collated_adiv1)
+        self.assertEqual(sample_ids, ['S1', 'S2', 'S3'])
+        self.assertEqual(depths.tolist(), [10, 10, 20])
+        self.assertEqual(obs.shape, (3, 3))
+        self.assertEqual(obs[[0, 2]].tolist(), [[1.0, 2.0, 3.0],
+                                                [7.0, 8.0, 9.0]])
+        self.assertTrue(isnan(obs[1, 0]))
+
+        self.assertRaises(ValueError, parse_collated_rarefaction,
+                          self.collated_adiv1 + ['foo.biom\t30\t0\t1\t2'])
+
     def test_can_ignore(self):
         """Test whether comments and whitespace-only lines are ignored."""
         self.assertEqual(_can_ignore("# a comment..."), True)
@@ -0,0 +1,127 @@
+#!/usr/bin/env python
+from __future__ import division
+
+__author__ = "Jai Ram Rideout"
+__copyright__ = "Copyright 2013, The QIIME Project"
+__credits__ = ["Jai Ram Rideout"]
+__license__ = "GPL"
+__version__ = "0.1.0-dev"
+__maintainer__ = "Jai Ram Rideout"
+__email__ = "jai.rideout@gmail.com"
+
+"""Test suite for the pcoa.py module."""
+
+from base64 import b64decode
+from json import loads
+from unittest import main, TestCase
+
+from numpy import frombuffer, isnan
+
+from my_microbes.pcoa import PCoAViewerData
+from my_microbes.sample_index import SampleIndex
+
+class PCoAViewerDataTests(TestCase):
+    """Tests for the pcoa.py module."""
+
+    def setUp(self):
+        """Define some sample data that will be used by the tests."""
+        # SampleID, PersonalID, BodySite, WeeksSinceStart.
+        self.sample_index = SampleIndex([['S1', 'P1', 'gut', '10'],
+                                         ['S2', 'P1', 'gut', '2'],
+                                         ['S3', 'P1', 'palm', '1'],
+                                         ['S4', 'P2', 'gut', '1'],
+                                         ['S5', 'P2', 'palm', 'n/a'],
+                                         ['S6', 'P2', 'palm', '3']],
+                                        0, 1, 2, 3)
+
+        # S6 isn't in the coordinates file and S7 isn't in the mapping file.
+        self.coord_f = ["pc vector number\t1\t2",
+                        "S1\t0.5\t-0.25",
+                        "S2\t0.25\t0.5",
+                        "S7\t1.0\t1.0",
+                        "S3\t-0.5\t0.0",
+                        "S4\t-0.25\t0.75",
+                        "S5\t0.0\t-1.0",
+                        "",
+                        "",
+                        "eigvals\t4.2\t2.1",
+                        "% variation explained\t60.5\t30.25"]
+        self.pcoa_data = PCoAViewerData(self.coord_f, self.sample_index)
+
+    def parse_js(self, js, var_name):
+        """Returns the JSON value assigned to var_name in js."""
+        prefix = 'var %s = ' % var_name
+        self.assertTrue(js.startswith(prefix))
+        self.assertTrue(js.endswith(';\n'))
+        return loads(js[len(prefix):-2])
+
+    def test_init(self):
+        """Test loading the study's coordinates."""
+        self.assertEqual(self.pcoa_data.sample_ids,
+                         ['S1', 'S2', 'S3', 'S4', 'S5'])
+        self.assertEqual(self.pcoa_data.body_sites, ['gut', 'palm'])
+
+        # There are only two axes, so the third is padded with zeros.
+        self.assertEqual(self.pcoa_data.pct_var, [60.5, 30.25, 0.0])
+        self.assertEqual(self.pcoa_data.get_sample_values('S2').tolist(),
+                         [0.25, 0.5, 0.0, 2.0])
+
+        obs = self.pcoa_data.get_sample_values('S5')
+        self.assertEqual(obs[:3].tolist(), [0.0, -1.0, 0.0])
+        self.assertTrue(isnan(obs[3]))
+
+    def test_format_study_data(self):
+        """Test formatting the study's data shared by every individual."""
+        obs = self.parse_js(
+                self.pcoa_data.format_study_data('WeeksSinceStart'),
+                'pcoaStudyData')
+        self.assertEqual(obs['sample_ids'], ['S1', 'S2', 'S3', 'S4', 'S5'])
+        self.assertEqual(obs['body_sites'], ['gut', 'palm'])
+        self.assertEqual(obs['sample_body_sites'], [0, 0, 1, 0, 1])
+        self.assertEqual(obs['pct_var'], [60.5, 30.25, 0.0])
+        self.assertEqual(obs['time_series_category'], 'WeeksSinceStart')
+        self.assertEqual(obs['num_values'], 4)
+
+        # Personal IDs aren't shared.
+        self.assertFalse('P1' in str(obs))
+
+        values = frombuffer(b64decode(obs['values']),
+                            dtype='<f4').reshape(5, 4)
+        self.assertEqual(values[:4].tolist(),
+                         [[0.5, -0.25, 0.0, 10.0],
+                          [0.25, 0.5, 0.0, 2.0],
+                          [-0.5, 0.0, 0.0, 1.0],
+                          [-0.25, 0.75, 0.0, 1.0]])
+        self.assertTrue(isnan(values[4, 3]))
+
+    def test_format_overlay(self):
+        """Test formatting an individual's overlay."""
+        obs = self.parse_js(self.pcoa_data.format_overlay('P1',
+                                                          ['Self', 'Other']),
+                            'pcoaOverlay')
+        self.assertEqual(obs, {'personal_id': 'P1',
+                               'self_title': 'Self',
+                               'other_title': 'Other',
+                               'self_samples': [0, 1, 2],
+                               'trajectories': [
+                                   {'body_site': 'gut', 'samples': [1, 0]},
+                                   {'body_site': 'palm', 'samples': [2]}]})
+
+        # S6 isn't in the coordinates, so P2 only has one palm sample.
+        obs = self.parse_js(self.pcoa_data.format_overlay('P2', ['yes', 'no']),
+                            'pcoaOverlay')
+        self.assertEqual(obs['self_samples'], [3, 4])
+        self.assertEqual(obs['self_title'], 'yes')
+        self.assertEqual(obs['trajectories'],
+                         [{'body_site': 'gut', 'samples': [3]},
+                          {'body_site': 'palm', 'samples': [4]}])
+
+        obs = self.parse_js(self.pcoa_data.format_overlay('P42',
+                                                          ['Self', 'Other']),
+                            'pcoaOverlay')
+        self.assertEqual(obs['self_samples'], [])
+        self.assertEqual(obs['trajectories'], [])
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,145 @@
+#!/usr/bin/env python
+from __future__ import division
+
+__author__ = "Jai Ram Rideout"
+__copyright__ = "Copyright 2013, The QIIME Project"
+__credits__ = ["Jai Ram Rideout"]
+__license__ = "GPL"
+__version__ = "0.1.0-dev"
+__maintainer__ = "Jai Ram Rideout"
+__email__ = "jai.rideout@gmail.com"
+
+"""Test suite for the plot.py module."""
+
+from os.path import exists, join
+from shutil import rmtree
+from tempfile import mkdtemp
+from unittest import main, TestCase
+
+from matplotlib.image import imread
+from qiime.pycogent_backports.distribution_plots import generate_box_plots
+
+from my_microbes.plot import BoxplotRenderer, plot_rarefaction_averages
+
+class PlotTests(TestCase):
+    """Tests for the plot.py module."""
+
+    def setUp(self):
+        """Define some sample data that will be used by the tests."""
+        self.output_dir = mkdtemp()
+        self.renderer = BoxplotRenderer()
+
+        self.dists1 = [[1, 2, 3, 4, 5], [2, 3, 4], [10, 12, 11, 15],
+                       [0.5, 1.5, 7]]
+        self.labels1 = ['forehead (Other)', 'forehead (Self)', 'gut (Other)',
+                        'gut (Self)']
+        self.dists2 = [[100, 200, 300], [150, 250]]
+        self.labels2 = ['a (Other)', 'a (Self)']
+
+    def tearDown(self):
+        """Remove temporary files created by the tests."""
+        rmtree(self.output_dir)
+
+    def test_render(self):
+        """Test rendering plots that look the same as generate_box_plots'."""
+        for i, (dists, labels) in enumerate([(self.dists1, self.labels1),
+                                             (self.dists2, self.labels2),
+                                             (self.dists1, self.labels1)]):
+            self.renderer.submit(join(self.output_dir, 'new%d.png' % i),
+                                 dists, labels, title='Foo', x_label='Bar',
+                                 y_label='Baz')
+
+            exp_fig = generate_box_plots(dists, x_tick_labels=labels,
+                                         title='Foo', x_label='Bar',
+                                         y_label='Baz')
+            exp_fig.savefig(join(self.output_dir, 'exp%d.png' % i))
+
+        obs = self.renderer.wait()
+        self.assertEqual([fp for fp, elapsed_time in obs],
+                         [join(self.output_dir, 'new%d.png' % i)
+                          for i in range(3)])
+        for fp, elapsed_time in obs:
+            self.assertTrue(elapsed_time >= 0)
+
+        # The same figure is reused for each plot.
+        self.assertEqual(len(self.renderer._templates), 1)
+
+        for i in range(3):
+            obs_image = imread(join(self.output_dir, 'new%d.png' % i))
+            exp_image = imread(join(self.output_dir, 'exp%d.png' % i))
+            self.assertEqual(obs_image.shape, exp_image.shape)
+            self.assertTrue((obs_image == exp_image).all())
+
+        # Timings are only returned once.
+        self.assertEqual(self.renderer.wait(), [])
+
+    def test_render_separate_templates(self):
+        """Test that each title and set of axis labels gets its own figure."""
+        self.renderer.submit(join(self.output_dir, 'a.png'), self.dists1,
+                             self.labels1, title='Foo', y_label='Chao1')
+        self.renderer.submit(join(self.output_dir, 'b.png'), self.dists2,
+                             self.labels2, title='Foo', y_label='PD')
+        self.assertEqual(len(self.renderer.wait()), 2)
+        self.assertEqual(len(self.renderer._templates), 2)
+        self.assertTrue(exists(join(self.output_dir, 'a.png')))
+        self.assertTrue(exists(join(self.output_dir, 'b.png')))
+
+    def test_render_error(self):
+        """Test that rendering errors are raised by wait."""
+        self.renderer.submit(join(self.output_dir, 'a.png'), self.dists1,
+                             self.labels1)
+        self.renderer.submit(join(self.output_dir, 'nonexistent', 'b.png'),
+                             self.dists2, self.labels2)
+        self.renderer.submit(join(self.output_dir, 'c.png'), self.dists2,
+                             self.labels2)
+        self.assertRaises(IOError, self.renderer.wait)
+
+        # The other plots are still rendered.
+        self.assertTrue(exists(join(self.output_dir, 'a.png')))
+        self.assertTrue(exists(join(self.output_dir, 'c.png')))
+        self.assertEqual(self.renderer.wait(), [])
+
+    def test_wait_nothing_submitted(self):
+        """Test waiting when no plots have been submitted."""
+        self.assertEqual(self.renderer.wait(), [])
+
+    def test_plot_rarefaction_averages(self):
+        """Test plotting groups' averages at each rarefaction depth."""
+        output_fp = join(self.output_dir, 'chao1.png')
+        plot_rarefaction_averages(output_fp, [10, 20, 30],
+                [('gut (Self)', '#0000ff', '-', [1, 2, 3], [0.5, 0.5, 0]),
+                 ('gut (Other)', '#0000ff', '--', [1, 1.5, float('nan')],
+                  [0.25, float('nan'), float('nan')])],
+                40, title='Foo', y_label='Chao1')
+        self.assertEqual(imread(output_fp).shape[2], 4)
+
+        # Nothing to plot.
+        plot_rarefaction_averages(output_fp, [10], [], 20)
+        self.assertTrue(exists(output_fp))
+
+    def test_plot_rarefaction_averages_while_rendering(self):
+        """Test plotting while boxplots are rendered in the background."""
+        for i in range(5):
+            self.renderer.submit(join(self.output_dir, 'new%d.png' % i),
+                                 self.dists1, self.labels1, title='Foo',
+                                 x_label='Bar', y_label='Baz')
+        for i in range(5):
+            plot_rarefaction_averages(
+                    join(self.output_dir, 'chao1_%d.png' % i), [10, 20],
+                    [('gut (Self)', '#0000ff', '-', [1, 2], [0.5, 0.5])], 30,
+                    title='Foo', y_label='Chao1')
+        self.assertEqual(len(self.renderer.wait()), 5)
+
+        exp_fig = generate_box_plots(self.dists1, x_tick_labels=self.labels1,
+                                     title='Foo', x_label='Bar',
+                                     y_label='Baz')
+        exp_fig.savefig(join(self.output_dir, 'exp.png'))
+        exp_image = imread(join(self.output_dir, 'exp.png'))
+        for i in range(5):
+            obs_image = imread(join(self.output_dir, 'new%d.png' % i))
+            self.assertTrue((obs_image == exp_image).all())
+            self.assertTrue(exists(join(self.output_dir, 'chao1_%d.png' % i)))
+
+
+if __name__ == "__main__":
+    main()
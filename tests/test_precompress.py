@@ -0,0 +1,127 @@
+#!/usr/bin/env python
+from __future__ import division
+
+__author__ = "Jai Ram Rideout"
+__copyright__ = "Copyright 2013, The QIIME Project"
+__credits__ = ["Jai Ram Rideout"]
+__license__ = "GPL"
+__version__ = "0.1.0-dev"
+__maintainer__ = "Jai Ram Rideout"
+__email__ = "jai.rideout@gmail.com"
+
+"""Test suite for the precompress.py module."""
+
+from gzip import GzipFile
+from os import makedirs, utime
+from os.path import dirname, exists, getmtime, join
+from shutil import rmtree
+from tempfile import mkdtemp
+from unittest import main, TestCase
+
+from my_microbes.precompress import (brotli, check_encodings,
+                                     precompress_files)
+
+class PrecompressTests(TestCase):
+    """Tests for the precompress.py module."""
+
+    def setUp(self):
+        """Define some sample data that will be used by the tests."""
+        self.tmp_dir = mkdtemp(prefix='my_microbes_tests_')
+
+        self.html = '<html>\n%s</html>\n' % ('<p>Hello, world!</p>\n' * 50)
+        self.files = {
+            'index.html': self.html,
+            join('js', 'helpers.js'): 'var x = 42;\n' * 100,
+            # Too small to compress.
+            join('js', 'small.js'): 'var x = 42;\n',
+            # Not compressible.
+            join('images', 'plot.png'): 'x' * 1000,
+            # Hidden.
+            '.build_manifest.json': '{}' * 500,
+            join('.hidden', 'index.html'): self.html
+        }
+        for fp, contents in self.files.items():
+            fp = join(self.tmp_dir, fp)
+            if not exists(dirname(fp)):
+                makedirs(dirname(fp))
+            f = open(fp, 'w')
+            f.write(contents)
+            f.close()
+
+    def tearDown(self):
+        rmtree(self.tmp_dir)
+
+    def read_gzip(self, fp):
+        gzip_f = GzipFile(join(self.tmp_dir, fp + '.gz'))
+        try:
+            return gzip_f.read()
+        finally:
+            gzip_f.close()
+
+    def test_precompress_files(self):
+        """Test writing gzip siblings for compressible files."""
+        num_compressed, num_up_to_date, sizes = precompress_files(
+                [self.tmp_dir])
+        self.assertEqual((num_compressed, num_up_to_date), (2, 0))
+
+        original_size = len(self.html) + len(self.files[join('js',
+                                                             'helpers.js')])
+        self.assertEqual(sizes['gzip'][0], original_size)
+        self.assertTrue(0 < sizes['gzip'][1] < original_size)
+
+        self.assertEqual(self.read_gzip('index.html'), self.html)
+        self.assertEqual(self.read_gzip(join('js', 'helpers.js')),
+                         self.files[join('js', 'helpers.js')])
+        for fp in (join('js', 'small.js'), join('images', 'plot.png'),
+                   '.build_manifest.json', join('.hidden', 'index.html')):
+            self.assertFalse(exists(join(self.tmp_dir, fp + '.gz')))
+
+    def test_precompress_files_up_to_date(self):
+        """Test that only files that have changed are recompressed."""
+        precompress_files([self.tmp_dir])
+        html_gz_fp = join(self.tmp_dir, 'index.html.gz')
+        js_fp = join(self.tmp_dir, 'js', 'helpers.js')
+        js_gz_fp = js_fp + '.gz'
+        html_gz_mtime = getmtime(html_gz_fp)
+
+        # Make the compressed javascript older than its source.
+        utime(js_gz_fp, (getmtime(js_fp) - 10, getmtime(js_fp) - 10))
+
+        num_compressed, num_up_to_date, sizes = precompress_files(
+                [self.tmp_dir], jobs=2)
+        self.assertEqual((num_compressed, num_up_to_date), (1, 1))
+        self.assertEqual(sizes['gzip'][0], len(self.files[join('js',
+                                                               'helpers.js')]))
+        self.assertEqual(getmtime(html_gz_fp), html_gz_mtime)
+        self.assertTrue(getmtime(js_gz_fp) >= getmtime(js_fp))
+
+        # Paths can be files, and missing paths are ignored.
+        self.assertEqual(precompress_files([join(self.tmp_dir, 'index.html'),
+                                            join(self.tmp_dir, 'foo.html')]),
+                         (0, 1, {'gzip': (0, 0)}))
+
+    def test_precompress_files_deterministic(self):
+        """Test that recompressing an unchanged file gives the same bytes."""
+        precompress_files([self.tmp_dir])
+        html_gz_fp = join(self.tmp_dir, 'index.html.gz')
+        exp = open(html_gz_fp, 'rb').read()
+
+        utime(html_gz_fp, (0, 0))
+        precompress_files([self.tmp_dir])
+        self.assertEqual(open(html_gz_fp, 'rb').read(), exp)
+
+    def test_check_encodings(self):
+        """Test that only supported encodings are accepted."""
+        check_encodings(['gzip'])
+        self.assertRaises(ValueError, check_encodings, ['gzip', 'foo'])
+        self.assertRaises(ValueError, precompress_files, [self.tmp_dir],
+                          ['gzip'], 0)
+
+        if brotli is None:
+            self.assertRaises(ValueError, check_encodings, ['br'])
+        else:
+            check_encodings(['gzip', 'br'])
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,133 @@
+#!/usr/bin/env python
+from __future__ import division
+
+__author__ = "Jai Ram Rideout"
+__copyright__ = "Copyright 2013, The QIIME Project"
+__credits__ = ["Jai Ram Rideout"]
+__license__ = "GPL"
+__version__ = "0.1.0-dev"
+__maintainer__ = "Jai Ram Rideout"
+__email__ = "jai.rideout@gmail.com"
+
+"""Test suite for the rep_set.py module."""
+
+from os import utime
+from os.path import exists, getmtime, join
+from shutil import rmtree
+from tempfile import mkdtemp
+from unittest import main, TestCase
+
+from cogent.parse.fasta import MinimalFastaParser
+
+from my_microbes.rep_set import RepSet
+
+class RepSetTests(TestCase):
+    """Tests for the rep_set.py module."""
+
+    def setUp(self):
+        """Define some sample data that will be used by the tests."""
+        self.tmp_dir = mkdtemp(prefix='my_microbes_tests_')
+        self.rep_set_fp = self.write_rep_set(rep_set_text)
+
+    def tearDown(self):
+        rmtree(self.tmp_dir)
+
+    def write_rep_set(self, text, filename='rep_set.fna'):
+        rep_set_fp = join(self.tmp_dir, filename)
+        rep_set_f = open(rep_set_fp, 'wb')
+        rep_set_f.write(text)
+        rep_set_f.close()
+        return rep_set_fp
+
+    def test_get(self):
+        """Test looking up sequences in a rep set."""
+        rep_set = RepSet(self.rep_set_fp)
+        self.assertEqual(len(rep_set), 5)
+        self.assertTrue('4' in rep_set)
+        self.assertFalse('42' in rep_set)
+        self.assertEqual(rep_set.get('42'), None)
+        self.assertEqual(rep_set.get('42', ''), '')
+
+        # Every sequence should match what MinimalFastaParser would parse,
+        # regardless of how the record's lines are laid out.
+        exp = dict([(label.split()[0], seq) for label, seq in
+                    MinimalFastaParser(rep_set_text.splitlines())])
+        for seq_id in exp:
+            self.assertEqual(rep_set.get(seq_id), exp[seq_id])
+        self.assertEqual(rep_set.get('2'), 'ACGTACGTAC')
+        rep_set.close()
+
+    def test_get_crlf(self):
+        """Test looking up sequences in a rep set with CRLF line endings."""
+        rep_set = RepSet(self.write_rep_set(
+                rep_set_text.replace('\n', '\r\n'), 'rep_set_crlf.fna'))
+        self.assertEqual(rep_set.get('1'), 'ACGTACGTACGTACGTAC')
+        self.assertEqual(rep_set.get('3'), 'ACGTACGTACGTACGTACG')
+        self.assertEqual(rep_set.get('5'), 'TT')
+        rep_set.close()
+
+    def test_index(self):
+        """Test that the index is written next to the rep set and reused."""
+        RepSet(self.rep_set_fp)
+        index_fp = self.rep_set_fp + '.fai'
+        index_f = open(index_fp, 'U')
+        index_lines = index_f.readlines()
+        index_f.close()
+        self.assertEqual(index_lines, exp_index_lines)
+
+        # An up-to-date index is used instead of re-reading the rep set.
+        index_f = open(index_fp, 'w')
+        index_f.write('1\t4\t14\t8\t9\n')
+        index_f.close()
+        rep_set = RepSet(self.rep_set_fp)
+        self.assertEqual(len(rep_set), 1)
+        self.assertEqual(rep_set.get('1'), 'ACGT')
+        rep_set.close()
+
+        # An index older than the rep set is rebuilt.
+        mtime = getmtime(self.rep_set_fp)
+        utime(index_fp, (mtime - 10, mtime - 10))
+        rep_set = RepSet(self.rep_set_fp)
+        self.assertEqual(len(rep_set), 5)
+        self.assertEqual(rep_set.get('1'), 'ACGTACGTACGTACGTAC')
+        self.assertFalse(exists(index_fp + '.tmp'))
+        rep_set.close()
+
+    def test_invalid_rep_set(self):
+        """Test that invalid rep sets raise errors."""
+        self.assertRaises(ValueError, RepSet,
+                          self.write_rep_set('ACGT\n>1\nACGT\n', 'bad1.fna'))
+        self.assertRaises(ValueError, RepSet,
+                          self.write_rep_set('>1\nACGT\n>2\n\n>3\nA\n',
+                                             'bad2.fna'))
+
+
+rep_set_text = """>1 sample1_42
+ACGTACGT
+ACGTACGT
+AC
+>2
+ACGTACGTAC
+
+>3 uneven lines
+ACGTACGT
+ACGTAC
+GTACG
+>4
+AC
+
+GT
+>5
+TT"""
+
+# Records 3 and 4 don't have evenly-sized lines, so each is indexed as if its
+# sequence were on a single line.
+exp_index_lines = ['1\t18\t14\t8\t9\n',
+                   '2\t10\t38\t10\t11\n',
+                   '3\t19\t66\t19\t22\n',
+                   '4\t4\t91\t4\t7\n',
+                   '5\t2\t101\t2\t2\n']
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,105 @@
+#!/usr/bin/env python
+from __future__ import division
+
+__author__ = "Jai Ram Rideout"
+__copyright__ = "Copyright 2013, The QIIME Project"
+__credits__ = ["Jai Ram Rideout"]
+__license__ = "GPL"
+__version__ = "0.1.0-dev"
+__maintainer__ = "Jai Ram Rideout"
+__email__ = "jai.rideout@gmail.com"
+
+"""Test suite for the sample_index.py module."""
+
+from unittest import main, TestCase
+
+from my_microbes.sample_index import SampleIndex
+
+class SampleIndexTests(TestCase):
+    """Tests for the sample_index.py module."""
+
+    def setUp(self):
+        """Define some sample data that will be used by the tests."""
+        # SampleID, PersonalID, BodySite, WeeksSinceStart.
+        self.mapping_data = [['S1', 'P1', 'Gut', '1'],
+                             ['S2', 'P1', 'Gut', '2'],
+                             ['S3', 'P1', 'Palm', '1'],
+                             ['S4', 'P2', 'Gut', '1'],
+                             ['S5', 'P2', 'Palm', '1'],
+                             ['S6', 'P3', 'Palm', '2']]
+        self.index = SampleIndex(self.mapping_data, 0, 1, 2, 3)
+
+    def test_init_duplicate_sample_ids(self):
+        """Test that sample IDs must be unique."""
+        self.assertRaises(ValueError, SampleIndex,
+                          self.mapping_data + [['S1', 'P3', 'Gut', '3']],
+                          0, 1, 2, 3)
+
+    def test_get_sample(self):
+        """Test looking up a sample's metadata."""
+        self.assertEqual(self.index.get_sample('S3'),
+                         ('P1', 'Palm', '1', False))
+        self.index.mark_rarefied(['S3'])
+        self.assertEqual(self.index.get_sample('S3'),
+                         ('P1', 'Palm', '1', True))
+        self.assertRaises(KeyError, self.index.get_sample, 'S42')
+
+    def test_get_body_sites(self):
+        """Test getting the study's and an individual's body sites."""
+        self.assertEqual(self.index.get_body_sites(), ['Gut', 'Palm'])
+        self.assertEqual(self.index.get_body_sites('P1'), ['Gut', 'Palm'])
+        self.assertEqual(self.index.get_body_sites('P3'), ['Palm'])
+        self.assertEqual(self.index.get_body_sites('P42'), [])
+
+    def test_count_samples(self):
+        """Test counting an individual's samples."""
+        self.assertEqual(self.index.count_samples('P1'), 3)
+        self.assertEqual(self.index.count_samples('P1', 'Gut'), 2)
+        self.assertEqual(self.index.count_samples('P1', rarefied=True), 0)
+        self.assertEqual(self.index.count_samples('P42'), 0)
+        self.assertEqual(self.index.count_samples('P3', 'Gut'), 0)
+
+        # Unknown and repeated sample IDs are ignored.
+        self.index.mark_rarefied(['S1', 'S3', 'S42'])
+        self.index.mark_rarefied(['S1'])
+        self.assertEqual(self.index.count_samples('P1', rarefied=True), 2)
+        self.assertEqual(self.index.count_samples('P1', 'Gut', True), 1)
+        self.assertEqual(self.index.count_samples('P1', 'Gut'), 2)
+
+    def test_mark_rarefied_body_site(self):
+        """Test that a per-body-site table only flags its body site."""
+        self.index.mark_rarefied(['S1', 'S3', 'S5'], 'Palm')
+        self.assertEqual(self.index.count_samples('P1', 'Gut', True), 0)
+        self.assertEqual(self.index.count_samples('P1', 'Palm', True), 1)
+        self.assertEqual(self.index.count_samples('P2', 'Palm', True), 1)
+
+    def test_is_comparable(self):
+        """Test checking whether an individual can be compared at a site."""
+        self.assertFalse(self.index.is_comparable('P1', 'Gut'))
+
+        # Only two samples at the body site.
+        self.index.mark_rarefied(['S1', 'S4'])
+        self.assertFalse(self.index.is_comparable('P1', 'Gut'))
+
+        # Nobody else has samples at the body site.
+        self.index.mark_rarefied(['S2'])
+        self.assertTrue(self.index.is_comparable('P1', 'Gut'))
+        self.assertTrue(self.index.is_comparable('P2', 'Gut'))
+        self.assertFalse(self.index.is_comparable('P3', 'Gut'))
+        self.assertFalse(self.index.is_comparable('P1', 'Foot'))
+
+        self.index.mark_rarefied(['S3', 'S6'])
+        self.assertFalse(self.index.is_comparable('P1', 'Palm'))
+        self.assertEqual(self.index.get_comparable_body_sites('P1'),
+                         ['Gut'])
+
+        self.index.mark_rarefied(['S5'])
+        self.assertEqual(self.index.get_comparable_body_sites('P1'),
+                         ['Gut', 'Palm'])
+        self.assertEqual(self.index.get_comparable_body_sites('P3'),
+                         ['Palm'])
+        self.assertEqual(self.index.get_comparable_body_sites('P42'), [])
+
+
+if __name__ == "__main__":
+    main()
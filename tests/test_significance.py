@@ -0,0 +1,154 @@
+#!/usr/bin/env python
+from __future__ import division
+
+__author__ = "Jai Ram Rideout"
+__copyright__ = "Copyright 2013, The QIIME Project"
+__credits__ = ["Jai Ram Rideout"]
+__license__ = "GPL"
+__version__ = "0.1.0-dev"
+__maintainer__ = "Jai Ram Rideout"
+__email__ = "jai.rideout@gmail.com"
+
+"""Test suite for the significance.py module."""
+
+from biom.parse import parse_biom_table
+from cogent.maths.stats.distribution import f_high
+from cogent.util.unit_test import TestCase, main
+from numpy import array, inf
+from qiime.parse import parse_mapping_file
+
+from my_microbes.aggregate import get_sample_groups
+from my_microbes.significance import (_betai, compare_individuals_to_study,
+                                      _correct_probs)
+
+class SignificanceTests(TestCase):
+    """Tests for the significance.py module."""
+
+    def setUp(self):
+        """Define some sample data that will be used by the tests."""
+        self.otu_table = parse_biom_table(otu_table_str.split('\n'))
+        mapping_data = parse_mapping_file(mapping_str.split('\n'))[0]
+        self.sample_groups = get_sample_groups(mapping_data, 0, [1, 2])
+
+    def test_compare_individuals_to_study(self):
+        """Test comparing each individual's OTU abundances to the rest."""
+        obs = compare_individuals_to_study(self.otu_table, self.sample_groups)
+
+        # Palm only has two samples, and OTU2 is in too few samples to be
+        # tested.
+        self.assertEqual(sorted(obs), ['NAU123', 'NAU456', 'NAU789'])
+        for personal_id in obs:
+            self.assertEqual(obs[personal_id].keys(), ['Gut'])
+
+        # p-values match qiime.pycogent_backports.test.ANOVA_one_way's.
+        obs_rows = obs['NAU123']['Gut']
+        self.assertEqual([row[0] for row in obs_rows], ['OTU0', 'OTU1'])
+        self.assertFloatEqual(obs_rows[0][1:6],
+                              (0.00092843855957250, 0.0018568771191450,
+                               0.0018568771191450, 0.55, 0.125))
+        self.assertEqual(obs_rows[0][6], 'k__Bacteria;p__Firmicutes')
+        self.assertFloatEqual(obs_rows[1][1:6],
+                              (0.0016551683945105, 0.0033103367890211,
+                               0.0016551683945105, 0.45, 0.85))
+
+        # Sorted by p-value, and corrected p-values are capped at 1.
+        obs_rows = obs['NAU456']['Gut']
+        self.assertEqual([row[0] for row in obs_rows], ['OTU0', 'OTU1'])
+        self.assertFloatEqual([row[2] for row in obs_rows],
+                              [0.86027923658547, 1.0])
+
+        obs_rows = obs['NAU789']['Gut']
+        self.assertEqual([row[0] for row in obs_rows], ['OTU1', 'OTU0'])
+
+    def test_compare_individuals_to_study_min_fraction(self):
+        """Test changing the fraction of samples an OTU must be in."""
+        obs = compare_individuals_to_study(self.otu_table, self.sample_groups,
+                                           min_fraction=0.1)
+
+        # OTU2 is now tested, which also affects the corrected p-values.
+        obs_rows = obs['NAU456']['Gut']
+        self.assertEqual([row[0] for row in obs_rows],
+                         ['OTU2', 'OTU0', 'OTU1'])
+        self.assertFloatEqual(obs_rows[0][1:4],
+                              (0.17780780835622, 0.53342342506866,
+                               0.53342342506866))
+        self.assertEqual(obs_rows[0][6], '')
+        self.assertFloatEqual(obs_rows[1][3], 0.64520942743911)
+
+    def test_compare_individuals_to_study_single_sample(self):
+        """Test an individual with a single sample has no testable OTUs."""
+        # NAU789 only has S5 in the table without S6 (S9 isn't in it).
+        sample_groups = [(sample_id, group)
+                         for sample_id, group in self.sample_groups
+                         if sample_id != 'S6']
+        obs = compare_individuals_to_study(self.otu_table, sample_groups)
+
+        # As with ANOVA_one_way, the p-values are undefined, so no OTUs are
+        # listed for NAU789. The other individuals are still compared to
+        # everyone else (including NAU789's sample).
+        self.assertEqual(obs['NAU789']['Gut'], [])
+        self.assertEqual([row[0] for row in obs['NAU123']['Gut']],
+                         ['OTU0', 'OTU1'])
+
+    def test_compare_individuals_to_study_chunks(self):
+        """Test comparing individuals a chunk at a time."""
+        exp = compare_individuals_to_study(self.otu_table, self.sample_groups)
+
+        # NAU123, NAU456, and NAU789 are split into two (and three) chunks.
+        for chunk_size in 2, 1:
+            obs = compare_individuals_to_study(self.otu_table,
+                                               self.sample_groups,
+                                               chunk_size=chunk_size)
+            self.assertEqual(sorted(obs), sorted(exp))
+            for personal_id in exp:
+                self.assertEqual(obs[personal_id].keys(), ['Gut'])
+                obs_rows = obs[personal_id]['Gut']
+                exp_rows = exp[personal_id]['Gut']
+                self.assertEqual([row[0] for row in obs_rows],
+                                 [row[0] for row in exp_rows])
+                self.assertFloatEqual([row[1:6] for row in obs_rows],
+                                      [row[1:6] for row in exp_rows])
+
+        self.assertRaises(ValueError, compare_individuals_to_study,
+                          self.otu_table, self.sample_groups, chunk_size=0)
+
+    def test_correct_probs(self):
+        """Test correcting p-values for multiple comparisons."""
+        bonferroni_probs, fdr_probs = _correct_probs(
+                array([[0.01, 0.04, inf, 0.02], [0.5, inf, inf, 0.1]]))
+        self.assertFloatEqual(bonferroni_probs[0, [0, 1, 3]],
+                              [0.03, 0.12, 0.06])
+        self.assertFloatEqual(fdr_probs[0, [0, 1, 3]], [0.03, 0.04, 0.03])
+        self.assertFloatEqual(bonferroni_probs[1, [0, 3]], [1.0, 0.2])
+        self.assertFloatEqual(fdr_probs[1, [0, 3]], [0.5, 0.2])
+
+    def test_betai(self):
+        """Test the regularized incomplete beta function."""
+        self.assertFloatEqual(_betai(1, 1, [0, 0.25, 0.5, 1]),
+                              [0, 0.25, 0.5, 1])
+        self.assertFloatEqual(_betai(3, 1, [0.5, 0.9]), [0.125, 0.729])
+
+        # Upper tail of the F distribution with one numerator degree of
+        # freedom.
+        f_stats = array([0.001, 0.5, 3.2, 42.0, 1e5])
+        for df in 1, 4, 27, 250:
+            self.assertFloatEqual(_betai(df / 2, 0.5, df / (df + f_stats)),
+                                  [f_high(1, df, f) for f in f_stats])
+
+
+mapping_str = """#SampleID\tBodySite\tPersonalID\tDescription
+S1\tGut\tNAU123\tS1
+S2\tGut\tNAU123\tS2
+S3\tGut\tNAU456\tS3
+S4\tGut\tNAU456\tS4
+S5\tGut\tNAU789\tS5
+S6\tGut\tNAU789\tS6
+S7\tPalm\tNAU123\tS7
+S8\tPalm\tNAU456\tS8
+S9\tGut\tNAU789\tS9"""
+
+otu_table_str = """{"rows": [{"id": "OTU0", "metadata": {"taxonomy": ["k__Bacteria", "p__Firmicutes"]}}, {"id": "OTU1", "metadata": {"taxonomy": ["k__Bacteria", "p__Bacteroidetes"]}}, {"id": "OTU2", "metadata": null}], "format": "Biological Observation Matrix 0.9dev", "data": [[5, 6, 1, 2, 1, 1, 5, 5], [5, 4, 8, 8, 9, 9, 5, 5], [0, 0, 1, 0, 0, 0, 0, 0]], "columns": [{"id": "S1", "metadata": null}, {"id": "S2", "metadata": null}, {"id": "S3", "metadata": null}, {"id": "S4", "metadata": null}, {"id": "S5", "metadata": null}, {"id": "S6", "metadata": null}, {"id": "S7", "metadata": null}, {"id": "S8", "metadata": null}], "generated_by": "QIIME 1.4.0-dev, svn revision 2532", "matrix_type": "dense", "shape": [3, 8], "format_url": "http://biom-format.org", "date": "2011-12-21T00:49:15.978315", "type": "OTU table", "id": null, "matrix_element_type": "float"}"""
+
+
+if __name__ == "__main__":
+    main()
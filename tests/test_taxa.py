@@ -0,0 +1,66 @@
+#!/usr/bin/env python
+from __future__ import division
+
+__author__ = "Jai Ram Rideout"
+__copyright__ = "Copyright 2013, The QIIME Project"
+__credits__ = ["Jai Ram Rideout"]
+__license__ = "GPL"
+__version__ = "0.1.0-dev"
+__maintainer__ = "Jai Ram Rideout"
+__email__ = "jai.rideout@gmail.com"
+
+"""Test suite for the taxa.py module."""
+
+from biom.parse import parse_biom_table
+from cogent.util.unit_test import TestCase, main
+from numpy import array
+
+from my_microbes.taxa import TaxaSummarizer
+
+class TaxaTests(TestCase):
+    """Tests for the taxa.py module."""
+
+    def setUp(self):
+        """Define some sample data that will be used by the tests."""
+        self.otu_table = parse_biom_table(otu_table_str.split('\n'))
+        self.summarizer = TaxaSummarizer(self.otu_table, [3, 2])
+
+    def test_get_taxa(self):
+        """Test retrieving the sorted taxa at each level."""
+        self.assertEqual(self.summarizer.levels, [2, 3])
+        self.assertEqual(self.summarizer.get_taxa(2),
+                         [('k__Bacteria', 'p__Bacteroidetes'),
+                          ('k__Bacteria', 'p__Firmicutes')])
+
+        # Short taxonomies are padded with 'Other'.
+        self.assertEqual(self.summarizer.get_taxa(3),
+                         [('k__Bacteria', 'p__Bacteroidetes', 'Other'),
+                          ('k__Bacteria', 'p__Firmicutes', 'c__Bacilli'),
+                          ('k__Bacteria', 'p__Firmicutes', 'c__Clostridia')])
+
+    def test_summarize(self):
+        """Test summarizing columns of OTU abundances at each level."""
+        obs = self.summarizer.summarize(array([[1, 0], [2, 1], [1, 3]]))
+        self.assertEqual(sorted(obs), [2, 3])
+        self.assertFloatEqual(obs[2], [[0.25, 0.75], [0.75, 0.25]])
+        self.assertFloatEqual(obs[3],
+                              [[0.25, 0.75], [0.25, 0.0], [0.5, 0.25]])
+
+    def test_invalid_input(self):
+        """Test building a summarizer without taxonomy metadata."""
+        otu_table = parse_biom_table(
+                otu_table_str.replace('taxonomy', 'foo').split('\n'))
+        self.assertRaises(KeyError, TaxaSummarizer, otu_table, [2])
+
+        otu_table = parse_biom_table(
+                otu_table_no_md_str.split('\n'))
+        self.assertRaises(ValueError, TaxaSummarizer, otu_table, [2])
+
+
+otu_table_str = """{"rows": [{"id": "OTU0", "metadata": {"taxonomy": ["k__Bacteria", "p__Firmicutes", "c__Bacilli"]}}, {"id": "OTU1", "metadata": {"taxonomy": ["k__Bacteria", "p__Firmicutes", "c__Clostridia"]}}, {"id": "OTU2", "metadata": {"taxonomy": ["k__Bacteria", "p__Bacteroidetes"]}}], "format": "Biological Observation Matrix 0.9dev", "data": [[1, 0], [2, 1], [1, 3]], "columns": [{"id": "S1", "metadata": null}, {"id": "S2", "metadata": null}], "generated_by": "QIIME 1.4.0-dev, svn revision 2532", "matrix_type": "dense", "shape": [3, 2], "format_url": "http://biom-format.org", "date": "2011-12-21T00:49:15.978315", "type": "OTU table", "id": null, "matrix_element_type": "float"}"""
+
+otu_table_no_md_str = """{"rows": [{"id": "OTU0", "metadata": null}], "format": "Biological Observation Matrix 0.9dev", "data": [[1, 0]], "columns": [{"id": "S1", "metadata": null}, {"id": "S2", "metadata": null}], "generated_by": "QIIME 1.4.0-dev, svn revision 2532", "matrix_type": "dense", "shape": [1, 2], "format_url": "http://biom-format.org", "date": "2011-12-21T00:49:15.978315", "type": "OTU table", "id": null, "matrix_element_type": "float"}"""
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,202 @@
+#!/usr/bin/env python
+from __future__ import division
+
+__author__ = "Jai Ram Rideout"
+__copyright__ = "Copyright 2013, The QIIME Project"
+__credits__ = ["Jai Ram Rideout"]
+__license__ = "GPL"
+__version__ = "0.1.0-dev"
+__maintainer__ = "Jai Ram Rideout"
+__email__ = "jai.rideout@gmail.com"
+
+"""Test suite for the timing.py module."""
+
+from os import makedirs
+from os.path import join
+from shutil import rmtree
+from StringIO import StringIO
+from tempfile import mkdtemp
+from unittest import main, TestCase
+
+from qiime.workflow.util import no_status_updates, WorkflowError
+
+from my_microbes.timing import (CommandTimer, format_timings_summary,
+                                get_path_size, get_percentile, parse_timings,
+                                run_command, summarize_timings)
+
+class TimingTests(TestCase):
+    """Tests for the timing.py module."""
+
+    def setUp(self):
+        """Define some sample data that will be used by the tests."""
+        self.tmp_dir = mkdtemp(prefix='my_microbes_tests_')
+        self.timings_fp = join(self.tmp_dir, 'timings.jsonl')
+        self.logger = FakeLogger()
+
+        self.records = [
+            {'stage': 'beta_diversity', 'script': 'make_3d_plots.py',
+             'wall_time': 4.0, 'cpu_time': 3.5, 'peak_rss': 2097152},
+            {'stage': 'beta_diversity', 'script': 'make_3d_plots.py',
+             'wall_time': 6.0, 'cpu_time': 5.0, 'peak_rss': 1048576},
+            {'stage': 'taxa_summary_plots', 'script': 'plot_taxa_summary.py',
+             'wall_time': 2.0, 'cpu_time': 1.0, 'peak_rss': 524288},
+            {'stage': 'taxa_summary_plots',
+             'script': 'compare_taxa_summaries.py', 'wall_time': 1.0,
+             'cpu_time': 0.5, 'peak_rss': 524288}
+        ]
+
+    def tearDown(self):
+        """Remove temporary files."""
+        rmtree(self.tmp_dir)
+
+    def test_command_timer(self):
+        """Test running commands and recording their timings."""
+        in_fp = join(self.tmp_dir, 'in.txt')
+        out_fp = join(self.tmp_dir, 'out.txt')
+        with open(in_fp, 'w') as in_f:
+            in_f.write('abcd')
+
+        timer = CommandTimer(self.timings_fp).for_person('P1')
+        timer([[('Copying (P1)', 'cat %s %s > %s' % (in_fp, in_fp, out_fp))],
+               [('Echoing (P1)', 'echo foo')]], no_status_updates,
+              self.logger, close_logger_on_success=False,
+              stage='beta_diversity', inputs=[in_fp], outputs=[out_fp])
+        self.assertFalse(self.logger.closed)
+        self.assertTrue('# Copying (P1) command \n' in self.logger.getvalue())
+        self.assertTrue('Stdout:\nfoo\n' in self.logger.getvalue())
+
+        with open(self.timings_fp, 'U') as timings_f:
+            records = parse_timings(timings_f)
+        self.assertEqual(len(records), 2)
+        self.assertEqual(records[0]['person_id'], 'P1')
+        self.assertEqual(records[0]['stage'], 'beta_diversity')
+        self.assertEqual(records[0]['title'], 'Copying (P1)')
+        self.assertEqual(records[0]['script'], 'cat')
+        self.assertEqual(records[0]['input_bytes'], 4)
+        self.assertEqual(records[0]['output_bytes'], 8)
+        self.assertEqual(records[0]['exit_status'], 0)
+        self.assertEqual(records[1]['script'], 'echo')
+
+        for record in records:
+            self.assertTrue(record['wall_time'] >= 0)
+            self.assertAlmostEqual(record['cpu_time'],
+                                   record['user_time'] +
+                                   record['system_time'])
+            self.assertTrue(record['peak_rss'] > 0)
+
+        # Records are appended to the file.
+        timer([[('Echoing', 'echo bar')]], no_status_updates, self.logger)
+        self.assertTrue(self.logger.closed)
+        with open(self.timings_fp, 'U') as timings_f:
+            self.assertEqual(len(parse_timings(timings_f)), 3)
+
+    def test_command_timer_failure(self):
+        """Test a failing command is recorded and raises an error."""
+        timer = CommandTimer(self.timings_fp)
+        self.assertRaises(WorkflowError, timer,
+                          [[('Failing', 'echo oops >&2; exit 3')],
+                           [('Not run', 'echo foo')]],
+                          no_status_updates, self.logger)
+        self.assertTrue(self.logger.closed)
+        self.assertTrue('exit status: 3\n' in self.logger.getvalue())
+        self.assertTrue('Stderr\noops\n' in self.logger.getvalue())
+
+        with open(self.timings_fp, 'U') as timings_f:
+            records = parse_timings(timings_f)
+        self.assertEqual(len(records), 1)
+        self.assertEqual(records[0]['exit_status'], 3)
+        self.assertEqual(records[0]['person_id'], None)
+
+    def test_run_command(self):
+        """Test measuring a command's CPU time and memory usage."""
+        stdout, stderr, return_value, usage = run_command(
+                'python -c "x = \'a\' * (64 * 1024 * 1024); '
+                'sum(range(2000000))"')
+        self.assertEqual((stdout, stderr, return_value), ('', '', 0))
+        self.assertTrue(usage['peak_rss'] >= 64 * 1024 * 1024)
+        self.assertTrue(usage['user_time'] + usage['system_time'] > 0)
+        self.assertTrue(usage['wall_time'] > 0)
+
+        self.assertEqual(run_command('kill -9 $$')[2], -9)
+
+    def test_get_path_size(self):
+        """Test computing the sizes of files and directories."""
+        dir_fp = join(self.tmp_dir, 'foo')
+        makedirs(join(dir_fp, 'bar'))
+        with open(join(dir_fp, 'a.txt'), 'w') as f:
+            f.write('abc')
+        with open(join(dir_fp, 'bar', 'b.txt'), 'w') as f:
+            f.write('defgh')
+
+        self.assertEqual(get_path_size(join(dir_fp, 'a.txt')), 3)
+        self.assertEqual(get_path_size(dir_fp), 8)
+        self.assertEqual(get_path_size(join(self.tmp_dir, 'missing')), 0)
+
+    def test_parse_timings(self):
+        """Test parsing a timings file, ignoring a partially-written line."""
+        obs = parse_timings(StringIO('{"wall_time": 1.5}\n\n'
+                                     '{"wall_time": 2.0}\n{"wall_t'))
+        self.assertEqual(obs, [{'wall_time': 1.5}, {'wall_time': 2.0}])
+
+        self.assertRaises(ValueError, parse_timings,
+                          StringIO('{"wall_t\n{"wall_time": 2.0}\n'))
+
+    def test_summarize_timings(self):
+        """Test summarizing timings by stage and by script."""
+        obs = summarize_timings(self.records)
+        self.assertEqual(obs,
+                [('beta_diversity', 2, 10.0, 6.0, 8.5, 2097152),
+                 ('taxa_summary_plots', 2, 3.0, 2.0, 1.5, 524288)])
+
+        obs = summarize_timings(self.records, 'script')
+        self.assertEqual([group[0] for group in obs],
+                         ['make_3d_plots.py', 'plot_taxa_summary.py',
+                          'compare_taxa_summaries.py'])
+
+        self.assertEqual(summarize_timings([]), [])
+
+    def test_get_percentile(self):
+        """Test computing nearest-rank percentiles."""
+        values = range(20, 0, -1)
+        self.assertEqual(get_percentile(values, 95), 19)
+        self.assertEqual(get_percentile(values, 50), 10)
+        self.assertEqual(get_percentile(values, 100), 20)
+        self.assertEqual(get_percentile([4.2], 95), 4.2)
+
+        self.assertRaises(ValueError, get_percentile, [], 95)
+        self.assertRaises(ValueError, get_percentile, [1], 0)
+        self.assertRaises(ValueError, get_percentile, [1], 101)
+
+    def test_format_timings_summary(self):
+        """Test formatting a report of the slowest stages and scripts."""
+        obs = format_timings_summary(self.records, top=1).split('\n')
+        self.assertEqual(obs[0],
+                         'Command timings (4 commands, 13.00 seconds total):')
+        self.assertTrue(obs[2].startswith('Stage '))
+        self.assertEqual(obs[3].split(),
+                         ['beta_diversity', '2', '10.00', '6.00', '8.50',
+                          '2.0'])
+        self.assertTrue(obs[5].startswith('Script '))
+        self.assertEqual(obs[6].split()[0], 'make_3d_plots.py')
+        self.assertEqual(len(obs), 8)
+
+
+class FakeLogger(object):
+    """Stands in for a WorkflowLogger, keeping everything written in memory."""
+
+    def __init__(self):
+        self._buffer = []
+        self.closed = False
+
+    def write(self, s):
+        self._buffer.append(s)
+
+    def close(self):
+        self.closed = True
+
+    def getvalue(self):
+        return ''.join(self._buffer)
+
+
+if __name__ == "__main__":
+    main()
@@ -15,22 +15,37 @@ __email__ = "jc33@nau.edu"
 import sys
 from glob import glob
 from os import chdir, getcwd
-from os.path import abspath, basename, dirname, exists, isdir, isfile, join
+from gzip import GzipFile
+from os.path import (abspath, basename, dirname, exists, getmtime, isdir,
+                     isfile, join)
 from shutil import rmtree
 from StringIO import StringIO
 from tempfile import mkdtemp
 
+from biom.parse import parse_biom_table
+
 from cogent.util.misc import remove_files
+from numpy import array, nan
 from cogent.util.unit_test import TestCase, main
-from qiime.parse import parse_mapping_file
+from qiime.parse import parse_mapping_file, parse_rarefaction_data
 from qiime.util import create_dir, get_qiime_temp_dir, MetadataMap
-from qiime.workflow.util import print_commands
+from qiime.workflow.util import print_commands, WorkflowError
 
+from my_microbes.aggregate import aggregate_otu_table, get_sample_groups
+from my_microbes.htpasswd import hash_password
+from my_microbes.manifest import BuildManifest
+from my_microbes.sample_index import SampleIndex
 from my_microbes.util import (_collect_alpha_diversity_boxplot_data,
-                              _count_num_samples,
-                              _count_per_individual_samples,
+                              _encode_category_values,
+                              _get_boxplot_renderer,
+                              _get_weeks,
+                              _group_alpha_diversity,
+                              _hash_stage_inputs,
+                              _stage_modules,
+                              _stages,
                               create_personal_mapping_file,
                               create_personal_results,
+                              generate_passwords,
                               generate_random_password,
                               get_personal_ids,
                               get_project_dir,
@@ -181,6 +196,29 @@ class UtilTests(TestCase):
                 self.otu_table_fp, self.prefs_fp, 'PersonalID',
                 time_series_category='foo')
 
+        # Invalid number of jobs.
+        self.assertRaises(ValueError, create_personal_results, self.output_dir,
+                self.mapping_fp, self.coord_fp, self.rarefaction_dir,
+                self.otu_table_fp, self.prefs_fp, 'PersonalID', jobs=0)
+
+        # Invalid maximum number of concurrent commands.
+        self.assertRaises(ValueError, create_personal_results, self.output_dir,
+                self.mapping_fp, self.coord_fp, self.rarefaction_dir,
+                self.otu_table_fp, self.prefs_fp, 'PersonalID',
+                max_concurrent_commands=0)
+
+        # The PCoA viewer can't display a directory of coordinates files.
+        self.assertRaises(ValueError, create_personal_results, self.output_dir,
+                self.mapping_fp, self.input_dir, self.rarefaction_dir,
+                self.otu_table_fp, self.prefs_fp, 'PersonalID',
+                pcoa_viewer=True)
+
+        # Invalid precompression encoding.
+        self.assertRaises(ValueError, create_personal_results, self.output_dir,
+                self.mapping_fp, self.coord_fp, self.rarefaction_dir,
+                self.otu_table_fp, self.prefs_fp, 'PersonalID',
+                precompress_encodings=['gzip', 'foo'])
+
     def test_create_personal_results_suppress_all(self):
         """Test running workflow with all output types suppressed."""
         # No output directories should be created under each personal ID
@@ -213,6 +251,388 @@ class UtilTests(TestCase):
                                  glob(join(self.output_dir, personal_id, '*')))
             self.assertEqual(personal_files, ['index.html'])
 
+    def test_create_personal_results_precompress(self):
+        """Test precompressing the results' static files."""
+        kwargs = dict(suppress_alpha_rarefaction=True,
+                      suppress_beta_diversity=True,
+                      suppress_taxa_summary_plots=True,
+                      suppress_alpha_diversity_boxplots=True,
+                      suppress_otu_category_significance=True,
+                      precompress_encodings=['gzip'])
+        create_personal_results(self.output_dir, self.mapping_fp,
+                self.coord_fp, self.rarefaction_dir, self.otu_table_fp,
+                self.prefs_fp, 'PersonalID', **kwargs)
+
+        for fp in (join('support_files', 'js', 'jquery.js'),
+                   join('NAU123', 'index.html')):
+            fp = join(self.output_dir, fp)
+            self.assertEqual(GzipFile(fp + '.gz').read(), open(fp).read())
+
+        # Images aren't compressed.
+        self.assertEqual(glob(join(self.output_dir, 'support_files',
+                                   'images', '*.gz')), [])
+
+        # Only the index pages (which are rewritten on every run) are
+        # recompressed.
+        jquery_gz_fp = join(self.output_dir, 'support_files', 'js',
+                            'jquery.js.gz')
+        jquery_gz_mtime = getmtime(jquery_gz_fp)
+        create_personal_results(self.output_dir, self.mapping_fp,
+                self.coord_fp, self.rarefaction_dir, self.otu_table_fp,
+                self.prefs_fp, 'PersonalID', incremental=True, **kwargs)
+        self.assertEqual(getmtime(jquery_gz_fp), jquery_gz_mtime)
+
+        log_fps = sorted(glob(join(self.output_dir, 'log_*.txt')),
+                         key=getmtime)
+        log_text = open(log_fps[-1], 'U').read()
+        self.assertTrue('Precompressing static files (gzip)' in log_text)
+        self.assertTrue('Compressed 3 files' in log_text)
+
+    def test_create_personal_results_pcoa_viewer(self):
+        """Test creating beta diversity plots for the built-in viewer."""
+        coord_fp = join(self.input_dir, 'coord_eigvals.txt')
+        coord_f = open(coord_fp, 'w')
+        coord_f.write(coord_str + '\n\n\neigvals\t4.2\t2.1\n'
+                      '% variation explained\t60.5\t30.25\n')
+        coord_f.close()
+        self.files_to_remove.append(coord_fp)
+
+        def command_handler(commands, status_update_callback, logger,
+                            close_logger_on_success=True):
+            self.fail("No commands should be run.")
+
+        obs = create_personal_results(self.output_dir, self.mapping_fp,
+                coord_fp, self.rarefaction_dir, self.otu_table_fp,
+                self.prefs_fp, 'PersonalID', personal_ids=['NAU123'],
+                suppress_alpha_rarefaction=True,
+                suppress_taxa_summary_plots=True,
+                suppress_alpha_diversity_boxplots=True,
+                suppress_otu_category_significance=True, pcoa_viewer=True,
+                command_handler=command_handler)
+
+        pcoa_dir = join(self.output_dir, 'NAU123', 'beta_diversity')
+        self.assertEqual(obs, [pcoa_dir])
+        self.assertEqual(sorted(map(basename, glob(join(pcoa_dir, '*')))),
+                         ['index.html', 'overlay.js'])
+
+        # The study's coordinates are written once for everyone.
+        study_data = open(join(self.output_dir, 'pcoa_data.js'), 'U').read()
+        self.assertTrue(study_data.startswith('var pcoaStudyData = '))
+        self.assertTrue('"S8"' in study_data)
+
+        overlay = open(join(pcoa_dir, 'overlay.js'), 'U').read()
+        self.assertTrue('"self_samples": [0, 3, 4, 6]' in overlay)
+        self.assertTrue('{"body_site": "Tongue", "samples": [4, 6]}' in
+                        overlay)
+
+        index_html = open(join(self.output_dir, 'NAU123', 'index.html'),
+                          'U').read()
+        self.assertTrue('./beta_diversity/index.html' in index_html)
+        self.assertFalse('3D_PCoA_plots.html' in index_html)
+        self.assertTrue('pcoa_viewer.js' in
+                        open(join(pcoa_dir, 'index.html'), 'U').read())
+
+    def test_create_personal_results_static_alpha_rarefaction(self):
+        """Test creating static alpha rarefaction plots in-process."""
+        def command_handler(commands, status_update_callback, logger,
+                            close_logger_on_success=True):
+            self.fail("No commands should be run.")
+
+        obs = create_personal_results(self.output_dir, self.mapping_fp,
+                self.coord_fp, self.rarefaction_dir, self.otu_table_fp,
+                self.prefs_fp, 'PersonalID', personal_ids=['NAU123'],
+                retain_raw_data=True, suppress_beta_diversity=True,
+                suppress_taxa_summary_plots=True,
+                suppress_alpha_diversity_boxplots=True,
+                suppress_otu_category_significance=True,
+                static_alpha_rarefaction=True,
+                command_handler=command_handler)
+
+        rarefaction_dir = join(self.output_dir, 'NAU123', 'alpha_rarefaction')
+        self.assertEqual(obs, [rarefaction_dir])
+        self.assertEqual(sorted(map(basename,
+                                    glob(join(rarefaction_dir, '*')))),
+                         ['PD_whole_tree.png', 'average_tables',
+                          'rarefaction_plots.html'])
+
+        # Each sample's mean is (i + (i + 8)) / 2 for sample Si. NAU123 has
+        # S1 and S4 (Palm) and S5 and S7 (Tongue).
+        table_fp = join(rarefaction_dir, 'average_tables',
+                        'PD_whole_treeSelf&&BodySite.txt')
+        obs = parse_rarefaction_data(open(table_fp, 'U').read().split('\n'))
+        self.assertEqual(obs['headers'], ['PD_whole_tree', 'Self&&BodySite'])
+        self.assertEqual(obs['xaxis'], [10.0])
+        self.assertEqual(obs['options'], ['SelfPalm', 'OtherPalm',
+                                          'SelfTongue', 'OtherTongue'])
+        self.assertFloatEqual(obs['series'], {'SelfPalm': [6.5],
+                                              'OtherPalm': [9.5],
+                                              'SelfTongue': [10.0],
+                                              'OtherTongue': [8.0]})
+        self.assertFloatEqual(obs['error'], {'SelfPalm': [1.5],
+                                             'OtherPalm': [2.5],
+                                             'SelfTongue': [1.0],
+                                             'OtherTongue': [2.0]})
+
+        html = open(join(rarefaction_dir, 'rarefaction_plots.html'),
+                    'U').read()
+        self.assertTrue('<img src="PD_whole_tree.png"/>' in html)
+        self.assertTrue('<td>6.500 &plusmn; 1.500</td>' in html)
+
+    def test_create_personal_results_otu_category_significance(self):
+        """Test creating OTU category significance tables in-process."""
+        # Use a per-body-site "rarefied" table so that rarefaction is skipped.
+        body_site_fp = join(self.input_dir, 'otu_table_even10000_Palm.biom')
+        body_site_f = open(body_site_fp, 'w')
+        body_site_f.write(otu_table_str)
+        body_site_f.close()
+        self.files_to_remove.append(body_site_fp)
+
+        obs = create_personal_results(self.output_dir, self.mapping_fp,
+                self.coord_fp, self.rarefaction_dir, self.otu_table_fp,
+                self.prefs_fp, 'PersonalID', personal_ids=['NAU123'],
+                body_site_rarefied_otu_table_dir=self.input_dir,
+                retain_raw_data=True,
+                suppress_alpha_rarefaction=True,
+                suppress_beta_diversity=True,
+                suppress_taxa_summary_plots=True,
+                suppress_alpha_diversity_boxplots=True)
+        otu_cat_sig_dir = join(self.output_dir, 'NAU123',
+                               'otu_category_significance')
+        self.assertEqual(obs, [otu_cat_sig_dir])
+
+        # There isn't a table for Tongue, and the only OTU can't be tested
+        # (its relative abundance is always 1).
+        self.assertEqual(map(basename, glob(join(otu_cat_sig_dir, '*.txt'))),
+                         ['otu_cat_sig_Palm.txt'])
+        obs = open(join(otu_cat_sig_dir, 'otu_cat_sig_Palm.txt'), 'U').read()
+        self.assertEqual(obs, 'OTU\tprob\tBonferroni_corrected\t'
+                         'FDR_corrected\tSelf_mean\tOther_mean\t'
+                         'Consensus Lineage\n')
+
+        # Every individual needs results for at least one body site.
+        self.assertRaises(ValueError, create_personal_results,
+                self.output_dir, self.mapping_fp, self.coord_fp,
+                self.rarefaction_dir, self.otu_table_fp, self.prefs_fp,
+                'PersonalID', personal_ids=['NAU456'],
+                body_site_rarefied_otu_table_dir=self.input_dir,
+                suppress_alpha_rarefaction=True,
+                suppress_beta_diversity=True,
+                suppress_taxa_summary_plots=True,
+                suppress_alpha_diversity_boxplots=True)
+
+    def test_create_personal_results_incremental(self):
+        """Test only rebuilding results whose inputs have changed."""
+        body_site_fp = join(self.input_dir, 'otu_table_even10000_Palm.biom')
+        body_site_f = open(body_site_fp, 'w')
+        body_site_f.write(otu_table_str)
+        body_site_f.close()
+        self.files_to_remove.append(body_site_fp)
+
+        def run(alpha, incremental):
+            return create_personal_results(self.output_dir, self.mapping_fp,
+                    self.coord_fp, self.rarefaction_dir, self.otu_table_fp,
+                    self.prefs_fp, 'PersonalID', personal_ids=['NAU123'],
+                    alpha=alpha,
+                    body_site_rarefied_otu_table_dir=self.input_dir,
+                    retain_raw_data=True,
+                    suppress_alpha_rarefaction=True,
+                    suppress_beta_diversity=True,
+                    suppress_taxa_summary_plots=True,
+                    suppress_alpha_diversity_boxplots=True,
+                    incremental=incremental)
+
+        otu_cat_sig_dir = join(self.output_dir, 'NAU123',
+                               'otu_category_significance')
+        otu_cat_sig_fp = join(otu_cat_sig_dir, 'otu_cat_sig_Palm.txt')
+        index_fp = join(self.output_dir, 'NAU123', 'index.html')
+
+        self.assertEqual(run(0.05, False), [otu_cat_sig_dir])
+        exp_index = open(index_fp, 'U').read()
+        self.assertTrue('otu_category_significance' in exp_index)
+
+        # Nothing has changed, so the table isn't recreated but is still
+        # linked to from the index page.
+        remove_files([otu_cat_sig_fp])
+        self.assertEqual(run(0.05, True), [otu_cat_sig_dir])
+        self.assertFalse(exists(otu_cat_sig_fp))
+        self.assertEqual(open(index_fp, 'U').read(), exp_index)
+
+        # Everything is rebuilt if we're not running incrementally.
+        self.assertEqual(run(0.05, False), [otu_cat_sig_dir])
+        self.assertTrue(exists(otu_cat_sig_fp))
+
+        # Changing a parameter causes the table to be recreated.
+        remove_files([otu_cat_sig_fp])
+        self.assertEqual(run(0.01, True), [otu_cat_sig_dir])
+        self.assertTrue(exists(otu_cat_sig_fp))
+
+        # So does removing the table's output directory.
+        rmtree(otu_cat_sig_dir)
+        self.assertEqual(run(0.01, True), [otu_cat_sig_dir])
+        self.assertTrue(exists(otu_cat_sig_fp))
+
+    def test_create_personal_results_resume(self):
+        """Test resuming a run after a command failed."""
+        run_titles = []
+
+        def command_handler(commands, status_update_callback, logger,
+                            close_logger_on_success=True):
+            # Mimic the commands by creating their output directories.
+            for command in commands:
+                for title, cmd in command:
+                    if fail_beta_diversity and 'make_3d_plots.py' in cmd:
+                        logger.close()
+                        raise WorkflowError("Failed on %s" % title)
+                    run_titles.append(title)
+                    create_dir(cmd.split(' -o ')[1].split()[0])
+
+        def run():
+            return create_personal_results(self.output_dir, self.mapping_fp,
+                    self.coord_fp, self.rarefaction_dir, self.otu_table_fp,
+                    self.prefs_fp, 'PersonalID', personal_ids=['NAU123'],
+                    suppress_taxa_summary_plots=True,
+                    suppress_alpha_diversity_boxplots=True,
+                    suppress_otu_category_significance=True,
+                    incremental=True, command_handler=command_handler)
+
+        fail_beta_diversity = True
+        self.assertRaises(WorkflowError, run)
+
+        # The alpha rarefaction plots were recorded as soon as they were
+        # created, even though a later command failed.
+        self.assertEqual(run_titles, ['Creating rarefaction plots (NAU123)'])
+        manifest_fp = join(self.output_dir, 'NAU123', '.build_manifest.json')
+        manifest = BuildManifest(manifest_fp, self.output_dir)
+        self.assertEqual(manifest.get_outputs('alpha_rarefaction'),
+                         [join(self.output_dir, 'NAU123',
+                               'alpha_rarefaction')])
+        self.assertEqual(manifest.get_outputs('beta_diversity'), [])
+
+        # Leave behind a partially written beta diversity directory.
+        stale_fp = join(self.output_dir, 'NAU123', 'beta_diversity',
+                        'stale.txt')
+        create_dir(dirname(stale_fp))
+        open(stale_fp, 'w').close()
+
+        fail_beta_diversity = False
+        run_titles = []
+        obs = run()
+        self.assertEqual(sorted(run_titles),
+                ['Creating beta diversity plots (NAU123)',
+                 'Creating beta diversity time series plots (NAU123)'])
+        self.assertFalse(exists(stale_fp))
+        self.assertEqual(map(basename, obs), ['alpha_rarefaction',
+                                              'beta_diversity',
+                                              'beta_diversity_time_series'])
+
+        # Nothing is left to be done.
+        run_titles = []
+        run()
+        self.assertEqual(run_titles, [])
+
+    def test_create_personal_results_suppress_all_parallel(self):
+        """Test running workflow in parallel with all output suppressed."""
+        # Output should be identical to a serial run, and the per-individual
+        # worker logs should have been merged into a single log file.
+        exp_personal_ids = ['NAU123', 'NAU456', 'NAU789']
+
+        obs = create_personal_results(self.output_dir, self.mapping_fp,
+                self.coord_fp, self.rarefaction_dir, self.otu_table_fp,
+                self.prefs_fp, 'PersonalID',
+                suppress_alpha_rarefaction=True,
+                suppress_beta_diversity=True,
+                suppress_taxa_summary_plots=True,
+                suppress_alpha_diversity_boxplots=True,
+                suppress_otu_category_significance=True,
+                jobs=2)
+        self.assertEqual(obs, [])
+
+        num_logs = len(glob(join(self.output_dir, 'log_*.txt')))
+        self.assertEqual(num_logs, 1)
+
+        for personal_id in exp_personal_ids:
+            personal_files = map(basename,
+                                 glob(join(self.output_dir, personal_id, '*')))
+            self.assertEqual(personal_files, ['index.html'])
+
+    def test_create_personal_results_failure_parallel(self):
+        """Test a command failing while processing individuals in parallel."""
+        # Each individual's boxplots are still being rendered when their
+        # command fails, and the command handler closes the worker's logger.
+        self.assertRaises(WorkflowError, create_personal_results,
+                self.output_dir, self.mapping_fp, self.coord_fp,
+                self.rarefaction_dir, self.otu_table_fp, self.prefs_fp,
+                'PersonalID', rarefaction_depth=10,
+                suppress_alpha_rarefaction=True,
+                suppress_taxa_summary_plots=True,
+                suppress_otu_category_significance=True,
+                command_handler=failing_command_handler, jobs=2)
+
+        # Every individual's log was merged, including the failure.
+        log_fps = glob(join(self.output_dir, 'log_*.txt'))
+        self.assertEqual(len(log_fps), 1)
+        log_text = open(log_fps[0], 'U').read()
+        for personal_id in 'NAU123', 'NAU456', 'NAU789':
+            self.assertTrue('Failed on Creating beta diversity time series '
+                            'plots (%s)' % personal_id in log_text)
+            self.assertFalse(exists(join(self.output_dir, personal_id,
+                                         'log.txt')))
+
+    def test_create_personal_results_failure(self):
+        """Test a command failing while boxplots are being rendered."""
+        self.assertRaises(WorkflowError, create_personal_results,
+                self.output_dir, self.mapping_fp, self.coord_fp,
+                self.rarefaction_dir, self.otu_table_fp, self.prefs_fp,
+                'PersonalID', personal_ids=['NAU123'], rarefaction_depth=10,
+                suppress_alpha_rarefaction=True,
+                suppress_taxa_summary_plots=True,
+                suppress_otu_category_significance=True,
+                command_handler=failing_command_handler)
+
+        # The failed individual's boxplots were waited on (and their
+        # timings discarded) before the error was raised.
+        self.assertEqual(_get_boxplot_renderer().wait(), [])
+
+    def test_create_personal_results_print_only_parallel(self):
+        """Test printing commands while processing individuals in parallel."""
+        saved_stdout = sys.stdout
+
+        try:
+            out = StringIO()
+            sys.stdout = out
+
+            obs = create_personal_results(self.output_dir, self.mapping_fp,
+                    self.coord_fp, self.rarefaction_dir, self.otu_table_fp,
+                    self.prefs_fp, 'PersonalID', rarefaction_depth=10,
+                    suppress_alpha_diversity_boxplots=True,
+                    suppress_taxa_summary_plots=True,
+                    suppress_otu_category_significance=True,
+                    command_handler=print_commands, jobs=3)
+        finally:
+            sys.stdout = saved_stdout
+
+        exp = set(['NAU123/beta_diversity',
+                   'NAU123/beta_diversity_time_series',
+                   'NAU123/alpha_rarefaction', 'NAU456/beta_diversity',
+                   'NAU456/beta_diversity_time_series',
+                   'NAU456/alpha_rarefaction', 'NAU789/beta_diversity',
+                   'NAU789/beta_diversity_time_series',
+                   'NAU789/alpha_rarefaction'])
+        fps = set([join(basename(dirname(fp)), basename(fp)) for fp in obs])
+        self.assertEqual(fps, exp)
+
+        # Each individual's commands should be in the single (merged) log.
+        log_fps = glob(join(self.output_dir, 'log_*.txt'))
+        self.assertEqual(len(log_fps), 1)
+        log_text = open(log_fps[0], 'U').read()
+        for personal_id in 'NAU123', 'NAU456', 'NAU789':
+            self.assertTrue('Creating beta diversity plots (%s)' %
+                            personal_id in log_text)
+            self.assertTrue('Creating rarefaction plots (%s)' % personal_id
+                            in log_text)
+            self.assertFalse(exists(join(self.output_dir, personal_id,
+                                         'log.txt')))
+
     def test_create_personal_results_print_only(self):
         """Test running workflow, but only printing the commands."""
         # Save stdout and replace it with something that will capture the print
@@ -253,6 +673,46 @@ class UtilTests(TestCase):
 
         self.assertEqual(fps, exp)
 
+    def test_create_personal_results_print_only_concurrent_commands(self):
+        """Test running workflow with concurrent commands in print-only mode.
+        """
+        saved_stdout = sys.stdout
+
+        try:
+            out = StringIO()
+            sys.stdout = out
+
+            obs = create_personal_results(self.output_dir, self.mapping_fp,
+                    self.coord_fp, self.rarefaction_dir, self.otu_table_fp,
+                    self.prefs_fp, 'PersonalID', personal_ids=['NAU123'],
+                    rarefaction_depth=10,
+                    suppress_alpha_diversity_boxplots=True,
+                    suppress_otu_category_significance=True,
+                    command_handler=print_commands, max_concurrent_commands=4)
+            obs_output = out.getvalue()
+        finally:
+            sys.stdout = saved_stdout
+
+        exp = set(['NAU123/time_series', 'NAU123/beta_diversity',
+                   'NAU123/beta_diversity_time_series',
+                   'NAU123/alpha_rarefaction'])
+        fps = set([join(basename(dirname(fp)), basename(fp)) for fp in obs])
+        self.assertEqual(fps, exp)
+
+        # Every command is printed.
+        self.assertTrue('make_rarefaction_plots.py' in obs_output)
+        self.assertEqual(obs_output.count('make_3d_plots.py'), 2)
+
+        # Each body site has 2+ weeks for self and other, so taxa summary
+        # plots are created for both body sites. The taxa summaries are
+        # created in-process.
+        self.assertEqual(obs_output.count('summarize_otu_by_cat.py'), 0)
+        self.assertEqual(obs_output.count('summarize_taxa.py'), 0)
+        self.assertEqual(obs_output.count('compare_taxa_summaries.py'), 10)
+        self.assertEqual(obs_output.count('plot_taxa_summary.py'), 4)
+        self.assertTrue(obs_output.index('compare_taxa_summaries.py') <
+                        obs_output.index('plot_taxa_summary.py'))
+
     def test_get_qiime_project_dir(self):
         """getting the qiime project directory functions as expected
         
@@ -310,6 +770,60 @@ class UtilTests(TestCase):
         finally:
             sys.stdout = saved_stdout
 
+    def test_notify_participants_journal(self):
+        """Tests dry runs skip participants who have already been emailed."""
+        journal_fp = join(get_qiime_temp_dir(),
+                          'my_microbes_notify_participants.sent')
+        self.files_to_remove.append(journal_fp)
+        journal_f = open(journal_fp, 'w')
+        journal_f.write('foo1\n')
+        journal_f.close()
+
+        saved_stdout = sys.stdout
+        try:
+            out = StringIO()
+            sys.stdout = out
+            notify_participants(self.recipients, self.email_settings,
+                                journal_fp=journal_fp)
+            obs_output = out.getvalue()
+        finally:
+            sys.stdout = saved_stdout
+
+        self.assertTrue('Skipping 1 recipient(s) who have already been '
+                        'emailed (recorded in %s).' % journal_fp in obs_output)
+        self.assertTrue('Sending emails to 1 recipient(s).' in obs_output)
+        self.assertTrue('To: foo2@bar.baz, foo3@bar.baz, foo4@bar.baz' in
+                        obs_output)
+
+        # The journal isn't modified by dry runs.
+        self.assertEqual(open(journal_fp, 'U').read(), 'foo1\n')
+
+    def test_notify_participants_spool(self):
+        """Tests writing the emails to a local maildir."""
+        spool_dir = join(self.output_dir, 'Maildir')
+
+        saved_stdout = sys.stdout
+        try:
+            out = StringIO()
+            sys.stdout = out
+            notify_participants(self.recipients, self.email_settings,
+                                dry_run=False, spool_dir=spool_dir)
+            obs_output = out.getvalue().strip()
+        finally:
+            sys.stdout = saved_stdout
+
+        self.assertEqual(obs_output, 'Wrote 2 email(s) to the maildir %s (0 '
+                         'skipped because they were already emailed, 0 '
+                         'failed).' % spool_dir)
+
+        message_fps = glob(join(spool_dir, 'new', '*'))
+        self.assertEqual(len(message_fps), 2)
+        message_strs = [open(fp, 'U').read() for fp in message_fps]
+        self.assertEqual(len([message_str for message_str in message_strs
+                              if 'Your personal ID is: foo2' in message_str and
+                              'To: foo2@bar.baz, foo3@bar.baz, foo4@bar.baz' in
+                              message_str]), 1)
+
     def test_collect_alpha_diversity_boxplot_data(self):
         """Tests collecting data for creating boxplots."""
         exp = (['Palm (Other)', 'Palm (Self)', 'Tongue (Other)',
@@ -334,16 +848,109 @@ class UtilTests(TestCase):
                 'BodySite', 'Self')
         self.assertEqual(obs, ([], []))
 
-    def test_count_num_samples(self):
-        """Test counting number of samples in OTU table."""
-        obs = _count_num_samples(self.otu_table_f)
-        self.assertEqual(obs, 8)
-
-    def test_count_per_individual_samples(self):
-        """Test counting number of individual's samples in OTU table."""
-        obs = _count_per_individual_samples(self.otu_table_f,
-                self.personal_metadata_map_f, 'PersonalID', 'NAU456')
-        self.assertEqual(obs, 2)
+    def test_encode_category_values(self):
+        """Tests encoding category values as integer codes."""
+        values, codes = _encode_category_values(['b', 'a', None, 'b'])
+        self.assertEqual(values, ['a', 'b'])
+        self.assertEqual(codes.tolist(), [1, 0, -1, 1])
+
+        values, codes = _encode_category_values([])
+        self.assertEqual(values, [])
+        self.assertEqual(codes.tolist(), [])
+
+    def test_group_alpha_diversity(self):
+        """Tests grouping alpha diversity values by category codes."""
+        # Sorted by label rather than by code (Self is encoded before Other).
+        data = array([[1, 2, 3, 4, nan], [5, 6, 7, 8, 9]])
+        obs = _group_alpha_diversity(data,
+                (['a', 'a b'], array([0, 1, 0, -1, 0])),
+                (['Self', 'Other'], array([0, 0, 1, 0, 1])))
+        self.assertEqual(obs[0], ['a (Other)', 'a (Self)', 'a b (Self)'])
+        self.assertFloatEqual(obs[1], [[3, 7, 9], [1, 5], [2, 6]])
+
+    def test_get_weeks(self):
+        """Test getting the naturally-sorted weeks at a body site."""
+        otu_table = parse_biom_table(self.otu_table_f)
+        sample_groups = get_sample_groups(self.mapping_data, 0, [1, 3])
+        sample_groups[2] = ('S3', ('Palm', '10'))
+        totals = aggregate_otu_table(otu_table, sample_groups)
+
+        self.assertEqual(_get_weeks(totals, 'Palm'), ['1', '4', '8', '10'])
+        self.assertEqual(_get_weeks(totals, 'Foot'), [])
+
+    def test_hash_stage_inputs(self):
+        """Test each stage's hash only covers the rows that it reads."""
+        def hash_stage_inputs(mapping_data, in_process=False):
+            sample_index = SampleIndex(mapping_data, 0, 2, 1, 3)
+            return _hash_stage_inputs(['NAU123', 'NAU789'], mapping_data,
+                    self.mapping_header, [], sample_index, 0, 2, 1, 3,
+                    self.coord_fp, self.rarefaction_dir, self.otu_table_fp,
+                    self.prefs_fp, 'PersonalID', ['Self', 'Other'],
+                    'BodySite', 'WeeksSinceStart', 10000, 0.05, None,
+                    self.input_dir, False, False, False, False, False, False,
+                    in_process, in_process)
+
+        def changed_stages(exp, obs):
+            return dict([(person, sorted([stage
+                                          for stage in exp[person]
+                                          if exp[person][stage] !=
+                                          obs[person][stage]]))
+                         for person in exp])
+
+        exp = hash_stage_inputs(self.mapping_data)
+        exp_in_process = hash_stage_inputs(self.mapping_data, True)
+        self.assertEqual(sorted(exp['NAU123']), sorted(_stages))
+        self.assertEqual(sorted(_stage_modules), sorted(_stages))
+        self.assertEqual(hash_stage_inputs(self.mapping_data), exp)
+
+        # Changing a Tongue sample's week only changes the time series of
+        # NAU123 (who has Tongue samples) and the plots that have everyone's
+        # samples. make_rarefaction_plots.py and make_3d_plots.py read the
+        # whole personal mapping file.
+        mapping_data = [row[:] for row in self.mapping_data]
+        mapping_data[1][3] = '9'
+        self.assertEqual(changed_stages(exp, hash_stage_inputs(mapping_data)),
+                         {'NAU123': ['alpha_rarefaction', 'beta_diversity',
+                                     'taxa_summary_plots'],
+                          'NAU789': ['alpha_rarefaction', 'beta_diversity']})
+        self.assertEqual(changed_stages(exp_in_process,
+                                        hash_stage_inputs(mapping_data, True)),
+                         {'NAU123': ['beta_diversity', 'taxa_summary_plots'],
+                          'NAU789': ['beta_diversity']})
+
+        # Columns that are only in the personal mapping file are only read by
+        # the QIIME scripts.
+        mapping_data = [row[:] for row in self.mapping_data]
+        mapping_data[1][4] = 'foo'
+        self.assertEqual(changed_stages(exp, hash_stage_inputs(mapping_data)),
+                         {'NAU123': ['alpha_rarefaction', 'beta_diversity'],
+                          'NAU789': ['alpha_rarefaction', 'beta_diversity']})
+        self.assertEqual(changed_stages(exp_in_process,
+                                        hash_stage_inputs(mapping_data, True)),
+                         {'NAU123': [], 'NAU789': []})
+
+        # A new Tongue sample is in everyone's boxplots and rarefaction
+        # plots, but NAU789 isn't compared to anyone else at Tongue.
+        mapping_data = self.mapping_data + [['S9', 'Tongue', 'NAU456', '9',
+                                             'S9']]
+        self.assertEqual(changed_stages(exp,
+                                        hash_stage_inputs(mapping_data)),
+                {'NAU123': ['alpha_diversity_boxplots', 'alpha_rarefaction',
+                            'beta_diversity', 'otu_category_significance',
+                            'taxa_summary_plots'],
+                 'NAU789': ['alpha_diversity_boxplots', 'alpha_rarefaction',
+                            'beta_diversity']})
+
+        # Only the rarefied OTU tables of an individual's body sites are read.
+        body_site_fp = join(self.input_dir, 'otu_table_even10000_Tongue.biom')
+        body_site_f = open(body_site_fp, 'w')
+        body_site_f.write(otu_table_str)
+        body_site_f.close()
+        self.files_to_remove.append(body_site_fp)
+        self.assertEqual(changed_stages(exp,
+                                        hash_stage_inputs(self.mapping_data)),
+                         {'NAU123': ['otu_category_significance'],
+                          'NAU789': []})
 
     def test_generate_random_password(self):
         """Test generating random password (encrypted and unencrypted)."""
@@ -353,6 +960,73 @@ class UtilTests(TestCase):
         obs = generate_random_password(1, 1)
         self.assertEqual(len(obs[0]), 1)
 
+        # The password is hashed the same way as htpasswd -m.
+        self.assertTrue(obs[1].startswith('$apr1$'))
+        self.assertEqual(hash_password(obs[0], salt=obs[1][6:14]), obs[1])
+
+        obs = generate_random_password(scheme='sha1')
+        self.assertEqual(obs[1], hash_password(obs[0], 'sha1'))
+
+    def test_generate_passwords(self):
+        """Test generating passwords, .htaccess files, and .htpasswd file."""
+        pids = ['NAU123', 'NAU456', 'NAU789']
+        for pid in pids:
+            create_dir(join(self.output_dir, 'results', pid))
+
+        generate_passwords(pids, join(self.output_dir, 'results'),
+                           '/foo/bar', self.output_dir, jobs=2)
+
+        pid_passwords = [line.split('\t') for line in
+                open(join(self.output_dir,
+                          'personal_ids_with_passwords.txt'), 'U').read()
+                .splitlines()]
+        htpasswd_lines = [line.split(':') for line in
+                open(join(self.output_dir, '.htpasswd'), 'U').read()
+                .splitlines()]
+        self.assertEqual([pid for pid, password in pid_passwords], pids)
+        self.assertEqual([pid for pid, hashed in htpasswd_lines], pids)
+        for (pid, password), (htpasswd_pid, hashed) in zip(pid_passwords,
+                                                           htpasswd_lines):
+            self.assertEqual(hash_password(password, salt=hashed[6:14]),
+                             hashed)
+            self.assertTrue(exists(join(self.output_dir, 'results', pid,
+                                        '.htaccess')))
+
+        # Updating a subset of users (and adding a new one) leaves the other
+        # users' passwords as they were.
+        create_dir(join(self.output_dir, 'results', 'NAU999'))
+        generate_passwords(['NAU456', 'NAU999'],
+                           join(self.output_dir, 'results'), '/foo/bar',
+                           self.output_dir)
+
+        new_pid_passwords = [line.split('\t') for line in
+                open(join(self.output_dir,
+                          'personal_ids_with_passwords.txt'), 'U').read()
+                .splitlines()]
+        new_htpasswd_lines = [line.split(':') for line in
+                open(join(self.output_dir, '.htpasswd'), 'U').read()
+                .splitlines()]
+        self.assertEqual([pid for pid, password in new_pid_passwords],
+                         pids + ['NAU999'])
+        self.assertEqual([pid for pid, hashed in new_htpasswd_lines],
+                         pids + ['NAU999'])
+        self.assertEqual(new_pid_passwords[0], pid_passwords[0])
+        self.assertEqual(new_pid_passwords[2], pid_passwords[2])
+        self.assertEqual(new_htpasswd_lines[0], htpasswd_lines[0])
+        self.assertNotEqual(new_htpasswd_lines[1], htpasswd_lines[1])
+        for (pid, password), (htpasswd_pid, hashed) in zip(new_pid_passwords,
+                                                           new_htpasswd_lines):
+            self.assertEqual(hash_password(password, salt=hashed[6:14]),
+                             hashed)
+        self.assertFalse(exists(join(self.output_dir, '.htpasswd.tmp')))
+
+        self.assertRaises(ValueError, generate_passwords, ['NAU000'],
+                          join(self.output_dir, 'results'), '/foo/bar',
+                          self.output_dir)
+        self.assertRaises(ValueError, generate_passwords, pids,
+                          join(self.output_dir, 'results'), '/foo/bar',
+                          self.output_dir, dbm_type='sdbm')
+
 
 mapping_str = """#SampleID\tBodySite\tPersonalID\tWeeksSinceStart\tDescription
 S1\tPalm\tNAU123\t1\tS1
@@ -392,7 +1066,7 @@ S6\t1\t2
 S7\t1\t2
 S8\t1\t2"""
 
-otu_table_str = """{"rows": [{"id": "0", "metadata": null}], "format": "Biological Observation Matrix 0.9dev", "data": [[1, 2, 3, 4, 5, 6, 7, 8]], "columns": [{"id": "S1", "metadata": null}, {"id": "S2", "metadata": null}, {"id": "S3", "metadata": null}, {"id": "S4", "metadata": null}, {"id": "S5", "metadata": null}, {"id": "S6", "metadata": null}, {"id": "S7", "metadata": null}, {"id": "S8", "metadata": null}], "generated_by": "QIIME 1.4.0-dev, svn revision 2532", "matrix_type": "dense", "shape": [1, 8], "format_url": "http://biom-format.org", "date": "2011-12-21T00:49:15.978315", "type": "OTU table", "id": null, "matrix_element_type": "float"}"""
+otu_table_str = """{"rows": [{"id": "0", "metadata": {"taxonomy": ["k__Bacteria", "p__Firmicutes"]}}], "format": "Biological Observation Matrix 0.9dev", "data": [[1, 2, 3, 4, 5, 6, 7, 8]], "columns": [{"id": "S1", "metadata": null}, {"id": "S2", "metadata": null}, {"id": "S3", "metadata": null}, {"id": "S4", "metadata": null}, {"id": "S5", "metadata": null}, {"id": "S6", "metadata": null}, {"id": "S7", "metadata": null}, {"id": "S8", "metadata": null}], "generated_by": "QIIME 1.4.0-dev, svn revision 2532", "matrix_type": "dense", "shape": [1, 8], "format_url": "http://biom-format.org", "date": "2011-12-21T00:49:15.978315", "type": "OTU table", "id": null, "matrix_element_type": "float"}"""
 
 prefs_str = """foobarbaz"""
 
@@ -442,5 +1116,14 @@ Thanks for participating in the study!
 The Student Microbiome Project Team"""
 
 
+def failing_command_handler(commands, status_update_callback, logger,
+                            close_logger_on_success=True):
+    """Fails on the first command, mimicking call_commands_serially."""
+    title = commands[0][0][0]
+    logger.write("Failed on %s\n" % title)
+    logger.close()
+    raise WorkflowError("Failed on %s" % title)
+
+
 if __name__ == "__main__":
     main()
@@ -0,0 +1,232 @@
+#!/usr/bin/env python
+from __future__ import division
+
+__author__ = "Jai Ram Rideout"
+__copyright__ = "Copyright 2013, The QIIME Project"
+__credits__ = ["Jai Ram Rideout"]
+__license__ = "GPL"
+__version__ = "0.1.0-dev"
+__maintainer__ = "Jai Ram Rideout"
+__email__ = "jai.rideout@gmail.com"
+
+"""Test suite for the workflow.py module."""
+
+from os.path import join
+from shutil import rmtree
+from tempfile import mkdtemp
+from threading import Event, Lock
+from unittest import main, TestCase
+
+from qiime.workflow.util import no_status_updates, WorkflowError
+
+from my_microbes.timing import CommandTimer, parse_timings
+from my_microbes.workflow import CommandGraph, _paths_overlap
+
+class WorkflowTests(TestCase):
+    """Tests for the workflow.py module."""
+
+    def setUp(self):
+        """Define some sample data that will be used by the tests."""
+        self.logger = FakeLogger()
+        self.run_titles = []
+        self.lock = Lock()
+
+        # Diamond-shaped graph: a -> (b, c) -> d.
+        self.graph1 = CommandGraph()
+        self.graph1.add_command('a', 'cmd a', inputs=['in.txt'],
+                                outputs=['out/a.txt'])
+        self.graph1.add_command('b', 'cmd b', inputs=['out/a.txt'],
+                                outputs=['out/b'])
+        self.graph1.add_command('c', 'cmd c', inputs=['out/a.txt'],
+                                outputs=['out/c.txt'])
+        self.graph1.add_command('d', 'cmd d',
+                                inputs=['out/b/foo.txt', 'out/c.txt'],
+                                outputs=['out/d.txt'])
+
+    def command_handler(self, commands, status_update_callback, logger,
+                        close_logger_on_success=True):
+        """Records the titles of the commands that are run."""
+        self.assertFalse(close_logger_on_success)
+        for command in commands:
+            for title, cmd in command:
+                with self.lock:
+                    self.run_titles.append(title)
+                logger.write('%s\n' % cmd)
+
+    def failing_command_handler(self, commands, status_update_callback,
+                                logger, close_logger_on_success=True):
+        """Fails on command 'c', mimicking call_commands_serially."""
+        for command in commands:
+            for title, cmd in command:
+                if title == 'c':
+                    logger.close()
+                    raise WorkflowError("Failed on %s" % title)
+        self.command_handler(commands, status_update_callback, logger,
+                             close_logger_on_success)
+
+    def test_run_serially(self):
+        """Test running commands one at a time in dependency order."""
+        obs = self.graph1.run(self.command_handler, None, self.logger)
+        self.assertEqual(obs, [0, 1, 2, 3])
+        self.assertEqual(self.run_titles, ['a', 'b', 'c', 'd'])
+        self.assertEqual(self.logger.getvalue(),
+                         'cmd a\ncmd b\ncmd c\ncmd d\n')
+        self.assertFalse(self.logger.closed)
+
+    def test_run_serially_order_added(self):
+        """Test that commands are run in the order added when possible."""
+        graph = CommandGraph()
+        graph.add_command('b', 'cmd b', inputs=['a.txt'], outputs=['b.txt'])
+        graph.add_command('c', 'cmd c', inputs=['foo.txt'],
+                          outputs=['c.txt'])
+        graph.add_command('a', 'cmd a', inputs=['foo.txt'],
+                          outputs=['a.txt'])
+
+        obs = graph.run(self.command_handler, None, self.logger)
+        self.assertEqual(obs, [1, 2, 0])
+        self.assertEqual(self.run_titles, ['c', 'a', 'b'])
+
+    def test_run_concurrently(self):
+        """Test running independent commands at the same time."""
+        # b and c both wait for each other to start, so this will only finish
+        # if they are run concurrently.
+        started = {'b': Event(), 'c': Event()}
+        other = {'b': 'c', 'c': 'b'}
+
+        def command_handler(commands, status_update_callback, logger,
+                            close_logger_on_success=True):
+            title = commands[0][0][0]
+            if title in started:
+                started[title].set()
+                started[other[title]].wait(10)
+                self.assertTrue(started[other[title]].is_set())
+            self.command_handler(commands, status_update_callback, logger,
+                                 close_logger_on_success)
+
+        obs = self.graph1.run(command_handler, None, self.logger, 2)
+        self.assertEqual(obs[0], 0)
+        self.assertEqual(sorted(obs[1:3]), [1, 2])
+        self.assertEqual(obs[3], 3)
+        self.assertEqual(self.run_titles[0], 'a')
+        self.assertEqual(self.run_titles[3], 'd')
+
+        # Each command's log output is written as a block.
+        self.assertEqual(sorted(self.logger.getvalue().splitlines()),
+                         ['cmd a', 'cmd b', 'cmd c', 'cmd d'])
+        self.assertFalse(self.logger.closed)
+
+    def test_run_failure(self):
+        """Test that a failing command stops the run and closes the logger."""
+        self.assertRaises(WorkflowError, self.graph1.run,
+                          self.failing_command_handler, None, self.logger)
+        self.assertEqual(self.run_titles, ['a', 'b'])
+        self.assertTrue(self.logger.closed)
+
+        self.run_titles = []
+        self.logger = FakeLogger()
+        self.assertRaises(WorkflowError, self.graph1.run,
+                          self.failing_command_handler, None, self.logger, 2)
+        self.assertTrue('d' not in self.run_titles)
+        self.assertTrue(self.logger.closed)
+
+    def test_run_step_finished_callback(self):
+        """Test being notified of each command as soon as it finishes."""
+        for max_concurrent_commands in 1, 2:
+            finished = []
+            self.run_titles = []
+            self.logger = FakeLogger()
+            self.assertRaises(WorkflowError, self.graph1.run,
+                              self.failing_command_handler, None, self.logger,
+                              max_concurrent_commands, finished.append)
+
+            # Commands that finished before the failure are reported.
+            self.assertTrue(0 in finished)
+            self.assertFalse(2 in finished)
+            self.assertFalse(3 in finished)
+            self.assertEqual(finished, [self.run_titles.index(title)
+                                        for title in self.run_titles])
+
+        finished = []
+        obs = self.graph1.run(self.command_handler, None, FakeLogger(), 2,
+                              finished.append)
+        self.assertEqual(finished, obs)
+
+    def test_run_command_timer(self):
+        """Test timing each command with its stage, inputs, and outputs."""
+        tmp_dir = mkdtemp(prefix='my_microbes_tests_')
+        try:
+            timings_fp = join(tmp_dir, 'timings.jsonl')
+            a_fp = join(tmp_dir, 'a.txt')
+            b_fp = join(tmp_dir, 'b.txt')
+
+            graph = CommandGraph()
+            graph.add_command('b', 'cat %s %s > %s' % (a_fp, a_fp, b_fp),
+                              inputs=[a_fp], outputs=[b_fp], stage='bar')
+            graph.add_command('a', 'printf abc > %s' % a_fp, outputs=[a_fp],
+                              stage='foo')
+
+            for max_concurrent_commands in 1, 2:
+                open(timings_fp, 'w').close()
+                obs = graph.run(self.command_handler, no_status_updates,
+                                FakeLogger(), max_concurrent_commands,
+                                command_timer=CommandTimer(timings_fp, 'P1'))
+                self.assertEqual(obs, [1, 0])
+
+                # The commands were run by the timer, not the handler.
+                self.assertEqual(self.run_titles, [])
+
+                with open(timings_fp, 'U') as timings_f:
+                    records = parse_timings(timings_f)
+                self.assertEqual([(record['title'], record['stage'],
+                                   record['person_id'], record['input_bytes'],
+                                   record['output_bytes'])
+                                  for record in records],
+                                 [('a', 'foo', 'P1', 0, 3),
+                                  ('b', 'bar', 'P1', 3, 6)])
+        finally:
+            rmtree(tmp_dir)
+
+    def test_run_invalid_input(self):
+        """Test running a graph with a cycle or invalid concurrency."""
+        graph = CommandGraph()
+        graph.add_command('a', 'cmd a', inputs=['b.txt'], outputs=['a.txt'])
+        graph.add_command('b', 'cmd b', inputs=['a.txt'], outputs=['b.txt'])
+        self.assertRaises(ValueError, graph.run, self.command_handler, None,
+                          self.logger)
+
+        self.assertRaises(ValueError, self.graph1.run, self.command_handler,
+                          None, self.logger, 0)
+
+    def test_run_empty(self):
+        """Test running a graph without any commands."""
+        self.assertEqual(CommandGraph().run(self.command_handler, None,
+                                            self.logger, 4), [])
+
+    def test_paths_overlap(self):
+        """Test checking for equal or nested paths."""
+        self.assertTrue(_paths_overlap(['/a/b'], ['/a/b']))
+        self.assertTrue(_paths_overlap(['/a/b/c.txt'], ['/a/b']))
+        self.assertTrue(_paths_overlap(['/a/b'], ['/foo', '/a/b/c.txt']))
+        self.assertFalse(_paths_overlap(['/a/bc.txt'], ['/a/b']))
+        self.assertFalse(_paths_overlap(['/a/b'], []))
+
+
+class FakeLogger(object):
+    """Minimal WorkflowLogger replacement that keeps its output in memory."""
+
+    def __init__(self):
+        self.lines = []
+        self.closed = False
+
+    def write(self, s):
+        self.lines.append(s)
+
+    def close(self):
+        self.closed = True
+
+    def getvalue(self):
+        return ''.join(self.lines)
+
+
+if __name__ == "__main__":
+    main()